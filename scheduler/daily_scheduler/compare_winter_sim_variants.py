@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+"""Regression benchmark for the scheduler variants sharing the winter_sim
+engine.
+
+Runs the same simulation with each variant twice -- with the current tree
+and with a reference git revision -- and reports whether the schedules
+(the Summary tables of the pointing logs) are the same and how long each
+run took.  Every run is a separate process, since all the variants are
+imported as winter_sim."""
+
+import os
+import sys
+import json
+import sqlite3
+import tarfile
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+
+
+VARIANTS = ['daily_scheduler', 'daily_summer_scheduler',
+            'daily_winter_scheduler', 'winter_scheduler']
+
+# these differ from run to run without the schedule being different
+IGNORED_COLUMNS = ['obsHistID', 'requestID']
+
+# the choices made by the scheduler (those present in a variant's Summary
+# table are compared); the other columns are derived from them, and may
+# differ slightly when e.g. ephemerides are interpolated
+SCHEDULE_COLUMNS = ['fieldID', 'filter', 'expMJD', 'progID', 'propID',
+                    'subprogram']
+
+RUNNER = """
+import sys, time
+import astropy.units as u
+from winter_sim.simulate import simulate
+(scheduler_config_path, scheduler_config_file, sim_config_path,
+    sim_config_file, output_path, time_limit) = sys.argv[1:]
+t0 = time.perf_counter()
+simulate(scheduler_config_file, sim_config_file,
+    scheduler_config_path = scheduler_config_path,
+    sim_config_path = sim_config_path,
+    output_path = output_path,
+    time_limit = float(time_limit) * u.second)
+print(time.perf_counter() - t0)
+"""
+
+
+def extract_reference(revision, dest):
+    """Extract the scheduler (and the wsp configuration it reads) at git
+    revision into dest; returns the path of its scheduler directory."""
+    top = subprocess.check_output(['git', 'rev-parse', '--show-toplevel'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), text=True).strip()
+    archive = os.path.join(dest, 'reference.tar')
+    subprocess.check_call(['git', 'archive', '-o', archive, revision,
+        'scheduler', 'wsp/config'], cwd=top)
+    with tarfile.open(archive) as tar:
+        tar.extractall(dest)
+    os.remove(archive)
+    return os.path.join(dest, 'scheduler')
+
+
+def run_variant(scheduler_dir, variant, scheduler_config, sim_config,
+                output_path, time_limit):
+    """Simulate with one variant; returns the wall time in seconds."""
+    variant_dir = os.path.join(scheduler_dir, variant)
+    os.makedirs(output_path, exist_ok=True)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [variant_dir] + [p for p in [env.get('PYTHONPATH')] if p])
+    out = subprocess.check_output([sys.executable, '-c', RUNNER,
+        os.path.join(variant_dir, 'sims'), scheduler_config,
+        os.path.join(variant_dir, 'config'), sim_config,
+        os.path.join(output_path, ''), str(time_limit)],
+        cwd=variant_dir, env=env, text=True)
+    return float(out.strip().splitlines()[-1])
+
+
+def read_schedule(output_path):
+    """Concatenate the Summary tables of the pointing logs written under
+    output_path."""
+    dfs = []
+    for root, dirs, files in os.walk(output_path):
+        for filename in sorted(files):
+            if not filename.endswith('.db'):
+                continue
+            conn = sqlite3.connect(os.path.join(root, filename))
+            try:
+                tables = pd.read_sql(
+                    "SELECT name FROM sqlite_master WHERE type='table'", conn)
+                if 'Summary' in tables['name'].values:
+                    dfs.append(pd.read_sql('SELECT * FROM Summary', conn))
+            finally:
+                conn.close()
+    if len(dfs) == 0:
+        return pd.DataFrame()
+    df = pd.concat(dfs, ignore_index=True)
+    df = df.drop(columns=[c for c in IGNORED_COLUMNS if c in df.columns])
+    if 'expMJD' in df.columns:
+        df = df.sort_values('expMJD').reset_index(drop=True)
+    return df
+
+
+def compare_schedules(df, df_ref, atol=1e-6):
+    """Compare two schedules.
+
+    Returns (same_schedule, differences): same_schedule is True if the
+    SCHEDULE_COLUMNS agree, and differences describes every column which
+    differs, with the largest difference for numeric columns."""
+    if len(df) != len(df_ref):
+        return False, [f'{len(df)} observations, reference has {len(df_ref)}']
+    same_schedule = True
+    differences = []
+    for column in df_ref.columns:
+        if column not in df.columns:
+            same_schedule &= column not in SCHEDULE_COLUMNS
+            differences.append(f'{column} missing')
+            continue
+        a, b = df[column], df_ref[column]
+        if pd.api.types.is_numeric_dtype(a) and pd.api.types.is_numeric_dtype(b):
+            a, b = a.astype(float), b.astype(float)
+            same = np.isclose(a, b, atol=atol, equal_nan=True)
+            largest = f', up to {np.nanmax(np.abs(a - b)):.3g}'
+        else:
+            same = (a.astype(str) == b.astype(str)).values
+            largest = ''
+        if not np.all(same):
+            same_schedule &= column not in SCHEDULE_COLUMNS
+            differences.append(f'{column}: {np.sum(~same)} rows differ{largest}')
+    return same_schedule, differences
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('reference',
+            help="git revision to compare against")
+    parser.add_argument('-c', '--scheduler-config',
+            default='W_reference_config.json',
+            help="Schedule configuration file, in each variant's sims/")
+    parser.add_argument('-s', '--sim-config', default='2021_reference.cfg',
+            help="Simulation configuration file, in each variant's config/")
+    parser.add_argument('-v', '--variants', nargs='+', default=VARIANTS,
+            help="Variants to compare")
+    parser.add_argument('-o', '--output', default=None,
+            help="Directory to write the simulations to.")
+    parser.add_argument('-t', '--time-limit', default=30., type=float,
+            help="Number of seconds to allow Gurobi optimizer to run")
+
+    args = parser.parse_args()
+
+    current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = args.output if args.output is not None else tempfile.mkdtemp()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        reference_dir = extract_reference(args.reference, tmp_dir)
+        for variant in args.variants:
+            timings = {}
+            schedules = {}
+            for label, scheduler_dir in [('reference', reference_dir),
+                                         ('current', current_dir)]:
+                output_path = os.path.join(output, variant, label)
+                try:
+                    timings[label] = run_variant(scheduler_dir, variant,
+                        args.scheduler_config, args.sim_config, output_path,
+                        args.time_limit)
+                except subprocess.CalledProcessError as e:
+                    print(f'{variant} ({label}) failed: {e}')
+                    break
+                schedules[label] = read_schedule(output_path)
+            if len(timings) < 2:
+                results.append({'variant': variant, 'failed': True})
+                continue
+
+            same_schedule, differences = compare_schedules(
+                schedules['current'], schedules['reference'])
+            results.append({'variant': variant,
+                'n_observations': len(schedules['current']),
+                'same_schedule': same_schedule,
+                'differences': differences,
+                'time_reference': timings['reference'],
+                'time_current': timings['current'],
+                'speedup': timings['reference'] / timings['current']})
+
+    print(json.dumps(results, indent=2))
+    if not all(result.get('same_schedule', False) for result in results):
+        sys.exit(1)
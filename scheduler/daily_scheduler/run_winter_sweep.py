@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+import os.path
+import os
+import json
+import argparse
+import logging
+import astropy.units as u
+from winter_sim.sweep import run_sweep
+
+
+home = os.path.expanduser("~")
+data_dir = home + '/data/sweeps/'
+
+parser = argparse.ArgumentParser(
+        description="Simulate WINTER observing for several configurations in parallel.")
+parser.add_argument('schedule_configuration',
+        help="Path to schedule configuration file")
+parser.add_argument('simulation_configuration',
+        help="Path to simulation configuration file")
+parser.add_argument('-v', '--variants', default=None,
+        help="JSON file mapping variant names to configuration overrides")
+parser.add_argument('-s', '--split-days', default=None, type=float,
+        help="Split the survey into independent chunks of this many days")
+parser.add_argument('-j', '--max-workers', default=None, type=int,
+        help="Number of simulations to run at once")
+parser.add_argument('-o', '--output', default=data_dir,
+        help="Directory to write the simulations to.")
+parser.add_argument('-t', '--time-limit', default=30., type=float,
+        help="Number of seconds to allow Gurobi optimizer to run")
+
+args = parser.parse_args()
+
+assert(os.path.isfile(args.schedule_configuration))
+assert(os.path.isfile(args.simulation_configuration))
+
+variants = None
+if args.variants is not None:
+    with open(args.variants) as f:
+        variants = json.load(f)
+
+logging.basicConfig(level=logging.INFO)
+
+results = run_sweep(args.schedule_configuration, args.simulation_configuration,
+    output_path = os.path.join(args.output, ''),
+    variants = variants,
+    split_days = args.split_days,
+    max_workers = args.max_workers,
+    time_limit = args.time_limit * u.second)
+
+for result in results:
+    print(result['name'], result['n_observations'], result['timings'])
+
+print(f" \n \n \n \nFINISHED RUNNING SWEEP: {os.path.join(args.output, 'sweep.db')}")
@@ -0,0 +1,79 @@
+"""Tabulated sun and moon ephemerides for fast per-observation lookups."""
+
+import numpy as np
+import astropy.coordinates as coord
+from astropy.time import Time
+import astropy.units as u
+from .constants import W_loc
+from .utils import skycoord_to_altaz
+
+
+class NightEphemeris(object):
+    """Sun and moon positions and sidereal time for one (UTC) day.
+
+    The positions are computed with astropy once on a regular time grid and
+    then linearly interpolated, so each lookup is a few numpy operations
+    instead of a get_sun/get_moon call and two AltAz transforms.  With the
+    default 5 minute step the interpolation error is well below an arcminute
+    for the sun and a few arcminutes for the moon."""
+
+    def __init__(self, mjd_night, step = 5. * u.min, location = W_loc):
+        self.mjd_night = np.floor(mjd_night)
+        self.location = location
+
+        step_days = step.to(u.day).value
+        self.mjd_grid = self.mjd_night + np.arange(0., 1. + step_days, step_days)
+        times = Time(self.mjd_grid, format='mjd', location=location)
+        # see note in utils.py
+        times.delta_ut1_utc = 0.
+
+        sun = coord.get_sun(times)
+        sun_altaz = skycoord_to_altaz(sun, times)
+        moon = coord.get_moon(times, location)
+        moon_altaz = skycoord_to_altaz(moon, times)
+
+        # all angles in radians; longitudes are unwrapped so they can be
+        # interpolated, and wrapped again on lookup
+        self._columns = {
+            'sunRA': np.unwrap(sun.ra.to(u.radian).value),
+            'sunDec': sun.dec.to(u.radian).value,
+            'sunAlt': sun_altaz.alt.to(u.radian).value,
+            'sunAz': np.unwrap(sun_altaz.az.to(u.radian).value),
+            'moonRA': np.unwrap(moon.ra.to(u.radian).value),
+            'moonDec': moon.dec.to(u.radian).value,
+            'moonAlt': moon_altaz.alt.to(u.radian).value,
+            'moonAZ': np.unwrap(moon_altaz.az.to(u.radian).value),
+            'lst': np.unwrap(times.sidereal_time('apparent').to(u.radian).value)}
+        self._wrapped = ('sunRA', 'sunAz', 'moonRA', 'moonAZ', 'lst')
+
+
+    def covers(self, mjd):
+        return (self.mjd_grid[0] <= np.min(mjd)) and (np.max(mjd) <= self.mjd_grid[-1])
+
+    def lookup(self, mjd):
+        """Return a dict of the tabulated quantities (radians) at mjd,
+        which may be a scalar or an array."""
+        values = {}
+        for name, column in self._columns.items():
+            value = np.interp(mjd, self.mjd_grid, column)
+            if name in self._wrapped:
+                value = np.mod(value, 2. * np.pi)
+            values[name] = value
+        return values
+
+
+def angular_separation(ra1, dec1, ra2, dec2):
+    """Angular separation in radians (Vincenty formula) between positions
+    given in radians.  Accepts scalars or arrays."""
+    dra = ra2 - ra1
+    sin_dra = np.sin(dra)
+    cos_dra = np.cos(dra)
+    sin_dec1 = np.sin(dec1)
+    cos_dec1 = np.cos(dec1)
+    sin_dec2 = np.sin(dec2)
+    cos_dec2 = np.cos(dec2)
+
+    num1 = cos_dec2 * sin_dra
+    num2 = cos_dec1 * sin_dec2 - sin_dec1 * cos_dec2 * cos_dra
+    denom = sin_dec1 * sin_dec2 + cos_dec1 * cos_dec2 * cos_dra
+    return np.arctan2(np.hypot(num1, num2), denom)
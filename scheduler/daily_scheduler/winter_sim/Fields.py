@@ -11,6 +11,7 @@ from .utils import *
 from .constants import BASE_DIR, P48_loc, W_slew_pars, PROGRAM_IDS, FILTER_IDS
 from .constants import TIME_BLOCK_SIZE, MAX_AIRMASS, EXPOSURE_TIME, READOUT_TIME
 from .constants import slew_time
+from .constants import FIELD_FILENAMES, FIELD_GRID_ID_BOUNDARIES
 
 
 class Fields(object):
@@ -29,43 +30,28 @@ class Fields(object):
 
     def _load_fields(self, field_filename):
         """Loads a field grid of the format generated by Tom B.
-        Expects field_id, ra (deg), dec (deg) columns"""
+        Expects field_id, ra (deg), dec (deg) columns
+
+        field_filename is the directory holding the FIELD_FILENAMES of
+        this camera."""
         
         # DF 8/17/23
-        # take out SUMMER fields while there is no SUMMER and it is 
-        # causing issues with WINTER
-        winter_field_filename = field_filename + 'WINTER_fields.txt'
-        # summer_field_filename = field_filename + 'SUMMER_fields.txt'
-        
-        df_winter = pd.read_csv(winter_field_filename,
+        # SUMMER fields are left out of FIELD_FILENAMES while there is no
+        # SUMMER and they are causing issues with WINTER
+        dfs = [pd.read_csv(field_filename + filename,
             names=['field_id','ra','dec','ebv','l','b',
                 'ecliptic_lon', 'ecliptic_lat', 'number'],
             sep='\s+',usecols=['field_id','ra','dec', 'l','b', 
                 'ecliptic_lon', 'ecliptic_lat'],index_col='field_id',
-            skiprows=1)
-        
-        #df_summer = pd.read_csv(summer_field_filename,
-        #    names=['field_id','ra','dec','ebv','l','b',
-        #        'ecliptic_lon', 'ecliptic_lat', 'number'],
-        #    sep='\s+',usecols=['field_id','ra','dec', 'l','b', 
-        #        'ecliptic_lon', 'ecliptic_lat'],index_col='field_id',
-        #    skiprows=1)
-
-        # append both databases 
-        #df = pd.concat([df_winter, df_summer])
-        df = pd.concat([df_winter])
+            skiprows=1) for filename in FIELD_FILENAMES]
+        df = pd.concat(dfs)
 
         # drop fields below dec of -36 degrees for speed
         # W
         df = df[df['dec'] >= -35]
 
-        # W Add more
         # label the grid ids
-        grid_id_boundaries = \
-            {0: {'min':1,'max':199999},
-             1: {'min':200001,'max':199999},
-             2: {'min':200001,'max':399999},
-             3: {'min':400001,'max':10000000}}
+        grid_id_boundaries = FIELD_GRID_ID_BOUNDARIES
 
         # intialize with a bad int value
         df['grid_id'] = 99
@@ -163,11 +149,19 @@ class Fields(object):
         #print("CURRENT ", current_state, df, df_altaz )
 
         slews_by_axis = {'readout': READOUT_TIME}
-        for axis in ['dome', 'az', 'alt']:
+        # the axes which move depend on the mount: alt-az for WINTER,
+        # equatorial (ha/dec) in the older configurations
+        for axis in W_slew_pars:
             if (axis == 'dome') | (axis == 'az'):
                 current_coord = current_state['current_domeaz'].value
             if axis == 'alt':
                 current_coord = current_state['current_alt'].value
+            if axis == 'ha':
+                # convert to RA for ease of subtraction
+                current_coord = HA_to_RA(current_state['current_ha'],
+                                         current_state['current_time']).degree
+            if axis == 'dec':
+                current_coord = current_state['current_dec'].value
 
             coord = W_slew_pars[axis]['coord']
             dangle = np.abs(df[coord] - current_coord)
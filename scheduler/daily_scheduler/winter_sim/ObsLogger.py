@@ -2,21 +2,23 @@
 
 import os.path
 from collections import defaultdict
-import uuid
+import weakref
 import numpy as np
 import pandas as pd
 import sqlalchemy as db
 from sqlalchemy import create_engine
 import astropy.coordinates as coord
+import astroplan.moon
 import pathlib
 from astropy.time import Time
 from datetime import datetime
 import astropy.units as u
-import astroplan.moon
 import psycopg
 import os
 import yaml
 from .Fields import Fields
+from .PointingLog import PointingLog
+from .Ephemeris import NightEphemeris, angular_separation
 from .utils import *
 from .constants import VALIDITY_WINDOW_MJD, DITHER, BASE_DIR, FILTER_ID_TO_NAME, EXPOSURE_TIME, READOUT_TIME
 from .constants import WINTER_FILTERS
@@ -31,12 +33,17 @@ class ObsLogger(object):
 
     def __init__(self, log_name, survey_start_time = Time('2018-01-01'),
             output_path = BASE_DIR+'../sims/',
-            clobber = False):
+            clobber = False, history = None):
         self.log_name = log_name
         self.survey_start_time = survey_start_time
         self.prev_obs = None
+        # sun and moon positions tabulated for the current night
+        self.ephemeris = None
         self.mjd_tonight = None
         self.moon_illumination_tonight = None
+        # subprogram name -> program metadata, see lookup_program_info
+        self._program_lookup = {}
+        self._program_lookup_key = None
         
         # W
         now = datetime.now()
@@ -54,6 +61,9 @@ class ObsLogger(object):
         self.conn = self.engine.connect()
         #self.create_fields_table(clobber=clobber)
         self.create_pointing_log(clobber=clobber)
+        self.pointing_log = PointingLog(self.engine, 'Summary')
+        # don't lose buffered pointings if the run ends with an exception
+        weakref.finalize(self, self.pointing_log.flush)
         
         # W
         #history_path = '../../wsp/demoRelational.db'
@@ -63,28 +73,33 @@ class ObsLogger(object):
         #self.historyengine = create_engine('sqlite:///'+output_path+f'WINTER_ObsLog.db') #NPL did this change on 2-16-21
         #self.history = pd.read_sql('Observation', self.historyengine)
         
-        try:
-            # Get history from Caltech database 
-            conn = psycopg.connect('dbname=winter user='+str(auth_config['drp']['USERNAME'])+' password='+str(auth_config['drp']['PASSWORD'])+
-                           ' host='+str(auth_config['drp']['HOSTNAME']), connect_timeout=60)
+        if history is not None:
+            # use a snapshot of an already loaded history (e.g. shared by
+            # the chunks of a simulation sweep) instead of querying the db
+            self.history = history.copy()
+        else:
+            try:
+                # Get history from Caltech database 
+                conn = psycopg.connect('dbname=winter user='+str(auth_config['drp']['USERNAME'])+' password='+str(auth_config['drp']['PASSWORD'])+
+                               ' host='+str(auth_config['drp']['HOSTNAME']), connect_timeout=60)
 
-            cur = conn.cursor()
+                cur = conn.cursor()
 
-            command = '''SELECT exposures.progname, exposures.fieldid, exposures.ra, exposures.dec,
-                    exposures.fid, exposures."expmjd", exposures."exptime",exposures.airmass,
-                    programs.progid, programs.progname, programs.progtitle FROM exposures INNER JOIN programs ON
-                    programs.progname=exposures.progname; '''
+                command = '''SELECT exposures.progname, exposures.fieldid, exposures.ra, exposures.dec,
+                        exposures.fid, exposures."expmjd", exposures."exptime",exposures.airmass,
+                        programs.progid, programs.progname, programs.progtitle FROM exposures INNER JOIN programs ON
+                        programs.progname=exposures.progname; '''
 
-            cur.execute(command)
+                cur.execute(command)
 
-            res = cur.fetchall()
+                res = cur.fetchall()
     
-            self.history = pd.DataFrame(res, columns=['puid', 'fieldid', 'ra', 'dec', 'fid', 'expMJD',
-                                        'ExpTime', 'airmass', 'progid', 'progname', 'progtitle'])
-        except Exception as e:
-            print("Failed to grab history because of:", e)
-            self.history = pd.DataFrame( columns=['puid', 'fieldid', 'ra', 'dec', 'fid', 'expMJD',
-                                        'ExpTime', 'airmass', 'progid', 'progname', 'progtitle'])
+                self.history = pd.DataFrame(res, columns=['puid', 'fieldid', 'ra', 'dec', 'fid', 'expMJD',
+                                            'ExpTime', 'airmass', 'progid', 'progname', 'progtitle'])
+            except Exception as e:
+                print("Failed to grab history because of:", e)
+                self.history = pd.DataFrame( columns=['puid', 'fieldid', 'ra', 'dec', 'fid', 'expMJD',
+                                            'ExpTime', 'airmass', 'progid', 'progname', 'progtitle'])
         print("History:", self.history)
         # rename progID to propID for scheduler
         if 'progid' in self.history.columns:
@@ -108,8 +123,6 @@ class ObsLogger(object):
     
             
         
-        self.log_tonight = pd.read_sql('Summary', self.engine)
-        
         # make a symbolic link (symlink) to the file
         print(f'trying to create link at {file_link_path} to {file_path}')
 
@@ -226,6 +239,30 @@ class ObsLogger(object):
             observed           INTEGER
             )""")
 
+    def flush(self):
+        """Write any buffered pointings to the database."""
+        self.pointing_log.flush()
+
+    def lookup_program_info(self, subprogram_name, queues):
+        """Look up the program metadata for a subprogram.
+
+        The lookup table is rebuilt when the queues change or the
+        subprogram is not found.  As in a linear scan over the queues,
+        the last matching program wins."""
+        key = tuple((qname, id(q)) for qname, q in queues.items())
+        if (key != self._program_lookup_key) or \
+                (subprogram_name not in self._program_lookup):
+            self._program_lookup = {}
+            for qname, q in queues.items():
+                for program in q.observing_programs:
+                    self._program_lookup[program.subprogram_name] = {
+                        'progPI': program.program_pi,
+                        'progTitle': program.subprogram_title,
+                        'ditherNumber': program.dither,
+                        'bestDetector': program.best_detector}
+            self._program_lookup_key = key
+        return self._program_lookup.get(subprogram_name, {})
+
     def log_pointing(self, state, request, queues):
 
         record = {}
@@ -238,14 +275,8 @@ class ObsLogger(object):
         record['progID'] = request['target_program_id']
         record['progName'] = request['target_subprogram_name'] 
         
-        for qname, q in queues.items():
-            for program in q.observing_programs:
-                if program.subprogram_name == request['target_subprogram_name']:
-                    pi = program.program_pi
-                    record['progPI'] = program.program_pi
-                    record['progTitle'] = program.subprogram_title
-                    record['ditherNumber'] = program.dither
-                    record['bestDetector'] = program.best_detector
+        record.update(self.lookup_program_info(
+            request['target_subprogram_name'], queues))
         
         record['fieldID'] = request['target_field_id']
         record['raDeg'] = request['target_ra']
@@ -297,40 +328,29 @@ class ObsLogger(object):
 
         record['airmass'] = altaz.secz.value
         record['filtSkyBright'] = request['target_sky_brightness']
-        # despite the docs, it seems lst is stored as radians
-        record['lst'] = np.radians(exposure_start.sidereal_time('apparent').to(
-            u.hourangle).value/24.*360.)
         record['altitude'] = altaz.alt.value
         record['azimuth'] = altaz.az.value
-        '''
-        # W trying to get the simulations to run faster
-        # Spending about 5 min per night recording moon and sun position
-        # TODO: uncomment for production code
-        
-        record['dist2Moon'] = 0.
-        record['solarElong'] = 0.
-        record['moonRA'] = 0.
-        record['moonDec'] = 0.
-        record['moonAlt'] = 0.
-        record['moonAZ'] = 0.
-        record['moonPhase'] = 0.
-        record['sunAlt'] = 0.
-        record['sunAz'] = 0.
-        
-        ''' 
-        sun = coord.get_sun(exposure_start)
-        sun_altaz = skycoord_to_altaz(sun, exposure_start)
-        moon = coord.get_moon(exposure_start, W_loc)
-        moon_altaz = skycoord_to_altaz(moon, exposure_start)
-
-        # WORKING AROUND a bug in sc.separation(moon)!
-        moon_sc = coord.SkyCoord(moon.ra,moon.dec)
-        record['dist2Moon'] = moon.separation(sc).to(u.radian).value
-        record['solarElong'] = sun.separation(sc).to(u.deg).value
-        record['moonRA'] = moon.ra.to(u.radian).value
-        record['moonDec'] = moon.dec.to(u.radian).value
-        record['moonAlt'] = moon_altaz.alt.to(u.radian).value
-        record['moonAZ'] = moon_altaz.az.to(u.radian).value
+
+        # sun, moon and sidereal time are interpolated from a table computed
+        # once per night: computing them here took about 5 min per
+        # simulated night
+        if (self.ephemeris is None) or \
+                (not self.ephemeris.covers(exposure_start.mjd)):
+            self.ephemeris = NightEphemeris(exposure_start.mjd)
+        eph = self.ephemeris.lookup(exposure_start.mjd)
+
+        # despite the docs, it seems lst is stored as radians
+        record['lst'] = eph['lst']
+        ra = np.radians(record['raDeg'])
+        dec = np.radians(record['decDeg'])
+        record['dist2Moon'] = angular_separation(ra, dec,
+            eph['moonRA'], eph['moonDec'])
+        record['solarElong'] = np.degrees(angular_separation(ra, dec,
+            eph['sunRA'], eph['sunDec']))
+        record['moonRA'] = eph['moonRA']
+        record['moonDec'] = eph['moonDec']
+        record['moonAlt'] = eph['moonAlt']
+        record['moonAZ'] = eph['moonAZ']
 
         # store tonight's mjd so that we can avoid recomputing moon
         # illumination, which profiling shows is weirdly expensive
@@ -344,13 +364,13 @@ class ObsLogger(object):
 
         record['moonPhase'] = self.moon_illumination_tonight
 
-        record['sunAlt'] = sun_altaz.alt.to(u.radian).value
-        record['sunAz'] = sun_altaz.az.to(u.radian).value
+        record['sunAlt'] = eph['sunAlt']
+        record['sunAz'] = eph['sunAz']
         
         if self.prev_obs is not None:
-            sc_prev = coord.SkyCoord(np.radians(self.prev_obs['raDeg']) * u.radian,
-                                     np.radians(self.prev_obs['decDeg']) * u.radian)
-            record['slewDist'] = sc.separation(sc_prev).to(u.radian).value
+            record['slewDist'] = angular_separation(ra, dec,
+                np.radians(self.prev_obs['raDeg']),
+                np.radians(self.prev_obs['decDeg']))
             record['slewTime'] = (record['expDate'] -
                                   (self.prev_obs['expDate'] +
                                       self.prev_obs['visitTime']))
@@ -362,32 +382,8 @@ class ObsLogger(object):
         record['metricValue'] = request['target_metric_value']
         
 
-        record_row = pd.DataFrame(record,index=[uuid.uuid1().hex])
-
-        # append to our local history DataFrame
-        # note that the index here will change when reloaded from the db
-        self.log_tonight = self.log_tonight.append(record_row, sort=False)
-
-        # write to the database
-        record_row.to_sql('Summary', self.conn, index=False, if_exists='append')
-
-#        # convert nan to SQL NULL. might be smarter to just replace the
-#        # insertion method below with something smarter (pd.to_sql?)
-#        for k,v in record.items():
-#            try:
-#                if np.isnan(v):
-#                    record[k] = 'NULL'
-#            except TypeError:
-#                continue
-#
-#        # use placeholders to create the INSERT query
-#        columns = ', '.join(list(record.keys()))
-#        placeholders = '{' + '}, {'.join(list(record.keys())) + '}'
-#        query = 'INSERT INTO Summary ({}) VALUES ({})'.format(
-#            columns, placeholders)
-#        query_filled = query.format(**record)
-#        self.conn.execute(query_filled)
-
+        # buffered, and written to the database in batches
+        self.pointing_log.append(record)
 
         # save record for next obs
         self.prev_obs = record
@@ -0,0 +1,102 @@
+"""Append-only columnar buffer for the pointing log."""
+
+import numpy as np
+
+
+class PointingLog(object):
+    """Buffer of pointing records stored column by column in preallocated
+    numpy arrays, written to a sqlite table in batches.
+
+    The columns and their types are read from the existing table, so the
+    table definition in ObsLogger.create_pointing_log stays the single
+    source of truth.  Missing values are stored as NaN (numeric columns) or
+    None (text columns) and written as NULL."""
+
+    def __init__(self, engine, table_name = 'Summary', capacity = 1024,
+            flush_every = 100):
+        self.engine = engine
+        self.table_name = table_name
+        self.flush_every = flush_every
+
+        raw = engine.raw_connection()
+        try:
+            cursor = raw.cursor()
+            cursor.execute(f'PRAGMA table_info({table_name})')
+            table_info = cursor.fetchall()
+        finally:
+            raw.close()
+
+        # (cid, name, type, notnull, default, pk); the integer primary key
+        # is left for sqlite to assign
+        self.columns = [row[1] for row in table_info if not row[5]]
+        self.text_columns = {row[1] for row in table_info
+                if not row[5] and row[2].upper() == 'TEXT'}
+
+        self._data = {name: self._empty(name, capacity) for name in self.columns}
+        self.n = 0
+        # records [0, n_flushed) are already in the database
+        self.n_flushed = 0
+
+        self._insert_sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            table_name, ', '.join(self.columns),
+            ', '.join(['?'] * len(self.columns)))
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def capacity(self):
+        return len(self._data[self.columns[0]])
+
+    def _empty(self, name, size):
+        if name in self.text_columns:
+            return np.full(size, None, dtype=object)
+        return np.full(size, np.nan)
+
+    def _grow(self):
+        for name, column in self._data.items():
+            self._data[name] = np.concatenate(
+                [column, self._empty(name, len(column))])
+
+    def append(self, record):
+        """Add one record (a dict of column name to value); keys which are
+        not columns of the table are ignored."""
+        if self.n == self.capacity:
+            self._grow()
+        for name, value in record.items():
+            column = self._data.get(name)
+            if column is not None:
+                column[self.n] = value
+        self.n += 1
+
+        if (self.n - self.n_flushed) >= self.flush_every:
+            self.flush()
+
+    def _sql_column(self, name, start, stop):
+        values = self._data[name][start:stop]
+        if name in self.text_columns:
+            return values.tolist()
+        # values go in as floats, even in INTEGER columns: sqlite stores
+        # whole numbers there as integers and keeps the rest (eg expDate)
+        isnull = np.isnan(values)
+        column = values.tolist()
+        for i in np.flatnonzero(isnull):
+            column[i] = None
+        return column
+
+    def flush(self):
+        """Write the records not yet in the database in one transaction."""
+        if self.n_flushed == self.n:
+            return
+        start, stop = self.n_flushed, self.n
+        rows = list(zip(*[self._sql_column(name, start, stop)
+            for name in self.columns]))
+
+        raw = self.engine.raw_connection()
+        try:
+            cursor = raw.cursor()
+            cursor.executemany(self._insert_sql, rows)
+            raw.commit()
+        finally:
+            raw.close()
+        self.n_flushed = stop
@@ -11,7 +11,7 @@ import astropy.units as u
 from astropy.time import Time, TimeDelta
 import astroplan
 from .Fields import Fields
-from .SkyBrightness import SkyBrightness
+from .SkyBrightness import shared_sky_brightness
 from .magnitudes import limiting_mag
 from .optimize import request_set_optimize, slot_optimize, tsp_optimize, night_optimize
 from .cadence import enough_gap_since_last_obs
@@ -92,7 +92,13 @@ class QueueManager(object):
         else:
             self.fields = fields
 
-        self.VisibleSky = SkyBrightness()
+        # sky brightness predictions are memoized on a grid of the model
+        # inputs; optionally the nightly assignment keeps its predictions
+        # for the whole night
+        self.VisibleSky = shared_sky_brightness(
+            queue_configuration.config.get('sky_brightness_grid'))
+        self.precompute_sky_brightness = queue_configuration.config.get(
+            'precompute_sky_brightness', False)
 
     def is_valid(self, time):
         if self.validity_window is None:
@@ -374,8 +380,12 @@ class QueueManager(object):
         # define functions that actually do the work in subclasses
         return self._remove_requests(request_id)
 
-    def compute_limiting_mag(self, df, time, filter_id=None):
-        """compute limiting magnitude based on sky brightness and seeing"""
+    def compute_limiting_mag(self, df, time, filter_id=None,
+            precompute_sky=False):
+        """compute limiting magnitude based on sky brightness and seeing
+
+        if precompute_sky, the sky brightness predictions are kept for the
+        rest of the night"""
         print(f"FID into compute_limiting_mag {filter_id},")
         # copy df so we can edit the filter id if desired
         if filter_id is not None:
@@ -420,7 +430,8 @@ class QueueManager(object):
                    (df['altitude'] <= airmass_to_altitude(MIN_AIRMASS) )) & \
                     df['filter_id'].isin(SUMMER_FILTERS) 
         #print(f"what's up for SUMMER {wup_tmp.sum()} {wup_tmp}")
-        df.loc[wup_tmp, 'sky_brightness'] = self.VisibleSky.predict(df[wup_tmp])
+        df.loc[wup_tmp, 'sky_brightness'] = self.VisibleSky.predict(df[wup_tmp],
+                                        precompute=precompute_sky)
 
         # compute seeing at each pointing
         df.loc[wup, 'seeing'] = seeing_at_pointing(df.loc[wup,'altitude'])
@@ -645,6 +656,8 @@ class GurobiQueueManager(QueueManager):
                     current_state['current_time'], where='mid')
             blocks, times = cut_blocks, cut_times
         #print("getting sky brightnesses")
+        if self.precompute_sky_brightness:
+            self.VisibleSky.clear_precomputed()
         lim_mags = {}
         sky_brightnesses = {}
         for bi, ti in zip(blocks, times):
@@ -661,7 +674,8 @@ class GurobiQueueManager(QueueManager):
             df = df.join(df_az, on='field_id')
             for fid in FILTER_IDS:
                 df_limmag, df_sky = \
-                    self.compute_limiting_mag(df, ti, filter_id = fid)
+                    self.compute_limiting_mag(df, ti, filter_id = fid,
+                        precompute_sky = self.precompute_sky_brightness)
                 lim_mags[(bi, fid)] = df_limmag
                 sky_brightnesses[(bi, fid)] = df_sky
 
@@ -4,14 +4,12 @@ import configparser
 from collections import defaultdict
 import logging
 import numpy as np
-from astropy.time import Time
 import astropy.units as u
 from .QueueManager import ListQueueManager, GreedyQueueManager, GurobiQueueManager
 from .ObsLogger import ObsLogger
 from .configuration import SchedulerConfiguration
 from .constants import BASE_DIR, PROGRAM_IDS, EXPOSURE_TIME, READOUT_TIME
-from .utils import block_index, block_use_fraction
-from .utils import next_evening_twilight, next_morning_twilight
+from .utils import night_context
 
 
 
@@ -21,7 +19,7 @@ class Scheduler(object):
 
     def __init__(self, scheduler_config_file_fullpath, 
             run_config_file_fullpath, other_queue_configs = None,
-            output_path = BASE_DIR+'../sims/'):
+            output_path = BASE_DIR+'../sims/', history = None):
 
         self.logger = logging.getLogger(__name__)
 
@@ -41,10 +39,16 @@ class Scheduler(object):
         else:
             log_name = self.scheduler_config.config['run_name']
 
-        # initialize sqlite history
+        # initialize sqlite history.  Only pass a history snapshot if there
+        # is one: the ObsLoggers of the older scheduler variants load their
+        # own history and don't take it
+        obs_log_kwargs = {}
+        if history is not None:
+            obs_log_kwargs['history'] = history
         self.obs_log = ObsLogger(log_name,
                 output_path = output_path,
-                clobber=self.run_config['scheduler'].getboolean('clobber_db'),) 
+                clobber=self.run_config['scheduler'].getboolean('clobber_db'),
+                **obs_log_kwargs)
 
 
     def set_queue(self, queue_name): 
@@ -81,28 +85,16 @@ class Scheduler(object):
         # Look for timed queues that will be valid tonight,
         # to exclude from the nightly solution
         self.timed_queues_tonight = []
-        today = Time(mjd_today, format='mjd')
-        tomorrow = Time(mjd_today + 1, format='mjd')
-        block_start = block_index(today)[0]
-        block_stop = block_index(tomorrow)[0]
+        night = night_context(mjd_today)
+        block_start = night.block_start
+        block_stop = night.block_stop
 
         block_use = defaultdict(float)
 
         # compute fraction of twilight blocks not available
-        evening_twilight = next_evening_twilight(today)
-        morning_twilight = next_morning_twilight(today)
-
-        evening_twilight_block = block_index(evening_twilight)[0]
-        frac_evening_twilight = block_use_fraction(
-                evening_twilight_block, today, evening_twilight)
-        block_use[evening_twilight_block] = frac_evening_twilight
-        self.logger.debug(f'{frac_evening_twilight} of block {evening_twilight_block} is before 12 degree twilight')
-
-        morning_twilight_block = block_index(morning_twilight)[0]
-        frac_morning_twilight = block_use_fraction(
-                morning_twilight_block, morning_twilight, tomorrow)
-        block_use[morning_twilight_block] = frac_morning_twilight
-        self.logger.debug(f'{frac_morning_twilight} of block {morning_twilight_block} is before 12 degree twilight')
+        for block, frac in night.twilight_block_use.items():
+            block_use[block] = frac
+            self.logger.debug(f'{frac} of block {block} is twilight')
 
         for qq_name, qq in self.queues.items():
             if qq.queue_name in ['default', 'fallback']:
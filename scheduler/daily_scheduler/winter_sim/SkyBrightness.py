@@ -16,14 +16,60 @@ try:
 except:
     from constants import FILTER_NAME_TO_ID, BASE_DIR
 import sys
+from collections import OrderedDict
 #sys.modules['sklearn.externals.joblib'] = joblib #NPL 4-1-22 what is this doing?
 
+# inputs of the sky models, in the order of the columns of the raw arrays
+SKY_FEATURES = ['moonillf', 'moonalt', 'moon_dist', 'azimuth', 'altitude',
+                'sunalt']
+
+# default quantization step of each input for CachedSkyBrightness
+DEFAULT_SKY_GRID = {'moonillf': 0.01,  # 0-1
+                    'moonalt': 1.,     # degrees
+                    'moon_dist': 1.,   # degrees
+                    'azimuth': 2.,     # degrees
+                    'altitude': 0.5,   # degrees
+                    'sunalt': 0.5}     # degrees
+
+
+def _pipeline_predict(clf, X):
+    """Run a (DataFrameMapper, regressor) pipeline on a raw array with
+    columns SKY_FEATURES, applying the mapper's transformers directly
+    rather than going through pandas."""
+    mapper = clf.steps[0][1]
+    if not isinstance(mapper, DataFrameMapper):
+        return clf.predict(pd.DataFrame(X, columns=SKY_FEATURES))
+
+    features = getattr(mapper, 'built_features', None) or mapper.features
+    columns = []
+    for feature in features:
+        names, transformer = feature[0], feature[1]
+        x = X[:, [SKY_FEATURES.index(name) for name in np.atleast_1d(names)]]
+        if transformer is not None:
+            x = transformer.transform(x)
+        columns.append(np.asarray(x).reshape(len(X), -1))
+    Xt = np.hstack(columns)
+    for _, step in clf.steps[1:-1]:
+        Xt = step.transform(Xt)
+    return np.ravel(clf.steps[-1][1].predict(Xt))
+
+
 class SkyBrightness(object):
 
     def __init__(self):
         self.clf_r = joblib.load(BASE_DIR + '../data/sky_model/sky_model_r.pkl')
         self.clf_g = joblib.load(BASE_DIR + '../data/sky_model/sky_model_g.pkl')
         self.clf_i = joblib.load(BASE_DIR + '../data/sky_model/sky_model_i.pkl')
+        # use g as a proxy for u
+        self.models = {FILTER_NAME_TO_ID['u']: self.clf_g,
+                       FILTER_NAME_TO_ID['g']: self.clf_g,
+                       FILTER_NAME_TO_ID['r']: self.clf_r,
+                       FILTER_NAME_TO_ID['i']: self.clf_i}
+
+    def predict_array(self, filter_id, X):
+        """Predict the sky brightness in one filter for a raw array X with
+        columns SKY_FEATURES."""
+        return _pipeline_predict(self.models[filter_id], X)
 
     def predict(self, df):
         """df is a dataframe with columns:
@@ -61,12 +107,127 @@ class SkyBrightness(object):
 class FakeSkyBrightness(object):
 
     def __init__(self):
-        pass
+        self.models = {FILTER_NAME_TO_ID[name]: None
+                       for name in ['u', 'g', 'r', 'i']}
 
     def predict(self, df):
         y = np.ones(len(df)) * 20.
         return pd.Series(y, index=df.index, name='sky_brightness')
 
+    def predict_array(self, filter_id, X):
+        return np.ones(len(X)) * 20.
+
+
+class CachedSkyBrightness(object):
+    """Memoizing front end to a sky brightness model.
+
+    The model inputs only change slowly through the night, so they are
+    quantized onto a grid (steps given per feature in grid) and the model
+    is run once per distinct grid cell, at the cell center; the predictions
+    are kept in an LRU cache of maxsize cells.  Predictions made with
+    precompute() are kept for the rest of the night instead, until
+    clear_precomputed() is called."""
+
+    def __init__(self, model=None, grid=None, maxsize=500000):
+        if model is None:
+            model = SkyBrightness()
+        self.model = model
+        self.grid = dict(DEFAULT_SKY_GRID)
+        if grid is not None:
+            self.grid.update(grid)
+        self.steps = np.array([self.grid[name] for name in SKY_FEATURES])
+        self.maxsize = maxsize
+
+        self._cache = OrderedDict()
+        self._precomputed = {}
+        self.hits = 0
+        self.misses = 0
+
+    def predict(self, df, precompute=False):
+        """Same interface as SkyBrightness.predict."""
+        sky = self.predict_arrays(df['filter_id'].values,
+            df[SKY_FEATURES].values.astype(float), precompute=precompute)
+        return pd.Series(sky, index=df.index, name='sky_brightness')
+
+    def precompute(self, df):
+        """Predict and keep the results until clear_precomputed()."""
+        return self.predict(df, precompute=True)
+
+    def clear_precomputed(self):
+        self._precomputed = {}
+
+    def clear(self):
+        self._cache.clear()
+        self._precomputed = {}
+        self.hits = 0
+        self.misses = 0
+
+    def predict_arrays(self, filter_id, X, precompute=False):
+        """Predict the sky brightness for raw arrays: filter_id (n,) and
+        X (n, len(SKY_FEATURES)).  Filters without a model get NaN."""
+        filter_id = np.asarray(filter_id).astype(np.int64)
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        sky = np.full(len(filter_id), np.nan)
+
+        ok = np.isin(filter_id, list(self.model.models)) & \
+            np.all(np.isfinite(X), axis=1)
+        if not np.any(ok):
+            return sky
+
+        cells = np.round(X[ok] / self.steps).astype(np.int64)
+        keys, inverse = np.unique(np.column_stack([filter_id[ok], cells]),
+            axis=0, return_inverse=True)
+
+        values = np.empty(len(keys))
+        missing = []
+        for i, key in enumerate(map(tuple, keys)):
+            value = self._precomputed.get(key)
+            if value is None:
+                value = self._cache.get(key)
+                if value is not None:
+                    self._cache.move_to_end(key)
+            if value is None:
+                missing.append(i)
+            else:
+                values[i] = value
+                if precompute:
+                    self._precomputed[key] = value
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            missing = np.array(missing)
+            for fid in np.unique(keys[missing, 0]):
+                w = missing[keys[missing, 0] == fid]
+                values[w] = self.model.predict_array(fid,
+                    keys[w, 1:] * self.steps)
+            for i in missing:
+                key = tuple(keys[i])
+                if precompute:
+                    self._precomputed[key] = values[i]
+                else:
+                    self._cache[key] = values[i]
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+        sky[ok] = values[np.ravel(inverse)]
+        return sky
+
+
+# the models are slow to load and the cache is worth sharing, so all the
+# queues use the same instance for a given grid
+_shared_sky_brightness = {}
+
+def shared_sky_brightness(grid=None):
+    """Return the CachedSkyBrightness shared by the queues for this grid."""
+    key = tuple(sorted((grid or {}).items()))
+    if key not in _shared_sky_brightness:
+        models = [sb.model for sb in _shared_sky_brightness.values()]
+        model = models[0] if len(models) else None
+        _shared_sky_brightness[key] = CachedSkyBrightness(model=model,
+            grid=grid)
+    return _shared_sky_brightness[key]
+
 
 def train_sky_model(filter_name='r', df=None):
 
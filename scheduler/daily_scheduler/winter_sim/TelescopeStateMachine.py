@@ -4,11 +4,11 @@ from transitions import Machine
 from astropy.time import Time
 import numpy as np
 import astropy.units as u
-import astropy.coordinates as coord
 import logging
 from .utils import *
 from .constants import BASE_DIR, P48_loc, FILTER_IDS
 from .constants import READOUT_TIME, EXPOSURE_TIME, FILTER_CHANGE_TIME, slew_time
+from .constants import TELESCOPE_SLEW_AXES, MIN_DEC
 
 class TelescopeStateMachine(Machine):
 
@@ -89,11 +89,9 @@ class TelescopeStateMachine(Machine):
         """Check for night and weather"""
         self.logger.info(self.current_time.iso)
 
-        # start by checking for 12 degree twilight
-        if coord.get_sun(self.current_time).transform_to(
-                coord.AltAz(obstime=self.current_time,
-                            location=P48_loc)).alt.is_within_bounds(
-                upper=which_twilight):
+        # start by checking for twilight
+        night = night_context_at(self.current_time)
+        if night.is_night(self.current_time):
             if self.historical_observability_year is None:
                 # don't use weather, just use 12 degree twilight
                 return True
@@ -113,8 +111,8 @@ class TelescopeStateMachine(Machine):
         else:
             # daytime
             # optimization: fast-forward to sunset
-            next_twilight = next_evening_twilight(self.current_time)
-            self.logger.info('Fast forwarding to 12 deg twilight: {}'.format(
+            next_twilight = night.evening_twilight
+            self.logger.info('Fast forwarding to twilight: {}'.format(
                 next_twilight.iso))
             self.current_time = next_twilight
             return False
@@ -126,7 +124,7 @@ class TelescopeStateMachine(Machine):
             < (10. * u.deg)):
             return False
         # W 
-        if ((target_skycoord.dec < -36. * u.deg) or
+        if ((target_skycoord.dec < MIN_DEC) or
                 (target_skycoord.dec > 90. * u.deg)):
             return False
         return True
@@ -148,7 +146,7 @@ class TelescopeStateMachine(Machine):
         # calculate time required to slew
         # duplicates codes in fields.py--consider refactoring
         axis_slew_times = [READOUT_TIME]
-        for axis in ['domeaz', 'alt']:
+        for axis in TELESCOPE_SLEW_AXES:
             dangle = np.abs(eval("target_{}".format(axis)) -
                             eval("self.current_{}".format(axis)))
 
@@ -124,6 +124,13 @@ class QueueConfiguration(Configuration):
             else:
                 # make it a quantity
                 prog['exposure_time'] = prog['exposure_time'] * u.second
+            # older survey files have no titles, dithers or detectors
+            if 'subprogram_title' not in prog:
+                prog['subprogram_title'] = prog['subprogram_name']
+            if 'dither' not in prog:
+                prog['dither'] = 'N'
+            if 'best_detector' not in prog:
+                prog['best_detector'] = 0
             print("Observing program requested:", PROGRAM_NAME_TO_ID[prog['program_name']],
                                   prog['subprogram_name'], 
                                   prog['subprogram_title'],
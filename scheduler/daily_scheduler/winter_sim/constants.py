@@ -138,6 +138,26 @@ SETTLE_TIME = 1. * u.second
 
 TIME_BLOCK_SIZE = 34. * u.min
 
+# sun altitude which starts and ends the observing night
+TWILIGHT_HORIZON = -6. * u.deg
+# twilight angle of approx_hours_of_darkness
+DARKNESS_TWILIGHT = TWILIGHT_HORIZON
+# the next_evening_twilight helpers search from this long before the time
+# they are given
+EVENING_TWILIGHT_LOOKBACK = 0. * u.min
+
+# axes TelescopeStateMachine slews (see slew_time), and its declination limit
+TELESCOPE_SLEW_AXES = ['domeaz', 'alt']
+MIN_DEC = -36. * u.deg
+
+# field grid: files in data/ and the field_id range of each grid_id
+FIELD_FILENAMES = ['WINTER_fields.txt']
+FIELD_GRID_ID_BOUNDARIES = \
+    {0: {'min':1,'max':199999},
+     1: {'min':200001,'max':199999},
+     2: {'min':200001,'max':399999},
+     3: {'min':400001,'max':10000000}}
+
 PROGRAM_NAME_TO_ID = {'Calibration': 0,
                       'Survey':1, 'MIT': 2, 'Caltech': 3, 'Engineering' :4 }
 PROGRAM_NAMES = list(PROGRAM_NAME_TO_ID.keys())
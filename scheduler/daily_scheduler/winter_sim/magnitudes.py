@@ -1,5 +1,6 @@
 """Utilities for magnitude conversions"""
 
+import functools
 import numpy as np
 import astropy.units as u
 from scipy.interpolate import interp1d
@@ -12,6 +13,16 @@ sensor = Sensor()
 site = Site()
 camera = Camera()
 
+# signal to noise of the WINTER limiting magnitudes
+WINTER_SNR = 5.
+# pixels in the WINTER photometry aperture
+WINTER_APERTURE_PIXELS = 4 # TODO don't hardcode
+
+# atmospheric extinction by WINTER filter (Y, J, Hs), see
+# zeropoint_by_altitude_winter
+WINTER_EXTINCTION_SLOPE = [0.047, 0.0153, 0.0149]
+WINTER_EXTINCTION_CONST = [0, 0.0085, 0.0091]
+
     
 def limiting_mag(exposure_time, seeing_fwhm, sky_brightness,
                  filter_id=2, altitude=90., SNR=5.):
@@ -96,44 +107,108 @@ def limiting_mag_summer(exposure_time, seeing_fwhm, sky_brightness,
 
 def limiting_mag_winter(exposure_time, seeing, sky_brightness,
                  filter_id=1, altitude=90.):
-    
-    #sky_brightness = airglow_by_altitude(altitude, filter_id)
-    #seeing = seeing_at_pointing(altitude)
-    #pixels = np.ceil(3.14159*(seeing / 2.35)**2 / camera.pixscale**2)
-    pixels = 4 # TODO don't hardcode 
-    
+    """Limiting magnitude of WINTER observations.
+
+    Solves obj**2 - SNR**2 * obj - SNR**2 * noise = 0 for the object
+    counts with one batched eigenvalue call on the companion matrices
+    (what np.roots did per request), using the per-filter constants
+    tabulated at import, so the whole calculation is a few array
+    operations whatever the mix of filters.  Filters which are not WINTER
+    filters get 0.
+
+    The closed-form root differs from np.roots in the last bit, which is
+    enough to change the optimizer's choice between near-equal fields, so
+    the results are kept bit-identical to the per-request version."""
+
+    # seeing is not used: the aperture is a fixed number of pixels
+    pixels = WINTER_APERTURE_PIXELS
+
     # remove units on exposure time
     exposure_time = float(exposure_time / u.s)
-    dark_counts = camera.sensor.dark * exposure_time * pixels 
+    dark_counts = camera.sensor.dark * exposure_time * pixels
     read_counts = camera.sensor.rn**2*pixels
-    
-    m = np.zeros(len(filter_id))
-    sky_counts = np.zeros(len(filter_id))
-    
-    w1 = filter_id == 1
-    sky_counts[w1]  = sky_electrons_per_pixel_winter(sky_brightness[w1], 1) * exposure_time * pixels
-    
-    w2 = filter_id == 2
-    sky_counts[w2]  = sky_electrons_per_pixel_winter(sky_brightness[w2], 2) * exposure_time * pixels
-    
-    w3 = filter_id == 3
-    sky_counts[w3]  = sky_electrons_per_pixel_winter(sky_brightness[w3], 3) * exposure_time * pixels
-    
-    noises = sky_counts+dark_counts+read_counts
-    obj_counts = np.fromiter(map(_roots, noises), float)
-    #print(obj_counts)
-    #obj_counts = np.amax(np.roots([1,-SNR**2,-SNR**2*(noises)]))
-    noise = np.sqrt(obj_counts+sky_counts+dark_counts+read_counts)
-    
-    w1 = filter_id == 1
-    m[w1] = zeropoint_by_altitude_winter(altitude[w1], 0) - (5/2)*np.log10(obj_counts[w1]/exposure_time)
-    
-    w2 = filter_id == 2
-    m[w2] = zeropoint_by_altitude_winter(altitude[w2], 1) - (5/2)*np.log10(obj_counts[w2]/exposure_time)
-    
-    w3 = filter_id == 3
-    m[w3] = zeropoint_by_altitude_winter(altitude[w3], 2) - (5/2)*np.log10(obj_counts[w3]/exposure_time)
-    return m 
+
+    filter_id = np.atleast_1d(np.asarray(filter_id)).astype(int)
+    fid = np.where((filter_id >= 0) & (filter_id < len(_WINTER_VALID)),
+                   filter_id, 0)
+    valid = _WINTER_VALID[fid]
+
+    sky_brightness = np.asarray(sky_brightness, dtype=float)
+    sky_counts = np.where(valid, _WINTER_SKY_COEF[fid] *
+        10.**(-0.4 * sky_brightness) * exposure_time * pixels, 0.)
+
+    noises = sky_counts + dark_counts + read_counts
+    snr2 = WINTER_SNR**2
+    obj_counts = _largest_roots(snr2, noises)
+
+    X = altitude_to_airmass(np.asarray(altitude, dtype=float))
+    zeropoint = _WINTER_ZP[fid] - (_WINTER_ZP_SLOPE[fid] * X +
+                                   _WINTER_ZP_CONST[fid])
+    m = zeropoint - (5/2)*np.log10(obj_counts/exposure_time)
+    return np.where(valid, m, 0.)
+
+
+@functools.lru_cache(maxsize=32)
+def limiting_mag_winter_grid(exposure_time_s, filter_id,
+                             sky_range=(10., 25.), altitude_range=(10., 90.),
+                             shape=(151, 81)):
+    """Table of WINTER limiting magnitudes on a (sky brightness, altitude)
+    grid for one exposure time (seconds) and filter, cached.
+
+    Returns (sky_axis, altitude_axis, table) with table[i_sky, i_alt]."""
+    sky_axis = np.linspace(*sky_range, shape[0])
+    altitude_axis = np.linspace(*altitude_range, shape[1])
+    sky, alt = np.meshgrid(sky_axis, altitude_axis, indexing='ij')
+    table = limiting_mag_winter(exposure_time_s * u.s, None, sky.ravel(),
+        np.full(sky.size, filter_id), alt.ravel()).reshape(shape)
+    table.setflags(write=False)
+    return sky_axis, altitude_axis, table
+
+
+def limiting_mag_winter_interp(exposure_time, sky_brightness, filter_id,
+                               altitude):
+    """Limiting magnitudes by bilinear interpolation in the cached
+    limiting_mag_winter_grid tables.  Inputs outside the grid are clipped
+    to its edges."""
+    exposure_time_s = float(exposure_time / u.s)
+    sky_brightness, filter_id, altitude = np.broadcast_arrays(
+        np.asarray(sky_brightness, dtype=float),
+        np.asarray(filter_id).astype(int),
+        np.asarray(altitude, dtype=float))
+    m = np.zeros(sky_brightness.shape)
+
+    for fid in np.unique(filter_id):
+        if fid not in WINTER_FILTERS:
+            continue
+        w = filter_id == fid
+        sky_axis, altitude_axis, table = limiting_mag_winter_grid(
+            exposure_time_s, int(fid))
+        i, fi = _grid_position(sky_axis, sky_brightness[w])
+        j, fj = _grid_position(altitude_axis, altitude[w])
+        m[w] = ((1 - fi) * (1 - fj) * table[i, j] + fi * (1 - fj) * table[i + 1, j]
+                + (1 - fi) * fj * table[i, j + 1] + fi * fj * table[i + 1, j + 1])
+    return m
+
+
+def _largest_roots(snr2, noises):
+    """Largest root of x**2 - snr2 * x - snr2 * noise for each noise,
+    from the eigenvalues of the stacked companion matrices as np.roots
+    computes them."""
+    noises = np.atleast_1d(noises)
+    companion = np.zeros(noises.shape + (2, 2))
+    companion[..., 0, 0] = snr2
+    companion[..., 0, 1] = snr2 * noises
+    companion[..., 1, 0] = 1.
+    return np.max(np.real(np.linalg.eigvals(companion)), axis=-1)
+
+
+def _grid_position(axis, x):
+    """Index of the grid cell holding x on a regular axis, and the
+    fractional position within it."""
+    step = axis[1] - axis[0]
+    pos = np.clip((x - axis[0]) / step, 0., len(axis) - 1.)
+    i = np.minimum(pos.astype(int), len(axis) - 2)
+    return i, pos - i
 
 
 def sky_electrons_per_pixel_summer(mag_per_sq_arcsec, filter_id=1):
@@ -159,18 +234,12 @@ def sky_electrons_per_pixel_winter(mag_per_sq_arcsec, filter_id=1):
 
         
 
-    
-# ONLY    
-def _roots(noise_val):
-    snr = 5.
-    root = np.amax(np.roots([1,-snr**2,-snr**2*(noise_val)]))
-    return root
 
 def zeropoint_by_altitude_winter(altitude=90., filter_id=1):
     # Y_band from https://www.jstor.org/stable/10.1086/341699?seq=13#metadata_info_tab_contents
     # J and H from https://iopscience.iop.org/article/10.1086/338545
-    slope = [0.047, 0.0153, 0.0149]
-    const = [0, 0.0085, 0.0091]
+    slope = WINTER_EXTINCTION_SLOPE
+    const = WINTER_EXTINCTION_CONST
     X = altitude_to_airmass(altitude)
     delta = slope[filter_id]*X + const[filter_id]
     return sensor.pred_zp[filter_id] - delta
@@ -267,3 +336,26 @@ def n_pixels(seeing_fwhm):
 
 
 
+def _winter_filter_constants():
+    """Tabulate the per-filter constants of limiting_mag_winter as arrays
+    indexed by filter_id."""
+    n = max(FILTER_ID_TO_NAME) + 1
+    valid = np.zeros(n, dtype=bool)
+    sky_coef = np.zeros(n)
+    zp = np.zeros(n)
+    zp_slope = np.zeros(n)
+    zp_const = np.zeros(n)
+
+    ids = np.array(WINTER_FILTERS)
+    valid[ids] = True
+    # sky electrons/s/pixel for 0 mag/arcsec^2; scales as 10**(-0.4 * sky)
+    sky_coef[ids] = sky_electrons_per_pixel_winter(np.zeros(len(ids)), ids)
+    # the zeropoint at airmass X is zp - (zp_slope * X + zp_const)
+    for fid in ids:
+        zp[fid] = sensor.pred_zp[fid - 1]
+        zp_slope[fid] = WINTER_EXTINCTION_SLOPE[fid - 1]
+        zp_const[fid] = WINTER_EXTINCTION_CONST[fid - 1]
+    return valid, sky_coef, zp, zp_slope, zp_const
+
+_WINTER_VALID, _WINTER_SKY_COEF, _WINTER_ZP, _WINTER_ZP_SLOPE, \
+    _WINTER_ZP_CONST = _winter_filter_constants()
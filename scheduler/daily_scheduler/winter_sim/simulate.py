@@ -1,6 +1,8 @@
 """Routines for running the scheduler in simulation mode."""
 
 import os.path
+import time
+from collections import defaultdict
 from datetime import datetime
 import configparser
 import logging
@@ -15,7 +17,7 @@ from .QueueManager import GreedyQueueManager, QueueEmptyError, GurobiQueueManage
 from .QueueManager import calc_pool_stats, calc_queue_stats
 from .configuration import SchedulerConfiguration
 from .constants import BASE_DIR, P48_loc, W_loc, W_Observer
-from .utils import block_index
+from .utils import block_index, load_night_contexts, save_night_contexts
 import sys
 
 # check aggressively for setting with copy
@@ -32,7 +34,28 @@ def simulate(scheduler_config_file, sim_config_file,
         sim_config_path = BASE_DIR+'../config/',
         output_path = BASE_DIR+'../sims/',
         profile=False, raise_queue_empty=False, fallback=True, 
-        time_limit = 30*u.second):
+        time_limit = 30*u.second, history = None,
+        night_context_file = None):
+    """Run the scheduler over the simulation period.
+
+    history is an optional obs history DataFrame to start from instead of
+    querying the observation database.  If night_context_file is given,
+    twilights solved in earlier runs are loaded from it and the ones solved
+    in this run are saved to it; it is written, not only read, so parallel
+    runs should not share one.  Returns a dict with the
+    run name, the path of the sqlite pointing log, the number of
+    observations and the wall-clock seconds spent in each phase of the
+    simulation."""
+
+    # time spent per phase; lap(phase) charges the time since the last
+    # lap to phase
+    timings = defaultdict(float)
+    t_lap = time.perf_counter()
+    def lap(phase):
+        nonlocal t_lap
+        t = time.perf_counter()
+        timings[phase] += t - t_lap
+        t_lap = t
 
     if profile:
         try:
@@ -41,6 +64,9 @@ def simulate(scheduler_config_file, sim_config_file,
             print('Error importing pyinstrument')
             profile = False
 
+    if night_context_file is not None:
+        load_night_contexts(night_context_file)
+
     sim_config = configparser.ConfigParser()
     sim_config_file_fullpath = os.path.join(sim_config_path, sim_config_file)
     sim_config.read(sim_config_file_fullpath)
@@ -82,7 +108,8 @@ def simulate(scheduler_config_file, sim_config_file,
     scheduler_config_file_fullpath = \
             os.path.join(scheduler_config_path, scheduler_config_file)
     scheduler = Scheduler(scheduler_config_file_fullpath,
-            sim_config_file_fullpath, output_path = output_path)
+            sim_config_file_fullpath, output_path = output_path,
+            history = history)
     # print("SCHEDULER ", scheduler.scheduler_config.build_queue_configs)
     # print("SCHEDULER ", scheduler.queues)
     # print("SCHEDULER ", scheduler.queues.items())
@@ -119,14 +146,19 @@ def simulate(scheduler_config_file, sim_config_file,
 
     # initialize to a low value so we start by assigning nightly requests
     current_night_mjd = 0
+    n_observations = 0
+    lap('setup')
 
     while tel.current_time < (survey_start_time + survey_duration):
+        # slews, exposures and waits of the previous iteration
+        lap('telescope')
         # check if it is a new night and reload queue with new requests
         if np.floor(tel.current_time.mjd) > current_night_mjd:
             # use the state machine to allow us to skip weathered out nights
             # if tel.check_if_ready():
             current_state = tel.current_state_dict()
             scheduler.obs_log.prev_obs = None
+            scheduler.obs_log.flush()
             current_night_mjd = np.floor(tel.current_time.mjd)
 
             block_use = scheduler.find_block_use_tonight(
@@ -146,6 +178,7 @@ def simulate(scheduler_config_file, sim_config_file,
                 logger.info("No new observations tonight in deafult Queue")
             except:
                 logger.info("Nightly requests could not be initialized")
+            lap('nightly_assignment')
 
         if tel.check_if_ready():
             current_state = tel.current_state_dict()
@@ -202,6 +235,8 @@ def simulate(scheduler_config_file, sim_config_file,
 
                         raise QueueEmptyError
 
+            lap('next_obs')
+
             # try to change filters, if needed
             if next_obs['target_filter_id'] != current_state['current_filter_id']:
                 if not tel.start_filter_change(next_obs['target_filter_id']):
@@ -233,18 +268,39 @@ def simulate(scheduler_config_file, sim_config_file,
                 # a) store exposure information in pointing history sqlite db
                 current_state = tel.current_state_dict()
                 scheduler.obs_log.log_pointing(current_state, next_obs, scheduler.queues)
+                n_observations += 1
+                lap('logging')
                 # b) remove completed request_id from the pool and the queue
                 logger.info(next_obs)
                 # assert(next_obs['request_id'] in scheduler.queues[next_obs['queue_name']].queue.index)
                 scheduler.queues[next_obs['queue_name']].remove_requests(next_obs['request_id']) 
+                lap('queue_update')
         else:
             scheduler.obs_log.prev_obs = None
             tel.set_cant_observe()
             tel.wait()
 
+    # write out the pointings still buffered
+    scheduler.obs_log.flush()
+    lap('logging')
+
+    if night_context_file is not None:
+        try:
+            save_night_contexts(night_context_file)
+        except OSError as e:
+            logger.warning(f'Could not save night contexts: {e}')
+
     if profile:
         profiler.stop()
         print(profiler.output_text(str=True, color=True))
         with open(os.path.join(output_path,f'{run_name}_profile.txt'), 'w') as f:
             f.write(profiler.output_text())
 
+    logger.info('Time per phase (s): ' + ', '.join(
+        f'{phase}: {t:.1f}' for phase, t in timings.items()))
+
+    return {'run_name': run_name,
+            'db_path': scheduler.obs_log.engine.url.database,
+            'n_observations': n_observations,
+            'timings': dict(timings)}
+
@@ -0,0 +1,249 @@
+"""Run many independent simulations in parallel.
+
+A sweep splits a survey simulation into chunks -- one per configuration
+variant, and optionally one per period of the survey -- and runs them on a
+process pool.  Every chunk runs in its own output directory, so it gets its
+own sqlite pointing log; the logs are merged into one database at the end.
+All the chunks start from the same obs history snapshot, which is loaded
+once rather than once per chunk.
+
+The periods of a survey are simulated independently, not one after the
+other: nothing is handed from one period to the next.  simulate() never
+adds the observations it simulates to the history, so each period sees the
+same history it would in an unsplit run; the only difference is that the
+telescope starts each period in its initial position and filter rather
+than where the previous night ended, which can change the first slews of
+the night."""
+
+import os
+import json
+import logging
+import pathlib
+import configparser
+import sqlite3
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from astropy.time import Time
+import astropy.units as u
+from .simulate import simulate
+from .ObsLogger import ObsLogger
+from .constants import BASE_DIR
+
+logger = logging.getLogger(__name__)
+
+
+def _update_nested(d, overrides):
+    """Recursively update dict d with overrides."""
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(d.get(key), dict):
+            _update_nested(d[key], value)
+        else:
+            d[key] = value
+    return d
+
+
+def write_variant_configs(scheduler_config_file_fullpath, variant, chunk_dir):
+    """Write the scheduler configuration (and any queue configurations it
+    modifies) of a variant into chunk_dir.
+
+    variant may hold 'scheduler': overrides of the scheduler configuration
+    and 'queues': {queue_name: overrides of that queue's configuration}.
+    Queue configuration files which are not modified are referenced by
+    their absolute path.  Returns the path of the scheduler configuration."""
+    scheduler_config_file_fullpath = pathlib.Path(
+        scheduler_config_file_fullpath).resolve()
+    with open(scheduler_config_file_fullpath) as f:
+        config = json.load(f)
+    _update_nested(config, variant.get('scheduler', {}))
+
+    queue_overrides = variant.get('queues', {})
+    for queue_pars in config['queues']:
+        queue_file = scheduler_config_file_fullpath.parent / queue_pars['config_file']
+        if queue_pars['queue_name'] in queue_overrides:
+            with open(queue_file) as f:
+                queue_config = json.load(f)
+            _update_nested(queue_config,
+                           queue_overrides[queue_pars['queue_name']])
+            queue_file = pathlib.Path(chunk_dir) / \
+                f"{queue_pars['queue_name']}_queue.json"
+            with open(queue_file, 'w') as f:
+                json.dump(queue_config, f, indent=2)
+        queue_pars['config_file'] = str(queue_file)
+
+    path = pathlib.Path(chunk_dir) / scheduler_config_file_fullpath.name
+    with open(path, 'w') as f:
+        json.dump(config, f, indent=2)
+    return path
+
+
+def write_sim_config(sim_config_file_fullpath, chunk_dir, start_time=None,
+                     survey_duration_days=None):
+    """Write a copy of the simulation configuration for one chunk, with
+    its start time and duration."""
+    sim_config = configparser.ConfigParser()
+    sim_config.read(sim_config_file_fullpath)
+    if start_time is not None:
+        sim_config['simulation']['start_time'] = start_time
+    if survey_duration_days is not None:
+        sim_config['simulation']['survey_duration_days'] = \
+            str(survey_duration_days)
+    # each chunk writes a fresh log
+    sim_config['scheduler']['clobber_db'] = 'True'
+
+    path = pathlib.Path(chunk_dir) / pathlib.Path(sim_config_file_fullpath).name
+    with open(path, 'w') as f:
+        sim_config.write(f)
+    return path
+
+
+def make_chunks(scheduler_config_file_fullpath, sim_config_file_fullpath,
+                output_path, variants=None, split_days=None):
+    """Split a sweep into chunks: every variant times every period of
+    split_days of the survey (the whole survey if split_days is None).
+    The periods are independent; see the module docstring.
+
+    variants maps a variant name to its overrides, see
+    write_variant_configs; by default there is one unmodified variant.
+    Returns a list of dicts describing the chunks."""
+    if variants is None:
+        variants = {'base': {}}
+
+    sim_config = configparser.ConfigParser()
+    sim_config.read(sim_config_file_fullpath)
+    start_time = sim_config['simulation']['start_time']
+    duration = sim_config['simulation'].getfloat('survey_duration_days')
+
+    if split_days is None or split_days >= duration:
+        periods = [(None, None)]
+    else:
+        if start_time.lower() == 'tonight':
+            raise ValueError("Can't split a simulation starting tonight")
+        t0 = Time(start_time, scale='utc')
+        starts = np.arange(0., duration, split_days)
+        periods = [((t0 + start * u.day).iso,
+                    min(split_days, duration - start)) for start in starts]
+
+    chunks = []
+    for variant_name, variant in variants.items():
+        for i, (start, days) in enumerate(periods):
+            name = variant_name if len(periods) == 1 \
+                else f'{variant_name}_{i:03d}'
+            chunks.append({'name': name,
+                           'variant': variant_name,
+                           'variant_overrides': variant,
+                           'start_time': start,
+                           'survey_duration_days': days,
+                           'scheduler_config': str(scheduler_config_file_fullpath),
+                           'sim_config': str(sim_config_file_fullpath),
+                           # ObsLogger appends to this without a separator
+                           'output_path': os.path.join(output_path, name, '')})
+    return chunks
+
+
+def run_chunk(chunk, history=None, time_limit=30*u.second):
+    """Run one chunk of a sweep; meant to run in a worker process."""
+    pathlib.Path(chunk['output_path']).mkdir(parents=True, exist_ok=True)
+    scheduler_config = write_variant_configs(chunk['scheduler_config'],
+        chunk['variant_overrides'], chunk['output_path'])
+    sim_config = write_sim_config(chunk['sim_config'], chunk['output_path'],
+        start_time=chunk['start_time'],
+        survey_duration_days=chunk['survey_duration_days'])
+
+    # simulate adds a log file handler per run; don't let them pile up in
+    # a worker which runs several chunks
+    root_logger = logging.getLogger()
+    handlers = list(root_logger.handlers)
+    try:
+        result = simulate(scheduler_config.name, sim_config.name,
+            scheduler_config_path=str(scheduler_config.parent),
+            sim_config_path=str(sim_config.parent),
+            output_path=chunk['output_path'],
+            time_limit=time_limit, history=history)
+    finally:
+        for handler in root_logger.handlers[:]:
+            if handler not in handlers:
+                root_logger.removeHandler(handler)
+                handler.close()
+
+    result.update({'name': chunk['name'], 'variant': chunk['variant']})
+    return result
+
+
+def merge_results(results, merged_db_path):
+    """Merge the Summary tables of the chunks into one sqlite database,
+    adding the chunk and variant names, and save the per-chunk timings
+    next to it."""
+    if os.path.exists(merged_db_path):
+        os.remove(merged_db_path)
+    conn = sqlite3.connect(merged_db_path)
+    try:
+        for result in results:
+            chunk_conn = sqlite3.connect(result['db_path'])
+            try:
+                df = pd.read_sql('SELECT * FROM Summary', chunk_conn)
+            finally:
+                chunk_conn.close()
+            df = df.drop(columns='obsHistID')
+            df['chunk'] = result['name']
+            df['variant'] = result['variant']
+            df.to_sql('Summary', conn, index=False, if_exists='append')
+
+        timings = pd.DataFrame([dict(name=result['name'],
+            variant=result['variant'], n_observations=result['n_observations'],
+            **result['timings']) for result in results])
+        timings.to_sql('Timings', conn, index=False, if_exists='replace')
+    finally:
+        conn.close()
+    return timings
+
+
+def run_sweep(scheduler_config_file_fullpath, sim_config_file_fullpath,
+              output_path=BASE_DIR+'../sims/sweep/', variants=None,
+              split_days=None, max_workers=None, time_limit=30*u.second,
+              history=None):
+    """Run a sweep on a process pool and merge its results into
+    output_path/sweep.db.
+
+    history is the obs history snapshot every chunk starts from; by default
+    it is loaded once from the observation database.  Each chunk runs its
+    own Gurobi solves, so max_workers may be limited by the licence."""
+    pathlib.Path(output_path).mkdir(parents=True, exist_ok=True)
+    chunks = make_chunks(scheduler_config_file_fullpath,
+        sim_config_file_fullpath, output_path, variants=variants,
+        split_days=split_days)
+
+    if history is None:
+        history = load_history_snapshot()
+
+    results = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run_chunk, chunk, history, time_limit):
+                   chunk['name'] for chunk in chunks}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.exception(f'Chunk {name} failed: {e}')
+                continue
+            logger.info(f"Chunk {name} done: {result['n_observations']} "
+                        f"observations, timings {result['timings']}")
+            results.append(result)
+
+    results.sort(key=lambda result: result['name'])
+    merge_results(results, os.path.join(output_path, 'sweep.db'))
+    return results
+
+
+def load_history_snapshot():
+    """Load the obs history once, the same way ObsLogger does."""
+    # a throwaway logger in a scratch directory does the query and renames
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        obs_log = ObsLogger('history_snapshot',
+                            output_path=os.path.join(tmp_dir, ''))
+        history = obs_log.history.copy()
+        obs_log.conn.close()
+        obs_log.engine.dispose()
+    return history
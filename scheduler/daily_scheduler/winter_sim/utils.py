@@ -1,5 +1,8 @@
 """Utility routines."""
 
+import os
+import json
+import functools
 import numpy as np
 import pandas as pd
 from astropy.time import Time
@@ -9,9 +12,10 @@ import astroplan
 from sqlalchemy import create_engine
 from datetime import datetime
 from .constants import BASE_DIR, P48_loc, W_loc, W_Observer, TIME_BLOCK_SIZE 
-from .constants import Site
+from .constants import Site, TWILIGHT_HORIZON, DARKNESS_TWILIGHT
+from .constants import EVENING_TWILIGHT_LOOKBACK
 
-which_twilight = -6.*u.deg
+which_twilight = TWILIGHT_HORIZON
 
 site = Site()
 
@@ -100,49 +104,51 @@ def RA_to_HA(ra, time):
 
     return ha
 
+# The twilight helpers look the twilights up in the NightContext of the
+# night (solving for them only the first time), rather than running the
+# astroplan rise/set solvers on every call.
+
+def _next_twilight(time, name):
+    night = night_context(np.floor(time.mjd))
+    if night.twilight(name) <= time:
+        night = night_context(night.mjd + 1)
+    return night.twilight(name)
+
+def _previous_twilight(time, name):
+    night = night_context(np.floor(time.mjd))
+    if night.twilight(name) >= time:
+        night = night_context(night.mjd - 1)
+    return night.twilight(name)
+
 def previous_evening_twilight(time):
-    return W_Observer.sun_set_time(time, which='previous', horizon=which_twilight)
+    return _previous_twilight(time, 'evening')
 
 def next_evening_twilight(time):
-    # return P48_Observer.twilight_evening_nautical(time, which='next')
-
-    # When more than 1 day in simulation, jumps ahead to 12 deg twilight
-    # so this function is unable to find the next twilight b/c it has already
-    # passed. If I temporarily go back in time 2 minutes, this works again.
-    # temp_time = time - 2*u.min
-    temp_time = time
-    return W_Observer.sun_set_time(temp_time, which='next', horizon=which_twilight)
+    return _next_twilight(time - EVENING_TWILIGHT_LOOKBACK, 'evening')
 
 def previous_morning_twilight(time):
-    return W_Observer.sun_rise_time(time, which='previous', horizon=which_twilight)
+    return _previous_twilight(time, 'morning')
 
 def next_morning_twilight(time):
-    return W_Observer.sun_rise_time(time, which='next', horizon=which_twilight)
+    return _next_twilight(time, 'morning')
 
 def previous_12deg_evening_twilight(time):
-    return W_Observer.twilight_evening_nautical(time, which='previous')
+    return _previous_twilight(time, 'evening_12deg')
     
 def next_12deg_evening_twilight(time):
-    # return P48_Observer.twilight_evening_nautical(time, which='next')
-
-    # When more than 1 day in simulation, jumps ahead to 12 deg twilight
-    # so this function is unable to find the next twilight b/c it has already
-    # passed. If I temporarily go back in time 2 minutes, this works again.
-    # temp_time = time - 2*u.min
-    temp_time = time
-    return W_Observer.twilight_evening_nautical(temp_time, which='next')
+    return _next_twilight(time - EVENING_TWILIGHT_LOOKBACK, 'evening_12deg')
 
 def next_12deg_morning_twilight(time):
-    return W_Observer.twilight_morning_nautical(time, which='next')
+    return _next_twilight(time, 'morning_12deg')
 
 def next_18deg_morning_twilight(time):
-    return W_Observer.twilight_morning_astronomical(time, which='next')
+    return _next_twilight(time, 'morning_18deg')
 
 def previous_18deg_evening_twilight(time):
-    return W_Observer.twilight_evening_astronomical(time, which='previous')
+    return _previous_twilight(time, 'evening_18deg')
 
 def next_18deg_evening_twilight(time):
-    return W_Observer.twilight_evening_astronomical(time, which='next')
+    return _next_twilight(time, 'evening_18deg')
 
 
 def skycoord_to_altaz(skycoord, time):
@@ -184,7 +190,7 @@ def seeing_at_pointing(altitude):
 
 
 def approx_hours_of_darkness(time, axis=coord.Angle(23.44 * u.degree),
-                             latitude=W_loc.lat, twilight=coord.Angle(which_twilight)):
+                             latitude=W_loc.lat, twilight=coord.Angle(DARKNESS_TWILIGHT)):
     """Compute the hours of darkness (greater than t degrees twilight)
 
     The main approximation is a casual treatment of the time since the solstice"""
@@ -244,6 +250,13 @@ def bin_ptf_obstimes(time_block_size=TIME_BLOCK_SIZE):
     df_write_to_sqlite(nexps, 'weather_blocks')
 
 
+@functools.lru_cache(maxsize=None)
+def _year_start(year):
+    """Time at the start of year (cached: block indices are computed for
+    every queue decision)."""
+    return Time([datetime(year, 1, 1)])
+
+
 def block_index(time, time_block_size=TIME_BLOCK_SIZE):
     """convert an astropy time object into a bin index for years broken up
     in time_block_size chunks."""
@@ -252,13 +265,13 @@ def block_index(time, time_block_size=TIME_BLOCK_SIZE):
     year = np.floor(time.decimalyear)
     # this is an annoying conversion. blow up scalars:
     year = np.atleast_1d(year)
-    tyear = Time([datetime(y, 1, 1) for y in year.astype(np.int)])
+    tyear_mjd = np.array([_year_start(int(y)).mjd[0] for y in year])
 
     # mjd to bin
     block_size = time_block_size.to(u.min).value
     convert = (1 * u.day.to(u.min)) / block_size
 
-    return np.floor((time.mjd - tyear.mjd) * convert).astype(np.int)
+    return np.floor((time.mjd - tyear_mjd) * convert).astype(int)
 
 
 def block_index_to_time(block, time_year, where='mid',
@@ -275,10 +288,10 @@ def block_index_to_time(block, time_year, where='mid',
 
     # get the time at the start of the year
     year = np.floor(time_year.decimalyear)
-    tyear = Time([datetime(np.int(year), 1, 1)])
+    tyear = _year_start(int(year))
 
     # this is an annoying conversion. blow up scalars:
-    block = np.atleast_1d(block).astype(np.float)
+    block = np.atleast_1d(block).astype(float)
 
     if where == 'mid':
         block += 0.5
@@ -290,21 +303,8 @@ def block_index_to_time(block, time_year, where='mid',
 def nightly_blocks(time, time_block_size=TIME_BLOCK_SIZE):
     """Return block numbers and midpoint times for a given night."""
 
-    evening_twilight = next_evening_twilight(time)
-    morning_twilight = next_morning_twilight(time)
-
-    if (evening_twilight > morning_twilight) or (evening_twilight.value < 0):
-        # the night has already started, find previous twilight
-        evening_twilight = previous_evening_twilight(time)
-    block_start = block_index(evening_twilight,
-                              time_block_size=time_block_size)
-    block_end = block_index(morning_twilight,
-                            time_block_size=time_block_size)
-
-    blocks = np.arange(block_start, block_end + 1, 1)
-    times = block_index_to_time(blocks, time, where='mid')
-
-    return blocks, times
+    night = night_context_at(time, time_block_size=time_block_size)
+    return night.blocks, night.block_times
 
 def block_use_fraction(block_index, obs_start_time, obs_end_time):
     """Given a block index and Times specifying the start and end of an observation window, return the fraction of the block covered by the window.
@@ -343,6 +343,137 @@ def block_use_fraction(block_index, obs_start_time, obs_end_time):
 
 
 
+class NightContext(object):
+    """Twilight times and time blocks of the night starting on a given MJD.
+
+    The night of mjd runs from the evening to the morning twilight
+    following 0h UTC on mjd (at Palomar both fall on the same UTC day).
+    Everything the scheduler needs about the night is computed here once,
+    so the astroplan rise/set solvers run a handful of times per night
+    rather than on every queue decision.  Use night_context() or
+    night_context_at() to get the memoized instances."""
+
+    # name: (function solving for it, sun altitude in deg or None for
+    # TWILIGHT_HORIZON)
+    TWILIGHTS = {'evening': ('sun_set_time', None),
+                 'morning': ('sun_rise_time', None),
+                 'evening_12deg': ('sun_set_time', -12.),
+                 'morning_12deg': ('sun_rise_time', -12.),
+                 'evening_18deg': ('sun_set_time', -18.),
+                 'morning_18deg': ('sun_rise_time', -18.)}
+
+    def __init__(self, mjd, time_block_size=TIME_BLOCK_SIZE,
+                 twilight_mjds=None):
+        self.mjd = int(mjd)
+        self.time_block_size = time_block_size
+        self.today = Time(self.mjd, format='mjd')
+        self.tomorrow = Time(self.mjd + 1, format='mjd')
+
+        # solved twilights (MJD), filled in as they are needed
+        self.twilight_mjds = {} if twilight_mjds is None else dict(twilight_mjds)
+
+        self.evening_twilight = self.twilight('evening')
+        self.morning_twilight = self.twilight('morning')
+
+        # blocks of the UTC day
+        self.block_start = block_index(self.today,
+                time_block_size=time_block_size)[0]
+        self.block_stop = block_index(self.tomorrow,
+                time_block_size=time_block_size)[0]
+
+        # blocks of the night and their midpoints
+        self.evening_twilight_block = block_index(self.evening_twilight,
+                time_block_size=time_block_size)[0]
+        self.morning_twilight_block = block_index(self.morning_twilight,
+                time_block_size=time_block_size)[0]
+        self.blocks = np.arange(self.evening_twilight_block,
+                                self.morning_twilight_block + 1, 1)
+        self.block_times = block_index_to_time(self.blocks, self.today,
+                where='mid', time_block_size=time_block_size)
+
+        # fraction of the first and last blocks which is twilight
+        self.twilight_block_use = {
+            self.evening_twilight_block: block_use_fraction(
+                self.evening_twilight_block, self.today,
+                self.evening_twilight),
+            self.morning_twilight_block: block_use_fraction(
+                self.morning_twilight_block, self.morning_twilight,
+                self.tomorrow)}
+
+    def twilight(self, name):
+        """Return the named twilight (see TWILIGHTS) of this night as a
+        Time, solving for it the first time it is asked for."""
+        if name not in self.twilight_mjds:
+            method, altitude = self.TWILIGHTS[name]
+            horizon = which_twilight if altitude is None else altitude * u.deg
+            t = getattr(W_Observer, method)(self.today, which='next',
+                                            horizon=horizon)
+            self.twilight_mjds[name] = float(t.mjd)
+        return Time(self.twilight_mjds[name], format='mjd')
+
+    def is_night(self, time):
+        """True if time is between this night's twilights."""
+        return self.evening_twilight <= time <= self.morning_twilight
+
+    def to_dict(self):
+        return {'mjd': self.mjd,
+                'time_block_size_min': self.time_block_size.to(u.min).value,
+                'twilight_horizon_deg': which_twilight.to(u.deg).value,
+                'twilight_mjds': self.twilight_mjds}
+
+
+# memoized NightContexts, keyed by (mjd, block size in minutes)
+_NIGHT_CONTEXTS = {}
+
+
+def night_context(mjd, time_block_size=TIME_BLOCK_SIZE):
+    """Return the (memoized) NightContext of the night starting on mjd."""
+    key = (int(mjd), time_block_size.to(u.min).value)
+    if key not in _NIGHT_CONTEXTS:
+        _NIGHT_CONTEXTS[key] = NightContext(int(mjd),
+            time_block_size=time_block_size)
+    return _NIGHT_CONTEXTS[key]
+
+
+def night_context_at(time, time_block_size=TIME_BLOCK_SIZE):
+    """Return the NightContext of the night time falls in, or of the next
+    night if it is after the morning twilight."""
+    night = night_context(np.floor(time.mjd), time_block_size=time_block_size)
+    if time > night.morning_twilight:
+        night = night_context(night.mjd + 1, time_block_size=time_block_size)
+    return night
+
+
+def save_night_contexts(filename):
+    """Write the twilights solved so far to a json file, so later runs
+    (e.g. repeated simulations of the same period) can skip solving them."""
+    contexts = [night.to_dict() for night in _NIGHT_CONTEXTS.values()]
+    # write and rename, so parallel simulations never read a partial file
+    tmp_filename = f'{filename}.{os.getpid()}.tmp'
+    with open(tmp_filename, 'w') as f:
+        json.dump(contexts, f)
+    os.replace(tmp_filename, filename)
+
+
+def load_night_contexts(filename):
+    """Load twilights saved by save_night_contexts.  Nights saved with a
+    different TWILIGHT_HORIZON are skipped."""
+    if not os.path.exists(filename):
+        return
+    with open(filename) as f:
+        contexts = json.load(f)
+    for d in contexts:
+        if not np.isclose(d['twilight_horizon_deg'],
+                          which_twilight.to(u.deg).value):
+            continue
+        key = (d['mjd'], d['time_block_size_min'])
+        if key in _NIGHT_CONTEXTS:
+            continue
+        _NIGHT_CONTEXTS[key] = NightContext(d['mjd'],
+            time_block_size=d['time_block_size_min'] * u.min,
+            twilight_mjds=d['twilight_mjds'])
+
+
 def scalar_len(x):
     """Convenience function to sanitize potential scalars or arrays
     so they can return a len"""
@@ -127,6 +127,27 @@ MAX_AIRMASS = 3.0 # for W (2.5 for ZTF)
 
 TIME_BLOCK_SIZE = 30. * u.min
 
+# sun altitude which starts and ends the observing night
+TWILIGHT_HORIZON = -12. * u.deg
+# twilight angle of approx_hours_of_darkness
+DARKNESS_TWILIGHT = 12. * u.deg
+# the next_evening_twilight helpers search from this long before the time
+# they are given, so a time just past twilight (which is where the
+# simulation fast-forwards to) still finds that twilight
+EVENING_TWILIGHT_LOOKBACK = 2. * u.min
+
+# axes TelescopeStateMachine slews (see slew_time), and its declination limit
+TELESCOPE_SLEW_AXES = ['ha', 'dec', 'domeaz']
+MIN_DEC = -36. * u.deg
+
+# field grid: files in data/ and the field_id range of each grid_id
+FIELD_FILENAMES = ['SUMMER_fields.txt']
+FIELD_GRID_ID_BOUNDARIES = \
+    {0: {'min':1,'max':99999},
+     1: {'min':100001,'max':199999},
+     2: {'min':200001,'max':299999},
+     3: {'min':300001,'max':700000}}
+
 PROGRAM_NAME_TO_ID = {'engineering': 0, 
                       'WINTER':1, 'SUMMER': 2, 'Palomar': 3, 'collaboration' :4 }
 PROGRAM_NAMES = list(PROGRAM_NAME_TO_ID.keys())
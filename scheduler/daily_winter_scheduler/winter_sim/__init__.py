@@ -1,3 +1,21 @@
+"""WINTER scheduler, daily_winter_scheduler variant.
+
+The scheduling engine is shared with daily_scheduler/winter_sim.  Modules
+in this directory override the engine's; every other module is loaded from
+the engine, which imports its settings from .constants, so it runs with
+this variant's constants, data and configuration.
+
+QueueManager, ObsLogger, simulate, magnitudes and SkyBrightness are this
+variant's own: it takes the sky brightness from airglow_by_altitude and the
+limiting magnitudes from W_limiting_mag, and its pointing log has the older
+Summary schema.  So the engine's batched pointing log and cached sky
+brightness model do not apply here."""
+
+import os
+
+__path__.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..', 'daily_scheduler', 'winter_sim'))
+
 from .constants import *
 from .Fields import *
 from .ObsLogger import *
@@ -102,6 +102,27 @@ MAX_AIRMASS = 3.0 # for W (2.5 for ZTF)
 
 TIME_BLOCK_SIZE = 30. * u.min
 
+# sun altitude which starts and ends the observing night
+TWILIGHT_HORIZON = -12. * u.deg
+# twilight angle of approx_hours_of_darkness
+DARKNESS_TWILIGHT = 12. * u.deg
+# the next_evening_twilight helpers search from this long before the time
+# they are given, so a time just past twilight (which is where the
+# simulation fast-forwards to) still finds that twilight
+EVENING_TWILIGHT_LOOKBACK = 2. * u.min
+
+# axes TelescopeStateMachine slews (see slew_time), and its declination limit
+TELESCOPE_SLEW_AXES = ['ha', 'dec', 'domeaz']
+MIN_DEC = -35. * u.deg
+
+# field grid: files in data/ and the field_id range of each grid_id
+FIELD_FILENAMES = ['WINTER_fields.txt']
+FIELD_GRID_ID_BOUNDARIES = \
+    {0: {'min':1,'max':9999},
+     1: {'min':10001,'max':19999},
+     2: {'min':20001,'max':29999},
+     3: {'min':30001,'max':42000}}
+
 PROGRAM_NAME_TO_ID = {'engineering': 0, 
                       'WINTER':1, 'collaboration': 2, 'Palomar': 3}
 PROGRAM_NAMES = list(PROGRAM_NAME_TO_ID.keys())
@@ -22,10 +22,16 @@ def sky_electrons_per_pixel(mag_per_sq_arcsec, filter_id=1):
     return R_sky
     
 # ONLY    
-def _roots(noise_val):
+def _roots(noises):
+    # largest root of x**2 - snr**2 x - snr**2 noise for every noise at once,
+    # from the eigenvalues of the companion matrices as np.roots computes it
     snr = 5.
-    root = np.amax(np.roots([1,-snr**2,-snr**2*(noise_val)]))
-    return root
+    noises = np.atleast_1d(noises)
+    companion = np.zeros(noises.shape + (2, 2))
+    companion[..., 0, 0] = snr**2
+    companion[..., 0, 1] = snr**2*noises
+    companion[..., 1, 0] = 1.
+    return np.max(np.real(np.linalg.eigvals(companion)), axis=-1)
     
 def W_limiting_mag(exposure_time, seeing, sky_brightness,
                  filter_id=1, altitude=90.):
@@ -53,7 +59,7 @@ def W_limiting_mag(exposure_time, seeing, sky_brightness,
     sky_counts[w3]  = sky_electrons_per_pixel(sky_brightness[w3], 2) * exposure_time * pixels
     
     noises = sky_counts+dark_counts+read_counts
-    obj_counts = np.fromiter(map(_roots, noises), float)
+    obj_counts = _roots(noises)
     #print(obj_counts)
     #obj_counts = np.amax(np.roots([1,-SNR**2,-SNR**2*(noises)]))
     noise = np.sqrt(obj_counts+sky_counts+dark_counts+read_counts)
@@ -6,6 +6,7 @@ Created on Tue Jan 25 13:51:59 2022
 @author: frostig
 """
 
+import functools
 import astropy.units as u
 from astropy.time import Time, TimeDelta
 from astropy.coordinates import SkyCoord, EarthLocation, AltAz
@@ -13,6 +14,7 @@ import astropy.coordinates as coords
 import astroplan
 import numpy as np
 import pandas as pd
+from scipy.spatial import cKDTree
 
 
 # define location of Wallace Observatory
@@ -35,42 +37,53 @@ def get_alt_az(times, ra, dec):
     
     return (alt_array, az_array)
 
-# what is up (above altitude 20 deg) in a given night?
-# date in MJD (median Julian Date), e.g. 59480 (Sept 23)
-# ra (right ascension) in hours, minutes, seconds, e.g. '+19h50m41s'
-# dec (declination) in hours, minutes, seconds, e.g. '+08d50m58s'
-def up_tonight(time, ra, dec):
-    loc = SkyCoord(ra=ra, dec=dec, frame='icrs')
+# sunset of the night of an MJD and a grid of times from then to sunrise.
+# these are the same for every target, so work them out once per night
+@functools.lru_cache(maxsize=32)
+def night_time_grid(time, n_times=100):
     time = Time(time, format='mjd') 
     sun_rise = W_Observer.sun_rise_time(time, which="previous") 
     sun_set = W_Observer.sun_set_time(time, which="next") 
     night =(sun_set.jd-sun_rise.jd)
     if night >= 1:
         # if next day, subtract a day
-        dt = np.linspace(sun_set.jd, sun_set.jd+(night-1), 100)
+        dt = np.linspace(sun_set.jd, sun_set.jd+(night-1), n_times)
     else:
-        dt = np.linspace(sun_set.jd, sun_set.jd+(night), 100)
-        
-    altaz = loc.transform_to(AltAz(obstime=Time(dt, format='jd'),location=W_loc))
-    d = {'time': dt, 'alt': altaz.alt}
-    df = pd.DataFrame(data=d)
-    df = df[df['alt']>=20] # can change limiting altitude here 
-    try:
-        time_up = df['time'].iloc[-1] - df['time'].iloc[0]
-    except:
-        time_up = 0
-     
-    if time_up > 0:
-        start = Time(df['time'].iloc[0], format='jd').isot
-        end = Time(df['time'].iloc[-1], format='jd').isot
-        is_available = 'Object is up between UTC ' + str(start)+ ' and ' + str(end)
-        avail_bool = True
-    else:
-        is_available = 'Object is not up'
-        avail_bool = False
-        
-    
-    return (avail_bool, is_available)
+        dt = np.linspace(sun_set.jd, sun_set.jd+(night), n_times)
+
+    frame = AltAz(obstime=Time(dt, format='jd'), location=W_loc)
+    isot = Time(dt, format='jd').isot
+    return dt, frame, isot
+
+# what is up (above altitude 20 deg) in a given night?
+# date in MJD (median Julian Date), e.g. 59480 (Sept 23)
+# ra (right ascension) in hours, minutes, seconds, e.g. '+19h50m41s'
+# dec (declination) in hours, minutes, seconds, e.g. '+08d50m58s'
+def up_tonight(time, ra, dec):
+    return targets_up_tonight(time, ra, dec)[0]
+
+# same as up_tonight for arrays of ras and decs, with one transform for
+# all the targets. returns a list of (avail_bool, is_available)
+def targets_up_tonight(time, ras, decs, min_alt=20):
+    dt, frame, isot = night_time_grid(float(time))
+    # targets along the first axis, times along the second
+    locs = SkyCoord(ra=ras, dec=decs, frame='icrs').reshape(-1, 1)
+    alts = locs.transform_to(frame).alt.degree
+
+    results = []
+    for alt in alts:
+        up = np.flatnonzero(alt >= min_alt) # can change limiting altitude here 
+        if len(up) > 0 and dt[up[-1]] - dt[up[0]] > 0:
+            start = isot[up[0]]
+            end = isot[up[-1]]
+            is_available = 'Object is up between UTC ' + str(start)+ ' and ' + str(end)
+            avail_bool = True
+        else:
+            is_available = 'Object is not up'
+            avail_bool = False
+        results.append((avail_bool, is_available))
+
+    return results
 
 
 ### backend 
@@ -83,41 +96,65 @@ git_path = '../daily_summer_scheduler/data/'
 
 field_filename = git_path + 'SUMMER_fields.txt'
 
+# field grid file and half field size (deg) of each camera
+camera_fields = {'WINTER': ('../daily_winter_scheduler/data/WINTER_fields.txt', 1 / 2),
+                 'SUMMER': (field_filename, camera_field_size)}
 
-def get_field_ids(ras, decs, units="degrees"):
-    field_list = []
-    
+def radec_to_xyz(ra_degs, dec_degs):
+    ra = np.radians(ra_degs)
+    dec = np.radians(dec_degs)
+    return np.stack([np.cos(dec)*np.cos(ra),
+                     np.cos(dec)*np.sin(ra),
+                     np.sin(dec)], axis=-1)
+
+# read the field grid of a camera once, and index the field centres
+# with a KD-tree on unit vectors
+@functools.lru_cache(maxsize=None)
+def load_field_grid(camera):
+    if camera not in camera_fields:
+        camera = 'SUMMER'
+    filename, half_size = camera_fields[camera]
+    fields = pd.read_csv(filename,
+     names=['field_id','ra','dec','ebv','l','b',
+         'ecliptic_lon', 'ecliptic_lat', 'number'],
+     sep='\s+',usecols=['field_id','ra','dec', 'l','b', 
+         'ecliptic_lon', 'ecliptic_lat'],index_col='field_id',
+     skiprows=1)
+    tree = cKDTree(radec_to_xyz(fields['ra'].values, fields['dec'].values))
+    return fields, tree, half_size
+
+
+def get_field_ids(camera, ras, decs, units="degrees"):
     lists = [ras, decs]
     if len(set(map(len, lists))) not in (0, 1):
         raise ValueError('RA and Dec lists are not the same length')
-    
-    for ra, dec in zip(ras, decs):
-        summer_fields = pd.read_csv(field_filename,
-         names=['field_id','ra','dec','ebv','l','b',
-             'ecliptic_lon', 'ecliptic_lat', 'number'],
-         sep='\s+',usecols=['field_id','ra','dec', 'l','b', 
-             'ecliptic_lon', 'ecliptic_lat'],index_col='field_id',
-         skiprows=1)
-        ra = float(ra)
-        dec = float(dec)
-        if units=="radians":
-            ra_degs = rad_to_deg(ra)
-            dec_degs = rad_to_deg(dec)
-        elif units == "degrees":
-            ra_degs = ra
-            dec_degs = dec
-            
-        print(ra, dec)
-        # sort dec
-        dec_sort = summer_fields.iloc[((summer_fields['dec']-dec_degs).abs() <= camera_field_size).values]
-        #print('dec', dec_sort)
-        
-        # sort ra
-        ra_sort = dec_sort.iloc[((dec_sort['ra']-ra_degs).abs() <= camera_field_size).values]
-        #print('ra', ra_sort)
-        
-        field_num = ra_sort.index[0]
-        field_list.append(int(field_num))
-        
-    return field_list
 
+    fields, tree, half_size = load_field_grid(camera)
+    field_ids = fields.index.values
+    field_ras = fields['ra'].values
+    field_decs = fields['dec'].values
+
+    ra_degs = np.asarray(ras, dtype=float)
+    dec_degs = np.asarray(decs, dtype=float)
+    if units=="radians":
+        ra_degs = rad_to_deg(ra_degs)
+        dec_degs = rad_to_deg(dec_degs)
+
+    # a field matches when both its ra and dec are within half a field
+    # size of the target. any such field centre is within the chord
+    # 2*sqrt(2)*sin(half_size/2) of the target, so only those candidates
+    # from the tree need the box test
+    radius = 2*np.sqrt(2)*np.sin(np.radians(half_size)/2)
+    candidates = tree.query_ball_point(radec_to_xyz(ra_degs, dec_degs), radius)
+
+    field_list = []
+    for ra, dec, cands in zip(ra_degs, dec_degs, candidates):
+        cands = np.sort(np.asarray(cands, dtype=int))
+        in_box = cands[(np.abs(field_decs[cands]-dec) <= half_size) &
+                       (np.abs(field_ras[cands]-ra) <= half_size)]
+        if len(in_box) == 0:
+            raise ValueError(f'No {camera} field found at RA {ra}, Dec {dec}')
+        # the first match in the field file
+        field_list.append(int(field_ids[in_box[0]]))
+
+    return field_list
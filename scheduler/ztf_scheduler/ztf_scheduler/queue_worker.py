@@ -0,0 +1,339 @@
+"""Run the CPU-bound queue work in a dedicated worker process.
+
+The Scheduler lives in a single worker process, so every operation on it is
+serialized there and the aiohttp event loop never runs a solve itself.  The
+web process keeps the last-known queue state, which the status endpoints serve
+while the worker is busy (e.g. during the nightly solve)."""
+
+import asyncio
+import logging
+import logging.config
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import astropy.units as u
+from astropy.time import Time
+from astroplan import download_IERS_A
+from ztf_sim.Scheduler import Scheduler
+from ztf_sim.QueueManager import QueueEmptyError, ListQueueManager
+from ztf_sim.constants import P48_loc
+from ztf_sim.configuration import Configuration
+from .constants import LOGGING
+
+# the Scheduler owned by the worker process
+_scheduler = None
+
+
+class WorkerTimeoutError(Exception):
+    """The worker did not answer within the allotted time."""
+    pass
+
+
+def _init_worker(op_config_file_fullpath, run_config_file_fullpath):
+    """Build the Scheduler in the worker process."""
+    global _scheduler
+    logging.config.dictConfig(LOGGING)
+    _scheduler = Scheduler(op_config_file_fullpath, run_config_file_fullpath)
+
+
+def _queue_status(qq, time_now):
+    return {'queue_name': qq.queue_name,
+            'queue_type': qq.queue_type,
+            'validity_window_mjd': qq.validity_window_mjd(),
+            'is_valid': qq.is_valid(time_now),
+            'is_TOO': qq.is_TOO,
+            'queue': qq.return_queue().to_json(orient='records')}
+
+
+def _op_snapshot():
+    """Return the status of every queue."""
+    s = _scheduler
+    time_now = Time.now()
+    return {'current_queue_name': s.Q.queue_name,
+            'queues': {name: _queue_status(qq, time_now)
+                       for name, qq in s.queues.items()},
+            'snapshot_time': time.time()}
+
+
+def _op_nightly_update(time_now, testing_state_dict=None):
+    """Clear old queues and assign the nightly requests."""
+    s = _scheduler
+
+    if testing_state_dict is None:
+        # only download IERS-A in daytime
+        dayfrac = time_now.mjd - np.floor(time_now.mjd)
+        # eariliest sunset is 00:40 UTC, latest sunrise is ~14:10 UTC
+        if (dayfrac < 30./(24.*60.)) or (dayfrac > 14.25/24.):
+            try:
+                download_IERS_A()
+            except Exception as e:
+                logging.exception(e)
+
+    if testing_state_dict is not None:
+        s.queues['default'].assign_nightly_requests(
+            testing_state_dict, s.obs_log)
+        return
+
+    try:
+        s.remove_empty_and_expired_queues(time_now)
+    except Exception as e:
+        logging.exception(e)
+
+    # Look for timed queues that will be valid tonight,
+    # to exclude from the nightly solution
+    block_use = s.find_block_use_tonight(time_now)
+    timed_obs_count = s.count_timed_observations_tonight()
+
+    logging.info(f'Block use by timed queues: {block_use}')
+
+    logging.info('Assigning nightly requests')
+    time_now.location = P48_loc
+    current_state_dict = {'current_time': time_now}
+    s.queues['default'].assign_nightly_requests(
+        current_state_dict,
+        s.obs_log, time_limit=15.*u.minute,
+        block_use = block_use,
+        timed_obs_count = timed_obs_count)
+
+
+def _op_check_queue_switch(time_now):
+    """Switch to TOO or timed queues if needed; returns (last, next) names."""
+    s = _scheduler
+    last_queue = s.Q.queue_name
+    s.check_for_TOO_queue_and_switch(time_now)
+    s.check_for_timed_queue_and_switch(time_now)
+    return last_queue, s.Q.queue_name
+
+
+def _op_next_obs(current_state_dict):
+    """Get the next observation, falling back to the default and fallback
+    queues, and remove it from its queue.  Returns None if nothing is
+    available."""
+    s = _scheduler
+    try:
+        next_obs = s.Q.next_obs(current_state_dict, s.obs_log)
+    except QueueEmptyError:
+
+        # if the current queue is empty and not the default,
+        # switch back to default
+        if s.Q.queue_name != 'default':
+            logging.info('Current queue returned QueueEmptyError! Switching to default')
+            s.set_queue('default')
+
+            try:
+                next_obs = s.Q.next_obs(current_state_dict, s.obs_log)
+            except QueueEmptyError:
+                # use the fallback program below
+                next_obs = None
+            except Exception as e:
+                logging.error('Failed getting next default observation!')
+                logging.exception(e)
+                next_obs = None
+        else:
+            next_obs = None # we're in the default Queue and it's empty
+
+        if next_obs is None:
+            if ('fallback' in s.queues):
+                logging.warning('Queue returned QueueEmptyError! Trying fallback queue')
+                try:
+                    next_obs = s.queues['fallback'].next_obs(
+                        current_state_dict, s.obs_log)
+                except Exception as e:
+                    logging.error('Failed getting fallback observation!')
+                    logging.exception(e)
+                    return None
+            else:
+                logging.error('No fallback queue available!')
+                return None
+
+    # remove from request sets
+    try:
+        s.queues[next_obs['queue_name']].remove_requests(
+                next_obs['request_id'])
+    except Exception as e:
+        logging.exception(e)
+
+    return next_obs
+
+
+def _op_log_pointing(state, obs):
+    _scheduler.obs_log.log_pointing(state, obs)
+
+
+def _op_set_queue(queue_name):
+    """Switch queues; returns False if the queue does not exist."""
+    if queue_name not in _scheduler.queues:
+        return False
+    _scheduler.set_queue(queue_name)
+    return True
+
+
+def _op_add_list_queue(data):
+    """Add a list queue; returns False if it already exists."""
+    s = _scheduler
+    if data['queue_name'] in s.queues:
+        return False
+
+    # make a fake QueueConfiguration
+    queue_config = Configuration(None)
+    queue_config.config = data
+    queue_config.config['queue_manager'] = 'list'
+    s.add_queue(data["queue_name"],
+                ListQueueManager(data["queue_name"], queue_config))
+
+    # if no validity window is specified, switch immediately
+    if (("validity_window_mjd" not in data) or
+        (data["validity_window_mjd"] is None)):
+        s.set_queue(data['queue_name'])
+    return True
+
+
+def _op_delete_queue(queue_name):
+    _scheduler.delete_queue(queue_name)
+
+
+def _op_set_validity_window(queue_name, start, end):
+    """Set a queue's validity window; returns False if it does not exist."""
+    if queue_name not in _scheduler.queues:
+        return False
+    _scheduler.queues[queue_name].set_validity_window_mjd(start, end)
+    return True
+
+
+def _op_obs_history(t):
+    return _scheduler.obs_log.return_obs_history(t)
+
+
+OPERATIONS = {'snapshot': _op_snapshot,
+              'nightly_update': _op_nightly_update,
+              'check_queue_switch': _op_check_queue_switch,
+              'next_obs': _op_next_obs,
+              'log_pointing': _op_log_pointing,
+              'set_queue': _op_set_queue,
+              'add_list_queue': _op_add_list_queue,
+              'delete_queue': _op_delete_queue,
+              'set_validity_window': _op_set_validity_window,
+              'obs_history': _op_obs_history}
+
+
+# operations which don't change the queues
+READ_ONLY_OPERATIONS = ('snapshot', 'obs_history')
+
+
+def _run_operation(op, args):
+    """Entry point in the worker process."""
+    return OPERATIONS[op](*args)
+
+
+class QueueWorker:
+    """Handle, in the web process, on the scheduler worker process.
+
+    Calls with the same coalesce_key while one is in flight share its
+    result instead of queuing duplicate work.  The last queue snapshot is
+    kept so status requests can be answered without waiting on the worker.
+    """
+
+    def __init__(self, op_config_file_fullpath, run_config_file_fullpath):
+        self._initargs = (op_config_file_fullpath, run_config_file_fullpath)
+        self._executor = None
+        self._in_flight = {}
+        # (op, start time) of every call submitted and not yet finished
+        self._pending_ops = []
+        self.last_snapshot = None
+        self._start()
+
+    def _start(self):
+        self._executor = ProcessPoolExecutor(max_workers=1,
+            initializer=_init_worker, initargs=self._initargs)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    @property
+    def is_busy(self):
+        return len(self._pending_ops) > 0
+
+    def status(self):
+        """Summary of the worker's activity for the status endpoints."""
+        now = time.time()
+        return {'worker_busy': self.is_busy,
+                'worker_pending_ops': [(op, now - t0) for op, t0 in self._pending_ops],
+                'snapshot_age': (None if self.last_snapshot is None
+                                 else now - self.last_snapshot['snapshot_time'])}
+
+    async def _run(self, op, args):
+        loop = asyncio.get_event_loop()
+        entry = (op, time.time())
+        self._pending_ops.append(entry)
+        try:
+            result = await loop.run_in_executor(self._executor,
+                _run_operation, op, args)
+        except BrokenProcessPool:
+            logging.error(f'Scheduler worker died during {op}! Restarting it')
+            self._start()
+            raise
+        finally:
+            self._pending_ops.remove(entry)
+
+        if op not in READ_ONLY_OPERATIONS:
+            # the queues changed: update the state served to status requests
+            asyncio.ensure_future(self._refresh_in_background())
+        return result
+
+    async def _refresh_in_background(self):
+        try:
+            await self.refresh_snapshot()
+        except Exception as e:
+            logging.exception(e)
+
+    async def call(self, op, *args, coalesce_key=None, timeout=None,
+                   on_late_result=None):
+        """Run op in the worker and return its result.
+
+        Raises WorkerTimeoutError if it takes longer than timeout seconds;
+        the operation itself keeps running in the worker, and if given,
+        on_late_result is called with its result when it does finish.
+        A coalesced result may already have gone to another caller, so the
+        two can't be combined."""
+        if coalesce_key is not None and on_late_result is not None:
+            raise ValueError('on_late_result cannot be used with coalesce_key')
+        key = (op, coalesce_key)
+        if coalesce_key is not None and key in self._in_flight:
+            task = self._in_flight[key]
+        else:
+            task = asyncio.ensure_future(self._run(op, args))
+            if coalesce_key is not None:
+                self._in_flight[key] = task
+                task.add_done_callback(
+                    lambda _: self._in_flight.pop(key, None))
+
+        try:
+            # shield so a timed-out caller doesn't cancel a shared call
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            if on_late_result is not None:
+                def _late(task):
+                    if not task.cancelled() and task.exception() is None:
+                        on_late_result(task.result())
+                task.add_done_callback(_late)
+            raise WorkerTimeoutError(f'{op} did not finish in {timeout} s')
+
+    async def refresh_snapshot(self, timeout=None):
+        """Get a fresh queue snapshot from the worker and keep it."""
+        self.last_snapshot = await self.call('snapshot', coalesce_key='snapshot',
+            timeout=timeout)
+        return self.last_snapshot
+
+    async def snapshot(self, timeout=5.):
+        """Return queue state: fresh if the worker is free, otherwise (or
+        if it doesn't answer in time) the last known one."""
+        if self.is_busy and self.last_snapshot is not None:
+            return self.last_snapshot
+        try:
+            return await self.refresh_snapshot(timeout=timeout)
+        except WorkerTimeoutError:
+            if self.last_snapshot is None:
+                raise
+            return self.last_snapshot
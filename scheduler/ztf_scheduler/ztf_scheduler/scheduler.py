@@ -7,19 +7,40 @@ import numpy as np
 from astropy.time import Time
 import astropy.coordinates as coord
 import astropy.units as u
-from astroplan import download_IERS_A
 import logging
 import logging.config
-from ztf_sim.Scheduler import Scheduler
-from ztf_sim.QueueManager import QueueEmptyError, ListQueueManager
-from ztf_sim.utils import RA_to_HA, skycoord_to_altaz, block_index
+from ztf_sim.utils import RA_to_HA, skycoord_to_altaz
 from ztf_sim.constants import P48_loc
-from ztf_sim.configuration import Configuration
 from .constants import BASE_DIR, TARGET_OUTPUT_DIR
 from .constants import ROZ_FILTER_NAME_TO_ID, FILTER_ID_TO_ROZ_NAME, TESTING
 from .constants import UTCFormatter, LOGGING
+from .queue_worker import QueueWorker, WorkerTimeoutError
 
-async def scheduler_update(scheduler):
+# seconds to wait on the scheduler worker before giving up on a request.
+# The nightly solve has a 15 minute time limit, plus setup and IERS download.
+NIGHTLY_UPDATE_TIMEOUT = 30. * 60.
+NEXT_OBS_TIMEOUT = 60.
+QUEUE_OP_TIMEOUT = 30.
+# how long an observation handed out after its request timed out is kept
+# for the robot's next request
+LATE_OBS_MAX_AGE = 300.
+
+
+async def nightly_update(worker, time_now):
+    """Run the nightly queue assignment in the scheduler worker."""
+    try:
+        await worker.call('nightly_update', time_now,
+                coalesce_key=np.floor(time_now.mjd).astype(int),
+                timeout=NIGHTLY_UPDATE_TIMEOUT)
+        logging.info('Nightly requests ready')
+    except NotImplementedError:
+        logging.warning('Automatic nightly requests not implemented for this queue!')
+    except WorkerTimeoutError as e:
+        logging.error(f'Nightly request assignment is taking too long: {e}')
+    except Exception as e:
+        logging.exception(e)
+
+async def scheduler_update(worker):
     """Main loop that updates the queue according to the clock."""
     interval = 10
 
@@ -41,44 +62,18 @@ async def scheduler_update(scheduler):
             if (mjd_now > mjd_today) and not TESTING:
                 mjd_today = mjd_now
 
-                # only download IERS-A in daytime
-                dayfrac = time_now.mjd - mjd_today
-                # eariliest sunset is 00:40 UTC, latest sunrise is ~14:10 UTC
-                if (dayfrac < 30./(24.*60.)) or (dayfrac > 14.25/24.):    
-                    try:
-                        download_IERS_A()
-                    except Exception as e:
-                        logging.exception(e)
-
-                try:
-                    scheduler.remove_empty_and_expired_queues(time_now)
-                except Exception as e:
-                    logging.exception(e)
-
-                # Look for timed queues that will be valid tonight, 
-                # to exclude from the nightly solution
-                block_use = scheduler.find_block_use_tonight(time_now)
-                timed_obs_count = scheduler.count_timed_observations_tonight()
-
-                logging.info(f'Block use by timed queues: {block_use}')
-
-                logging.info('Assigning nightly requests')
-                time_now.location = P48_loc
-                current_state_dict = {'current_time': time_now}
-                try:
-                    scheduler.queues['default'].assign_nightly_requests(
-                        current_state_dict,
-                        scheduler.obs_log, time_limit=15.*u.minute, 
-                        block_use = block_use,
-                        timed_obs_count = timed_obs_count)
-                    logging.info('Nightly requests ready')
-                except NotImplementedError:
-                    logging.warning('Automatic nightly requests not implemented for this queue!')
-
-            last_queue = scheduler.Q.queue_name
-            scheduler.check_for_TOO_queue_and_switch(time_now)
-            scheduler.check_for_timed_queue_and_switch(time_now)
-            next_queue = scheduler.Q.queue_name
+                # the solve runs in the worker process; don't wait on it
+                # here so the server keeps answering in the meantime
+                asyncio.ensure_future(nightly_update(worker, time_now))
+
+            try:
+                last_queue, next_queue = await worker.call(
+                    'check_queue_switch', time_now,
+                    coalesce_key='check_queue_switch', timeout=interval)
+            except WorkerTimeoutError:
+                # the worker is busy (e.g. with the nightly solve);
+                # the check is queued and we'll pick it up next time
+                continue
             if next_queue != last_queue:
                 logging.info(f'Switching to queue {next_queue}')
 
@@ -105,48 +100,34 @@ async def next_obs_handler(request):
         time_now.location=P48_loc
         current_state_dict['current_time'] = time_now
 
-    try:
-        next_obs = request.app['scheduler'].Q.next_obs(current_state_dict,
-                request.app['scheduler'].obs_log)
-    except QueueEmptyError:
-
-        # if the current queue is empty and not the default, 
-        # switch back to default
-        if request.app['scheduler'].Q.queue_name != 'default':
-            logging.info('Current queue returned QueueEmptyError! Switching to default')
-            request.app['scheduler'].set_queue('default')
-
-            try:
-                next_obs = request.app['scheduler'].Q.next_obs(current_state_dict,
-                        request.app['scheduler'].obs_log)
-            except QueueEmptyError:
-                # use the fallback program below
-                next_obs = None
-            except Exception as e:
-                logging.error('Failed getting next default observation!')
-                logging.exception(e)
-                next_obs = None
-        else:
-            next_obs = None # we're in the default Queue and it's empty
-        
-        if next_obs is None:
-            if  ('fallback' in request.app['scheduler'].queues):
-                logging.warning('Queue returned QueueEmptyError! Trying fallback queue')
-                try:
-                    next_obs = request.app['scheduler'].queues['fallback'].next_obs(
-                        current_state_dict, request.app['scheduler'].obs_log)
-                except Exception as e:
-                    logging.error('Failed getting fallback observation!')
-                    logging.exception(e)
-                    return web.Response(status=404)
-            else:
-                logging.error('No fallback queue available!')
-                return web.Response(status=404)
+    def keep_late_obs(next_obs):
+        # the observation has already been removed from its queue, so hand
+        # it out on the robot's next request rather than losing it
+        if next_obs is not None:
+            logging.warning(f"Holding late observation {next_obs['request_id']}")
+            request.app['late_obs'] = (next_obs, Time.now())
+
+    late_obs = request.app.pop('late_obs', None)
+    if ((late_obs is not None) and
+        ((Time.now() - late_obs[1]).to(u.second).value < LATE_OBS_MAX_AGE)):
+        next_obs = late_obs[0]
+    else:
+        try:
+            # not coalesced: each call takes an observation off its queue, so
+            # two requests must not be handed the same one
+            next_obs = await request.app['worker'].call('next_obs',
+                current_state_dict,
+                timeout=NEXT_OBS_TIMEOUT, on_late_result=keep_late_obs)
+        except WorkerTimeoutError as e:
+            logging.error(f'Scheduler worker busy: {e}')
+            return web.Response(status=503)
+        except Exception as e:
+            logging.error('Failed getting next observation!')
+            logging.exception(e)
+            return web.Response(status=500)
 
-    except Exception as e:
-        logging.error('Failed getting next observation!')
-        logging.exception(e)
-        return web.Response(status=500)
+    if next_obs is None:
+        return web.Response(status=404)
 
     logging.info(next_obs)
 
@@ -191,13 +172,6 @@ async def next_obs_handler(request):
     #if len(request.app['pending_obs']) >= 3:
     logging.info(f"{len(request.app['pending_obs'])} observations pending status: {list(request.app['pending_obs'].keys())}")
 
-    # remove from request sets
-    try:
-        request.app['scheduler'].queues[next_obs['queue_name']].remove_requests(
-                next_obs['request_id'])
-    except Exception as e:
-        logging.exception(e)
-
     return web.Response(status=200)
 
 async def obs_status_handler(request):
@@ -231,8 +205,10 @@ async def obs_status_handler(request):
             time_now = Time.now()
             time_now.location=P48_loc
             state['current_time'] = time_now
-            request.app['scheduler'].obs_log.log_pointing(
-                    state, request.app['pending_obs'][data['request_id']])
+            # the worker runs calls in order, so this is logged before the
+            # next observation is picked even though we don't wait on it
+            asyncio.ensure_future(log_pointing(request.app['worker'],
+                    state, request.app['pending_obs'][data['request_id']]))
         except Exception as e:
             logging.exception(e)
 
@@ -248,6 +224,13 @@ async def obs_status_handler(request):
     return web.Response(status=200)
 
 
+async def log_pointing(worker, state, obs):
+    try:
+        await worker.call('log_pointing', state, obs)
+    except Exception as e:
+        logging.exception(e)
+
+
 async def reload_queue_handler(request):
     """Reload the queue if requested by the robot."""
     data = await request.json()
@@ -322,12 +305,16 @@ async def switch_queue_handler(request):
         logging.error(f"Missing queue_name argument to switch_queue.")
         return web.Response(status=400)
 
-    if data['queue_name'] not in request.app['scheduler'].queues:
+    try:
+        found = await request.app['worker'].call('set_queue', data['queue_name'],
+                timeout=QUEUE_OP_TIMEOUT)
+    except WorkerTimeoutError:
+        return web.Response(status=503)
+
+    if not found:
         logging.error(f"Requested queue {data['queue_name']} does not exist")
         return web.Response(status=400)
 
-    request.app['scheduler'].set_queue(data['queue_name'])
-
     return web.Response(status=200)
 
 def validate_list_queue(target_dict_list):
@@ -380,63 +367,50 @@ async def add_queue_handler(request):
         logging.error("Only list queues are implemented")
         return web.Response(status=400)
 
-    # check if the queue already exists--don't replace it if so
-    # (PUT should be idempotent)
-    if data['queue_name'] in request.app['scheduler'].queues:
-        msg = f"Provided queue {data['queue_name']} already exists"
-        logging.info(msg)
-        return web.Response(status=200, text=msg)
+    if not validate_list_queue(data['targets']):
+        logging.error("Supplied list queue did not validate!")
+        return web.Response(status=400)
 
+    # the queue is built, and switched to if it has no validity window,
+    # in the worker
     try:
-        queue = load_list_queue(data)
-        request.app['scheduler'].add_queue(data["queue_name"], queue)
+        added = await request.app['worker'].call('add_list_queue', data,
+                timeout=QUEUE_OP_TIMEOUT)
+    except WorkerTimeoutError:
+        return web.Response(status=503)
     except Exception as e:
         logging.exception(e)
         return web.Response(status=400)
 
-    # if no validity window is specified, switch immediately
-    if (("validity_window_mjd" not in data) or 
-        (data["validity_window_mjd"] is None)): 
-        try:
-            request.app['scheduler'].set_queue(data['queue_name'])
-        except Exception as e:
-            logging.exception(e)
-            return web.Response(status=400)
+    # if the queue already exists we didn't replace it
+    # (PUT should be idempotent)
+    if not added:
+        msg = f"Provided queue {data['queue_name']} already exists"
+        logging.info(msg)
+        return web.Response(status=200, text=msg)
 
     return web.Response(status=200)
 
 
-def load_list_queue(data):
-    """Helper function to construct a list queue."""
-
-    # don't await here since we call from add_queue_handler
-    print(data["targets"])
-
-    if "queue_name" not in data:
-        data["queue_name"] = "list_queue"
-
-    if not validate_list_queue(data['targets']):
-        raise ValueError("Supplied list queue did not validate!")
-
-    # make a fake QueueConfiguration
-    queue_config = Configuration(None)
-    queue_config.config = data
-    queue_config.config['queue_manager'] = 'list'
-
-    return ListQueueManager(data["queue_name"], queue_config)
+async def get_queue_snapshot(request):
+    """Return the queue state, which is the last known one if the scheduler
+    worker is busy."""
+    snapshot = await request.app['worker'].snapshot()
+    if request.app['worker'].is_busy:
+        logging.info('Scheduler worker busy, serving queue state from {:.0f} s ago'.format(
+            request.app['worker'].status()['snapshot_age']))
+    return snapshot
 
 async def current_queue_status_handler(request):
     """Return current queue status"""
 
-    s = request.app['scheduler']
+    try:
+        snapshot = await get_queue_snapshot(request)
+    except WorkerTimeoutError:
+        return web.Response(status=503)
 
-    data = {'queue_name': s.Q.queue_name,
-             'queue_type': s.Q.queue_type,
-             'is_current': True,
-             'validity_window_mjd': s.Q.validity_window_mjd(),
-             'is_valid': s.Q.is_valid(Time.now()),
-             'is_TOO': s.Q.is_TOO,
-             'queue': s.Q.return_queue().to_json(orient='records')}
+    data = dict(snapshot['queues'][snapshot['current_queue_name']])
+    data['is_current'] = True
 
     return web.json_response(data)
 
@@ -445,27 +419,22 @@ async def queue_status_handler(request):
     data = await request.json()
     logging.info(data)
 
-    s = request.app['scheduler']
+    try:
+        snapshot = await get_queue_snapshot(request)
+    except WorkerTimeoutError:
+        return web.Response(status=503)
+
+    queues = snapshot['queues']
+    current_queue_name = snapshot['current_queue_name']
 
     if 'queue_name' in data:
         n = data['queue_name']
-        if n not in s.queues:
+        if n not in queues:
             return web.Response(status=404)
-        is_current = (n == s.Q.queue_name)
-        response = {'queue_name': s.queues[n].queue_name, 
-                  'queue_type': s.queues[n].queue_type,
-                  'is_current': is_current,
-                  'validity_window_mjd': s.queues[n].validity_window_mjd(),
-                  'is_valid': s.queues[n].is_valid(Time.now()),
-                  'is_TOO': s.queues[n].is_TOO,
-                  'queue': s.queues[n].return_queue().to_json(orient='records')}
+        response = dict(queues[n], is_current=(n == current_queue_name))
     else:
-        response = [{'queue_name': qq.queue_name, 'queue_type': qq.queue_type,
-                   'is_current': (qq.queue_name == s.Q.queue_name),
-                   'validity_window_mjd': qq.validity_window_mjd(),
-                   'is_valid': qq.is_valid(Time.now()), 'is_TOO': qq.is_TOO,
-                   'queue': qq.return_queue().to_json(orient='records')}
-                   for name, qq in s.queues.items()]
+        response = [dict(qq, is_current=(name == current_queue_name))
+                   for name, qq in queues.items()]
 
 
     return web.json_response(response)
@@ -475,8 +444,6 @@ async def delete_queue_handler(request):
     data = await request.json()
     logging.info(data)
 
-    s = request.app['scheduler']
-
     if 'queue_name' not in data:
         return web.Response(status=400)
 
@@ -485,7 +452,10 @@ async def delete_queue_handler(request):
         return web.Response(status=403)
 
     try:
-        s.delete_queue(data['queue_name'])
+        await request.app['worker'].call('delete_queue', data['queue_name'],
+                timeout=QUEUE_OP_TIMEOUT)
+    except WorkerTimeoutError:
+        return web.Response(status=503)
     except Exception as e:
         logging.exception(e)
         return web.Response(status=400)
@@ -510,7 +480,11 @@ async def obs_history_handler(request):
     else:
         t = Time.now()
 
-    history = request.app['scheduler'].obs_log.return_obs_history(t)
+    try:
+        history = await request.app['worker'].call('obs_history', t,
+                timeout=QUEUE_OP_TIMEOUT)
+    except WorkerTimeoutError:
+        return web.Response(status=503)
 
     if len(history) == 0:
         response = {'history':[]}
@@ -537,8 +511,6 @@ async def set_validity_window_handler(request):
     data = await request.json()
     logging.info(data)
 
-    s = request.app['scheduler']
-
     if 'queue_name' not in data:
         return web.Response(status=400)
 
@@ -553,11 +525,15 @@ async def set_validity_window_handler(request):
     if data['queue_name'] in ['default','fallback']:
         return web.Response(status=403)
 
-    n = data['queue_name']
-    if n not in s.queues:
+    try:
+        found = await request.app['worker'].call('set_validity_window',
+            data['queue_name'], data['validity_window'][0],
+            data['validity_window'][1], timeout=QUEUE_OP_TIMEOUT)
+    except WorkerTimeoutError:
+        return web.Response(status=503)
+
+    if not found:
         return web.Response(status=404)
-    s.queues[n].set_validity_window_mjd(data['validity_window'][0],
-        data['validity_window'][1])
 
     return web.Response(status=200)
 
@@ -599,7 +575,7 @@ async def aio_scheduler_status_handler(request):
  
 
 
-async def build_server(address, port, ALL_FILTER_IDS, scheduler):
+async def build_server(address, port, ALL_FILTER_IDS, worker):
     # For most applications -- those with one event loop -- 
     # you don't need to pass around a loop object. At anytime, 
     # you can retrieve it with a call to asyncio.get_event_loop(). 
@@ -622,7 +598,7 @@ async def build_server(address, port, ALL_FILTER_IDS, scheduler):
     app.router.add_route('DELETE', "/queues", delete_queue_handler)
     app.router.add_route('GET', "/obs_history", obs_history_handler)
     app.router.add_route('PUT', "/validity_window", set_validity_window_handler)
-    app['scheduler'] = scheduler
+    app['worker'] = worker
     time_now = Time.now()
     time_now.location = P48_loc
     app['current_state_dict'] =  {'current_time': time_now}
@@ -667,7 +643,9 @@ def main():
     PORT = run_config['server'].getint('PORT')
     ALL_FILTER_IDS = eval(run_config['scheduler']['ALL_FILTER_IDS'])
 
-    scheduler = Scheduler(op_config_file_fullpath, run_config_file_fullpath)
+    # the Scheduler itself lives in a worker process
+    worker = QueueWorker(op_config_file_fullpath, run_config_file_fullpath)
+    loop = asyncio.get_event_loop()
 
     # TODO: need a function to call to populate this correctly
     if TESTING:
@@ -676,17 +654,17 @@ def main():
 
         logging.info('Assigning nightly requests')
         try:
-            scheduler.queues['default'].assign_nightly_requests(
-                current_state_dict, scheduler.obs_log)
+            loop.run_until_complete(worker.call('nightly_update',
+                current_state_dict['current_time'], current_state_dict))
             logging.info('Nightly requests ready')
         except NotImplementedError:
             logging.warning('Automatic nightly requests not implemented for this queue!')
-    
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(build_server(HOST, PORT, ALL_FILTER_IDS, scheduler))
+
+    loop.run_until_complete(worker.refresh_snapshot())
+    loop.run_until_complete(build_server(HOST, PORT, ALL_FILTER_IDS, worker))
     logging.info("Server ready!")
 
-    task = loop.create_task(scheduler_update(scheduler))
+    task = loop.create_task(scheduler_update(worker))
     
     try:
         loop.run_forever()
@@ -694,5 +672,6 @@ def main():
         logging.info("Shutting Down!")
         # Canceling pending tasks and stopping the loop
         asyncio.gather(*asyncio.Task.all_tasks()).cancel()
+        worker.shutdown()
         loop.stop()
         loop.close()
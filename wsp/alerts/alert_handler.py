@@ -7,14 +7,19 @@ Created on Mon Apr  5 17:35:52 2021
 """
 
 
+import atexit
 import json
 import logging
 import os
+import queue
 
 # needed for email
 import smtplib
 import ssl
 import sys
+import threading
+import time
+from collections import deque
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
@@ -31,12 +36,301 @@ sys.path.insert(1, wsp_path)
 print(f"wsp_path = {wsp_path}")
 
 
+class AlertSendError(Exception):
+    """
+    An alert which could not be sent. retry is False if sending it again
+    won't help (eg an unknown channel), and retry_after is how long the
+    server asked for before the next try, if it did.
+    """
+
+    def __init__(self, msg, retry=True, retry_after=None):
+        super().__init__(msg)
+        self.retry = retry
+        self.retry_after = retry_after
+
+
+class AlertJob(object):
+    """
+    One alert for the AlertDispatcher. send(text) sends it and raises an
+    exception if that fails. Jobs on the same channel with the same key
+    are coalesced into one message (key = None: never), and jobs with
+    summarize = True can be combined into a summary when they pile up.
+    """
+
+    def __init__(self, channel, send, text, key=None, summarize=False, description="alert"):
+        self.channel = channel
+        self.send = send
+        self.text = text
+        self.key = key
+        self.summarize = summarize
+        self.description = description
+
+        self.count = 1
+        self.attempts = 0
+        self.not_before = 0.0
+        self.t_submitted = time.monotonic()
+
+    def message(self):
+        if self.count > 1:
+            return f"{self.text} (repeated {self.count} times)"
+        return self.text
+
+
+class AlertDispatcher(object):
+    """
+    Sends alerts from a background thread, so that the thread raising an
+    alert only has to put it on a queue: submit never waits, and if the
+    queue is full the alert is dropped (and counted in n_dropped).
+
+    Each channel (a slack channel, an email address) is sent to at most
+    once every min_interval_s. A message which repeats one sent to the same
+    channel in the last repeat_interval_s is held until the end of that
+    interval, and all its repeats in the meantime go out as one message
+    with a count. When more than summary_threshold messages are waiting
+    for a channel they are sent together as one summary. Failed sends are
+    retried max_retries times, with exponential backoff.
+    """
+
+    def __init__(self, dispatcher_config=None, logger=None):
+        if dispatcher_config is None:
+            dispatcher_config = dict()
+        self.queue_size = dispatcher_config.get("queue_size", 1000)
+        self.min_interval = dispatcher_config.get("min_interval_s", 1.0)
+        self.repeat_interval = dispatcher_config.get("repeat_interval_s", 60.0)
+        self.summary_threshold = dispatcher_config.get("summary_threshold", 3)
+        self.max_retries = dispatcher_config.get("max_retries", 5)
+        self.backoff = dispatcher_config.get("backoff_s", 2.0)
+        self.max_backoff = dispatcher_config.get("max_backoff_s", 120.0)
+        self.flush_timeout = dispatcher_config.get("flush_timeout_s", 10.0)
+        self.logger = logger
+
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        # jobs waiting to be sent, by channel. only touched by the dispatcher thread
+        self.pending = dict()
+        # when each channel can next be sent to
+        self.next_send = dict()
+        # when each (channel, key) was last sent
+        self.last_sent = dict()
+
+        self.n_sent = 0
+        self.n_failed = 0
+        self.n_dropped = 0
+        self.n_dropped_logged = 0
+
+        # jobs submitted and not yet sent, coalesced or given up on
+        self.n_unfinished = 0
+        self.finished = threading.Condition()
+        self.flushing = False
+
+        self.thread = None
+        self.thread_lock = threading.Lock()
+
+    def log(self, msg, level=logging.INFO):
+        msg = f"AlertDispatcher: {msg}"
+        if self.logger is None:
+            print(msg)
+        else:
+            self.logger.log(level=level, msg=msg)
+
+    def start(self):
+        if self.thread is not None:
+            return
+        with self.thread_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name="AlertDispatcher", daemon=True
+                )
+                self.thread.start()
+                # send whatever is still waiting when the program exits
+                atexit.register(self.flush)
+
+    def submit(self, job):
+        """
+        Queue job to be sent. Returns False if it was dropped because the
+        queue is full.
+        """
+        self.start()
+        with self.finished:
+            self.n_unfinished += 1
+        try:
+            self.queue.put_nowait(job)
+            return True
+        except queue.Full:
+            with self.finished:
+                self.n_unfinished -= 1
+                self.n_dropped += 1
+                self.finished.notify_all()
+            return False
+
+    def flush(self, timeout=None):
+        """
+        Send everything that is waiting now, regardless of the rate limits,
+        and wait up to timeout seconds for it to go out. Returns True if
+        everything was sent (or given up on).
+        """
+        if self.thread is None:
+            return True
+        if timeout is None:
+            timeout = self.flush_timeout
+        self.flushing = True
+        try:
+            # wake up the dispatcher thread
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+        with self.finished:
+            done = self.finished.wait_for(lambda: self.n_unfinished == 0, timeout)
+        self.flushing = False
+        return done
+
+    def finish(self, jobs):
+        with self.finished:
+            self.n_unfinished -= len(jobs)
+            self.finished.notify_all()
+
+    def run(self):
+        while True:
+            try:
+                self.add(self.queue.get(timeout=self.time_to_next_send()))
+                # take everything else that is already waiting, so repeats get coalesced
+                while True:
+                    self.add(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            if self.n_dropped > self.n_dropped_logged:
+                self.log(
+                    f"alert queue full, dropped {self.n_dropped - self.n_dropped_logged} alerts",
+                    level=logging.WARNING,
+                )
+                self.n_dropped_logged = self.n_dropped
+
+            try:
+                self.send_ready()
+            except Exception as e:
+                self.log(f"error sending alerts: {e}", level=logging.ERROR)
+
+    def add(self, job):
+        if job is None:
+            return
+        jobs = self.pending.setdefault(job.channel, deque())
+        if job.key is not None:
+            for waiting in jobs:
+                if waiting.key == job.key:
+                    waiting.count += job.count
+                    self.finish([job])
+                    return
+            last_sent = self.last_sent.get((job.channel, job.key))
+            if last_sent is not None:
+                job.not_before = last_sent + self.repeat_interval
+        jobs.append(job)
+
+    def time_to_next_send(self):
+        # seconds until a waiting job can be sent, or None if there are none
+        if self.flushing:
+            return 0.0
+        times = []
+        for channel, jobs in self.pending.items():
+            if jobs:
+                first_ready = min(job.not_before for job in jobs)
+                times.append(max(first_ready, self.next_send.get(channel, 0.0)))
+        if not times:
+            return None
+        return max(0.0, min(times) - time.monotonic())
+
+    def send_ready(self):
+        now = time.monotonic()
+        for channel, jobs in list(self.pending.items()):
+            if not jobs:
+                del self.pending[channel]
+                continue
+            if (now < self.next_send.get(channel, 0.0)) and not self.flushing:
+                continue
+            ready = [job for job in jobs if self.flushing or (job.not_before <= now)]
+            if not ready:
+                continue
+
+            summary = [job for job in ready if job.summarize]
+            if (len(summary) > self.summary_threshold) or (
+                self.flushing and len(summary) > 1
+            ):
+                self.send(channel, summary, self.summary_text(summary, now))
+            else:
+                self.send(channel, ready[:1], ready[0].message())
+
+        # forget the sends which are too old to hold back a repeat
+        if len(self.last_sent) > self.queue_size:
+            self.last_sent = {
+                key: t
+                for key, t in self.last_sent.items()
+                if now - t < self.repeat_interval
+            }
+
+    def summary_text(self, jobs, now):
+        n_alerts = sum(job.count for job in jobs)
+        age = now - min(job.t_submitted for job in jobs)
+        lines = [f"{n_alerts} alerts in the last {age:.0f} s:"]
+        lines += [job.message() for job in jobs]
+        return "\n".join(lines)
+
+    def send(self, channel, jobs, text):
+        try:
+            jobs[0].send(text)
+        except Exception as e:
+            for job in jobs:
+                job.attempts += 1
+            attempts = max(job.attempts for job in jobs)
+            if getattr(e, "retry", True) and (attempts <= self.max_retries):
+                delay = getattr(e, "retry_after", None)
+                if delay is None:
+                    delay = min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+                self.next_send[channel] = time.monotonic() + delay
+                self.log(
+                    f"could not send {jobs[0].description} to {channel} (attempt {attempts}), trying again in {delay:0.1f} s: {e}",
+                    level=logging.WARNING,
+                )
+                return
+            self.log(
+                f"giving up on sending {jobs[0].description} to {channel} after {attempts} attempts: {e}",
+                level=logging.ERROR,
+            )
+            self.n_failed += len(jobs)
+        else:
+            self.n_sent += 1
+            t_sent = time.monotonic()
+            for job in jobs:
+                if job.key is not None:
+                    self.last_sent[(channel, job.key)] = t_sent
+
+        pending = self.pending[channel]
+        for job in jobs:
+            pending.remove(job)
+        self.finish(jobs)
+        self.next_send[channel] = time.monotonic() + self.min_interval
+
+
 class SlackDispatcher(object):
-    def __init__(self, auth_config, logger=None):
+    """
+    Posts messages and images to slack. If it has a dispatcher (an
+    AlertDispatcher) they are queued and sent from its thread, otherwise
+    they are sent straight away.
+    """
+
+    def __init__(self, auth_config, logger=None, dispatcher=None, timeout=10.0):
         self.auth_config = auth_config
         self.logger = logger
+        self.dispatcher = dispatcher
+        # seconds to wait for slack to answer
+        self.timeout = timeout
+
+        client_kwargs = dict()
+        if "slackbot_api_url" in self.auth_config:
+            # eg a MockSlackServer for testing, see mock_slack.py
+            client_kwargs["base_url"] = self.auth_config["slackbot_api_url"]
         self.client = slack_sdk.WebClient(
-            token=self.auth_config.get("slackbot_token", "")
+            token=self.auth_config.get("slackbot_token", ""),
+            timeout=int(self.timeout),
+            **client_kwargs,
         )
 
     def log(self, msg, level=logging.INFO, verbose=False):
@@ -55,26 +349,23 @@ class SlackDispatcher(object):
             channel_list = [channel_list]
 
         for channel in channel_list:
-
-            try:
-                slack_data = dict({"text": msg})
-                webhook_url = self.auth_config["slackbot_webhooks"][channel]
-
-                response = requests.post(
-                    webhook_url,
-                    data=json.dumps(slack_data),
-                    headers={"Content-Type": "application/json"},
-                )
-
-                status_code = response.status_code
-                reply_text = response.text
-
-                # log the post
-                self.log(
-                    f"SlackDispatcher: posted slack message to {channel}. Got status code {status_code}: {reply_text}",
-                    verbose=verbose,
+            if self.dispatcher is not None:
+                self.dispatcher.submit(
+                    AlertJob(
+                        f"#{channel}",
+                        lambda text, channel=channel: self.send_message(
+                            channel, text, verbose=verbose
+                        ),
+                        msg,
+                        key=msg,
+                        summarize=True,
+                        description="slack message",
+                    )
                 )
+                continue
 
+            try:
+                self.send_message(channel, msg, verbose=verbose)
             except Exception as e:
                 status_code = -999
                 reply_text = e
@@ -86,6 +377,45 @@ class SlackDispatcher(object):
                 )
         # return status_code, reply_text
 
+    def send_message(self, channel, msg, verbose=False):
+        """
+        Post msg to the channel's webhook. Raises an AlertSendError if slack
+        doesn't accept it.
+        """
+        try:
+            webhook_url = self.auth_config["slackbot_webhooks"][channel]
+        except KeyError:
+            raise AlertSendError(f"no slack webhook for channel {channel}", retry=False)
+
+        slack_data = dict({"text": msg})
+        response = requests.post(
+            webhook_url,
+            data=json.dumps(slack_data),
+            headers={"Content-Type": "application/json"},
+            timeout=self.timeout,
+        )
+
+        status_code = response.status_code
+        reply_text = response.text
+
+        if status_code == 429:
+            retry_after = float(response.headers.get("Retry-After", 1))
+            raise AlertSendError(
+                f"rate limited by slack: {reply_text}", retry_after=retry_after
+            )
+        elif status_code >= 400:
+            # only a server error might go away by itself
+            raise AlertSendError(
+                f"got status code {status_code}: {reply_text}",
+                retry=status_code >= 500,
+            )
+
+        # log the post
+        self.log(
+            f"SlackDispatcher: posted slack message to {channel}. Got status code {status_code}: {reply_text}",
+            verbose=verbose,
+        )
+
     def postImage(self, channel_list, filepath, msg="", verbose=False):
         """
         Post an image to the channel using the new Slack file upload API.
@@ -103,83 +433,116 @@ class SlackDispatcher(object):
             if verbose:
                 self.log(f"posting image to channel {channel}", verbose=verbose)
 
-            try:
-                # Get file info
-                filename = os.path.basename(filepath)
-                filesize = os.path.getsize(filepath)
-
-                # Map channel name to ID using auth config
-                # Channel IDs start with 'C', 'D', or 'G'
-                if not channel.startswith(("C", "D", "G")):
-                    # This is a channel name, look it up in the config
-                    channel_id = self.auth_config.get("slackbot_channel_id", {}).get(
-                        channel
+            if self.dispatcher is not None:
+                self.dispatcher.submit(
+                    AlertJob(
+                        f"#{channel}",
+                        lambda text, channel=channel: self.send_image(
+                            channel, filepath, text, verbose=verbose
+                        ),
+                        msg,
+                        description=f"image {os.path.basename(filepath)}",
                     )
-                    if channel_id is None:
-                        raise Exception(
-                            f"Could not find channel ID for channel '{channel}' in auth_config['slackbot_channel_id']"
-                        )
-
-                    if verbose:
-                        self.log(
-                            f"Mapped channel '{channel}' to ID {channel_id}",
-                            verbose=verbose,
-                        )
-                else:
-                    # Already a channel ID
-                    channel_id = channel
-
-                # Step 1: Get upload URL
-                upload_url_response = self.client.files_getUploadURLExternal(
-                    filename=filename, length=filesize
                 )
+                continue
 
-                upload_url = upload_url_response["upload_url"]
-                file_id = upload_url_response["file_id"]
+            try:
+                self.send_image(channel, filepath, msg, verbose=verbose)
+            except Exception as e:
+                self.log(f"Error uploading file: {str(e)}", verbose=verbose)
 
-                if verbose:
-                    self.log(f"Got upload URL and file_id: {file_id}", verbose=verbose)
+    def send_image(self, channel, filepath, msg="", verbose=False):
+        """
+        Upload the image at filepath to the channel. Raises an AlertSendError
+        if it can't.
+        """
+        # Get file info
+        try:
+            filename = os.path.basename(filepath)
+            filesize = os.path.getsize(filepath)
+        except OSError as e:
+            raise AlertSendError(f"could not read {filepath}: {e}", retry=False)
+
+        # Map channel name to ID using auth config
+        # Channel IDs start with 'C', 'D', or 'G'
+        if not channel.startswith(("C", "D", "G")):
+            # This is a channel name, look it up in the config
+            channel_id = self.auth_config.get("slackbot_channel_id", {}).get(channel)
+            if channel_id is None:
+                raise AlertSendError(
+                    f"Could not find channel ID for channel '{channel}' in auth_config['slackbot_channel_id']",
+                    retry=False,
+                )
 
-                # Step 2: Upload the file to the URL
-                with open(filepath, "rb") as file_content:
-                    upload_response = requests.post(
-                        upload_url,
-                        data=file_content.read(),
-                        headers={"Content-Type": "application/octet-stream"},
-                    )
+            if verbose:
+                self.log(
+                    f"Mapped channel '{channel}' to ID {channel_id}",
+                    verbose=verbose,
+                )
+        else:
+            # Already a channel ID
+            channel_id = channel
 
-                if upload_response.status_code != 200:
-                    raise Exception(
-                        f"File upload failed with status code {upload_response.status_code}"
-                    )
+        try:
+            # Step 1: Get upload URL
+            upload_url_response = self.client.files_getUploadURLExternal(
+                filename=filename, length=filesize
+            )
 
-                if verbose:
-                    self.log(f"File uploaded successfully", verbose=verbose)
+            upload_url = upload_url_response["upload_url"]
+            file_id = upload_url_response["file_id"]
 
-                # Step 3: Complete the upload
-                complete_response = self.client.files_completeUploadExternal(
-                    files=[{"id": file_id, "title": filename}],
-                    channel_id=channel_id,
-                    initial_comment=msg,
+            if verbose:
+                self.log(f"Got upload URL and file_id: {file_id}", verbose=verbose)
+
+            # Step 2: Upload the file to the URL
+            with open(filepath, "rb") as file_content:
+                upload_response = requests.post(
+                    upload_url,
+                    data=file_content.read(),
+                    headers={"Content-Type": "application/octet-stream"},
+                    timeout=self.timeout,
                 )
 
-                self.log(f"Successfully uploaded file to {channel}", verbose=verbose)
-                if verbose:
-                    self.log(complete_response, verbose=verbose)
-
-            except slack_sdk.errors.SlackApiError as e:
-                self.log(
-                    f"Error uploading file: {e.response['error']}", verbose=verbose
+            if upload_response.status_code != 200:
+                raise AlertSendError(
+                    f"File upload failed with status code {upload_response.status_code}"
                 )
-            except Exception as e:
-                self.log(f"Error uploading file: {str(e)}", verbose=verbose)
+
+            if verbose:
+                self.log(f"File uploaded successfully", verbose=verbose)
+
+            # Step 3: Complete the upload
+            complete_response = self.client.files_completeUploadExternal(
+                files=[{"id": file_id, "title": filename}],
+                channel_id=channel_id,
+                initial_comment=msg,
+            )
+
+        except slack_sdk.errors.SlackApiError as e:
+            retry_after = None
+            if e.response.status_code == 429:
+                retry_after = float(e.response.headers.get("Retry-After", 1))
+            raise AlertSendError(e.response["error"], retry_after=retry_after)
+
+        self.log(f"Successfully uploaded file to {channel}", verbose=verbose)
+        if verbose:
+            self.log(complete_response, verbose=verbose)
 
 
 class EmailDispatcher(object):
-    def __init__(self, auth_config, logger=None):
+    """
+    Sends emails. If it has a dispatcher (an AlertDispatcher) they are
+    queued and sent from its thread, otherwise they are sent straight away.
+    """
+
+    def __init__(self, auth_config, logger=None, dispatcher=None, timeout=10.0):
 
         self.auth_config = auth_config
         self.logger = logger
+        self.dispatcher = dispatcher
+        # seconds to wait for the mail server
+        self.timeout = timeout
 
         # set up the sending account
         try:
@@ -206,28 +569,44 @@ class EmailDispatcher(object):
             recipient_list = [recipient_list]
         # print(f'Recipient list = {recipient_list}')
         for receiver_email in recipient_list:
-            try:
-                # set up the email
-                email = MIMEMultipart("alternative")
-                email["Subject"] = subject
-                email["From"] = self.sender_email
-                email["To"] = receiver_email
-                # add the body of the email
-                email.attach(MIMEText(message, "plain"))
-
-                # Create secure connection with server and send email
-                context = ssl.create_default_context()
-                with smtplib.SMTP_SSL("smtp.gmail.com", 465, context=context) as server:
-                    server.login(self.sender_email, self.__password__)
-                    server.sendmail(
-                        self.sender_email, receiver_email, email.as_string()
+            if self.dispatcher is not None:
+                self.dispatcher.submit(
+                    AlertJob(
+                        receiver_email,
+                        lambda text, receiver_email=receiver_email: self.send_email(
+                            receiver_email, subject, text
+                        ),
+                        message,
+                        key=(subject, message),
+                        description="alert email",
                     )
-                # Make a note that the email was sent
-                self.log(f"EmailDispatcher: sent alert email to {receiver_email}")
+                )
+                continue
 
+            try:
+                self.send_email(receiver_email, subject, message)
             except Exception as e:
                 self.log(f"Could not send alert email to user {receiver_email}: {e}")
 
+    def send_email(self, receiver_email, subject, message):
+        # set up the email
+        email = MIMEMultipart("alternative")
+        email["Subject"] = subject
+        email["From"] = self.sender_email
+        email["To"] = receiver_email
+        # add the body of the email
+        email.attach(MIMEText(message, "plain"))
+
+        # Create secure connection with server and send email
+        context = ssl.create_default_context()
+        with smtplib.SMTP_SSL(
+            "smtp.gmail.com", 465, context=context, timeout=self.timeout
+        ) as server:
+            server.login(self.sender_email, self.__password__)
+            server.sendmail(self.sender_email, receiver_email, email.as_string())
+        # Make a note that the email was sent
+        self.log(f"EmailDispatcher: sent alert email to {receiver_email}")
+
 
 class AlertHandler(object):
 
@@ -237,9 +616,30 @@ class AlertHandler(object):
         self.auth_config = auth_config
         self.user_config = user_config
 
+        # send the alerts from a background thread, unless it is turned off
+        dispatcher_config = self.alert_config.get("dispatcher", dict())
+        if dispatcher_config.get("enabled", True):
+            self.dispatcher = AlertDispatcher(dispatcher_config)
+        else:
+            self.dispatcher = None
+        timeout = dispatcher_config.get("request_timeout_s", 10.0)
+
         # set up the dispatchers
-        self.slacker = SlackDispatcher(self.auth_config)
-        self.emailer = EmailDispatcher(self.auth_config)
+        self.slacker = SlackDispatcher(
+            self.auth_config, dispatcher=self.dispatcher, timeout=timeout
+        )
+        self.emailer = EmailDispatcher(
+            self.auth_config, dispatcher=self.dispatcher, timeout=timeout
+        )
+
+    def flush(self, timeout=None):
+        """
+        Wait up to timeout seconds for the queued alerts to be sent. This
+        also happens when the program exits.
+        """
+        if self.dispatcher is None:
+            return True
+        return self.dispatcher.flush(timeout)
 
     def email_group(self, group, subject, message):
         recipient_list = []
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A local stand-in for Slack, for trying out the alert handler without
+posting anything.
+
+It answers the parts of the Slack API that the SlackDispatcher uses --
+incoming webhooks (/webhook/<channel>) and the external file upload
+(files.getUploadURLExternal, the upload itself, and
+files.completeUploadExternal) -- and keeps what it was sent in messages
+and files. It can also fail or rate limit the next few requests, and
+answer slowly, to see how the AlertDispatcher copes.
+
+auth_config() makes an auth config which points the AlertHandler at it.
+
+    python mock_slack.py         # sends an alert storm through an AlertHandler
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockSlackServer(object):
+    def __init__(self, host="127.0.0.1", port=0, delay=0.0, verbose=False):
+        # seconds to wait before answering each request
+        self.delay = delay
+        self.verbose = verbose
+
+        # (time, channel, text) of each message posted
+        self.messages = []
+        # (time, channel_id, filename, nbytes, comment) of each file uploaded
+        self.files = []
+        self.n_requests = 0
+        self.lock = threading.Lock()
+
+        # failures to give for the next requests: a list of (status, retry_after)
+        self.failures = []
+        # bytes of the uploads which have not been completed yet, by file_id
+        self.uploads = dict()
+
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                mock.log(format % args)
+
+            def do_GET(self):
+                mock.handle(self)
+
+            def do_POST(self):
+                mock.handle(self)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+
+    def log(self, msg):
+        if self.verbose:
+            print(f"MockSlackServer: {msg}")
+
+    def fail_next(self, n=1, status=500):
+        """Answer the next n requests with the HTTP status."""
+        with self.lock:
+            self.failures += [(status, None)] * n
+
+    def rate_limit_next(self, n=1, retry_after=1):
+        """Answer the next n requests with 429 Too Many Requests."""
+        with self.lock:
+            self.failures += [(429, retry_after)] * n
+
+    def auth_config(self, channels, channel_ids=None):
+        """
+        An auth config with webhooks for the channels and the API url
+        pointing here.
+        """
+        if channel_ids is None:
+            channel_ids = {channel: f"C{i:08d}" for i, channel in enumerate(channels)}
+        return {
+            "slackbot_token": "xoxb-mock",
+            "slackbot_api_url": f"{self.url}/api/",
+            "slackbot_webhooks": {
+                channel: f"{self.url}/webhook/{channel}" for channel in channels
+            },
+            "slackbot_channel_id": channel_ids,
+        }
+
+    def reply(self, request, status, body, headers=None):
+        data = body.encode("utf-8")
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            request.send_header(key, value)
+        request.end_headers()
+        request.wfile.write(data)
+
+    def handle(self, request):
+        length = int(request.headers.get("Content-Length", 0))
+        body = request.rfile.read(length)
+        url = urllib.parse.urlparse(request.path)
+        # the slack client sends the API arguments in the query or the form
+        params = dict(urllib.parse.parse_qsl(url.query))
+        if request.headers.get("Content-Type", "").startswith(
+            "application/x-www-form-urlencoded"
+        ):
+            params.update(urllib.parse.parse_qsl(body.decode("utf-8")))
+
+        if self.delay:
+            time.sleep(self.delay)
+
+        with self.lock:
+            self.n_requests += 1
+            failure = self.failures.pop(0) if self.failures else None
+        if failure is not None:
+            status, retry_after = failure
+            headers = {} if retry_after is None else {"Retry-After": str(retry_after)}
+            self.log(f"failing {url.path} with {status}")
+            if url.path.startswith("/api/"):
+                error = "ratelimited" if status == 429 else "internal_error"
+                self.reply(request, status, json.dumps({"ok": False, "error": error}), headers)
+            else:
+                self.reply(request, status, "error", headers)
+            return
+
+        now = time.time()
+        if url.path.startswith("/webhook/"):
+            channel = url.path[len("/webhook/") :]
+            text = json.loads(body)["text"]
+            with self.lock:
+                self.messages.append((now, channel, text))
+            self.log(f"message to {channel}: {text}")
+            self.reply(request, 200, "ok")
+
+        elif url.path == "/api/files.getUploadURLExternal":
+            with self.lock:
+                file_id = f"F{len(self.uploads) + len(self.files):08d}"
+                self.uploads[file_id] = None
+            upload_url = f"{self.url}/upload/{file_id}"
+            self.reply(
+                request,
+                200,
+                json.dumps({"ok": True, "upload_url": upload_url, "file_id": file_id}),
+            )
+
+        elif url.path.startswith("/upload/"):
+            file_id = url.path[len("/upload/") :]
+            with self.lock:
+                self.uploads[file_id] = len(body)
+            self.reply(request, 200, f"OK - {len(body)}")
+
+        elif url.path == "/api/files.completeUploadExternal":
+            files = json.loads(params.get("files", "[]"))
+            with self.lock:
+                for file in files:
+                    self.files.append(
+                        (
+                            now,
+                            params.get("channel_id"),
+                            file.get("title"),
+                            self.uploads.pop(file["id"], None),
+                            params.get("initial_comment", ""),
+                        )
+                    )
+            self.log(f"files to {params.get('channel_id')}: {files}")
+            self.reply(request, 200, json.dumps({"ok": True, "files": files}))
+
+        else:
+            self.reply(request, 404, json.dumps({"ok": False, "error": "unknown_method"}))
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.log(f"serving on {self.url}")
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+if __name__ == "__main__":
+
+    wsp_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(1, wsp_path)
+    from alerts.alert_handler import AlertHandler
+
+    mock = MockSlackServer(delay=0.05, verbose="-v" in sys.argv[1:])
+    mock.start()
+
+    alert_config = {
+        "dispatcher": {
+            "min_interval_s": 0.2,
+            "repeat_interval_s": 2.0,
+            "backoff_s": 0.2,
+        }
+    }
+    alertHandler = AlertHandler({"users": {}}, alert_config, mock.auth_config(["winter_observatory"]))
+
+    # a hardware fault: the same error over and over, mixed with other messages
+    mock.fail_next(2)
+    mock.rate_limit_next(1, retry_after=1)
+    t_announce = []
+    for i in range(200):
+        t0 = time.monotonic()
+        alertHandler.slack_log("dome: lost connection to the dome")
+        if i % 20 == 0:
+            alertHandler.slack_log(f"robo: trying to reconnect, attempt {i // 20 + 1}")
+        t_announce.append(time.monotonic() - t0)
+        time.sleep(0.01)
+    alertHandler.flush()
+
+    print(f"MockSlackServer: 210 alerts raised, slack_log took at most {max(t_announce) * 1e3:0.2f} ms")
+    print(f"MockSlackServer: {len(mock.messages)} messages posted, {mock.n_requests} requests:")
+    for t, channel, text in mock.messages:
+        print(f"  {t - mock.messages[0][0]:5.2f} s #{channel}: {text!r}")
+    mock.stop()
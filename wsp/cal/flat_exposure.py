@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+flat_exposure.py
+
+Exposure time control for twilight sky flats.
+
+The sky gets orders of magnitude fainter over the twilight flat window, so an
+exposure time from a sky model fit on some other night gives a lot of
+saturated or underexposed frames. The FlatExposureController predicts each
+exposure from the median counts of the last frame taken in the same filter,
+moved to the sun altitude expected at the middle of the next exposure with
+the shape of the sky brightness model in cal_params:
+
+    sky_rate(sun_alt) = exp(a * (-sun_alt)**n) / scale     [counts/s]
+    dark_rate = model dark_rate / scale                     [counts/s]
+
+The model alone is only used for the first frame in each filter. The sun
+altitude rate comes from the sun altitudes the controller is given.
+
+The filters are done in order of twilight brightness: in the evening the one
+which collects the fewest counts goes first, while the sky is brightest, and
+in the morning it goes last. A filter is done once it has n_imgs frames with
+median counts within tolerance of its goal counts, and is given up on once
+the sky has moved out of the exposure time range for it.
+
+Running this file simulates flat sequences against a synthetic twilight sky
+(SyntheticTwilightSky), to try out the controller settings offline:
+
+    python flat_exposure.py [camname]
+"""
+
+import logging
+import os
+import sys
+
+import numpy as np
+import yaml
+
+
+def measure_median_counts(filepath):
+    """
+    median counts of all the image data in a fits file (all the extensions of
+    a multi-extension file)
+    """
+    from astropy.io import fits
+
+    with fits.open(filepath) as hdul:
+        data = [
+            np.ravel(hdu.data)
+            for hdu in hdul
+            if (hdu.data is not None) and (np.ndim(hdu.data) >= 2)
+        ]
+    return float(np.nanmedian(np.concatenate(data)))
+
+
+class FlatExposureController(object):
+    """
+    Picks the exposure time of each twilight flat. flat_config is the
+    cal_params[camname]['flats'] section of the config.
+    """
+
+    def __init__(self, flat_config, sun_rising, logger=None):
+        self.config = flat_config
+        self.model = flat_config["model"]
+        self.sun_rising = sun_rising
+        self.logger = logger
+
+        self.n_imgs = flat_config["n_imgs"]
+        self.min_exptime = flat_config["exptime"]["min"]
+        self.max_exptime = flat_config["exptime"]["max"]
+        self.dark_rate = self.model.get("dark_rate", 0.0)
+
+        adaptive = flat_config.get("adaptive", dict())
+        # a frame is good if its median is within this fraction of the goal counts
+        self.tolerance = adaptive.get("tolerance", 0.25)
+        self.bias_counts = adaptive.get("bias_counts", 0.0)
+        self.saturation_counts = adaptive.get("saturation_counts", 60000.0)
+        # time from asking for the exposure time to the shutter opening (s)
+        self.overhead_s = adaptive.get("overhead_s", 10.0)
+        # how fast the sun moves until there are enough samples to measure it (deg/s)
+        self.default_sun_alt_rate = adaptive.get("sun_alt_rate", 0.0035)
+        # shortest time span of sun samples to measure the rate from (s)
+        self.min_sun_sample_span_s = adaptive.get("min_sun_sample_span_s", 30.0)
+
+        # (timestamp, sun_alt) samples
+        self.sun_samples = []
+        # filterID: (sun_alt, counts/s) measured from the last frame
+        self.measured = dict()
+        # filterID: number of good frames
+        self.n_good = dict()
+        # one dict per frame recorded
+        self.frames = []
+
+    def log(self, msg, level=logging.INFO):
+        msg = f"flat_exposure: {msg}"
+        if self.logger is None:
+            print(msg)
+        else:
+            self.logger.log(level=level, msg=msg)
+
+    def goal_counts(self, filterID):
+        return self.model.get(filterID, dict()).get(
+            "goal_counts", self.model["goal_counts"]
+        )
+
+    def model_sky_rate(self, filterID, sun_alt):
+        """sky counts/s from the sky brightness model"""
+        if sun_alt >= 0:
+            # the model is only for the sun below the horizon
+            return np.inf
+        params = self.model[filterID]
+        return np.exp(params["a"] * (-sun_alt) ** params["n"]) / params.get("scale", 1.0)
+
+    def model_dark_rate(self, filterID):
+        """dark counts/s: the model's dark_rate is in the same units as the sky before scaling"""
+        return self.dark_rate / self.model[filterID].get("scale", 1.0)
+
+    def add_sun_sample(self, timestamp, sun_alt):
+        self.sun_samples.append((timestamp, sun_alt))
+        self.sun_samples = self.sun_samples[-20:]
+
+    def sun_alt_rate(self):
+        """rate of change of the sun altitude in deg/s"""
+        if len(self.sun_samples) >= 2:
+            t, alt = np.array(self.sun_samples).T
+            if (t[-1] - t[0]) >= self.min_sun_sample_span_s:
+                return np.polyfit(t - t[0], alt, 1)[0]
+        if self.sun_rising:
+            return self.default_sun_alt_rate
+        else:
+            return -self.default_sun_alt_rate
+
+    def predicted_rate(self, filterID, sun_alt):
+        """total counts/s (sky + dark) expected at sun_alt"""
+        dark_rate = self.model_dark_rate(filterID)
+        if filterID in self.measured:
+            # scale the sky part of the last measurement with the model
+            measured_alt, measured_rate = self.measured[filterID]
+            sky_rate = (measured_rate - dark_rate) * (
+                self.model_sky_rate(filterID, sun_alt)
+                / self.model_sky_rate(filterID, measured_alt)
+            )
+            return sky_rate + dark_rate
+        else:
+            return self.model_sky_rate(filterID, sun_alt) + dark_rate
+
+    def predict_exptime(self, filterID, sun_alt, timestamp):
+        """
+        exposure time which gives the goal counts at the sun altitude expected
+        at the middle of the exposure
+        """
+        self.add_sun_sample(timestamp, sun_alt)
+        sun_alt_rate = self.sun_alt_rate()
+        counts = self.goal_counts(filterID) - self.bias_counts
+
+        # the exposure time and the sun altitude at its middle depend on each other
+        exptime = self.min_exptime
+        for _ in range(5):
+            sun_alt_mid = sun_alt + sun_alt_rate * (self.overhead_s + exptime / 2.0)
+            rate = self.predicted_rate(filterID, sun_alt_mid)
+            if not (rate > 0):
+                return np.inf
+            exptime = counts / rate
+        return exptime
+
+    def plan(self, filterID, sun_alt, timestamp):
+        """
+        what to do next in filterID: returns (action, exptime), where action is
+            'expose': take a flat with exptime
+            'wait': the sky is out of range now, but getting there
+            'skip': the sky is out of range and getting further away
+        """
+        exptime = self.predict_exptime(filterID, sun_alt, timestamp)
+        if exptime < self.min_exptime:
+            # too bright: it only gets darker in the evening
+            action = "skip" if self.sun_rising else "wait"
+        elif exptime > self.max_exptime:
+            # too dark: it only gets brighter in the morning
+            action = "wait" if self.sun_rising else "skip"
+        else:
+            action = "expose"
+        return action, exptime
+
+    def record(self, filterID, exptime, median_counts, sun_alt):
+        """
+        add a frame taken with the sun at sun_alt (at the middle of the
+        exposure). returns True if it is a good flat
+        """
+        goal = self.goal_counts(filterID)
+        good = abs(median_counts - goal) <= self.tolerance * goal
+
+        rate = (median_counts - self.bias_counts) / exptime
+        if median_counts >= self.saturation_counts:
+            # a saturated frame only says the sky is at least this bright,
+            # so make sure the next one is well short of it
+            rate *= 2.0
+        if rate > 0:
+            self.measured[filterID] = (sun_alt, rate)
+
+        if good:
+            self.n_good[filterID] = self.n_good.get(filterID, 0) + 1
+        self.frames.append(
+            {
+                "filterID": filterID,
+                "exptime": exptime,
+                "median_counts": median_counts,
+                "sun_alt": sun_alt,
+                "good": good,
+            }
+        )
+        self.log(
+            f"{filterID}: {exptime:0.2f} s at sun alt {sun_alt:0.2f} deg gave median {median_counts:0.0f} "
+            f"(goal {goal:0.0f}): {'good' if good else 'rejected'}, "
+            f"{self.n_good.get(filterID, 0)}/{self.n_imgs} good"
+        )
+        return good
+
+    def done(self, filterID):
+        return self.n_good.get(filterID, 0) >= self.n_imgs
+
+    def order_filters(self, filterIDs, sun_alt):
+        """
+        order the filters by how bright the twilight sky is in them: faintest
+        first in the evening, brightest first in the morning
+        """
+        rates = dict()
+        for filterID in filterIDs:
+            try:
+                rates[filterID] = self.model_sky_rate(filterID, sun_alt)
+            except KeyError:
+                rates[filterID] = np.nan
+        modelled = [filterID for filterID in filterIDs if np.isfinite(rates[filterID])]
+        unmodelled = [filterID for filterID in filterIDs if filterID not in modelled]
+        ordered = sorted(modelled, key=lambda filterID: rates[filterID])
+        if self.sun_rising:
+            ordered = ordered[::-1]
+        return ordered + unmodelled
+
+
+class SyntheticTwilightSky(object):
+    """
+    A twilight sky for trying the controller offline: the sky brightness model
+    times brightness_error (how far tonight is off from the model), with the
+    sun moving at sun_alt_rate deg/s, plus dark current, bias and read noise.
+    """
+
+    def __init__(
+        self,
+        flat_config,
+        sun_alt0,
+        sun_alt_rate,
+        brightness_error=1.0,
+        bias_counts=0.0,
+        saturation_counts=60000.0,
+        noise_counts=50.0,
+        seed=None,
+    ):
+        self.model = flat_config["model"]
+        self.dark_rate = self.model.get("dark_rate", 0.0)
+        self.sun_alt0 = sun_alt0
+        self.sun_alt_rate = sun_alt_rate
+        self.brightness_error = brightness_error
+        self.bias_counts = bias_counts
+        self.saturation_counts = saturation_counts
+        self.noise_counts = noise_counts
+        self.rng = np.random.default_rng(seed)
+
+    def sun_alt(self, t):
+        return self.sun_alt0 + self.sun_alt_rate * t
+
+    def sky_rate(self, filterID, t):
+        params = self.model[filterID]
+        sun_alt = min(self.sun_alt(t), -1e-3)
+        return (
+            self.brightness_error
+            * np.exp(params["a"] * (-sun_alt) ** params["n"])
+            / params.get("scale", 1.0)
+        )
+
+    def median_counts(self, filterID, t_start, exptime):
+        """median counts of a frame exposed from t_start for exptime seconds"""
+        t = np.linspace(t_start, t_start + exptime, 50)
+        sky = np.mean([self.sky_rate(filterID, ti) for ti in t]) * exptime
+        dark = self.dark_rate / self.model[filterID].get("scale", 1.0) * exptime
+        counts = self.bias_counts + sky + dark
+        counts += self.rng.normal(0, self.noise_counts)
+        return float(min(counts, self.saturation_counts))
+
+
+def simulate_flats(
+    flat_config,
+    sky,
+    sun_rising,
+    filterIDs,
+    readout_s=10.0,
+    max_time_s=3600.0,
+    logger=None,
+):
+    """
+    run a flat sequence against a SyntheticTwilightSky the way do_flats
+    does, and return the controller with all the frames recorded
+    """
+    controller = FlatExposureController(flat_config, sun_rising, logger=logger)
+    wait_s = flat_config.get("adaptive", dict()).get("wait_s", 15.0)
+    min_sunalt = flat_config["min_sunalt"]
+    max_sunalt = flat_config["max_sunalt"]
+
+    t = 0.0
+    for filterID in controller.order_filters(filterIDs, sky.sun_alt(t)):
+        while (not controller.done(filterID)) and (t < max_time_s):
+            if not (min_sunalt < sky.sun_alt(t) < max_sunalt):
+                if sun_rising == (sky.sun_alt(t) <= min_sunalt):
+                    # the window hasn't opened yet
+                    t += wait_s
+                    continue
+                return controller
+            action, exptime = controller.plan(filterID, sky.sun_alt(t), t)
+            if action == "skip":
+                controller.log(f"{filterID}: sky out of range ({exptime:0.1f} s), skipping")
+                break
+            elif action == "wait":
+                t += wait_s
+                continue
+            t_start = t + controller.overhead_s
+            median_counts = sky.median_counts(filterID, t_start, exptime)
+            controller.record(
+                filterID, exptime, median_counts, sky.sun_alt(t_start + exptime / 2.0)
+            )
+            t = t_start + exptime + readout_s
+    return controller
+
+
+if __name__ == "__main__":
+
+    wsp_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    config = yaml.load(
+        open(os.path.join(wsp_path, "config", "config.yaml")), Loader=yaml.FullLoader
+    )
+    camname = sys.argv[1] if len(sys.argv) > 1 else "winter"
+    flat_config = config["cal_params"][camname]["flats"]
+    filterIDs = flat_config["filterIDs"]
+
+    for sun_rising in [False, True]:
+        for brightness_error in [0.5, 1.0, 2.0]:
+            sun_alt0 = flat_config["max_sunalt"] if not sun_rising else flat_config["min_sunalt"]
+            sky = SyntheticTwilightSky(
+                flat_config,
+                sun_alt0=sun_alt0 + (0.01 if sun_rising else -0.01),
+                sun_alt_rate=0.0035 if sun_rising else -0.0035,
+                brightness_error=brightness_error,
+                seed=0,
+            )
+            print(
+                f"\n{'morning' if sun_rising else 'evening'}, sky {brightness_error}x the model:"
+            )
+            controller = simulate_flats(flat_config, sky, sun_rising, filterIDs)
+            n_good = sum(frame["good"] for frame in controller.frames)
+            print(f"{n_good}/{len(controller.frames)} frames good: {controller.n_good}")
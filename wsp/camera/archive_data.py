@@ -7,15 +7,34 @@ Created on Wed Jun  5 14:18:37 2024
 """
 import os
 import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 import argparse
 import logging
-from typing import Optional
+from typing import Optional, Tuple
+
+try:
+    from archive_manifest import (
+        archive_dir,
+        load_manifest,
+        save_manifest,
+        unarchived_files,
+        walk_files,
+    )
+except ImportError:
+    from wsp.camera.archive_manifest import (
+        archive_dir,
+        load_manifest,
+        save_manifest,
+        unarchived_files,
+        walk_files,
+    )
 
 
 # Paths
 source_dir = os.path.expanduser("~/data/images")
-backup_dir = "/data/images"
+backup_dir = archive_dir
 log_file = os.path.expanduser("~/data/data_archiver.log")  # Log file path
 
 # Ensure the log directory exists
@@ -24,6 +43,10 @@ os.makedirs(os.path.dirname(log_file), exist_ok=True)
 # Date format used for folders (YYYYMMDD)
 date_format = "%Y%m%d"
 
+# Copy settings
+max_copy_workers = 4
+chunk_size = 8 * 1024 * 1024
+
 # Set up logging
 logging.basicConfig(
     filename=log_file,
@@ -32,39 +55,131 @@ logging.basicConfig(
 )
 
 
-def copy_and_verify(src: str, dst: str) -> bool:
+def file_checksum(path: str) -> str:
+    """
+    Computes the sha256 checksum of a file.
+
+    Args:
+        path (str): The file path.
+
+    Returns:
+        str: The hex digest.
+    """
+    checksum = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def copy_file_with_checksum(src_file: str, dst_file: str) -> Tuple[str, int]:
     """
-    Copies a directory from src to dst and verifies that all files were copied correctly.
+    Copies a file, computing its checksum from the same reads as the copy, then
+    re-reads the copy to verify it. The copy is written to a temporary file
+    and only renamed into place once it is complete.
+
+    Args:
+        src_file (str): The source file path.
+        dst_file (str): The destination file path.
+
+    Returns:
+        tuple: The sha256 hex digest and the number of bytes copied.
+
+    Raises:
+        IOError: If the checksum of the copy does not match the source.
+    """
+    os.makedirs(os.path.dirname(dst_file), exist_ok=True)
+    tmp_file = dst_file + ".archiving"
+    checksum = hashlib.sha256()
+    nbytes = 0
+    try:
+        with open(src_file, "rb") as fsrc, open(tmp_file, "wb") as fdst:
+            for chunk in iter(lambda: fsrc.read(chunk_size), b""):
+                checksum.update(chunk)
+                fdst.write(chunk)
+                nbytes += len(chunk)
+            fdst.flush()
+            os.fsync(fdst.fileno())
+        shutil.copystat(src_file, tmp_file)
+
+        digest = checksum.hexdigest()
+        if file_checksum(tmp_file) != digest:
+            raise IOError(f"checksum mismatch copying {src_file} to {dst_file}")
+        os.replace(tmp_file, dst_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return digest, nbytes
+
+
+def copy_and_verify(src: str, dst: str, max_workers: int = None) -> bool:
+    """
+    Incrementally copies a directory from src to dst with a pool of workers,
+    verifying each file by checksum. A manifest kept in dst records what has
+    been archived, so re-runs only copy new or changed files.
 
     Args:
         src (str): The source directory path.
         dst (str): The destination directory path.
+        max_workers (int): Number of files to copy at once.
 
     Returns:
         bool: True if all files are copied and verified successfully, False otherwise.
     """
-    shutil.copytree(src, dst)
-    src_files = [os.path.join(root, file) for root, _, files in os.walk(src) for file in files]
-    dst_files = [os.path.join(dst, os.path.relpath(file, src)) for file in src_files]
+    if max_workers is None:
+        max_workers = max_copy_workers
 
-    logging.info(f"Copying {len(src_files)} files from {src} to {dst}.")
+    manifest = load_manifest(dst)
+    manifest["source"] = src
+    to_copy = unarchived_files(src, manifest)
+    n_total = len(walk_files(src))
 
-    for i, (src_file, dst_file) in enumerate(zip(src_files, dst_files), 1):
-        if not os.path.exists(dst_file) or os.path.getsize(src_file) != os.path.getsize(dst_file):
-            logging.error(f"Verification failed for {src_file} to {dst_file}.")
-            return False
-        logging.info(f"Verified {i}/{len(src_files)}: {dst_file}")
+    logging.info(
+        f"Copying {len(to_copy)} new or changed files of {n_total} from {src} to {dst}."
+    )
 
-    return True
+    success = True
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for relpath in to_copy:
+            src_file = os.path.join(src, relpath)
+            # stat before copying so a file that changes mid-copy is redone next time
+            futures[
+                executor.submit(
+                    copy_file_with_checksum, src_file, os.path.join(dst, relpath)
+                )
+            ] = (relpath, os.stat(src_file))
 
+        for i, future in enumerate(as_completed(futures), 1):
+            relpath, stat_result = futures[future]
+            try:
+                digest, nbytes = future.result()
+            except Exception as e:
+                logging.error(f"Verification failed for {relpath}: {e}")
+                success = False
+                continue
+            manifest["files"][relpath] = {
+                "size": stat_result.st_size,
+                "mtime": stat_result.st_mtime,
+                "sha256": digest,
+            }
+            logging.info(f"Verified {i}/{len(to_copy)}: {relpath} ({nbytes} bytes)")
+
+    # save whatever did get copied, even on failure, so a re-run picks up from here
+    save_manifest(dst, manifest)
+    return success
 
-def move_folders_to_backup(days_old: int, dry_run: bool = False) -> None:
+
+def move_folders_to_backup(
+    days_old: int, dry_run: bool = False, max_workers: Optional[int] = None
+) -> None:
     """
     Moves folders from the source directory to the backup directory if they are older than a given number of days.
 
     Args:
         days_old (int): The number of days old the folders need to be to move them.
         dry_run (bool): If True, only log the actions without executing them.
+        max_workers (int): Number of files to copy at once.
     """
     cutoff_date = datetime.today() - timedelta(days=days_old)
     for folder_name in os.listdir(source_dir):
@@ -78,13 +193,13 @@ def move_folders_to_backup(days_old: int, dry_run: bool = False) -> None:
                         logging.info(f"Would move folder from {folder_path} to {backup_path}.")
                     else:
                         logging.info(f"Starting to move folder from {folder_path} to {backup_path}.")
-                        if copy_and_verify(folder_path, backup_path):
+                        if copy_and_verify(folder_path, backup_path, max_workers=max_workers):
                             shutil.rmtree(folder_path)
                             logging.info(
                                 f"Successfully moved folder from {folder_path} to {backup_path} after verification."
                             )
                         else:
-                            shutil.rmtree(backup_path)
+                            # keep the verified files, the next run only retries the rest
                             logging.error(f"Failed to verify folder {folder_path}. Aborting move.")
             except ValueError:
                 continue
@@ -115,7 +230,9 @@ def delete_old_folders(days_old: int, dry_run: bool = False) -> None:
                 continue
 
 
-def main(move_days_old: int, delete_days_old: int, dry_run: bool) -> None:
+def main(
+    move_days_old: int, delete_days_old: int, dry_run: bool, max_workers: Optional[int] = None
+) -> None:
     """
     Main function to move and delete old image folders based on specified criteria.
 
@@ -123,9 +240,10 @@ def main(move_days_old: int, delete_days_old: int, dry_run: bool) -> None:
         move_days_old (int): The number of days old for moving folders to backup.
         delete_days_old (int): The number of days to keep folders before deleting.
         dry_run (bool): If True, only log the actions without executing them.
+        max_workers (int): Number of files to copy at once.
     """
     logging.info("Script started.")
-    move_folders_to_backup(days_old=move_days_old, dry_run=dry_run)
+    move_folders_to_backup(days_old=move_days_old, dry_run=dry_run, max_workers=max_workers)
     delete_old_folders(days_old=delete_days_old, dry_run=dry_run)
     logging.info("Script completed.")
 
@@ -147,8 +265,19 @@ if __name__ == "__main__":
     parser.add_argument(
         "--dry_run", action="store_true", help="Print actions without executing them."
     )
+    parser.add_argument(
+        "--max_workers",
+        type=int,
+        default=max_copy_workers,
+        help="Number of files to copy at once.",
+    )
 
     args = parser.parse_args()
-    main(move_days_old=args.move_days_old, delete_days_old=args.delete_days_old, dry_run=args.dry_run)
+    main(
+        move_days_old=args.move_days_old,
+        delete_days_old=args.delete_days_old,
+        dry_run=args.dry_run,
+        max_workers=args.max_workers,
+    )
 
 
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Archive manifests shared by the data archiver and the image purger.
+
+Each archived night directory holds a manifest listing every file that has
+been copied into it, with the size and mtime of the source file and the
+checksum of the copy. The archiver uses it to only transfer new or changed
+files, and the purger uses it to check that a night is safely archived and
+to get its size without walking the directory.
+"""
+import json
+import os
+from typing import Dict, List, Tuple
+
+# default location of the archive
+archive_dir = "/data/images"
+
+MANIFEST_NAME = ".archive_manifest.json"
+MANIFEST_VERSION = 1
+
+
+def manifest_path(archive_night_dir: str) -> str:
+    """
+    Returns the path of the manifest for an archived night directory.
+    """
+    return os.path.join(archive_night_dir, MANIFEST_NAME)
+
+
+def new_manifest(source: str) -> Dict:
+    """
+    Returns an empty manifest for the given source directory.
+    """
+    return {"version": MANIFEST_VERSION, "source": source, "files": {}}
+
+
+def load_manifest(archive_night_dir: str) -> Dict:
+    """
+    Loads the manifest of an archived night directory.
+
+    Args:
+        archive_night_dir (str): The archived night directory.
+
+    Returns:
+        dict: The manifest, or an empty one if the directory has none yet.
+    """
+    try:
+        with open(manifest_path(archive_night_dir)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return new_manifest(source=None)
+    manifest.setdefault("files", {})
+    return manifest
+
+
+def save_manifest(archive_night_dir: str, manifest: Dict) -> None:
+    """
+    Atomically writes the manifest of an archived night directory.
+
+    Args:
+        archive_night_dir (str): The archived night directory.
+        manifest (dict): The manifest to write.
+    """
+    os.makedirs(archive_night_dir, exist_ok=True)
+    path = manifest_path(archive_night_dir)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def manifest_entry_matches(entry: Dict, stat_result: os.stat_result) -> bool:
+    """
+    Checks whether a manifest entry still describes a source file.
+    """
+    return (
+        entry is not None
+        and entry.get("size") == stat_result.st_size
+        and entry.get("mtime") == stat_result.st_mtime
+    )
+
+
+def manifest_total_size(manifest: Dict) -> int:
+    """
+    Returns the total size in bytes of the files in a manifest.
+    """
+    return sum(entry["size"] for entry in manifest["files"].values())
+
+
+def walk_files(directory: str) -> List[str]:
+    """
+    Returns the paths relative to directory of every file below it.
+    """
+    relpaths = []
+    for root, _, files in os.walk(directory):
+        for file in files:
+            relpaths.append(os.path.relpath(os.path.join(root, file), directory))
+    return relpaths
+
+
+def unarchived_files(source_night_dir: str, manifest: Dict) -> List[str]:
+    """
+    Returns the files in a source night directory that are missing from the
+    manifest or have changed since they were archived.
+
+    Args:
+        source_night_dir (str): The night directory on the source disk.
+        manifest (dict): The manifest of its archived copy.
+
+    Returns:
+        list: Paths relative to source_night_dir.
+    """
+    files = manifest["files"]
+    missing = []
+    for relpath in walk_files(source_night_dir):
+        stat_result = os.stat(os.path.join(source_night_dir, relpath))
+        if not manifest_entry_matches(files.get(relpath), stat_result):
+            missing.append(relpath)
+    return missing
+
+
+def is_safely_archived(
+    source_night_dir: str, archive_night_dir: str
+) -> Tuple[bool, Dict]:
+    """
+    Checks whether every file in a source night directory has been archived.
+
+    Args:
+        source_night_dir (str): The night directory on the source disk.
+        archive_night_dir (str): The night directory in the archive.
+
+    Returns:
+        tuple: (True if everything is archived, the archive manifest)
+    """
+    manifest = load_manifest(archive_night_dir)
+    if not manifest["files"]:
+        return False, manifest
+    return len(unarchived_files(source_night_dir, manifest)) == 0, manifest
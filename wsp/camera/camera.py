@@ -29,6 +29,8 @@ from PyQt5 import QtCore
 
 from wsp.camera import fitsheader
 from wsp.camera.state import CameraState
+from wsp.housekeeping import shared_state
+from wsp.utils import trace
 
 
 class BaseCamera(QtCore.QObject):
@@ -108,6 +110,10 @@ class BaseCamera(QtCore.QObject):
         self.remote_state = dict()
         self.connected = False
         self.hk_connected = False
+        # housekeeping's shared memory snapshot, when on the same machine
+        self.hk_shared_state = shared_state.SharedStateReader.from_config(
+            self.config, logger=self.logger
+        )
 
         # Camera state tracking
         self._camera_state = CameraState.OFF
@@ -238,6 +244,11 @@ class BaseCamera(QtCore.QObject):
 
     def update_hk_state(self):
         """Update housekeeping state"""
+        # read the shared memory snapshot if there is one, otherwise use Pyro
+        hk_state = self.hk_shared_state.read()
+        if hk_state is not None:
+            self.hk_state = hk_state
+            return
         if not self.hk_connected:
             self.init_hk_state_object()
         else:
@@ -468,11 +479,13 @@ class BaseCamera(QtCore.QObject):
 
             # Update state dictionaries
             self.log(f"updating state dictionaries")
-            self.update_hk_state()
-            self.update_state()
+            with trace.span("camera.state"):
+                self.update_hk_state()
+                self.update_state()
 
             self.log(f"making FITS header")
-            header = self.getFITSheader()
+            with trace.span("camera.header"):
+                header = self.getFITSheader()
             # header = fitsheader.GetHeader(
             #   self.config, self.hk_state, self.state, logger=self.logger
             # )
@@ -483,14 +496,15 @@ class BaseCamera(QtCore.QObject):
                 f"sending doExposure request to camera: imdir = {self.imdir}, imname = {self.imname}"
             )
 
-            self.remote_object.doExposure(
-                imdir=self.imdir,
-                imname=self.imname,
-                imtype=self.imtype,
-                mode=self.mode,
-                metadata=header,
-                **kwargs,
-            )
+            with trace.span("camera.daemon_call"):
+                self.remote_object.doExposure(
+                    imdir=self.imdir,
+                    imname=self.imname,
+                    imtype=self.imtype,
+                    mode=self.mode,
+                    metadata=header,
+                    **kwargs,
+                )
 
             # grab the filename after exposure command is sent
             self.last_image_dir, self.last_image_filename = (
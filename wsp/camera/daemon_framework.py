@@ -7,15 +7,19 @@ Each camera type will have its own daemon that inherits from this framework.
 import getopt
 import logging
 import os
+import queue
 import shutil
 import signal
 import subprocess
 import sys
+import threading
+import time
 import traceback
 from abc import abstractmethod
 from datetime import datetime
 from pathlib import Path
 
+import astropy.io.fits as fits
 import Pyro5.server  # type: ignore
 import pytz
 import yaml
@@ -25,10 +29,22 @@ from wsp.alerts.alert_handler import AlertHandler
 from wsp.camera.camera_command_decorators import async_camera_command
 from wsp.camera.state import CameraState
 from wsp.daemon.daemon_utils import PyroDaemon
+from wsp.utils import trace
 from wsp.utils.logging_setup import setup_logger
 from wsp.utils.paths import CONFIG_PATH, CREDENTIALS_DIR, WSP_PATH
 
 
+def header_obs(header):
+    """The obsHistID in a FITS header, header card list or dict, or None"""
+    try:
+        if isinstance(header, (list, tuple)):
+            header = {card[0]: card[1] for card in header}
+        obs = header.get("OBHISTID")
+        return None if obs is None or int(obs) < 0 else int(obs)
+    except Exception:
+        return None
+
+
 class ExposureConfig:
     """Container for exposure configuration"""
 
@@ -41,6 +57,231 @@ class ExposureConfig:
         self.metadata = metadata
 
 
+class ImageWriter(QtCore.QObject):
+    """
+    Background FITS writer shared by the camera daemons.
+
+    Finished images are put on a bounded queue and written by a dedicated
+    thread, so the exposure completion path only pays for a queue put. Each
+    file is written to a temporary file in the destination directory and then
+    renamed into place, so readers never see a partially written image.
+    Optionally the image extensions are tile compressed (RICE_1, HCOMPRESS_1).
+    """
+
+    COMPRESSION_TYPES = ("RICE_1", "HCOMPRESS_1")
+
+    # Signals, emitted from the writer thread
+    imageWritten = QtCore.pyqtSignal(str, float)  # filepath, latency (s)
+    imageWriteFailed = QtCore.pyqtSignal(str, str)  # filepath, error message
+
+    def __init__(
+        self,
+        queue_size=8,
+        put_timeout=30.0,
+        compression=None,
+        tile_size=None,
+        logger=None,
+    ):
+        super().__init__()
+
+        if compression is not None and compression not in self.COMPRESSION_TYPES:
+            raise ValueError(
+                f"compression must be None or one of {self.COMPRESSION_TYPES}, "
+                f"got {compression}"
+            )
+        self.queue_size = queue_size
+        self.put_timeout = put_timeout
+        self.compression = compression
+        self.tile_size = tuple(tile_size) if tile_size else None
+        self.logger = logger
+
+        # metrics
+        self._lock = threading.Lock()
+        self.images_written = 0
+        self.write_errors = 0
+        self.last_write_latency = 0.0
+        self.max_write_latency = 0.0
+        self.mean_write_latency = 0.0
+        self.last_written_image = None
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(
+            target=self._run, name="image_writer", daemon=True
+        )
+        self._thread.start()
+
+    @classmethod
+    def from_config(cls, config, logger=None):
+        """Create a writer from the image_writer section of the wsp config"""
+        writer_config = config.get("image_writer", {}) or {}
+        return cls(
+            queue_size=writer_config.get("queue_size", 8),
+            put_timeout=writer_config.get("put_timeout", 30.0),
+            compression=writer_config.get("compression", None),
+            tile_size=writer_config.get("tile_size", None),
+            logger=logger,
+        )
+
+    def log(self, msg, level=logging.INFO):
+        if self.logger:
+            self.logger.log(level=level, msg=f"image_writer: {msg}")
+        else:
+            print(f"image_writer: {msg}")
+
+    @property
+    def backlog(self):
+        """Number of images waiting to be written"""
+        return self._queue.qsize()
+
+    def submit(self, filepath, hdulist, callback=None):
+        """
+        Queue an image for writing.
+
+        hdulist can be an HDUList or a single HDU. The optional callback is
+        called from the writer thread as callback(filepath, success).
+        Blocks for at most put_timeout if the queue is full, and returns
+        False if the image could not be queued.
+        """
+        if not isinstance(hdulist, fits.HDUList):
+            hdulist = fits.HDUList([hdulist])
+        try:
+            self._queue.put(
+                (str(filepath), hdulist, callback, time.monotonic()),
+                timeout=self.put_timeout,
+            )
+        except queue.Full:
+            self.log(
+                f"queue full ({self.queue_size} images), could not queue {filepath}",
+                level=logging.ERROR,
+            )
+            with self._lock:
+                self.write_errors += 1
+            return False
+        return True
+
+    def flush(self, timeout=None):
+        """Wait until every queued image has been written"""
+        if timeout is None:
+            self._queue.join()
+            return True
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stop(self, timeout=10.0):
+        """Finish writing queued images and stop the writer thread"""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def get_state(self):
+        """Writer metrics to merge into the daemon state"""
+        with self._lock:
+            return {
+                "image_writer_backlog": self.backlog,
+                "image_writer_images_written": self.images_written,
+                "image_writer_errors": self.write_errors,
+                "image_writer_last_latency": self.last_write_latency,
+                "image_writer_mean_latency": self.mean_write_latency,
+                "image_writer_max_latency": self.max_write_latency,
+                "image_writer_compression": self.compression,
+                "image_writer_last_image": self.last_written_image,
+            }
+
+    def _compress(self, hdulist):
+        """Convert the image extensions into tile-compressed extensions"""
+        primary = hdulist[0]
+        hdus = []
+        if primary.data is not None:
+            # a primary HDU can't be compressed: move its data into the first
+            # extension and keep an empty primary with the header
+            hdus.append(fits.PrimaryHDU(header=primary.header))
+            hdus.append(
+                fits.CompImageHDU(
+                    data=primary.data,
+                    compression_type=self.compression,
+                    tile_size=self.tile_size,
+                )
+            )
+        else:
+            hdus.append(primary)
+        for hdu in hdulist[1:]:
+            if isinstance(hdu, fits.ImageHDU) and hdu.data is not None:
+                hdus.append(
+                    fits.CompImageHDU(
+                        data=hdu.data,
+                        header=hdu.header,
+                        compression_type=self.compression,
+                        tile_size=self.tile_size,
+                    )
+                )
+            else:
+                hdus.append(hdu)
+        return fits.HDUList(hdus)
+
+    def _write(self, filepath, hdulist):
+        """Write atomically: temp file in the same directory, then rename"""
+        if self.compression is not None:
+            hdulist = self._compress(hdulist)
+        dirname, basename = os.path.split(filepath)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        tmp_path = os.path.join(dirname, f".{basename}.tmp")
+        try:
+            hdulist.writeto(tmp_path, overwrite=True)
+            os.replace(tmp_path, filepath)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            filepath, hdulist, callback, submitted = item
+            success = False
+            t_write = time.monotonic()
+            try:
+                self._write(filepath, hdulist)
+                success = True
+            except Exception as e:
+                self.log(f"error writing {filepath}: {e}", level=logging.ERROR)
+                with self._lock:
+                    self.write_errors += 1
+                self.imageWriteFailed.emit(filepath, str(e))
+            else:
+                now = time.monotonic()
+                trace.record(
+                    "daemon.write", t_write, now, obs=header_obs(hdulist[0].header)
+                )
+                latency = now - submitted
+                with self._lock:
+                    self.images_written += 1
+                    self.last_write_latency = latency
+                    self.max_write_latency = max(self.max_write_latency, latency)
+                    # running mean over every image written so far
+                    self.mean_write_latency += (
+                        latency - self.mean_write_latency
+                    ) / self.images_written
+                    self.last_written_image = filepath
+                self.imageWritten.emit(filepath, latency)
+            finally:
+                self._queue.task_done()
+
+            if callback is not None:
+                try:
+                    callback(filepath, success)
+                except Exception as e:
+                    self.log(
+                        f"error in write callback for {filepath}: {e}",
+                        level=logging.ERROR,
+                    )
+
+
 class CameraCommandWorker(QtCore.QObject):
     """Worker that executes camera commands in a separate thread"""
 
@@ -158,6 +399,11 @@ class BaseCameraInterface(QtCore.QObject):
         self.command_sent_timestamp = 0.0
         self.command_elapsed_dt = 0.0
 
+        # when the current exposure and its readout started, and its obsHistID
+        self.t_exposure_start = None
+        self.t_readout_start = None
+        self.exposure_obs = None
+
         # Set up persistent worker thread
         self.command_thread = QtCore.QThread()
         self.command_worker = CameraCommandWorker(logger=logger)
@@ -194,6 +440,11 @@ class BaseCameraInterface(QtCore.QObject):
         # Hardware connection status
         self.connected = False
 
+        # Background image writer, so exposures don't wait on the disk
+        self.image_writer = ImageWriter.from_config(self.config, logger=logger)
+        self.image_writer.imageWritten.connect(self._on_image_written)
+        self.image_writer.imageWriteFailed.connect(self._on_image_write_failed)
+
         # Local timezone
         self.local_timezone = pytz.timezone("America/Los_Angeles")
 
@@ -212,6 +463,8 @@ class BaseCameraInterface(QtCore.QObject):
 
     def __del__(self):
         """Clean up the worker thread on deletion"""
+        if hasattr(self, "image_writer"):
+            self.image_writer.stop()
         if hasattr(self, "command_thread"):
             self.command_thread.quit()
             if not self.command_thread.wait(5000):  # Wait up to 5 seconds
@@ -413,6 +666,14 @@ class BaseCameraInterface(QtCore.QObject):
     def update_camera_state(self, new_state: CameraState):
         """Update camera state and emit signal"""
         if self.state["camera_state"] != new_state.value:
+            if new_state == CameraState.READING and self.t_exposure_start is not None:
+                self.t_readout_start = time.monotonic()
+                trace.record(
+                    "daemon.exposure",
+                    self.t_exposure_start,
+                    self.t_readout_start,
+                    obs=self.exposure_obs,
+                )
             self.state["camera_state"] = new_state.value
             self.stateChanged.emit(new_state.value)
             self.log(f"State changed to: {new_state.value}")
@@ -462,6 +723,7 @@ class BaseCameraInterface(QtCore.QObject):
                     self.command_elapsed_dt if self.command_running else 0
                 ),
                 "pending_completion": self.pending_command_completion is not None,
+                **self.image_writer.get_state(),
             }
         )
 
@@ -675,6 +937,10 @@ class BaseCameraInterface(QtCore.QObject):
         then call camera-specific methods to finalize the exposure setup"""
         self.state.update({"doing_exposure": True})
         self.update_camera_state(CameraState.EXPOSING)
+        # for the exposure and readout trace spans
+        self.t_exposure_start = time.monotonic()
+        self.t_readout_start = None
+        self.exposure_obs = header_obs(metadata)
         self.imdir = imdir
         self.imname = imname
         self.imtype = imtype
@@ -686,15 +952,26 @@ class BaseCameraInterface(QtCore.QObject):
         # This is where the camera-specific implementation should handle the exposure
         # For example, it might start a timer or initiate hardware communication
 
-    # helper method for closing out exposure, making symbolic links, etc.
-    def _exposure_complete(self, imdir, imname):
-        """Finalize exposure by creating symbolic link to last image"""
-
-        self.makeSymLink_lastImage(self.lastfilename)
-        self.update_camera_state(CameraState.READY)
-        self.log(f"Exposure complete: {imname} at {imdir}")
-
-        # Post the image to slack if configured
+    def writeImage(self, filepath, hdulist):
+        """Hand an image to the background writer.
+        Returns False if it could not be queued. The last image symlink and
+        slack post happen once the file is on disk, see _on_image_written"""
+        self.log(f"Queueing FITS file for writing: {filepath}")
+        return self.image_writer.submit(filepath, hdulist)
+
+    def _on_image_written(self, filepath, latency):
+        """Handle an image landing on disk (runs in the main thread)"""
+        self.log(f"FITS file written: {filepath} ({latency:.2f} s after readout)")
+        self.makeSymLink_lastImage(filepath)
+        self._post_last_image(os.path.basename(filepath))
+
+    def _on_image_write_failed(self, filepath, error_msg):
+        """Handle a failed background write (runs in the main thread)"""
+        self.alert_error(f"could not write image {filepath}: {error_msg}")
+        self.state.update({"last_image_write_error": error_msg})
+
+    def _post_last_image(self, imname):
+        """Post the last image to slack if configured"""
         if self.post_images_to_slack and self.alertHandler:
             try:
                 plotterpath = os.path.join(WSP_PATH, "plotLastImg.py")
@@ -703,6 +980,36 @@ class BaseCameraInterface(QtCore.QObject):
             except Exception as e:
                 self.log(f"Failed to post image to Slack: {e}", level=logging.ERROR)
 
+    # helper method for closing out exposure, making symbolic links, etc.
+    def _exposure_complete(self, imdir, imname, image_queued=False):
+        """Finalize exposure by creating symbolic link to last image.
+        If the image was handed to writeImage, the link and slack post are
+        made once the background write finishes instead"""
+
+        if self.t_exposure_start is not None:
+            # cameras that don't go through READING get one span for both
+            if self.t_readout_start is None:
+                trace.record(
+                    "daemon.exposure",
+                    self.t_exposure_start,
+                    time.monotonic(),
+                    obs=self.exposure_obs,
+                )
+            else:
+                trace.record(
+                    "daemon.readout",
+                    self.t_readout_start,
+                    time.monotonic(),
+                    obs=self.exposure_obs,
+                )
+            self.t_exposure_start = None
+
+        if not image_queued:
+            self.makeSymLink_lastImage(self.lastfilename)
+            self._post_last_image(imname)
+        self.update_camera_state(CameraState.READY)
+        self.log(f"Exposure complete: {imname} at {imdir}")
+
     @abstractmethod
     def tecSetSetpoint(self, temp, addrs=None):
         """Set TEC temperature setpoint"""
@@ -974,7 +1281,7 @@ def create_camera_daemon(camera_class, daemon_name):
     post_images_to_slack = False
 
     options = "vpn:"
-    long_options = ["verbose", "print", "ns_host=", "post_images"]
+    long_options = ["verbose", "print", "ns_host=", "post_images", "name="]
 
     try:
         arguments, values = getopt.getopt(argumentList, options, long_options)
@@ -989,6 +1296,9 @@ def create_camera_daemon(camera_class, daemon_name):
                 slack_alerts = True
             elif currentArgument in ("--post_images"):
                 post_images_to_slack = True
+            elif currentArgument == "--name":
+                # register under another name, eg to stand in for a real camera
+                daemon_name = currentValue
     except getopt.error as err:
         print(str(err))
         sys.exit(1)
@@ -1045,5 +1355,9 @@ def create_camera_daemon(camera_class, daemon_name):
     timer.start(500)
     timer.timeout.connect(lambda: None)
 
+    trace.start(daemon_name, config, logger=logger)
+
     # Run event loop
-    sys.exit(app.exec_())
+    exit_code = app.exec_()
+    trace.stop()
+    sys.exit(exit_code)
@@ -6,14 +6,13 @@ Example fake camera implementation that demonstrates proper state management
 with immediate state transitions handled by the daemon.
 """
 
-import logging
 from datetime import datetime
 
 import astropy.io.fits as fits
 import numpy as np
 from PyQt5 import QtCore
 
-from wsp.camera.camera_command_decorators import camera_command
+from wsp.camera.camera_command_decorators import async_camera_command
 from wsp.camera.daemon_framework import (
     BaseCameraInterface,
     ExposureConfig,
@@ -80,6 +79,11 @@ class FakeCameraInterface(BaseCameraInterface):
         self._exposure_start_time = datetime.utcnow()
         self._exposure_complete_time = datetime.utcnow()
 
+        # Set by the timer callbacks, checked by the pending completion polling
+        self._startup_done = False
+        self._shutdown_done = False
+        self._exposure_done = False
+
         # Create worker thread for timers
         self.timer_thread = QtCore.QThread()
         self.timer_worker = TimerWorker()
@@ -128,11 +132,16 @@ class FakeCameraInterface(BaseCameraInterface):
         # For fake camera, we rely on timer callbacks to signal completion
         pass
 
-    @camera_command(timeout=3600.0)  # 1 hour timeout for long startups
+    @async_camera_command(
+        timeout=3600.0,  # 1 hour timeout for long startups
+        completion_state=CameraState.READY,
+        initial_state=CameraState.STARTUP_REQUESTED,
+        pending_completion=True,  # Stay in STARTUP_REQUESTED until the timer fires
+    )
     def autoStartup(self):
         """Fake startup sequence"""
         self.log("Starting fake camera startup")
-        self.update_camera_state(CameraState.STARTUP_REQUESTED)
+        self._startup_done = False
 
         # Simulate startup delay
         self.timer_worker.startupTimerRequested.emit(2000)
@@ -140,17 +149,19 @@ class FakeCameraInterface(BaseCameraInterface):
 
     def _startup_complete(self):
         """Complete startup - called by signal from worker thread"""
-        self.update_camera_state(CameraState.READY)
         self.log("Fake camera startup complete")
-        # Signal command completion
-        self.resetCommandPassSignal.emit(1)
-        self.resetCommandActiveSignal.emit(0)
+        self._startup_done = True
 
-    @camera_command(timeout=300.0)  # 5 minute timeout for shutdown
+    @async_camera_command(
+        timeout=300.0,  # 5 minute timeout for shutdown
+        completion_state=CameraState.OFF,
+        initial_state=CameraState.SHUTDOWN_REQUESTED,
+        pending_completion=True,  # Stay in SHUTDOWN_REQUESTED until the timer fires
+    )
     def autoShutdown(self):
         """Fake shutdown sequence"""
         self.log("Starting fake camera shutdown")
-        self.update_camera_state(CameraState.SHUTDOWN_REQUESTED)
+        self._shutdown_done = False
 
         # Simulate shutdown delay
         self.timer_worker.shutdownTimerRequested.emit(1000)
@@ -158,16 +169,19 @@ class FakeCameraInterface(BaseCameraInterface):
 
     def _shutdown_complete(self):
         """Complete shutdown - called by signal from worker thread"""
-        self.update_camera_state(CameraState.OFF)
         self.log("Fake camera shutdown complete")
-        # Signal command completion
-        self.resetCommandPassSignal.emit(1)
-        self.resetCommandActiveSignal.emit(0)
+        self._shutdown_done = True
 
-    @camera_command(
-        timeout_func=lambda self, *args, **kwargs: 10.0,
-        completion_state=CameraState.READY,
-    )
+    def _check_startup_complete(self) -> bool:
+        return self._startup_done
+
+    def _check_shutdown_complete(self) -> bool:
+        return self._shutdown_done
+
+    def _check_exposure_complete(self) -> bool:
+        return self._exposure_done
+
+    @async_camera_command(timeout=10.0, completion_state=CameraState.READY)
     def setExposure(self, exptime, addrs=None):
         """Set exposure time"""
         self.exposure_time = exptime
@@ -175,13 +189,15 @@ class FakeCameraInterface(BaseCameraInterface):
         self.state.update({"exposure_time": exptime})
         return True
 
-    @camera_command(
-        timeout_func=lambda self, *args, **kwargs: max(
-            5 * self.exposure_time + 10, 60.0
-        )
+    @async_camera_command(
+        timeout=lambda self, *args, **kwargs: max(5 * self.exposure_time + 10, 60.0),
+        completion_state=CameraState.READY,
+        initial_state=CameraState.EXPOSING,
+        pending_completion=True,  # Stay in EXPOSING until the timer fires
     )
     def doExposure(self, imdir, imname, imtype, mode, metadata, addrs=None):
         """Execute fake exposure - state already set to EXPOSING by daemon decorator"""
+        self._exposure_done = False
         # Call parent to set up basic exposure parameters
         super().doExposure(imdir, imname, imtype, mode, metadata, addrs)
         self._exposure_start_time = datetime.utcnow()
@@ -250,22 +266,13 @@ class FakeCameraInterface(BaseCameraInterface):
         hdr["IMAGETYP"] = exposure_config.imtype
         hdr["DATE-OBS"] = datetime.utcnow().isoformat()
 
-        # Write the image
-        try:
-            self.log(f"Writing FITS file to: {self.lastfilename}")
-            hdu.writeto(self.lastfilename, overwrite=True)
-            self.log(f"FITS file written successfully: {self.lastfilename}")
-        except Exception as e:
-            self.log(f"Error writing FITS file: {e}", level=logging.ERROR)
+        # Hand the image to the background writer so the next exposure
+        # doesn't have to wait on the disk
+        if not self.writeImage(self.lastfilename, hdu):
+            self.pending_command_completion = None
             self.update_camera_state(CameraState.ERROR)
-            self.resetCommandPassSignal.emit(0)
-            self.resetCommandActiveSignal.emit(0)
             return
 
-        # Signal command completion
-        self.resetCommandPassSignal.emit(1)
-        self.resetCommandActiveSignal.emit(0)
-
         # Update state to show exposure complete
         self.state.update(
             {
@@ -275,9 +282,12 @@ class FakeCameraInterface(BaseCameraInterface):
         )
 
         # Call parent's exposure complete method
-        super()._exposure_complete(exposure_config.imdir, exposure_config.imname)
+        super()._exposure_complete(
+            exposure_config.imdir, exposure_config.imname, image_queued=True
+        )
+        self._exposure_done = True
 
-    @camera_command(timeout=10.0, completion_state=CameraState.READY)
+    @async_camera_command(timeout=10.0, completion_state=CameraState.READY)
     def tecSetSetpoint(self, temp, addrs=None):
         """Set TEC setpoint"""
         self.tec_setpoint = temp
@@ -285,7 +295,7 @@ class FakeCameraInterface(BaseCameraInterface):
         self.state.update({"tec_setpoint": temp})
         return True
 
-    @camera_command(timeout=5.0, completion_state=CameraState.READY)
+    @async_camera_command(timeout=5.0, completion_state=CameraState.READY)
     def tecStart(self, addrs=None):
         """Start TEC"""
         self.tec_enabled = True
@@ -293,7 +303,7 @@ class FakeCameraInterface(BaseCameraInterface):
         self.state.update({"tec_enabled": True})
         return True
 
-    @camera_command(timeout=5.0, completion_state=CameraState.READY)
+    @async_camera_command(timeout=5.0, completion_state=CameraState.READY)
     def tecStop(self, addrs=None):
         """Stop TEC"""
         self.tec_enabled = False
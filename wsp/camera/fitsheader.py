@@ -8,20 +8,22 @@ FITS Header Creator
 Takes in metadata, typically a state dictionary from WSP, and produces
 a full FITS header
 
+The cards are compiled once per camera into a HeaderTemplate, so that each
+exposure only has to look up the values which change, and the angles and
+times are formatted directly rather than through astropy Angle and Time.
+
 @author: winter
 """
 import logging
+import math
 import os
 import sys
-from datetime import datetime
+from datetime import date, datetime, timedelta
 
-import astropy.coordinates
 import astropy.io.fits as fits
-import astropy.units as u
 import numpy as np
 import Pyro5.core
 import Pyro5.server
-from astropy.time import Time
 
 # add the wsp directory to the PATH
 wsp_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -38,523 +40,462 @@ def log(logger, msg, level=logging.INFO):
         logger.log(level=level, msg=msg)
 
 
-def GetHeader(config, state, imageinfo, logger=None, verbose=False):
+# where the value of each card comes from
+STATIC = 0  # fixed when the template is compiled
+STATE = 1  # the WSP housekeeping state
+IMAGEINFO = 2  # the information about this image
+DERIVED = 3  # computed from the state and image info by derive()
+DERIVED_CARD = 4  # as DERIVED, but the comment is computed too
 
-    # state is the WSP housekeeping state metadata
-    # imageinfo is specific information about the image
+CARD_LENGTH = 80
+BLOCK_LENGTH = 2880
 
-    """
-    Things expected in image info:
-        - exptime
-        - imname
-        -
+# degrees per hour of RA, as astropy converts them (by way of radians, so it
+# is a hair under 15), so the angles match the ones from astropy Angle
+HOURANGLE_DEG = (math.pi / 12.0) / (math.pi / 180.0)
 
-    """
+MJD_EPOCH = date(1858, 11, 17)
+DJM0 = 2400000.5
 
-    # state should be the housekeeping state of the full observatory
 
-    # make an empty header LIST: EACH ENTRY WILL BE A  object
-    header = list()
+def sexagesimal(value, precision=None):
+    """
+    Format value (hours or degrees) as d:m:s, the same as astropy's
+    Angle.to_string(sep=":"), without making an Angle.
+    """
+    sign = math.copysign(1.0, value)
+    frac, d = math.modf(abs(value))
+    mfrac, m = math.modf(frac * 60.0)
+    s = mfrac * 60.0
 
-    # populate the header. this would be better done driven by a config file
-    camname = imageinfo.get("camname", "")
+    if precision is None:
+        rounding_thresh = 60.0 - (10.0**-8)
+    else:
+        rounding_thresh = 60.0 - (10.0**-precision)
+    if s >= rounding_thresh:
+        s = 0.0
+        m += 1.0
+    if m >= 60.0:
+        m = 0.0
+        d += 1.0
+
+    if precision is None:
+        last = f"{s:.8f}".rstrip("0").rstrip(".")
+    else:
+        last = f"{s:.{precision}f}"
+    if len(last) == 1 or last[1] == ".":
+        last = "0" + last
+    return f"{math.copysign(d, sign):.0f}:{int(m):02d}:{last}"
+
+
+def _two_sum(a, b):
+    # a + b, and the floating point error of the sum
+    x = a + b
+    eb = x - a
+    ea = x - eb
+    eb = b - eb
+    ea = a - ea
+    return x, ea + eb
+
+
+def _day_frac(val1, val2):
+    # val1 + val2 as an integer day and a fraction within +/- 0.5, the way
+    # astropy Time stores them
+    sum12, err12 = _two_sum(val1, val2)
+    day = float(round(sum12))
+    frac, check = _two_sum(sum12 - day, err12)
+    sign = (check > 0) - (check < 0)
+    if frac * sign != 0.5:
+        excess = round(frac)
+    else:
+        excess = round(frac + 2 * check)
+    day += excess
+    frac = sum12 - day
+    frac += err12
+    return day, frac
 
-    ###### BASIC PARAMETERS ######
-    header.append(("OBSTYPE", imageinfo.get("imtype", ""), "Observation Type"))
-    header.append(
-        (
-            "OBSMODE",
-            state.get("obsmode", ""),
-            "Observation mode (eg manual/calibration/schedule",
-        )
-    )
-    # add the filename to the header
-    header.append(("FILENAME", imageinfo.get("imname", ""), "File name"))
-    header.append(("ORIGNAME", imageinfo.get("imname", ""), "Original filename"))
-    # add the image readout mode
-    header.append(
-        ("READOUTM", imageinfo.get("immode", ""), "Image readout mode (eg cds, iwr)")
-    )
 
-    ###### TELESCOPE PARAMETERS ######
-    # Site lon/lat/height
-    header.append(("OBSERVAT", "Palomar Observatory", "Observatory"))
-    header.append(("TELESCOP", "WINTER / P39", "Observatory telescope"))
-    header.append(
-        ("OBSLAT", state.get("site_latitude_degs", ""), "Observatory latitude (deg)")
-    )
-    header.append(
-        ("OBSLON", state.get("site_longitude_degs", ""), "Observatory longitude (deg)")
-    )
-    header.append(
-        ("OBSALT", state.get("site_height_meters", ""), "Observatory altitude (m)")
-    )
-    header.append(
-        ("TELLAT", state.get("mount_latitude_degs", ""), "Telescope latitude (deg)")
-    )
-    header.append(
-        ("TELLON", state.get("mount_longitude_degs", ""), "Telescope longitude (deg)")
-    )
-    header.append(
-        ("TELALT", state.get("mount_height_meters", ""), "Telescope altitude (m)")
-    )
+def utc_jd_mjd(dt):
+    """
+    The JD and MJD of a UTC datetime, with the same arithmetic as
+    astropy Time(dt).jd and .mjd (days with leap seconds excepted).
+    """
+    mjd_day = float((dt.date() - MJD_EPOCH).days)
+    sec = dt.second + dt.microsecond / 1e6
+    day_fraction = (60.0 * (60 * dt.hour + dt.minute) + sec) / 86400.0
+    jd1, jd2 = _day_frac(DJM0 + mjd_day, day_fraction)
+    mjd1, mjd2 = _day_frac(jd1 - DJM0, jd2)
+    return jd1 + jd2, mjd1 + mjd2
+
+
+def _card_image(keyword, value, comment):
+    # the 80 character card for the common value types, formatted like
+    # astropy.io.fits.Card. Returns None for anything else (long strings,
+    # numpy scalars, nan, HIERARCH keywords) so the caller can ask astropy.
+    if len(keyword) > 8 or not keyword.isascii():
+        return None
+    if isinstance(value, str):
+        if not (value.isascii() and value.isprintable()):
+            return None
+        if value == "":
+            value_str = "''"
+        else:
+            value_str = "'{:8}'".format(value.replace("'", "''"))
+            value_str = f"{value_str:20}"
+    elif isinstance(value, bool):
+        value_str = f"{'T' if value else 'F':>20}"
+    elif type(value) is int:
+        value_str = f"{value:>20d}"
+    elif type(value) is float:
+        if not math.isfinite(value):
+            return None
+        value_str = str(value).replace("e", "E")
+        if len(value_str) > 20:
+            return None
+        value_str = f"{value_str:>20}"
+    elif value is None:
+        value_str = ""
+    else:
+        return None
 
-    # mirror cover status
-    header.append(
-        ("MIRCOVER", state.get("mirror_cover_state_str", ""), "Mirror cover status")
-    )
+    image = f"{keyword.upper():8}= {value_str}"
+    if comment:
+        if not (comment.isascii() and comment.isprintable()):
+            return None
+        image = f"{image} / {comment}"
+    if len(image) > CARD_LENGTH:
+        return None
+    return f"{image:{CARD_LENGTH}}"
 
-    # target RA/DEC
-
-    # RA
-    ra_hours = state.get("mount_ra_j2000_hours", 0)
-    ra_obj = astropy.coordinates.Angle(ra_hours * u.hour)
-    # recasting to get rid of any numpy type objects for passing through the pyro server
-    header.append(
-        (
-            "RA",
-            str(ra_obj.to_string(unit=u.deg, sep=":")),
-            "Requested right ascension (deg:m:s)",
-        )
-    )
-    header.append(("RADEG", ra_obj.deg, "Requested right ascension (deg)"))
-
-    # DEC
-    dec_deg = state.get("mount_dec_j2000_deg", 0)
-    dec_obj = astropy.coordinates.Angle(dec_deg * u.deg)
-    header.append(
-        (
-            "DEC",
-            str(dec_obj.to_string(unit=u.deg, sep=":")),
-            "Requested declination (deg:m:s)",
-        )
-    )
-    header.append(("DECDEG", dec_obj.deg, "Requested declination (deg)"))
 
-    header.append(
-        (
-            "TELRA",
-            str(ra_obj.to_string(unit=u.deg, sep=":")),
-            "Telescope right ascension (deg:m:s)",
-        )
-    )
-    header.append(
-        (
-            "TELDEC",
-            str(dec_obj.to_string(unit=u.deg, sep=":")),
-            "Telescope declination (deg:m:s)",
-        )
-    )
+def header_block(header):
+    """
+    The header as the bytes of a FITS header: 80 character cards and an
+    END card, padded with blanks to a multiple of 2880 bytes, ready to be
+    written in front of the data.
+    """
+    images = []
+    for keyword, value, comment in header:
+        image = _card_image(keyword, value, comment)
+        if image is None:
+            image = fits.Card(keyword, value, comment).image
+        images.append(image)
+    images.append(f"{'END':{CARD_LENGTH}}")
+    block = "".join(images)
+    block += " " * (-len(block) % BLOCK_LENGTH)
+    return block.encode("ascii")
+
+
+class HeaderTemplate(object):
+    """
+    A FITS header compiled from a list of card specs, each one
+    (keyword, source, key, default, comment):
 
-    # Alt and Az
-    header.append(("AZIMUTH", state.get("mount_az_deg", ""), "Telescope azimuth (deg)"))
-    header.append(
-        ("ALTITUDE", state.get("mount_alt_deg", ""), "Telescope altitude (deg)")
-    )
-    header.append(
-        ("ELVATION", state.get("mount_alt_deg", ""), "Telescope elevation (deg)")
-    )
-    # airmass
-    z = float((90 - state.get("mount_alt_deg", 0)) * np.pi / 180.0)
-    airmass = 1 / np.cos(z)
-    header.append(("AIRMASS", airmass, "Airmass"))
-    header.append(("DOME_AZ", state.get("dome_az_deg", ""), "Dome azimuth (deg)"))
-
-    header.append(
-        ("FOCPOS", state.get("focuser_position", ""), "Focuser position (micron)")
-    )
-    header.append(
-        (
-            "ROTMECH",
-            state.get("rotator_mech_position", ""),
-            "Rotator mechanical angle (deg)",
-        )
-    )
-    header.append(
-        ("ROTFIELD", state.get("rotator_field_angle", ""), "Rotator field angle (deg)")
-    )
+        STATIC:       key is the value itself
+        STATE:        state.get(key, default)
+        IMAGEINFO:    imageinfo.get(key, default)
+        DERIVED:      derive(state, imageinfo)[key]
+        DERIVED_CARD: derive(state, imageinfo)[key] is a (value, comment) pair
 
-    ###### SCHEDULE PARAMETERS ######
-    ### obsHistID
-    header.append(
-        ("OBHISTID", state.get("robo_obsHistID", ""), "obsHistID: line in schedulefile")
-    )
-    ### raDeg
-    # handled already as RA
-    ### decDeg
-    # handled already as DEC
-    ### filter
-    # handled already as FILTER
-    # visitExpTime
-    header.append(
-        (
-            "VEXPTIME",
-            state.get("robo_visitExpTime", ""),
-            "Total target visit exposure time (s)",
-        )
-    )
-    ###priority
-    # not implemented
-    ### ProgPI
-    header.append(("PROGPI", state.get("programPI", ""), "schedule program ID"))
-    ### progID
-    header.append(("PROGID", state.get("robo_programID", ""), "schedule program PI"))
-    ### progName
-    header.append(("PROGNAME", state.get("programName", ""), "schedule program name"))
-    ### validStart
-    header.append(
-        ("VALSTART", state.get("robo_validStart", ""), "schedule valid start (MJD)")
-    )
-    ### validStop
-    header.append(
-        ("VALSTOP", state.get("robo_validStop", ""), "schedule valid start (MJD)")
-    )
+    The static cards are made once, here. fill() only looks up the others,
+    and returns the header as a list of (keyword, value, comment) tuples.
+    """
 
-    ### observed
-    ### maxAirmass
-    header.append(
-        ("MXAIRMAS", state.get("robo_maxAirmass", ""), "scheduled max airmass")
-    )
+    def __init__(self, specs):
+        self.cards = []
+        self.dynamic = []
+        for index, (keyword, source, key, default, comment) in enumerate(specs):
+            if source == STATIC:
+                self.cards.append((keyword, key, comment))
+            else:
+                self.cards.append((keyword, default, comment))
+                self.dynamic.append((index, source, key, default))
+
+    def derive(self, state, imageinfo, logger=None, verbose=False):
+        return {}
+
+    def fill(self, state, imageinfo, logger=None, verbose=False):
+        derived = self.derive(state, imageinfo, logger=logger, verbose=verbose)
+        sources = (None, state, imageinfo, derived, derived)
+        header = list(self.cards)
+        for index, source, key, default in self.dynamic:
+            keyword, _, comment = header[index]
+            if source == DERIVED_CARD:
+                value, comment = derived[key]
+            else:
+                value = sources[source].get(key, default)
+            header[index] = (keyword, value, comment)
+        return header
+
+
+class ObservatoryHeaderTemplate(HeaderTemplate):
+    """
+    The standard WSP header for an image from camera camname.
+    """
 
-    ### ditherNumber
-    header.append(
-        ("NUMDITHS", state.get("robo_num_dithers", ""), "total number of dithers")
-    )
-    header.append(
-        (
-            "DITHNUM",
-            state.get("robo_dithnum", ""),
-            "this dither number (eg 1 out of total of 5)",
-        )
-    )
-    header.append(
-        ("DITHSTEP", state.get("robo_ditherStepSize", ""), "dither step size")
-    )
-    ### fieldID
-    header.append(("FIELDID", state.get("robo_fieldID", ""), "Field ID number"))
-    ### targName
-    header.append(("TARGNAME", state.get("targetName", ""), "target name"))
-    ### scheduleName
-    header.append(("SCHDNAME", state.get("scheduleName", ""), "schedule file name"))
-    ### scheduleType
-    header.append(
-        (
-            "SCHDTYPE",
-            state.get("scheduleType", ""),
-            "schedule type (eg nightly or target)",
-        )
-    )
-    ### qcomment
-    header.append(
-        ("QCOMMENT", state.get("qcomment", ""), "Queue comment (general comment)")
-    )
-    # try:
-    #     objra = astropy.coordinates.Angle(state.get('robo_target_ra_j2000', 0)*u.hour)
-    #     objdec = astropy.coordinates.Angle(state.get('robo_target_dec_j2000', 0)*u.deg)
-    #     objra_str = str(objra.to_string(unit = u.deg, sep = ':'))
-    #     objdec_str = str(objdec.to_string(unit = u.deg, sep = ':'))
-    # except Exception as e:
-    #     objra_str = ''
-    #     objdec_str = ''
-    #     log(logger,(f'header creator: could not form object ra/dec strings: {e}'))
-
-    # header.append(('OBJRA', objra_str,     'Object right ascension (deg:m:s)'))
-    # header.append(('OBJDEC', objdec_str,   'Object declination (deg:m:s)'))
-
-    header.append(("OBJRA", "", "DEPRECATED - Object RA"))
-    header.append(("OBJDEC", "", "DEPRECATED - Object DEC"))
-
-    # Update the headers with the Scheduled Target RA/Dec
-    targ_ra_comment = "Target RA (J2000)"
-    targ_dec_comment = "Target DEC (J2000)"
-    targ_ra_value = None
-    targ_dec_value = None
-    try:
-        # if there is no target ra, don't stuff with garbage (eg -999)
-        assert state.get("robo_target_ra_j2000_hours", -999) != -999
-        targ_ra = astropy.coordinates.Angle(
-            state.get("robo_target_ra_j2000_hours", 0) * u.hour
-        )
-        targ_dec = astropy.coordinates.Angle(
-            state.get("robo_target_dec_j2000_deg", 0) * u.deg
-        )
+    def __init__(self, config, camname=""):
+        self.camname = camname
 
-        targ_ra_comment = f"Target RA {targ_ra.to_string(unit = u.hour, sep = ':', precision = 1)} (J2000)"
-        targ_dec_comment = f"Target DEC {targ_dec.to_string(unit = u.deg, sep = ':', precision = 1)} (J2000)"
-        targ_ra_value = np.round(targ_ra.deg, 6)
-        targ_dec_value = np.round(targ_dec.deg, 6)
-    except AssertionError:
-        targ_ra_value = ""
-        targ_dec_value = ""
-    except Exception as e:
-        if verbose:
-            log(logger, f"header creator: could not form target ra/dec strings: {e}")
-        targ_ra_value = ""
-        targ_dec_value = ""
-    header.append(("TARGRA", targ_ra_value, targ_ra_comment))
-    header.append(("TARGDEC", targ_dec_value, targ_dec_comment))
-
-    # Update the headers with the pointing center RA/Dec
-    pointing_ra_comment = "Target RA (J2000)"
-    pointing_dec_comment = "Target DEC (J2000)"
-    pointing_ra_value = None
-    pointing_dec_value = None
-    try:
-        # if there is no target ra, don't stuff with garbage (eg -999)
-        assert state.get("robo_pointing_ra_j2000_hours", -999) != -999
-        pointing_ra = astropy.coordinates.Angle(
-            state.get("robo_pointing_ra_j2000_hours", 0) * u.hour
+        # filter wheel position -> (filter ID, filter name), eg 1 -> ('r', "SDSS r' (Chroma)")
+        self.filters = dict()
+        try:
+            positions = config["filter_wheels"][camname]["positions"]
+        except:
+            positions = dict()
+        for filterpos, filterID in positions.items():
+            try:
+                filtername = config["filters"][camname][filterID]["name"]
+                self.filters[filterpos] = (filterID, filtername)
+            except:
+                pass
+
+        super().__init__(self.card_specs())
+
+    def card_specs(self):
+        camname = self.camname
+        # fmt: off
+        return [
+            ###### BASIC PARAMETERS ######
+            ("OBSTYPE", IMAGEINFO, "imtype", "", "Observation Type"),
+            ("OBSMODE", STATE, "obsmode", "", "Observation mode (eg manual/calibration/schedule"),
+            # add the filename to the header
+            ("FILENAME", IMAGEINFO, "imname", "", "File name"),
+            ("ORIGNAME", IMAGEINFO, "imname", "", "Original filename"),
+            # add the image readout mode
+            ("READOUTM", IMAGEINFO, "immode", "", "Image readout mode (eg cds, iwr)"),
+            ###### TELESCOPE PARAMETERS ######
+            # Site lon/lat/height
+            ("OBSERVAT", STATIC, "Palomar Observatory", None, "Observatory"),
+            ("TELESCOP", STATIC, "WINTER / P39", None, "Observatory telescope"),
+            ("OBSLAT", STATE, "site_latitude_degs", "", "Observatory latitude (deg)"),
+            ("OBSLON", STATE, "site_longitude_degs", "", "Observatory longitude (deg)"),
+            ("OBSALT", STATE, "site_height_meters", "", "Observatory altitude (m)"),
+            ("TELLAT", STATE, "mount_latitude_degs", "", "Telescope latitude (deg)"),
+            ("TELLON", STATE, "mount_longitude_degs", "", "Telescope longitude (deg)"),
+            ("TELALT", STATE, "mount_height_meters", "", "Telescope altitude (m)"),
+            # mirror cover status
+            ("MIRCOVER", STATE, "mirror_cover_state_str", "", "Mirror cover status"),
+            # target RA/DEC
+            ("RA", DERIVED, "ra_str", None, "Requested right ascension (deg:m:s)"),
+            ("RADEG", DERIVED, "ra_deg", None, "Requested right ascension (deg)"),
+            ("DEC", DERIVED, "dec_str", None, "Requested declination (deg:m:s)"),
+            ("DECDEG", DERIVED, "dec_deg", None, "Requested declination (deg)"),
+            ("TELRA", DERIVED, "ra_str", None, "Telescope right ascension (deg:m:s)"),
+            ("TELDEC", DERIVED, "dec_str", None, "Telescope declination (deg:m:s)"),
+            # Alt and Az
+            ("AZIMUTH", STATE, "mount_az_deg", "", "Telescope azimuth (deg)"),
+            ("ALTITUDE", STATE, "mount_alt_deg", "", "Telescope altitude (deg)"),
+            ("ELVATION", STATE, "mount_alt_deg", "", "Telescope elevation (deg)"),
+            ("AIRMASS", DERIVED, "airmass", None, "Airmass"),
+            ("DOME_AZ", STATE, "dome_az_deg", "", "Dome azimuth (deg)"),
+            ("FOCPOS", STATE, "focuser_position", "", "Focuser position (micron)"),
+            ("ROTMECH", STATE, "rotator_mech_position", "", "Rotator mechanical angle (deg)"),
+            ("ROTFIELD", STATE, "rotator_field_angle", "", "Rotator field angle (deg)"),
+            ###### SCHEDULE PARAMETERS ######
+            ("OBHISTID", STATE, "robo_obsHistID", "", "obsHistID: line in schedulefile"),
+            ("VEXPTIME", STATE, "robo_visitExpTime", "", "Total target visit exposure time (s)"),
+            ("PROGPI", STATE, "programPI", "", "schedule program ID"),
+            ("PROGID", STATE, "robo_programID", "", "schedule program PI"),
+            ("PROGNAME", STATE, "programName", "", "schedule program name"),
+            ("VALSTART", STATE, "robo_validStart", "", "schedule valid start (MJD)"),
+            ("VALSTOP", STATE, "robo_validStop", "", "schedule valid start (MJD)"),
+            ("MXAIRMAS", STATE, "robo_maxAirmass", "", "scheduled max airmass"),
+            ("NUMDITHS", STATE, "robo_num_dithers", "", "total number of dithers"),
+            ("DITHNUM", STATE, "robo_dithnum", "", "this dither number (eg 1 out of total of 5)"),
+            ("DITHSTEP", STATE, "robo_ditherStepSize", "", "dither step size"),
+            ("FIELDID", STATE, "robo_fieldID", "", "Field ID number"),
+            ("TARGNAME", STATE, "targetName", "", "target name"),
+            ("SCHDNAME", STATE, "scheduleName", "", "schedule file name"),
+            ("SCHDTYPE", STATE, "scheduleType", "", "schedule type (eg nightly or target)"),
+            ("QCOMMENT", STATE, "qcomment", "", "Queue comment (general comment)"),
+            ("OBJRA", STATIC, "", None, "DEPRECATED - Object RA"),
+            ("OBJDEC", STATIC, "", None, "DEPRECATED - Object DEC"),
+            # the scheduled target and pointing center RA/Dec
+            ("TARGRA", DERIVED_CARD, "targ_ra", None, None),
+            ("TARGDEC", DERIVED_CARD, "targ_dec", None, None),
+            ("POINTRA", DERIVED_CARD, "pointing_ra", None, None),
+            ("POINTDEC", DERIVED_CARD, "pointing_dec", None, None),
+            # target type: altaz, radec, schedule
+            ("TARGTYPE", STATE, "targtype", "", "Target Type"),
+            ###### FILTER PARAMETERS ######
+            ("FILTER", DERIVED, "filtername", None, "Filter name"),
+            ("FILTERID", DERIVED, "filterID", None, "Filter ID"),
+            ("FILPOS", STATE, f"{camname}_fw_filter_pos", "", "Filter position"),
+            ###### CAMERA PARAMETERS #####
+            ("INSTRUME", STATIC, camname, None, "Instrument name"),
+            ("EXPTIME", IMAGEINFO, "exptime", -1, "Requested exposure time (sec)"),
+            ###### TIME PARAMETERS ######
+            ("UTC", DERIVED, "utc", None, "Time of observation "),
+            ("UTCISO", DERIVED, "utciso", None, "Time of observation in ISO format"),
+            ("UTCSHUT", DERIVED, "utc", None, "UTC time shutter open"),
+            ("UTC-OBS", DERIVED, "utc_obs", None, "UTC time shutter open"),
+            ("DATE-OBS", DERIVED, "utc_obs", None, "UTC date of observation (MM/DD/YY)"),
+            ("OBSJD", DERIVED, "jd", None, "Julian day corresponds to UTC"),
+            ("OBSMJD", DERIVED, "mjd", None, "MJD corresponds to UTC"),
+            ###### WEATHER PARAMETERS ######
+            ("UT_WEATH", DERIVED, "ut_weath", None, "UT of weather data"),
+            ("TEMPTURE", STATE, "T_outside_pcs", "", "Outside air temperature (C)"),
+            ("WINDSPD", STATE, "windspeed_average_pcs", "", "Outside wind speed"),
+            ("WINDDIR", STATE, "wind_direction_pcs", "", "Outside wind direction (deg)"),
+            ("DEWPOINT", STATE, "Tdp_outside_pcs", "", "Dewpoint (C)"),
+            ("WETNESS", STATE, "dome_wetness_status", "", "Wetness sensor reading"),
+            ("HUMIDITY", STATE, "rh_outside_pcs", "", "Relative humidity (%)"),
+            ("PRESSURE", STATE, "pressure_pcs", "", "Atmospheric pressure, millibars"),
+            # TELESCOPE TEMPS
+            ("TEMPM1", STATE, "telescope_temp_m1", "", "telescope temp M1, C"),
+            ("TEMPM2", STATE, "telescope_temp_m2", "", "telescope temp M2, C"),
+            ("TEMPM3", STATE, "telescope_temp_m3", "", "telescope temp M3, C"),
+            ("TEMPAMB", STATE, "telescope_temp_ambient", "", "telescope temp ambient, C"),
+            ###### INSTRUMENT MONITOR PARAMETERS ######
+            ("TMISCPBT", STATE, "T_misc_powerbox", "", "Misc Power Box Temp (C)"),
+            ("TPBSTAR", STATE, "T_powerbox_star", "", "Starboard FPA Power Box Temp (C)"),
+            ("TPBPORT", STATE, "T_powerbox_port", "", "Port FPA Power Box Temp (C)"),
+            ("TOBSTAR", STATE, "T_ob_star", "", "Optics Box Temp - Starboard (C)"),
+            ("TOBPORT", STATE, "T_ob_port", "", "Optics Box Temp - Port (C)"),
+            ("TOBCENT", STATE, "T_ob_center", "", "Optics Box Temp - Center (C)"),
+            ("TFPGA", STATE, "T_fpga_sb", "", "FPGA Temp - StarB (C)"),
+            ("THXSC", STATE, "T_hx_sc", "", "FPA Heat Exchanger Temp - StarC (C)"),
+            ("THSNKSA", STATE, "T_heatsink_sa", "", "FPA Heatsink Temp - StarA"),
+            ("THSNKSB", STATE, "T_heatsink_sb", "", "FPA Heatsink Temp - StarB"),
+            ("THSNKSC", STATE, "T_heatsink_sc", "", "FPA Heatsink Temp - StarC"),
+            ("THSNKPA", STATE, "T_heatsink_pa", "", "FPA Heatsink Temp - PortA"),
+            ("THSNKPB", STATE, "T_heatsink_pb", "", "FPA Heatsink Temp - PortB"),
+            ("THSNKPC", STATE, "T_heatsink_pc", "", "FPA Heatsink Temp - PortC"),
+            ###### OTHER PARAMETERS ######
+            ("MOONRA", STATE, "moon_ra_deg", "", "Moon J2000.0 R.A. (deg)"),
+            ("MOONDEC", STATE, "moon_dec_deg", "", "Moon J2000.0 Dec. (deg)"),
+            ("MOONILLF", STATE, "moon_illf", "", "Moon illuminated fraction (frac)"),
+            ("MOONPHAS", STATE, "moon_phase", "", "Moon phase angle (deg)"),
+            ("MOONESB", STATE, "moon_excess_brightness_vband", "", "Moon excess in sky brightness V-band"),
+            ("MOONALT", STATE, "moon_alt", "", "Moon altitude (deg)"),
+            ("MOONAZ", STATE, "moon_az", "", "Moon azimuth (deg)"),
+            ("SUNALT", STATE, "sun_alt", "", "Sun altitude (deg)"),
+            ("SUNAZ", STATE, "sun_az", "", "Sun azimuth (deg)"),
+            ("SEEING", STATE, "fwhm_mean", "", "Seeing measurement: FWHM mean from focusing"),
+        ]
+        # fmt: on
+
+    def radec_cards(self, state, name, label, logger=None, verbose=False):
+        # the (value, comment) of the {label} RA and DEC cards from the
+        # robo_{name}_* state entries
+        ra_card = ("", "Target RA (J2000)")
+        dec_card = ("", "Target DEC (J2000)")
+        try:
+            # if there is no target ra, don't stuff with garbage (eg -999)
+            ra_hours = state.get(f"robo_{name}_ra_j2000_hours", -999)
+            if ra_hours != -999:
+                dec_deg = state.get(f"robo_{name}_dec_j2000_deg", 0)
+                ra_card = (
+                    float(np.round(ra_hours * HOURANGLE_DEG, 6)),
+                    f"{label} RA {sexagesimal(ra_hours, precision=1)} (J2000)",
+                )
+                dec_card = (
+                    float(np.round(dec_deg * 1.0, 6)),
+                    f"{label} DEC {sexagesimal(dec_deg, precision=1)} (J2000)",
+                )
+        except Exception as e:
+            if verbose:
+                log(logger, f"header creator: could not form {name} ra/dec strings: {e}")
+            ra_card = ("", "Target RA (J2000)")
+            dec_card = ("", "Target DEC (J2000)")
+        return ra_card, dec_card
+
+    def derive(self, state, imageinfo, logger=None, verbose=False):
+        derived = dict()
+
+        # RA/DEC: recasting to get rid of any numpy type objects for passing through the pyro server
+        ra_deg = state.get("mount_ra_j2000_hours", 0) * HOURANGLE_DEG
+        dec_deg = state.get("mount_dec_j2000_deg", 0) * 1.0
+        derived["ra_str"] = sexagesimal(ra_deg)
+        derived["ra_deg"] = float(ra_deg)
+        derived["dec_str"] = sexagesimal(dec_deg)
+        derived["dec_deg"] = float(dec_deg)
+
+        # airmass
+        z = float((90 - state.get("mount_alt_deg", 0)) * np.pi / 180.0)
+        derived["airmass"] = 1 / math.cos(z)
+
+        derived["targ_ra"], derived["targ_dec"] = self.radec_cards(
+            state, "target", "Target", logger=logger, verbose=verbose
         )
-        pointing_dec = astropy.coordinates.Angle(
-            state.get("robo_pointing_dec_j2000_deg", 0) * u.deg
+        derived["pointing_ra"], derived["pointing_dec"] = self.radec_cards(
+            state, "pointing", "Pointing Center", logger=logger, verbose=verbose
         )
 
-        pointing_ra_comment = f"Pointing Center RA {pointing_ra.to_string(unit = u.hour, sep = ':', precision = 1)} (J2000)"
-        pointing_dec_comment = f"Pointing Center DEC {pointing_dec.to_string(unit = u.deg, sep = ':', precision = 1)} (J2000)"
-        pointing_ra_value = np.round(pointing_ra.deg, 6)
-        pointing_dec_value = np.round(pointing_dec.deg, 6)
-    except AssertionError:
-        # No need to do anything, fallback values will be used
-        pass
-        pointing_ra_value = ""
-        pointing_dec_value = ""
-    except Exception as e:
-        if verbose:
-            log(logger, f"header creator: could not form pointing ra/dec strings: {e}")
-        pointing_ra_value = ""
-        pointing_dec_value = ""
-
-    header.append(("POINTRA", pointing_ra_value, pointing_ra_comment))
-    header.append(("POINTDEC", pointing_dec_value, pointing_dec_comment))
-    # target type: altaz, radec, schedule
-    header.append(("TARGTYPE", state.get("targtype", ""), "Target Type"))
-
-    ###### FILTER PARAMETERS ######
-
-    # filtername = state.get('filtername', '')
-    # filterID = state.get('filterID', '')
-    # filterpos = state.get('filterpos', '')
-
-    filterpos = state.get(f"{camname}_fw_filter_pos", "")  # eg 1
-    try:
-        filterID = config["filter_wheels"][camname]["positions"][filterpos]  # eg. 'r'
-        filtername = config["filters"][camname][filterID][
-            "name"
-        ]  # eg. "SDSS r' (Chroma)"
-    except:
-        filterID = ""
-        filtername = ""
-
-    header.append(("FILTER", filtername, "Filter name"))
-    header.append(("FILTERID", filterID, "Filter ID"))
-    header.append(("FILPOS", filterpos, "Filter position"))
-
-    ###### CAMERA PARAMETERS #####
-    header.append(("INSTRUME", camname, "Instrument name"))
-    header.append(
-        ("EXPTIME", imageinfo.get("exptime", -1), "Requested exposure time (sec)")
-    )
-
-    # MODE_NUM
+        # filter
+        filterpos = state.get(f"{self.camname}_fw_filter_pos", "")
+        try:
+            derived["filterID"], derived["filtername"] = self.filters[filterpos]
+        except:
+            derived["filterID"], derived["filtername"] = "", ""
 
-    ###### TIME PARAMETERS ######
-    try:
         # add the image acquisition timestamp to the fits header
-        image_starttime_utc = imageinfo.get("imstarttime")
-        image_starttime_utc_datetime_object = datetime.strptime(
-            image_starttime_utc, "%Y%m%d-%H%M%S-%f"
-        )
-        image_starttime_utc_object = Time(image_starttime_utc_datetime_object)
-
-        header.append(
-            (
-                "UTC",
-                image_starttime_utc_datetime_object.strftime("%Y%m%d_%H%M%S.%f"),
-                "Time of observation ",
-            )
-        )
-        header.append(
-            (
-                "UTCISO",
-                image_starttime_utc_object.iso,
-                "Time of observation in ISO format",
-            )
-        )
-        header.append(
-            (
-                "UTCSHUT",
-                image_starttime_utc_datetime_object.strftime("%Y%m%d_%H%M%S.%f"),
-                "UTC time shutter open",
+        try:
+            image_starttime_utc = datetime.strptime(
+                imageinfo.get("imstarttime"), "%Y%m%d-%H%M%S-%f"
             )
-        )
-        header.append(
-            (
-                "UTC-OBS",
-                image_starttime_utc_datetime_object.strftime("%Y%m%d %H%M%S.%f"),
-                "UTC time shutter open",
+            # the ISO time is rounded to the ms
+            iso = image_starttime_utc + timedelta(microseconds=500)
+            derived["utc"] = image_starttime_utc.strftime("%Y%m%d_%H%M%S.%f")
+            derived["utc_obs"] = image_starttime_utc.strftime("%Y%m%d %H%M%S.%f")
+            derived["utciso"] = (
+                f"{iso:%Y-%m-%d %H:%M:%S}.{iso.microsecond // 1000:03d}"
             )
-        )
-        header.append(
-            (
-                "DATE-OBS",
-                image_starttime_utc_datetime_object.strftime("%Y%m%d %H%M%S.%f"),
-                "UTC date of observation (MM/DD/YY)",
-            )
-        )
-        header.append(
-            ("OBSJD", image_starttime_utc_object.jd, "Julian day corresponds to UTC")
-        )
-        header.append(
-            ("OBSMJD", image_starttime_utc_object.mjd, "MJD corresponds to UTC")
-        )
-
-    except Exception as e:
-        if verbose:
-            log(logger, f"could not make the time entries: {e}")
-        header.append(("UTC", "", "Time of observation "))
-        header.append(("UTCISO", "", "Time of observation in ISO format"))
-        header.append(("UTCSHUT", "", "UTC time shutter open"))
-        header.append(("UTC-OBS", "", "UTC time shutter open"))
-        header.append(("DATE-OBS", "", "UTC date of observation (MM/DD/YY)"))
-        header.append(("OBSJD", "", "Julian day corresponds to UTC"))
-        header.append(("OBSMJD", "", "MJD corresponds to UTC"))
+            derived["jd"], derived["mjd"] = utc_jd_mjd(image_starttime_utc)
+        except Exception as e:
+            if verbose:
+                log(logger, f"could not make the time entries: {e}")
+            for key in ["utc", "utc_obs", "utciso", "jd", "mjd"]:
+                derived[key] = ""
+
+        # UT_WEATH
+        try:
+            weather_datetime = datetime.fromtimestamp(state["dome_timestamp"])
+            derived["ut_weath"] = weather_datetime.strftime("%Y-%m-%d %H%M%S.%f")
+        except Exception as e:
+            if verbose:
+                log(
+                    logger,
+                    (f'state["dome_timestamp"] = {state.get("dome_timestamp", "?")}'),
+                )
+                log(logger, (f"could not get dome time, {e}"))
+            derived["ut_weath"] = ""
+
+        return derived
+
+
+# compiled templates, by camera name
+_templates = dict()
+
+
+def get_template(config, camname=""):
     """
-    obstime = Time(self.image_starttime_utc, scale = 'utc', location = self.site)
-    lst_obj = obstime.sidereal_time('mean')
-    header.append(('OBSLST', lst_obj.to_string(unit = u.deg, sep = ':'),              'Mean LST corresponds to UTC'))
+    The compiled ObservatoryHeaderTemplate for camname. It is compiled the
+    first time it's asked for, and again if the config is replaced.
     """
+    cached = _templates.get(camname)
+    if cached is None or cached[0] is not config:
+        cached = (config, ObservatoryHeaderTemplate(config, camname))
+        _templates[camname] = cached
+    return cached[1]
 
-    ###### WEATHER PARAMETERS ######
-    # UT_WEATH
-    try:
-
-        weather_datetime = datetime.fromtimestamp(state["dome_timestamp"])
-        ut_weath = weather_datetime.strftime("%Y-%m-%d %H%M%S.%f")
-    except Exception as e:
-        if verbose:
-            log(
-                logger,
-                (f'state["dome_timestamp"] = {state.get("dome_timestamp", "?")}'),
-            )
-            log(logger, (f"could not get dome time, {e}"))
-        ut_weath = ""
 
-    header.append(("UT_WEATH", ut_weath, "UT of weather data"))
-    # TEMPTURE
-    header.append(
-        ("TEMPTURE", state.get("T_outside_pcs", ""), "Outside air temperature (C)")
-    )
-    # WINDSPD
-    header.append(
-        ("WINDSPD", state.get("windspeed_average_pcs", ""), "Outside wind speed")
-    )
-    # WINDDIR
-    header.append(
-        ("WINDDIR", state.get("wind_direction_pcs", ""), "Outside wind direction (deg)")
-    )
-    # DEWPOINT
-    header.append(("DEWPOINT", state.get("Tdp_outside_pcs", ""), "Dewpoint (C)"))
-    # WETNESS
-    header.append(
-        ("WETNESS", state.get("dome_wetness_status", ""), "Wetness sensor reading")
-    )
-    # HUMIDITY
-    header.append(
-        ("HUMIDITY", state.get("rh_outside_pcs", ""), "Relative humidity (%)")
-    )
-    # PRESSURE
-    header.append(
-        ("PRESSURE", state.get("pressure_pcs", ""), "Atmospheric pressure, millibars")
-    )
-    # TELESCOPE TEMPS
-    header.append(
-        ("TEMPM1", state.get("telescope_temp_m1", ""), "telescope temp M1, C")
-    )
-    header.append(
-        ("TEMPM2", state.get("telescope_temp_m2", ""), "telescope temp M2, C")
-    )
-    header.append(
-        ("TEMPM3", state.get("telescope_temp_m3", ""), "telescope temp M3, C")
-    )
-    header.append(
-        (
-            "TEMPAMB",
-            state.get("telescope_temp_ambient", ""),
-            "telescope temp ambient, C",
-        )
-    )
+def GetHeader(config, state, imageinfo, logger=None, verbose=False):
 
-    ###### INSTRUMENT MONITOR PARAMETERS ######
-    header.append(
-        ("TMISCPBT", state.get("T_misc_powerbox", ""), "Misc Power Box Temp (C)")
-    )
-    header.append(
-        (
-            "TPBSTAR",
-            state.get("T_powerbox_star", ""),
-            "Starboard FPA Power Box Temp (C)",
-        )
-    )
-    header.append(
-        ("TPBPORT", state.get("T_powerbox_port", ""), "Port FPA Power Box Temp (C)")
-    )
-    header.append(
-        ("TOBSTAR", state.get("T_ob_star", ""), "Optics Box Temp - Starboard (C)")
-    )
-    header.append(("TOBPORT", state.get("T_ob_port", ""), "Optics Box Temp - Port (C)"))
-    header.append(
-        ("TOBCENT", state.get("T_ob_center", ""), "Optics Box Temp - Center (C)")
-    )
-    header.append(("TFPGA", state.get("T_fpga_sb", ""), "FPGA Temp - StarB (C)"))
-    header.append(
-        ("THXSC", state.get("T_hx_sc", ""), "FPA Heat Exchanger Temp - StarC (C)")
-    )
-    header.append(
-        ("THSNKSA", state.get("T_heatsink_sa", ""), "FPA Heatsink Temp - StarA")
-    )
-    header.append(
-        ("THSNKSB", state.get("T_heatsink_sb", ""), "FPA Heatsink Temp - StarB")
-    )
-    header.append(
-        ("THSNKSC", state.get("T_heatsink_sc", ""), "FPA Heatsink Temp - StarC")
-    )
-    header.append(
-        ("THSNKPA", state.get("T_heatsink_pa", ""), "FPA Heatsink Temp - PortA")
-    )
-    header.append(
-        ("THSNKPB", state.get("T_heatsink_pb", ""), "FPA Heatsink Temp - PortB")
-    )
-    header.append(
-        ("THSNKPC", state.get("T_heatsink_pc", ""), "FPA Heatsink Temp - PortC")
-    )
+    # state is the WSP housekeeping state metadata
+    # imageinfo is specific information about the image
 
-    ###### OTHER PARAMETERS ######
-    header.append(("MOONRA", state.get("moon_ra_deg", ""), "Moon J2000.0 R.A. (deg)"))
-    header.append(("MOONDEC", state.get("moon_dec_deg", ""), "Moon J2000.0 Dec. (deg)"))
-    header.append(
-        ("MOONILLF", state.get("moon_illf", ""), "Moon illuminated fraction (frac)")
-    )
-    header.append(("MOONPHAS", state.get("moon_phase", ""), "Moon phase angle (deg)"))
-    header.append(
-        (
-            "MOONESB",
-            state.get("moon_excess_brightness_vband", ""),
-            "Moon excess in sky brightness V-band",
-        )
-    )
-    header.append(("MOONALT", state.get("moon_alt", ""), "Moon altitude (deg)"))
-    header.append(("MOONAZ", state.get("moon_az", ""), "Moon azimuth (deg)"))
-    header.append(("SUNALT", state.get("sun_alt", ""), "Sun altitude (deg)"))
-    header.append(("SUNAZ", state.get("sun_az", ""), "Sun azimuth (deg)"))
-    header.append(
-        (
-            "SEEING",
-            state.get("fwhm_mean", ""),
-            "Seeing measurement: FWHM mean from focusing",
-        )
-    )
+    """
+    Things expected in image info:
+        - exptime
+        - imname
+        - imstarttime
+        - camname
 
-    return header
+    Returns the header as a list of (keyword, value, comment) tuples.
+    """
+    template = get_template(config, imageinfo.get("camname", ""))
+    return template.fill(state, imageinfo, logger=logger, verbose=verbose)
 
 
 if __name__ == "__main__":
@@ -30,6 +30,11 @@ import shutil
 
 actually_delete = True
 
+# only delete nights whose every file is listed in the archive manifest.
+# nights archived before the manifest existed don't have one, so this is off
+# until they have been re-run through archive_data
+require_archive = False
+
 
 # add the wsp directory to the PATH
 code_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -45,6 +50,7 @@ except:
     import schedule
 from alerts import alert_handler
 from utils import logging_setup
+from camera.archive_manifest import archive_dir, is_safely_archived, manifest_total_size
 logger = None
 config = utils.loadconfig(os.path.join(wsp_path, 'config', 'config.yaml'))
 #logger = logging_setup.setup_logger(wsp_path, config)
@@ -96,6 +102,7 @@ skippeddirs = []
 purgepaths = []
 purgedirs = []
 preshipdirs = []
+unarchiveddirs = []
 est_purgesize = 0
 # get today's data: just use simple now to do in current cpu time/timezone
 today = datetime.now()
@@ -116,9 +123,19 @@ for dirpath in imagedirpaths:
             
             # if enough days have passed since the folder's date
             if dt.days > ndays:
-                purgedirs.append(dirname)
-                purgepaths.append(dirpath)
-                est_purgesize += getFolderSize(dirpath)
+                # the archive manifest tells us both whether the night is
+                # safely archived and how big it is, without walking the archive
+                archived, manifest = is_safely_archived(dirpath, os.path.join(archive_dir, dirname))
+                if archived:
+                    purgedirs.append(dirname)
+                    purgepaths.append(dirpath)
+                    est_purgesize += manifest_total_size(manifest)
+                elif not require_archive:
+                    purgedirs.append(dirname)
+                    purgepaths.append(dirpath)
+                    est_purgesize += getFolderSize(dirpath)
+                else:
+                    unarchiveddirs.append(dirname)
         else:
             preshipdirs.append(dirname)
     except:
@@ -140,6 +157,11 @@ log(f'skipped these directories bc they could not be turned into dates: {skipped
 log()
 log(f'skipped these directories bc they were from before commissioning: {preshipdirs}')
 log()
+if len(unarchiveddirs) > 0:
+    msg = f'NOT purging these directories bc they are not fully archived in {archive_dir}: {unarchiveddirs}'
+    log(msg)
+    log()
+    alertHandler.slack_log(f':warning: {msg}')
 if len(purgedirs)==0:
     purgemsg = f'No directories to delete.'
 else:
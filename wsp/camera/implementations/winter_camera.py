@@ -33,7 +33,8 @@ from PyQt5 import QtCore
 
 from wsp.camera import fitsheader
 from wsp.camera.state import CameraState
-from wsp.utils import logging_setup, utils
+from wsp.housekeeping import shared_state
+from wsp.utils import logging_setup, trace, utils
 from wsp.utils.paths import WSP_PATH as wsp_path
 
 
@@ -78,6 +79,10 @@ class local_camera(QtCore.QObject):
         self.logger = logger
         self.default = self.config["default_value"]
         self.verbose = verbose
+        # housekeeping's shared memory snapshot, when on the same machine
+        self.hk_shared_state = shared_state.SharedStateReader.from_config(
+            self.config, logger=self.logger
+        )
 
         # placeholders for getting the image parameters from ccd_daemon
         self.connected = 0
@@ -87,6 +92,9 @@ class local_camera(QtCore.QObject):
         self.mode = None
         self.imtype = None
 
+        # compiled FITS header templates for the sensor cards, by addrs
+        self.sensor_header_templates = dict()
+
         # connect the signals and slots
         self.newCommand.connect(self.doCommand)
 
@@ -99,6 +107,9 @@ class local_camera(QtCore.QObject):
         self.init_hk_state_object()
         self.update_hk_state()
 
+        # compile the FITS header now, rather than on the first exposure
+        fitsheader.get_template(self.config, self.camname)
+
     def log(self, msg, level=logging.INFO):
         msg = f"{self.daemonname}_local: {msg}"
         if self.logger is None:
@@ -124,7 +135,13 @@ class local_camera(QtCore.QObject):
         """
 
     def update_hk_state(self):
-        # poll the state, if we're not connected try to reconnect
+        # on the same machine as housekeeping, read its shared memory snapshot
+        hk_state = self.hk_shared_state.read()
+        if hk_state is not None:
+            self.hk_state = hk_state
+            return
+
+        # otherwise poll the state, if we're not connected try to reconnect
         # this should reconnect down the line if we get disconnected
         if not self.hk_connected:
             self.init_hk_state_object()
@@ -247,6 +264,45 @@ class local_camera(QtCore.QObject):
             }
         )
 
+    def get_sensor_header_template(self, addrs):
+        """
+        The template for the cards this camera adds to the standard header:
+        the best board ID, and the temperatures and TEC status of each of
+        the sensors in addrs. It is compiled once for each set of addrs.
+        """
+        addrs = tuple(addrs)
+        if addrs in self.sensor_header_templates:
+            return self.sensor_header_templates[addrs]
+
+        # get the board ID of the best sensor from the config file
+        try:
+            best_board_id = self.config["observing_parameters"]["winter"][
+                "best_position"
+            ]["board_id"]
+        except Exception as e:
+            self.log(f"could not get best board ID from config: {e}")
+            best_board_id = ""
+
+        IMAGEINFO = fitsheader.IMAGEINFO
+        specs = [("BESTBRD", fitsheader.STATIC, best_board_id, None, "Best Board ID")]
+        # now add some sensor specific stuff
+        for addr in addrs:
+            # fmt: off
+            specs += [
+                (f"{addr}TPID".upper(), IMAGEINFO, f"{addr}_T_pid", "", f"{addr} FPA PID Temp (C)"),
+                (f"{addr}TFPA".upper(), IMAGEINFO, f"{addr}_T_fpa", "", f"{addr} FPA Temp (C)"),
+                (f"{addr}TROIC".upper(), IMAGEINFO, f"{addr}_T_roic", "", f"{addr} ROIC Temp (C)"),
+                (f"{addr}TECST".upper(), IMAGEINFO, f"{addr}_tec_status", "", f"{addr} TEC Status"),
+                (f"{addr}TECSP".upper(), IMAGEINFO, f"{addr}_tec_setpoint", "", f"{addr} TEC Status"),
+                (f"{addr}TECV".upper(), IMAGEINFO, f"{addr}_V_tec", "", f"{addr} TEC Voltage (V)"),
+                (f"{addr}TECI".upper(), IMAGEINFO, f"{addr}_I_tec", "", f"{addr} TEC Current (A)"),
+            ]
+            # fmt: on
+
+        template = fitsheader.HeaderTemplate(specs)
+        self.sensor_header_templates[addrs] = template
+        return template
+
     def getFITSheader(self):
         # self.log(f'making default header')
         # make the baseline header
@@ -258,72 +314,13 @@ class local_camera(QtCore.QObject):
             self.log(f"could not build default header: {e}")
             header = []
 
-        # get the board ID of the best sensor from the config file
+        # self.log('now adding sensor specific fields')
+        addrs = self.state.get("addrs", ["sa", "sb", "sc", "pa", "pb", "pc"])
         try:
-            best_board_id = self.config["observing_parameters"]["winter"][
-                "best_position"
-            ]["board_id"]
+            template = self.get_sensor_header_template(addrs)
+            header += template.fill(self.hk_state, self.state)
         except Exception as e:
-            self.log(f"could not get best board ID from config: {e}")
-            best_board_id = ""
-
-        header.append(("BESTBRD", best_board_id, "Best Board ID"))
-
-        # self.log('now adding sensor specific fields')
-        # now add some sensor specific stuff
-        for addr in self.state.get("addrs", ["sa", "sb", "sc", "pa", "pb", "pc"]):
-            try:
-                header.append(
-                    (
-                        f"{addr}TPID".upper(),
-                        self.state.get(f"{addr}_T_pid", ""),
-                        f"{addr} FPA PID Temp (C)",
-                    )
-                )
-                header.append(
-                    (
-                        f"{addr}TFPA".upper(),
-                        self.state.get(f"{addr}_T_fpa", ""),
-                        f"{addr} FPA Temp (C)",
-                    )
-                )
-                header.append(
-                    (
-                        f"{addr}TROIC".upper(),
-                        self.state.get(f"{addr}_T_roic", ""),
-                        f"{addr} ROIC Temp (C)",
-                    )
-                )
-                header.append(
-                    (
-                        f"{addr}TECST".upper(),
-                        self.state.get(f"{addr}_tec_status", ""),
-                        f"{addr} TEC Status",
-                    )
-                )
-                header.append(
-                    (
-                        f"{addr}TECSP".upper(),
-                        self.state.get(f"{addr}_tec_setpoint", ""),
-                        f"{addr} TEC Status",
-                    )
-                )
-                header.append(
-                    (
-                        f"{addr}TECV".upper(),
-                        self.state.get(f"{addr}_V_tec", ""),
-                        f"{addr} TEC Voltage (V)",
-                    )
-                )
-                header.append(
-                    (
-                        f"{addr}TECI".upper(),
-                        self.state.get(f"{addr}_I_tec", ""),
-                        f"{addr} TEC Current (A)",
-                    )
-                )
-            except Exception as e:
-                self.log(f"could not add {addr} FPA Card entries: {e}")
+            self.log(f"could not add FPA Card entries: {e}")
         # print(f'got FITS header: {header}')
         self.header = header
         return header
@@ -424,10 +421,11 @@ class local_camera(QtCore.QObject):
 
         self.log(f"updating state dictionaries")
         # make sure all the state dictionaries are up-to-date
-        # update the camera state by querying the camera daemon
-        self.update_state()
-        # update the housekeeping state by grabbing it from the housekeeping server
-        self.update_hk_state()
+        with trace.span("camera.state"):
+            # update the camera state by querying the camera daemon
+            self.update_state()
+            # update the housekeeping state by grabbing it from the housekeeping server
+            self.update_hk_state()
 
         # print(f'hk_state = {self.hk_state}')
         # print()
@@ -435,20 +433,22 @@ class local_camera(QtCore.QObject):
 
         # now make the fits header
         self.log(f"making FITS header")
-        header = self.getFITSheader()
+        with trace.span("camera.header"):
+            header = self.getFITSheader()
         # print(f'header = {header}')
         self.log(
             f"sending doExposure request to camera: imdir = {self.imdir}, imname = {self.imname}"
         )
         try:
-            self.remote_object.doExposure(
-                imdir=self.imdir,
-                imname=self.imname,
-                imtype=self.imtype,
-                mode=self.mode,
-                metadata=header,
-                addrs=addrs,
-            )
+            with trace.span("camera.daemon_call"):
+                self.remote_object.doExposure(
+                    imdir=self.imdir,
+                    imname=self.imname,
+                    imtype=self.imtype,
+                    mode=self.mode,
+                    metadata=header,
+                    addrs=addrs,
+                )
         except Exception as e:
             print(f"Error: {e}, PyroError: {Pyro5.errors.get_pyro_traceback()}")
 
@@ -177,6 +177,7 @@ def main(argv=None):
         "domesim",
         "dometest",
         "mountsim",
+        "fwsim",
         "shell",
         "disablewatchdog",
     ]
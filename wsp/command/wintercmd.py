@@ -81,6 +81,10 @@ from daemon import daemon_utils
 from focuser import summerFocusLoop
 from utils import logging_setup, utils
 
+# imported through the wsp package like roboOperator does, so both use the
+# same tracer
+from wsp.utils import trace
+
 # GLOBAL VARS
 
 # load the config
@@ -311,7 +315,8 @@ class Wintercmd(QtCore.QObject):
                 self.logger.debug(e)"""
 
             # try it without the try/except block. don't want too many otherwise the error handling gets lost
-            getattr(self, self.command)()
+            with trace.span("wintercmd." + self.command):
+                getattr(self, self.command)()
 
     def parse_list(self, cmdlist):
         # assumes each item in the list is a well-formed wintercmd
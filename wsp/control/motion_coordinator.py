@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+motion_coordinator.py
+
+Moves the dome, mount, rotator and filter wheel together to acquire a target.
+
+The wintercmd commands each start one move and then wait for it to finish,
+so an acquisition made of them takes the sum of all the moves. The
+MotionCoordinator starts every move as soon as the moves it depends on are
+done, and watches all of them in one loop, so the acquisition takes about as
+long as the slowest chain of moves:
+
+    dome:    tracking off -> goto az ---------------------.
+    mount:   goto ---------------------.                   +-> dome tracking on
+    rotator: goto mech (pre-position) -+-> goto field -> mount tracking on
+    filter:  goto filter
+
+Each move is done when its readiness condition (the same ones the wintercmd
+wait loops use) holds for cmd_satisfied_N_samples samples in a row, and the
+time each one took is kept in axis_times. Each move is also traced, as
+motion.<axis> up to the first ready sample and motion.<axis>.settle from there
+until it is done.
+"""
+
+import logging
+import time
+
+import numpy as np
+from PyQt5 import QtCore
+
+from wsp.utils import trace
+
+
+class MotionInterlockError(Exception):
+    pass
+
+
+class signalCmd(object):
+    """
+    this is an object which can pass commands and args via a signal/slot to
+    other threads, ideally for daemons
+    """
+
+    def __init__(self, cmd, *args, **kwargs):
+        self.cmd = cmd
+        self.argdict = dict()
+        self.args = args
+        self.kwargs = kwargs
+
+
+class Axis(object):
+    """
+    One move of an acquisition: start() issues it without waiting, and
+    is_ready() tells from the housekeeping state whether it has finished.
+    It is only started once the axes named in requires are done.
+    """
+
+    def __init__(self, name, start, is_ready, timeout, requires=()):
+        self.name = name
+        self.start = start
+        self.is_ready = is_ready
+        self.timeout = timeout
+        self.requires = list(requires)
+
+        self.t_start = None
+        # the first of the run of ready samples which finished the move
+        self.t_ready = None
+        self.t_done = None
+        self.ready_samples = 0
+
+    @property
+    def started(self):
+        return self.t_start is not None
+
+    @property
+    def done(self):
+        return self.t_done is not None
+
+
+class MotionCoordinator(object):
+    def __init__(self, config, state, telescope, dome, fwdict, logger=None):
+        self.config = config
+        self.state = state
+        self.telescope = telescope
+        self.dome = dome
+        self.fwdict = fwdict
+        self.logger = logger
+
+        # time (s) from issuing each move to it being done, for the last acquisition
+        self.axis_times = dict()
+        # time (s) for the whole last acquisition
+        self.total_time = None
+        # the axis which stopped the last acquisition, if one did
+        self.failed_axis = None
+
+    def log(self, msg, level=logging.INFO):
+        msg = f"motion_coordinator: {msg}"
+        if self.logger is None:
+            print(msg)
+        else:
+            self.logger.log(level=level, msg=msg)
+
+    def check_interlocks(self, alt, mech_angle=None):
+        """
+        Raise a MotionInterlockError if the moves would take the mount or
+        the rotator out of their allowed ranges.
+        """
+        min_alt = self.config["telescope"]["min_alt"]
+        max_alt = self.config["telescope"]["max_alt"]
+        if not (min_alt <= alt <= max_alt):
+            self.failed_axis = "mount"
+            raise MotionInterlockError(
+                f"target alt {alt:0.1f} outside allowed range [{min_alt}, {max_alt}]"
+            )
+
+        if mech_angle is not None:
+            rotator_config = self.config["telescope"]["ports"][self.telescope.port][
+                "rotator"
+            ]
+            if not (rotator_config["min_degs"] < mech_angle < rotator_config["max_degs"]):
+                self.failed_axis = "rotator"
+                raise MotionInterlockError(
+                    f"rotator mech angle {mech_angle:0.1f} outside cable wrap range "
+                    f'[{rotator_config["min_degs"]}, {rotator_config["max_degs"]}]'
+                )
+
+    def build_axes(
+        self,
+        alt,
+        az,
+        ra_hours=None,
+        dec_deg=None,
+        field_angle=None,
+        mech_angle=None,
+        tracking=True,
+        fwname=None,
+        filter_pos=None,
+    ):
+        """
+        Make the list of moves for an acquisition. The mount goes to ra_hours,
+        dec_deg if they are given, otherwise to alt, az. The rotator only
+        moves if field_angle is given, and the filter wheel if filter_pos is.
+        """
+        dome_stopped = self.config["Dome_Status_Dict"]["Dome_Status"]["STOPPED"]
+        axes = []
+
+        # the dome can't be sent anywhere while it is following the mount
+        axes.append(
+            Axis(
+                "dome_tracking_off",
+                start=lambda: self.dome.newCommand.emit(signalCmd("TrackingOff")),
+                is_ready=lambda: self.state["dome_tracking_status"] == 0,
+                timeout=5.0,
+            )
+        )
+        axes.append(
+            Axis(
+                "dome",
+                start=lambda: self.dome.newCommand.emit(signalCmd("GoTo", az)),
+                is_ready=lambda: (self.state["dome_status"] == dome_stopped)
+                and (np.abs(self.state["dome_az_deg"] - az) < 0.5),
+                timeout=600.0,
+                requires=["dome_tracking_off"],
+            )
+        )
+
+        if ra_hours is not None:
+            axes.append(
+                Axis(
+                    "mount",
+                    start=lambda: self.telescope.mount_goto_ra_dec_j2000(
+                        ra_hours=ra_hours, dec_degs=dec_deg
+                    ),
+                    is_ready=lambda: (not self.state["mount_is_slewing"])
+                    & (abs(self.state["mount_az_dist_to_target"]) < 3)
+                    & (abs(self.state["mount_alt_dist_to_target"]) < 0.5),
+                    timeout=60.0,
+                )
+            )
+        else:
+            axes.append(
+                Axis(
+                    "mount",
+                    start=lambda: self.telescope.mount_goto_alt_az(
+                        alt_degs=alt, az_degs=az
+                    ),
+                    is_ready=lambda: (not self.state["mount_is_slewing"])
+                    & (abs(self.state["mount_az_dist_to_target"]) < 0.1)
+                    & (abs(self.state["mount_alt_dist_to_target"]) < 0.1)
+                    & (
+                        ((alt - self.state["mount_alt_deg"]) ** 2
+                         + (az - self.state["mount_az_deg"]) ** 2) ** 0.5
+                        < 0.1
+                    ),
+                    timeout=60.0,
+                )
+            )
+
+        after_mount = ["mount"]
+        if field_angle is not None:
+            rotator_requires = ["mount"]
+            if mech_angle is not None:
+                # the mechanical angle for the target doesn't depend on where
+                # the mount is, so the rotator can make the long move during
+                # the slew, and only the last bit once the mount is there
+                axes.append(
+                    Axis(
+                        "rotator_mech",
+                        start=lambda: self.telescope.rotator_goto_mech(
+                            target_degs=mech_angle
+                        ),
+                        is_ready=lambda: (self.state["rotator_is_slewing"] == False)
+                        & (np.abs(self.state["rotator_mech_position"] - mech_angle) < 1.0),
+                        timeout=60.0,
+                    )
+                )
+                rotator_requires.append("rotator_mech")
+
+            def rotator_is_ready():
+                # put the angle between 0-360
+                field_angle_norm = np.mod(self.state["rotator_field_angle"], 360)
+                dist = np.mod(np.abs(field_angle_norm - np.mod(field_angle, 360)), 360.0)
+                return (self.state["rotator_is_slewing"] == False) & (dist < 1.0)
+
+            axes.append(
+                Axis(
+                    "rotator",
+                    start=lambda: self.telescope.rotator_goto_field(
+                        target_degs=field_angle
+                    ),
+                    is_ready=rotator_is_ready,
+                    timeout=60.0,
+                    requires=rotator_requires,
+                )
+            )
+            after_mount = ["mount", "rotator"]
+
+        if tracking:
+            axes.append(
+                Axis(
+                    "mount_tracking",
+                    start=self.telescope.mount_tracking_on,
+                    is_ready=lambda: self.state["mount_is_tracking"],
+                    timeout=5.0,
+                    requires=after_mount,
+                )
+            )
+            after_mount = after_mount + ["mount_tracking"]
+
+        # the dome only follows the mount again once both have arrived
+        axes.append(
+            Axis(
+                "dome_tracking_on",
+                start=lambda: self.dome.newCommand.emit(signalCmd("TrackingOn")),
+                is_ready=lambda: self.state["dome_tracking_status"] == 1,
+                timeout=5.0,
+                requires=["dome"] + after_mount,
+            )
+        )
+
+        if filter_pos is not None:
+            fw = self.fwdict[fwname]
+            axes.append(
+                Axis(
+                    "filter",
+                    start=lambda: fw.newCommand.emit(signalCmd("goToFilter", filter_pos)),
+                    is_ready=lambda: self.state[f"{fwname}_fw_filter_pos"] == filter_pos,
+                    timeout=60.0 * 5,
+                )
+            )
+
+        return axes
+
+    def run(self, axes):
+        """
+        Start the axes as their requirements are met and wait until all of
+        them are done. Raises a TimeoutError naming the axis that didn't
+        finish in time. Returns axis_times.
+        """
+        n_samples = self.config.get("cmd_satisfied_N_samples")
+        dt = self.config["cmd_status_dt"]
+
+        t0 = time.monotonic()
+        self.axis_times = dict()
+        self.total_time = None
+        self.failed_axis = None
+        done = set()
+
+        while len(done) < len(axes):
+            # start everything that can go now
+            for axis in axes:
+                if (not axis.started) and all(name in done for name in axis.requires):
+                    self.log(f"starting {axis.name}")
+                    self.failed_axis = axis.name
+                    axis.t_start = time.monotonic()
+                    axis.start()
+                    self.failed_axis = None
+
+            QtCore.QCoreApplication.processEvents()
+            time.sleep(dt)
+            now = time.monotonic()
+
+            for axis in axes:
+                if (not axis.started) or axis.done:
+                    continue
+                if axis.is_ready():
+                    if axis.ready_samples == 0:
+                        axis.t_ready = now
+                    axis.ready_samples += 1
+                else:
+                    axis.ready_samples = 0
+                if axis.ready_samples >= n_samples:
+                    axis.t_done = now
+                    self.axis_times[axis.name] = axis.t_done - axis.t_start
+                    done.add(axis.name)
+                    trace.record(f"motion.{axis.name}", axis.t_start, axis.t_ready)
+                    trace.record(
+                        f"motion.{axis.name}.settle", axis.t_ready, axis.t_done
+                    )
+                    self.log(
+                        f"{axis.name} done after {self.axis_times[axis.name]:0.1f} s "
+                        f"({axis.t_done - t0:0.1f} s into the acquisition)"
+                    )
+                elif now - axis.t_start > axis.timeout:
+                    self.failed_axis = axis.name
+                    trace.record(
+                        f"motion.{axis.name}", axis.t_start, now, error="TimeoutError"
+                    )
+                    raise TimeoutError(
+                        f"{axis.name} move timed out after {axis.timeout} seconds before completing"
+                    )
+
+        self.total_time = time.monotonic() - t0
+        self.log(
+            f"acquisition complete in {self.total_time:0.1f} s, sum of moves "
+            f"{sum(self.axis_times.values()):0.1f} s"
+        )
+        return self.axis_times
+
+    def acquire(self, alt, az, mech_angle=None, **kwargs):
+        """
+        Check the interlocks, then do all the moves of an acquisition. See
+        build_axes for the arguments.
+        """
+        self.failed_axis = None
+        rotating = kwargs.get("field_angle") is not None
+        self.check_interlocks(alt, mech_angle=mech_angle if rotating else None)
+        axes = self.build_axes(alt, az, mech_angle=mech_angle, **kwargs)
+        return self.run(axes)
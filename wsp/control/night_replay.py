@@ -0,0 +1,813 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+night_replay.py
+
+Replays a night of observing through the robotic operator against the
+simulators, to measure how efficiently wsp observes.
+
+It boots a Pyro nameserver on this machine, the sun simulator (which sets
+the clock wsp observes by, and how fast it runs), the PWI4 telescope
+simulator and the fake camera daemon in place of the WINTER camera, then
+starts wsp in robotic mode with the dome and filter wheel simulators. The
+schedule is either a recorded one (a nightly schedule file) or a synthetic
+one made for the night, and everything runs in a sandbox HOME so nothing
+touches the real data, schedules or logs.
+
+While it runs the housekeeping state is polled and the samples are written
+to <output>_samples.jsonl. At the end they are reduced to:
+    - the open shutter efficiency: time exposing / time from the start of
+      the first observation to the end of the last
+    - the overhead of each observation: target selection, acquisition and
+      the rest (dither moves, readout, logging, waiting)
+    - percentiles of how late the housekeeping loop runs, how long each of
+      its updates takes, and how long a state poll over Pyro takes
+which go to <output> as json.
+
+The speed only runs the sky clock faster: slews and exposures in the
+simulators take their real time. Speeding it up gets through the waits for
+twilight and between schedule windows quicker, but times and efficiencies
+are always in wall clock seconds, and the efficiency is only the one of a
+real night at speed 1.
+
+    python night_replay.py --synthetic 30 --duration 3600 -o replay.json
+    python night_replay.py --schedule ~/data/schedules/nightly_20240601.db --speed 5
+    python night_replay.py --analyze replay_samples.jsonl -o replay.json
+
+Needs PyQt5, PySide6 and Pyro5 like the rest of wsp.
+"""
+
+import getopt
+import json
+import os
+import shutil
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import yaml
+
+wsp_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+repo_path = os.path.dirname(wsp_path)
+
+# the fake camera stands in for the WINTER camera daemon
+CAMNAME = "winter"
+CAMERA_DAEMON = "WINTERcamera"
+
+# the wsp options for running against the simulators
+WSP_SIM_OPTS = [
+    "-r",
+    "--sunsim",
+    "--domesim",
+    "--mountsim",
+    "--fwsim",
+    "--nochiller",
+    "--disablewatchdog",
+]
+
+# the housekeeping state fields that are recorded
+SAMPLE_FIELDS = [
+    "timestamp",
+    "sun_alt",
+    "robo_obsHistID",
+    "robo_dithnum",
+    "robo_num_dithers",
+    "robo_visitExpTime",
+    "robo_acquisition_time",
+    "robo_target_selection_time",
+    f"{CAMNAME}_camera_doing_exposure",
+    f"{CAMNAME}_camera_exptime",
+    "hk_loop_index",
+    "hk_loop_period_ms",
+    "hk_loop_update_ms",
+]
+
+# the columns of the Summary table of a nightly schedule file
+SUMMARY_COLUMNS = [
+    "obsHistID",
+    "requestID",
+    "progID",
+    "progName",
+    "progTitle",
+    "fieldID",
+    "raDeg",
+    "decDeg",
+    "filter",
+    "expDate",
+    "expMJD",
+    "validStart",
+    "validStop",
+    "ditherNumber",
+    "bestDetector",
+    "night",
+    "visitTime",
+    "visitExpTime",
+    "progPI",
+    "observed",
+]
+
+
+def log(msg):
+    print(f"night_replay: {msg}", flush=True)
+
+
+def load_config():
+    return yaml.load(
+        open(os.path.join(wsp_path, "config", "config.yaml")), Loader=yaml.FullLoader
+    )
+
+
+def get_site(config):
+    import astropy.coordinates
+    import astropy.units as u
+
+    lat = astropy.coordinates.Angle(config["site"]["lat"])
+    lon = astropy.coordinates.Angle(config["site"]["lon"])
+    height = config["site"]["height"] * u.Unit(config["site"]["height_units"])
+    return astropy.coordinates.EarthLocation(lat=lat, lon=lon, height=height)
+
+
+def get_night_start(config, night):
+    """
+    The UTC datetime when the sun goes below max_sun_alt_for_observing on
+    the evening of night (a local date).
+    """
+    import astropy.coordinates
+    import astropy.time
+    import astropy.units as u
+    import pytz
+
+    tz = pytz.timezone(config["site"]["timezone"])
+    noon = tz.localize(datetime(night.year, night.month, night.day, 12, 0, 0))
+    times = astropy.time.Time(noon) + np.arange(0, 18 * 60, 2) * u.min
+    frame = astropy.coordinates.AltAz(obstime=times, location=get_site(config))
+    sun_alt = astropy.coordinates.get_sun(times).transform_to(frame).alt.deg
+    below = np.nonzero(sun_alt < config["max_sun_alt_for_observing"])[0]
+    return times[below[0]].to_datetime(timezone=timezone.utc)
+
+
+def make_synthetic_schedule(
+    filepath,
+    config,
+    start,
+    n_obs,
+    spacing_s,
+    visit_exptime=240.0,
+    dithers=8,
+    seed=0,
+):
+    """
+    Write a nightly schedule file with n_obs observations scheduled
+    spacing_s (sky clock) seconds apart from start. Each one is within an
+    hour and a half of the meridian when it is scheduled, and valid for
+    three slots either side, so that the robot can catch up if it runs late.
+    """
+    import astropy.time
+    import astropy.units as u
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    filters = [
+        name
+        for name, info in config["filters"][CAMNAME].items()
+        if name != "dark" and info.get("active", True)
+    ]
+    site = get_site(config)
+
+    t0 = astropy.time.Time(start)
+    times = t0 + np.arange(n_obs) * spacing_s * u.s
+    lst_deg = times.sidereal_time("apparent", longitude=site.lon).deg
+    ha_deg = rng.uniform(-22.5, 22.5, n_obs)
+    window_mjd = 3 * spacing_s / 86400.0
+
+    df = pd.DataFrame(
+        {
+            "obsHistID": np.arange(1, n_obs + 1),
+            "requestID": np.arange(1, n_obs + 1),
+            "progID": 1,
+            "progName": "night_replay",
+            "progTitle": "night replay benchmark",
+            "fieldID": np.arange(1, n_obs + 1),
+            "raDeg": np.mod(lst_deg - ha_deg, 360.0),
+            "decDeg": rng.uniform(-5.0, 65.0, n_obs),
+            "filter": rng.choice(filters, n_obs),
+            "expDate": (np.arange(n_obs) * spacing_s).astype(int),
+            "expMJD": times.mjd,
+            "validStart": times.mjd - window_mjd,
+            "validStop": times.mjd + window_mjd,
+            "ditherNumber": dithers,
+            "bestDetector": 1,
+            "night": 0,
+            "visitTime": visit_exptime,
+            "visitExpTime": visit_exptime,
+            "progPI": "",
+            "observed": 0,
+        },
+        columns=SUMMARY_COLUMNS,
+    )
+    with sqlite3.connect(filepath) as conn:
+        df.to_sql("Summary", conn, index=False, if_exists="replace")
+    return filepath
+
+
+def schedule_span(filepath):
+    """(first validStart, last validStop) of a schedule file, as mjds."""
+    with sqlite3.connect(filepath) as conn:
+        return conn.execute("SELECT MIN(validStart), MAX(validStop) FROM Summary").fetchone()
+
+
+def count_unobserved(filepath):
+    with sqlite3.connect(filepath) as conn:
+        return conn.execute("SELECT COUNT(*) FROM Summary WHERE observed = 0").fetchone()[0]
+
+
+def mjd_to_datetime(mjd):
+    return datetime(1858, 11, 17, tzinfo=timezone.utc) + timedelta(days=float(mjd))
+
+
+def make_sandbox(home, config, schedule_filepath):
+    """
+    Lay out the directories wsp expects under home, put the schedule in the
+    schedule directory (with nothing marked observed) and point the nightly
+    schedule link at it. Returns the path of the copied schedule.
+    """
+    schedule_dir = os.path.join(home, config["scheduleFile_directory"])
+    for directory in [
+        schedule_dir,
+        os.path.join(home, config["scheduleFile_ToO_directory"]),
+        os.path.join(home, config["image_directory"]),
+        os.path.join(home, config["log_directory"]),
+        os.path.join(home, config["obslog_directory"]),
+    ]:
+        os.makedirs(directory, exist_ok=True)
+
+    filepath = os.path.join(schedule_dir, os.path.basename(schedule_filepath))
+    if os.path.abspath(filepath) != os.path.abspath(schedule_filepath):
+        shutil.copyfile(schedule_filepath, filepath)
+    with sqlite3.connect(filepath) as conn:
+        conn.execute("UPDATE Summary SET observed = 0")
+
+    link = os.path.join(
+        home,
+        config["scheduleFile_nightly_link_directory"],
+        config["scheduleFile_nightly_link_name"],
+    )
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(filepath, link)
+    return filepath
+
+
+class ProcessGroup(object):
+    """
+    The processes started for a replay. Each one gets its own session so
+    that it can be stopped along with everything it launched (wsp starts
+    its daemons itself), and logs to <logdir>/<name>.log.
+    """
+
+    def __init__(self, home, logdir):
+        self.logdir = logdir
+        self.processes = dict()
+        self.env = dict(os.environ)
+        self.env.update(
+            {
+                "HOME": home,
+                "QT_QPA_PLATFORM": "offscreen",
+                # wsp launches its daemons with whatever "python" is on the
+                # path, so make that this interpreter
+                "PATH": os.pathsep.join(
+                    [os.path.dirname(sys.executable), self.env.get("PATH", "")]
+                ),
+                "PYTHONPATH": os.pathsep.join(
+                    [repo_path] + self.env.get("PYTHONPATH", "").split(os.pathsep)
+                ).rstrip(os.pathsep),
+            }
+        )
+        os.makedirs(logdir, exist_ok=True)
+
+    def launch(self, name, args):
+        logfile = open(os.path.join(self.logdir, f"{name}.log"), "w")
+        log(f"starting {name}: {' '.join(args)}")
+        self.processes[name] = subprocess.Popen(
+            [sys.executable] + args,
+            cwd=repo_path,
+            env=self.env,
+            stdout=logfile,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+        return self.processes[name]
+
+    def check(self):
+        """Raise a RuntimeError if any of the processes has died."""
+        for name, process in self.processes.items():
+            if process.poll() is not None:
+                raise RuntimeError(
+                    f"{name} exited with code {process.returncode}, see {self.logdir}/{name}.log"
+                )
+
+    def stop(self, timeout=10.0):
+        # stop in the reverse order, so wsp goes before the simulators
+        for name, process in reversed(list(self.processes.items())):
+            if process.poll() is None:
+                log(f"stopping {name}")
+                try:
+                    os.killpg(process.pid, signal.SIGINT)
+                except ProcessLookupError:
+                    pass
+        t0 = time.monotonic()
+        for name, process in self.processes.items():
+            try:
+                process.wait(max(0.1, timeout - (time.monotonic() - t0)))
+            except subprocess.TimeoutExpired:
+                pass
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+
+def default_ns_host():
+    """
+    This machine's address. Some of the daemons wsp launches aren't given
+    the nameserver address and look for it here, so it has to be here.
+    """
+    import Pyro5.socketutil
+
+    return str(
+        Pyro5.socketutil.get_ip_address("localhost", workaround127=True, version=4)
+    )
+
+
+def wait_for_pyro(ns_host, name, timeout, processes=None):
+    """Wait for name to be registered with the nameserver, return its uri."""
+    import Pyro5.core
+    import Pyro5.errors
+
+    t0 = time.monotonic()
+    while True:
+        try:
+            return Pyro5.core.locate_ns(host=ns_host).lookup(name)
+        except Pyro5.errors.PyroError:
+            if time.monotonic() - t0 > timeout:
+                raise TimeoutError(f"{name} was not registered within {timeout} s")
+            if processes is not None:
+                processes.check()
+            time.sleep(0.5)
+
+
+def percentiles(values):
+    values = np.asarray(values, dtype=float)
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        return None
+    return {
+        "n": int(len(values)),
+        "mean": float(np.mean(values)),
+        "p50": float(np.percentile(values, 50)),
+        "p90": float(np.percentile(values, 90)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(np.max(values)),
+    }
+
+
+def _number(value, default=None):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return default
+    return value if np.isfinite(value) else default
+
+
+def analyze(samples, hk_dt_ms):
+    """
+    Reduce the recorded samples to the benchmark results. Each sample is a
+    dict of SAMPLE_FIELDS plus t (wall clock seconds since the start) and
+    poll_ms (how long the state poll took).
+
+    An observation runs from the first sample with its obsHistID to the
+    first one with the next obsHistID. The last one only counts if all its
+    dithers were seen, and then ends when its last exposure does.
+    Exposures are counted from the camera's doing_exposure going high (or
+    the dither number going up, if that counted more) and are
+    visitExpTime / num_dithers long. The target selection charged to an
+    observation is the one for the next target, which happens at its end.
+    """
+    samples = [s for s in samples if s.get("t") is not None]
+    results = {"n_samples": len(samples)}
+    if not samples:
+        return results
+
+    # clocks
+    wall_s = samples[-1]["t"] - samples[0]["t"]
+    sky = [(s["t"], _number(s.get("timestamp"))) for s in samples]
+    sky = [(t, ts) for t, ts in sky if ts is not None and ts > 0]
+    results["wall_s"] = wall_s
+    if len(sky) > 1 and sky[-1][0] > sky[0][0]:
+        results["sky_s"] = sky[-1][1] - sky[0][1]
+        results["speed"] = results["sky_s"] / (sky[-1][0] - sky[0][0])
+
+    # split the samples up into observations
+    observations = []
+    current = None
+    prev_exposing = False
+    prev_dithnum = None
+    for s in samples:
+        obsHistID = _number(s.get("robo_obsHistID"))
+        if obsHistID is not None and obsHistID >= 0:
+            obsHistID = int(obsHistID)
+            if current is None or obsHistID != current["obsHistID"]:
+                if current is not None:
+                    current["t_end"] = s["t"]
+                current = {
+                    "obsHistID": obsHistID,
+                    "t_start": s["t"],
+                    "t_end": None,
+                    "t_last_exposure_end": None,
+                    "exposures": 0,
+                    "dither_steps": 0,
+                    "num_dithers": 1,
+                    "visitExpTime": None,
+                    "acquisition_s": None,
+                    "selection_s": _number(s.get("robo_target_selection_time")),
+                }
+                observations.append(current)
+                prev_dithnum = None
+        if current is None:
+            continue
+
+        num_dithers = _number(s.get("robo_num_dithers"))
+        visitExpTime = _number(s.get("robo_visitExpTime"))
+        if visitExpTime is not None and visitExpTime > 0:
+            current["visitExpTime"] = visitExpTime
+            current["num_dithers"] = max(1, int(num_dithers or 1))
+        acquisition_s = _number(s.get("robo_acquisition_time"))
+        if acquisition_s is not None:
+            current["acquisition_s"] = acquisition_s
+
+        exposing = bool(s.get(f"{CAMNAME}_camera_doing_exposure"))
+        if exposing and not prev_exposing:
+            current["exposures"] += 1
+        if prev_exposing and not exposing:
+            current["t_last_exposure_end"] = s["t"]
+        prev_exposing = exposing
+
+        dithnum = _number(s.get("robo_dithnum"))
+        if dithnum is not None and prev_dithnum is not None and dithnum > prev_dithnum:
+            current["dither_steps"] += int(dithnum - prev_dithnum)
+        prev_dithnum = dithnum
+
+    if observations and observations[-1]["t_end"] is None:
+        last = observations[-1]
+        done = max(last["exposures"], last["dither_steps"])
+        if done >= last["num_dithers"] and last["t_last_exposure_end"] is not None:
+            last["t_end"] = last["t_last_exposure_end"]
+        else:
+            observations.pop()
+
+    breakdown = []
+    for i, obs in enumerate(observations):
+        n_exposures = max(obs["exposures"], obs["dither_steps"])
+        exptime = (obs["visitExpTime"] or 0.0) / obs["num_dithers"]
+        wall = obs["t_end"] - obs["t_start"]
+        exposure = n_exposures * exptime
+        acquisition = obs["acquisition_s"] or 0.0
+        if i + 1 < len(observations):
+            selection = observations[i + 1]["selection_s"] or 0.0
+        else:
+            selection = 0.0
+        breakdown.append(
+            {
+                "obsHistID": obs["obsHistID"],
+                "t_start": obs["t_start"],
+                "wall_s": wall,
+                "n_exposures": n_exposures,
+                "exposure_s": exposure,
+                "acquisition_s": acquisition,
+                "next_selection_s": selection,
+                "other_s": wall - exposure - acquisition - selection,
+            }
+        )
+    results["observations"] = breakdown
+    results["n_observations"] = len(breakdown)
+
+    if breakdown:
+        observing_s = breakdown[-1]["t_start"] + breakdown[-1]["wall_s"] - breakdown[0]["t_start"]
+        open_shutter_s = sum(obs["exposure_s"] for obs in breakdown)
+        results["n_exposures"] = sum(obs["n_exposures"] for obs in breakdown)
+        results["observing_s"] = observing_s
+        results["open_shutter_s"] = open_shutter_s
+        results["open_shutter_efficiency"] = (
+            open_shutter_s / observing_s if observing_s > 0 else None
+        )
+        results["overhead_per_observation_s"] = {
+            key: percentiles([obs[key] for obs in breakdown])
+            for key in ["wall_s", "acquisition_s", "next_selection_s", "other_s"]
+        }
+
+    # housekeeping loop: one entry per update seen, the ones in between missed
+    hk = dict()
+    for s in samples:
+        index = _number(s.get("hk_loop_index"))
+        if index is not None:
+            hk[int(index)] = s
+    indices = sorted(hk)
+    periods = [
+        _number(hk[index].get("hk_loop_period_ms"))
+        for prev, index in zip(indices, indices[1:])
+        if index == prev + 1
+    ]
+    periods = [p for p in periods if p is not None]
+    results["hk_loop"] = {
+        "dt_ms": hk_dt_ms,
+        "n_updates": len(indices),
+        "n_missed": int(indices[-1] - indices[0] + 1 - len(indices)) if indices else 0,
+        "period_ms": percentiles(periods),
+        "late_ms": percentiles([p - hk_dt_ms for p in periods]),
+        "update_ms": percentiles(
+            [_number(hk[index].get("hk_loop_update_ms")) for index in indices]
+        ),
+    }
+    results["state_poll_ms"] = percentiles([s.get("poll_ms") for s in samples])
+    return results
+
+
+def record(state_uri, samples_file, poll_dt, should_stop, processes=None):
+    """
+    Poll the housekeeping state every poll_dt seconds, writing a line of
+    json to samples_file for each poll, until should_stop(sample) is True.
+    Returns the samples.
+    """
+    import Pyro5.client
+
+    state = Pyro5.client.Proxy(state_uri)
+    samples = []
+    t0 = time.monotonic()
+    t_next = t0
+    while True:
+        t_poll = time.monotonic()
+        try:
+            status = state.GetStatus()
+        except Exception as e:
+            log(f"could not poll the state: {e}")
+            status = dict()
+            state._pyroRelease()
+        poll_ms = (time.monotonic() - t_poll) * 1000.0
+        sample = {"t": t_poll - t0, "poll_ms": poll_ms}
+        sample.update({field: status.get(field) for field in SAMPLE_FIELDS})
+        samples.append(sample)
+        samples_file.write(json.dumps(sample, default=str) + "\n")
+
+        if should_stop(sample):
+            return samples
+        if processes is not None:
+            processes.check()
+
+        t_next += poll_dt
+        time.sleep(max(0.0, t_next - time.monotonic()))
+
+
+def replay(
+    schedule_filepath,
+    output,
+    home,
+    ns_host=None,
+    speed=1,
+    start=None,
+    duration=3600.0,
+    poll_dt=0.05,
+    boot_timeout=120.0,
+):
+    """
+    Run the replay of schedule_filepath (see the module docstring) for up to
+    duration seconds, or until the schedule is done, and write the results
+    to output. Returns the results.
+    """
+    config = load_config()
+    if ns_host is None:
+        ns_host = default_ns_host()
+    schedule_filepath = make_sandbox(home, config, schedule_filepath)
+    if start is None:
+        start = mjd_to_datetime(schedule_span(schedule_filepath)[0])
+    stop_timestamp = mjd_to_datetime(schedule_span(schedule_filepath)[1]).timestamp()
+    samples_filepath = os.path.splitext(output)[0] + "_samples.jsonl"
+
+    processes = ProcessGroup(home, os.path.join(home, "replay_logs"))
+    try:
+        processes.launch("nameserver", ["-m", "Pyro5.nameserver", "-n", ns_host])
+        wait_for_pyro(ns_host, "Pyro.NameServer", boot_timeout, processes)
+
+        processes.launch(
+            "sun_simulator",
+            [
+                os.path.join(wsp_path, "ephem", "sun_simulator_gui.py"),
+                "-p",
+                "-n",
+                ns_host,
+                f"--speed={int(speed)}",
+                f"--start={start.astimezone(timezone.utc).replace(tzinfo=None).isoformat()}",
+                "--run",
+            ],
+        )
+        wait_for_pyro(ns_host, "sunsim", boot_timeout, processes)
+
+        processes.launch(
+            "telescope_simulator",
+            [
+                os.path.join(wsp_path, "telescope", "simulator", "simulated_telescope.py"),
+                "-n",
+                ns_host,
+                "--sunsim",
+            ],
+        )
+        processes.launch(
+            "fake_camera",
+            [
+                "-m",
+                "wsp.camera.daemons.fake_camera_daemon",
+                "-p",
+                "-n",
+                ns_host,
+                f"--name={CAMERA_DAEMON}",
+            ],
+        )
+        wait_for_pyro(ns_host, CAMERA_DAEMON, boot_timeout, processes)
+
+        processes.launch("wsp", ["-m", "wsp"] + WSP_SIM_OPTS + ["-n", ns_host])
+        state_uri = wait_for_pyro(ns_host, "state", boot_timeout, processes)
+        log(f"wsp is up, recording for up to {duration} s")
+
+        t_stop = time.monotonic() + duration
+        t_next_check = 0.0
+
+        def should_stop(sample):
+            nonlocal t_next_check
+            if time.monotonic() > t_stop:
+                log("reached the duration")
+                return True
+            timestamp = _number(sample.get("timestamp"))
+            if timestamp is not None and timestamp > stop_timestamp:
+                log("reached the end of the schedule")
+                return True
+            # only look at the schedule file now and then, and only between exposures
+            if time.monotonic() > t_next_check and not sample.get(
+                f"{CAMNAME}_camera_doing_exposure"
+            ):
+                t_next_check = time.monotonic() + 10.0
+                if count_unobserved(schedule_filepath) == 0:
+                    log("everything in the schedule has been observed")
+                    return True
+            return False
+
+        with open(samples_filepath, "w") as samples_file:
+            samples = record(state_uri, samples_file, poll_dt, should_stop, processes)
+    finally:
+        processes.stop()
+
+    hk_config = yaml.load(
+        open(os.path.join(wsp_path, "config", "telemetry_config.yaml")),
+        Loader=yaml.FullLoader,
+    )
+    results = analyze(samples, hk_config["daq_dt"]["hk"])
+    results["run"] = {
+        "schedule": os.path.basename(schedule_filepath),
+        "start": start.isoformat(),
+        "speed": speed,
+        "duration_s": duration,
+        "poll_dt_s": poll_dt,
+        "samples": samples_filepath,
+        "home": home,
+        "date": datetime.now(timezone.utc).isoformat(),
+    }
+    write_results(results, output)
+    return results
+
+
+def write_results(results, output):
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    log(f"wrote results to {output}")
+    if results.get("n_observations"):
+        log(
+            f'{results["n_observations"]} observations, open shutter efficiency '
+            f'{results["open_shutter_efficiency"]:0.3f}'
+        )
+    late = results.get("hk_loop", {}).get("late_ms")
+    if late is not None:
+        log(f'hk loop late by p50 {late["p50"]:0.1f} ms, p99 {late["p99"]:0.1f} ms')
+
+
+if __name__ == "__main__":
+
+    usage = """usage: night_replay.py [--schedule FILE | --synthetic N] [options]
+                       night_replay.py --analyze SAMPLES.jsonl [-o OUTPUT]
+
+    --schedule FILE     replay a nightly schedule file
+    --synthetic N       replay N synthetic observations
+    --night YYYY-MM-DD  local date of the evening to make them for (default today)
+    --spacing S         sky clock seconds between them (default: what they take at the speed)
+    --exptime S         visitExpTime of each one (default 240)
+    --dithers N         dithers per observation (default 8)
+    --seed N            random seed for the targets (default 0)
+    --speed N           sky clock seconds per second (default 1)
+    --start ISO         UTC to start the sky clock at (default the start of the schedule)
+    --duration S        stop recording after this many seconds (default 3600)
+    --poll S            seconds between state polls (default 0.05)
+    --home DIR          sandbox HOME (default a temporary directory)
+    -n, --ns_host HOST  address for the nameserver (default this machine's)
+    -o, --output FILE   results file (default night_replay.json)
+    """
+
+    options = "hn:o:"
+    long_options = [
+        "help",
+        "schedule=",
+        "synthetic=",
+        "night=",
+        "spacing=",
+        "exptime=",
+        "dithers=",
+        "seed=",
+        "speed=",
+        "start=",
+        "duration=",
+        "poll=",
+        "home=",
+        "ns_host=",
+        "output=",
+        "analyze=",
+    ]
+    try:
+        arguments, values = getopt.getopt(sys.argv[1:], options, long_options)
+    except getopt.error as err:
+        print(str(err))
+        print(usage)
+        sys.exit(2)
+    opts = dict(arguments)
+    if "-h" in opts or "--help" in opts:
+        print(usage)
+        sys.exit(0)
+
+    output = opts.get("--output", opts.get("-o", "night_replay.json"))
+
+    if "--analyze" in opts:
+        hk_config = yaml.load(
+            open(os.path.join(wsp_path, "config", "telemetry_config.yaml")),
+            Loader=yaml.FullLoader,
+        )
+        with open(opts["--analyze"]) as f:
+            samples = [json.loads(line) for line in f if line.strip()]
+        write_results(analyze(samples, hk_config["daq_dt"]["hk"]), output)
+        sys.exit(0)
+
+    speed = int(opts.get("--speed", 1))
+    start = None
+    if "--start" in opts:
+        start = datetime.fromisoformat(opts["--start"])
+        if start.tzinfo is None:
+            start = start.replace(tzinfo=timezone.utc)
+    home = opts.get("--home") or tempfile.mkdtemp(prefix="night_replay_")
+    os.makedirs(home, exist_ok=True)
+
+    if "--synthetic" in opts:
+        config = load_config()
+        if "--night" in opts:
+            night = datetime.strptime(opts["--night"], "%Y-%m-%d")
+        else:
+            night = datetime.now()
+        exptime = float(opts.get("--exptime", 240.0))
+        # the default is about what an observation takes: the exposure and
+        # a minute and a half of overhead, on the sky clock
+        spacing = float(opts.get("--spacing", (exptime + 90.0) * speed))
+        schedule_filepath = make_synthetic_schedule(
+            os.path.join(home, f'{config["scheduleFile_nightly_prefix"]}replay.db'),
+            config,
+            get_night_start(config, night),
+            n_obs=int(opts["--synthetic"]),
+            spacing_s=spacing,
+            visit_exptime=exptime,
+            dithers=int(opts.get("--dithers", 8)),
+            seed=int(opts.get("--seed", 0)),
+        )
+    elif "--schedule" in opts:
+        schedule_filepath = os.path.abspath(os.path.expanduser(opts["--schedule"]))
+    else:
+        print(usage)
+        sys.exit(2)
+
+    log(f"sandbox HOME is {home}")
+    replay(
+        schedule_filepath,
+        os.path.abspath(output),
+        home,
+        ns_host=opts.get("--ns_host", opts.get("-n")),
+        speed=speed,
+        start=start,
+        duration=float(opts.get("--duration", 3600.0)),
+        poll_dt=float(opts.get("--poll", 0.05)),
+    )
@@ -10,9 +10,11 @@ operator.py
 
 
 import glob
+import hashlib
 import json
 import logging
 import os
+import sqlite3
 import subprocess
 import threading
 import time
@@ -32,14 +34,17 @@ import sqlalchemy as db
 from astropy.io import fits
 from PyQt5 import QtCore
 
-from wsp.cal import cal_tracker
+from wsp.cal import cal_tracker, flat_exposure
 from wsp.camera.config import CameraConfigManager
+from wsp.control import motion_coordinator
 from wsp.ephem import ephem_utils
 from wsp.focuser import focus_tracker, focusing
 from wsp.housekeeping import data_handler
+from wsp.schedule import schedule as schedule_module
 from wsp.schedule import wintertoo_validate
 from wsp.telescope import pointingModelBuilder
 from wsp.telescope.telescope import WrapWarningInfo
+from wsp.utils import trace
 
 # add the wsp directory to the PATH
 wsp_path = os.path.dirname(os.path.dirname(__file__))
@@ -168,7 +173,16 @@ class RoboOperatorThread(QtCore.QThread):
         self.dometest = dometest
         self.mountsim = mountsim
 
+        self.robo = None
+        # a restart which came in while the RoboOperator was starting up
+        self.pending_restart = None
+
     def run(self):
+        # robo_run can come in while the RoboOperator is still starting up (eg
+        # switching the camera), so connect it first and hold on to it until
+        # the RoboOperator is ready. connected from here, it runs in this thread
+        self.restartRoboSignal.connect(lambda arg: self._restart_robo(arg))
+
         self.robo = RoboOperator(
             base_directory=self.base_directory,
             config=self.config,
@@ -196,8 +210,6 @@ class RoboOperatorThread(QtCore.QThread):
         )
 
         # Put all the signal/slot connections here:
-        ## if we get a signal to start the robotic operator, start it!
-        self.restartRoboSignal.connect(self.robo.restart_robo)
         ## change schedule
         self.changeSchedule.connect(self.robo.change_schedule)
         ## do an exposure with the ccd
@@ -206,9 +218,18 @@ class RoboOperatorThread(QtCore.QThread):
         # connect the signals and slots
         self.newCommand.connect(self.robo.doCommand)
 
+        if self.pending_restart is not None:
+            self.robo.restart_robo(self.pending_restart)
+
         # Start the event loop
         self.exec_()
 
+    def _restart_robo(self, arg):
+        if self.robo is None:
+            self.pending_restart = arg
+        else:
+            self.robo.restart_robo(arg)
+
 
 class roboError(object):
     """
@@ -228,6 +249,53 @@ class roboError(object):
         self.msg = msg
 
 
+def _same_value(old, new):
+    """whether a robostate field assignment leaves the published value unchanged"""
+    if old is new:
+        return True
+    if type(old) is not type(new):
+        return False
+    try:
+        if (old != old) and (new != new):
+            # both nan
+            return True
+        return bool(old == new)
+    except Exception:
+        return False
+
+
+class RobostateField(object):
+    """
+    A RoboOperator attribute which is published in robostate. Assigning it
+    a new value marks it dirty, so that update_state only has to push the
+    fields which changed.
+    """
+
+    # the robo loop and the status update thread both touch the dirty set
+    lock = threading.Lock()
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        try:
+            return obj.__dict__[self.name]
+        except KeyError:
+            raise AttributeError(self.name)
+
+    def __set__(self, obj, value):
+        with self.lock:
+            unset = self.name not in obj.__dict__
+            if unset or not _same_value(obj.__dict__[self.name], value):
+                obj.__dict__.setdefault("robostate_dirty", set()).add(self.name)
+            obj.__dict__[self.name] = value
+
+    def __delete__(self, obj):
+        del obj.__dict__[self.name]
+
+
 class RoboOperator(QtCore.QObject):
 
     hardware_error = QtCore.pyqtSignal(object)
@@ -246,6 +314,67 @@ class RoboOperator(QtCore.QObject):
     disableAlarms = QtCore.pyqtSignal()
     enableAlarms = QtCore.pyqtSignal()
 
+    # the attributes published in robostate. they are made RobostateFields
+    # below the class
+    ROBOSTATE_FIELDS = [
+        "ok_to_observe",
+        "target_alt",
+        "target_az",
+        # TODO: do we need all of these? NPL 9-13-24
+        "target_ra_j2000_hours",
+        "target_dec_j2000_deg",
+        "j2000_ra_scheduled_hours",
+        "j2000_ra_scheduled_deg",
+        "j2000_dec_scheduled_deg",
+        "pointing_ra_j2000_hours",
+        "pointing_dec_j2000_deg",
+        ####
+        "visitExpTime",
+        "obsHistID",
+        "targetPriority",
+        "operator",
+        "obstype",
+        "programPI",
+        "validStart",
+        "validStop",
+        "programID",
+        "programName",
+        "qcomment",
+        "targtype",
+        "targetName",
+        "obsmode",
+        "scheduleName",
+        "scheduleType",
+        "maxAirmass",
+        #'ditherNumber',
+        "num_dithers",
+        "dithnum",
+        "ditherStepSize",
+        "fieldID",
+        "observatory_stowed",
+        "observatory_ready",
+        "acquisition_time",
+        "target_selection_time",
+    ]
+
+    # the state keys that the observatory ready and stowed checks look at
+    OBSERVATORY_STATUS_STATE_KEYS = [
+        "mount_is_connected",
+        "mount_alt_is_enabled",
+        "mount_az_is_enabled",
+        "mount_is_tracking",
+        "mount_az_deg",
+        "rotator_is_connected",
+        "rotator_is_enabled",
+        "rotator_wrap_check_enabled",
+        "rotator_mech_position",
+        "focuser_is_connected",
+        "focuser_is_enabled",
+        "dome_az_deg",
+        "dome_tracking_status",
+        "Mirror_Cover_State",
+    ]
+
     def __init__(
         self,
         base_directory,
@@ -303,6 +432,26 @@ class RoboOperator(QtCore.QObject):
         # set up the camera manager
         self.camera_manager = CameraConfigManager(self.config)
 
+        # moves the dome, mount, rotator and filter wheel together when acquiring targets
+        self.motion = motion_coordinator.MotionCoordinator(
+            self.config,
+            self.state,
+            self.telescope,
+            self.dome,
+            self.fwdict,
+            logger=self.logger,
+        )
+        # a filter change to make during the next acquisition: (camname, filter_num)
+        self.pending_filter_move = None
+        # how long the last acquisition took (s), in total and per axis
+        self.acquisition_time = None
+        self.acquisition_axis_times = dict()
+        # the targets ranked during the last exposure of an observation
+        self.lookahead = None
+        self.lookahead_thread = None
+        # how long it took to pick the last target (s)
+        self.target_selection_time = None
+
         # for now just trying to start leaving places in the code to swap between winter and summer
         self.camname = "winter"
 
@@ -353,6 +502,8 @@ class RoboOperator(QtCore.QObject):
         self.observatory_ready = False
         # a similar flag to denote whether the observatory is safely stowed
         self.observatory_stowed = False
+        # what the observatory checks were last run with
+        self.observatory_status_inputs = None
 
         self.in_manual_lockout = False  # Track manual lockout state
 
@@ -432,6 +583,14 @@ class RoboOperator(QtCore.QObject):
         # set up the schedule
         ## after this point we should have something in self.schedule.currentObs
         self.change_schedule(self.survey_schedulefile_name, postPlot=True)
+
+        # a separate schedule for ranking the survey targets in the lookahead thread
+        self.lookahead_schedule = schedule_module.Schedule(
+            base_directory=self.base_directory,
+            config=self.config,
+            logger=self.logger,
+            verbose=False,
+        )
         # self.schedule.loadSchedule(self.survey_schedulefile_name, postPlot = True)
 
         ### SET UP POINTING MODEL BUILDER ###
@@ -507,58 +666,51 @@ class RoboOperator(QtCore.QObject):
         except:
             pass
 
-    def update_state(self, printstate=False):
-        self.get_observatory_ready_status()
-        self.get_observatory_stowed_status()
-        fields = [
-            "ok_to_observe",
-            "target_alt",
-            "target_az",
-            # TODO: do we need all of these? NPL 9-13-24
-            "target_ra_j2000_hours",
-            "target_dec_j2000_deg",
-            "j2000_ra_scheduled_hours",
-            "j2000_ra_scheduled_deg",
-            "j2000_dec_scheduled_deg",
-            "pointing_ra_j2000_hours",
-            "pointing_dec_j2000_deg",
-            ####
-            "visitExpTime",
-            "obsHistID",
-            "targetPriority",
-            "operator",
-            "obstype",
-            "programPI",
-            "validStart",
-            "validStop",
-            "programID",
-            "programName",
-            "qcomment",
-            "targtype",
-            "targetName",
-            "obsmode",
-            "scheduleName",
-            "scheduleType",
-            "maxAirmass",
-            #'ditherNumber',
-            "num_dithers",
-            "dithnum",
-            "ditherStepSize",
-            "fieldID",
-            "observatory_stowed",
-            "observatory_ready",
-        ]
+    def get_observatory_status_inputs(self):
+        """
+        everything get_observatory_ready_status and get_observatory_stowed_status
+        look at, to tell when they need to be re-run
+        """
+        state_inputs = tuple(
+            self.state.get(key) for key in self.OBSERVATORY_STATUS_STATE_KEYS
+        )
+        other_inputs = (
+            self.dome.Control_Status,
+            self.dome.Home_Status,
+            self.dome.Shutter_Status,
+            self.telescope.port,
+            self.mountsim,
+            self.test_mode,
+        )
+        return state_inputs + other_inputs
 
-        for field in fields:
+    def update_state(self, printstate=False):
+        # only re-run the observatory checks if something they look at has changed
+        try:
+            inputs = self.get_observatory_status_inputs()
+        except Exception:
+            inputs = None
+        if (inputs is None) or (inputs != self.observatory_status_inputs):
+            self.get_observatory_ready_status()
+            self.get_observatory_stowed_status()
+            self.observatory_status_inputs = inputs
+
+        # only push the fields which have changed since the last update
+        with RobostateField.lock:
+            dirty = self.__dict__.get("robostate_dirty", set())
+            self.robostate_dirty = set()
+        changes = dict()
+        for field in dirty:
             try:
                 val = getattr(self, field)
                 # if type(val) is bool:
                 #    val = int(val)
-                self.robostate.update({field: val})
+                changes.update({field: val})
             except Exception as e:
                 if printstate:
                     print(f"could not add {field} to robostate: {e}")
                 pass
+        self.robostate.update(changes)
         if printstate:
             print(f"robostate = {json.dumps(self.robostate, indent = 3)}")
 
@@ -1403,7 +1555,13 @@ class RoboOperator(QtCore.QObject):
                                 self.state["sun_alt"]
                                 <= self.config["max_sun_alt_for_observing"]
                             ):
-                                self.load_best_observing_target(obstime_mjd)
+                                t_select = time.monotonic()
+                                with trace.span("robo.select"):
+                                    if not self.commit_lookahead_target(obstime_mjd):
+                                        self.load_best_observing_target(obstime_mjd)
+                                self.target_selection_time = (
+                                    time.monotonic() - t_select
+                                )
 
                                 # print(f'currentObs = {self.schedule.currentObs}')
                                 # print(f'self.schedule.schedulefile = {self.schedule.schedulefile}, self.schedule.scheduleType = {self.schedule.scheduleType}')
@@ -1436,9 +1594,14 @@ class RoboOperator(QtCore.QObject):
                                     # for now, still logging the observation first.
                                     # next step is to move it to after.
 
-                                    self.schedule.log_observation()
+                                    trace.set_obs(
+                                        int(self.schedule.currentObs["obsHistID"])
+                                    )
+                                    with trace.span("robo.log_observation"):
+                                        self.schedule.log_observation()
 
-                                    self.do_currentObs(self.schedule.currentObs)
+                                    with trace.span("robo.observation"):
+                                        self.do_currentObs(self.schedule.currentObs)
 
                                     # if we get here, then the observation is complete, either bc it's done or there was an error
 
@@ -1583,289 +1746,501 @@ class RoboOperator(QtCore.QObject):
             obstime_mjd = float(astropy.time.Time(datetime.utcnow()).mjd)
 
         # get all the files in the ToO High Priority folder
-        ToO_schedule_directory = os.path.join(
-            os.getenv("HOME"), self.config["scheduleFile_ToO_directory"]
-        )
-        ToOscheduleFiles = glob.glob(os.path.join(ToO_schedule_directory, "*.db"))
+        ToOscheduleFiles = self.get_ToO_schedule_files()
 
         self.log(f"found these schedule files in the TOO directory: {ToOscheduleFiles}")
         self.log(f"analyzing schedules...")
 
         if len(ToOscheduleFiles) > 0:
-            # bundle up all the schedule files in a single pandas dataframe
-            full_df = pd.DataFrame()
-            # add all the ToOs
-            for too_file in ToOscheduleFiles:
-                try:
-                    ### try to read in the SQL file
-                    self.log(f"validating too_file = {too_file}")
-                    engine = db.create_engine("sqlite:///" + too_file)
-                    conn = engine.connect()
-                    df = pd.read_sql("SELECT * FROM summary;", conn)
-
-                    # if targname not in the df, add in a default
-                    if "targName" not in df:
-                        df["targName"] = ""
-
-                    # keep analyzing and making cuts unless you throw away all the entries
-                    df["origin_filepath"] = too_file
-                    df["origin_filename"] = os.path.basename(too_file)
-                    conn.close()
+            full_df = self.rank_ToO_targets(obstime_mjd, ToOscheduleFiles)
 
-                    ### if we were able to load and query the SQL db, check to make sure the schema are correct
-                    wintertoo_validate.validate_schedule_df(df)
-                    self.log(f"obstime_mjd = {obstime_mjd}")
-                    select_cols = df[
-                        [
-                            "raDeg",
-                            "decDeg",
-                            "filter",
-                            "progPI",
-                            "priority",
-                            "obsHistID",
-                            "targName",
-                            "observed",
-                            "origin_filename",
-                        ]
-                    ]
-                    self.log(f"entries before making any cuts: df = \n{select_cols}")
-
-                    ### if the schema were correct, make cuts based on observability
-                    # Note: if we don't do this we can end up in a situation where do_Observation will reject an
-                    #       observation, but this will keep submitting it and we'll get stuck in a useless loop
-                    # select only targets within their valid start and stop times
-                    df = df.loc[
-                        (obstime_mjd >= df["validStart"])
-                        & (obstime_mjd <= df["validStop"])
-                        & (df["observed"] == 0)
+            if len(full_df) == 0:
+                # there are no valid schedule files. break out to the handling at the bottom
+                pass
+
+            else:
+                # save the dataframe to csv for realtime reference
+                rankedSummary = full_df[
+                    ["obsHistID", "priority", "validStop", "origin_filename"]
+                ]
+                rankedSummary.to_csv(
+                    os.path.join(
+                        os.getenv("HOME"),
+                        "data",
+                        "Valid_ToO_Observations_Ranked.csv",
+                    )
+                )
+
+                # the best target is the first one in this sorted pandas dataframe
+                currentObs = dict(full_df.iloc[0])
+                scheduleFile = currentObs["origin_filepath"]
+                scheduleFile_without_path = scheduleFile.split("/")[-1]
+                self.announce(
+                    f'we should be observing from {scheduleFile_without_path}, obsHistID = {currentObs["obsHistID"]}'
+                )
+                # point self.schedule to the TOO
+                self.schedule.loadSchedule(scheduleFile)
+                self.schedule.updateCurrentObs(currentObs, obstime_mjd)
+                return
+
+        # if we're here, there are no TOO valid observations
+        self.announce(f"there are no valid ToO observations, defaulting to survey")
+
+        scheduleFile = self.survey_schedulefile_name
+        # point self.schedule to the survey
+        self.announce(f"loading survey schedule: {scheduleFile}")
+        self.schedule.loadSchedule(scheduleFile)
+        currentObs = self.schedule.getTopRankedObs(obstime_mjd)
+        # self.announce(f'currentObs = {currentObs}')
+        self.schedule.updateCurrentObs(currentObs, obstime_mjd)
+        return
+
+    def get_ToO_schedule_files(self):
+        ToO_schedule_directory = os.path.join(
+            os.getenv("HOME"), self.config["scheduleFile_ToO_directory"]
+        )
+        return glob.glob(os.path.join(ToO_schedule_directory, "*.db"))
+
+    def rank_ToO_targets(self, obstime_mjd, ToOscheduleFiles):
+        """
+        validate the schedule files in the TOO folder and cut their entries down to the
+        ones which can be observed at obstime_mjd. returns the survivors of all the files
+        in one dataframe, sorted so that the best target is first
+        """
+        # bundle up all the schedule files in a single pandas dataframe
+        full_df = pd.DataFrame()
+        # add all the ToOs
+        for too_file in ToOscheduleFiles:
+            try:
+                ### try to read in the SQL file
+                self.log(f"validating too_file = {too_file}")
+                engine = db.create_engine("sqlite:///" + too_file)
+                conn = engine.connect()
+                df = pd.read_sql("SELECT * FROM summary;", conn)
+
+                # if targname not in the df, add in a default
+                if "targName" not in df:
+                    df["targName"] = ""
+
+                # keep analyzing and making cuts unless you throw away all the entries
+                df["origin_filepath"] = too_file
+                df["origin_filename"] = os.path.basename(too_file)
+                conn.close()
+
+                ### if we were able to load and query the SQL db, check to make sure the schema are correct
+                wintertoo_validate.validate_schedule_df(df)
+                self.log(f"obstime_mjd = {obstime_mjd}")
+                select_cols = df[
+                    [
+                        "raDeg",
+                        "decDeg",
+                        "filter",
+                        "progPI",
+                        "priority",
+                        "obsHistID",
+                        "targName",
+                        "observed",
+                        "origin_filename",
                     ]
+                ]
+                self.log(f"entries before making any cuts: df = \n{select_cols}")
+
+                ### if the schema were correct, make cuts based on observability
+                # Note: if we don't do this we can end up in a situation where do_Observation will reject an
+                #       observation, but this will keep submitting it and we'll get stuck in a useless loop
+                # select only targets within their valid start and stop times
+                df = df.loc[
+                    (obstime_mjd >= df["validStart"])
+                    & (obstime_mjd <= df["validStop"])
+                    & (df["observed"] == 0)
+                ]
 
-                    select_cols = df[
-                        [
-                            "raDeg",
-                            "decDeg",
-                            "filter",
-                            "progPI",
-                            "priority",
-                            "obsHistID",
-                            "targName",
-                            "observed",
-                            "origin_filename",
-                        ]
+                select_cols = df[
+                    [
+                        "raDeg",
+                        "decDeg",
+                        "filter",
+                        "progPI",
+                        "priority",
+                        "obsHistID",
+                        "targName",
+                        "observed",
+                        "origin_filename",
                     ]
+                ]
+                self.log(
+                    f"after making cuts on start/stop times and observed status: df = \n{select_cols}"
+                )
+
+                if len(df) == 0:
                     self.log(
-                        f"after making cuts on start/stop times and observed status: df = \n{select_cols}"
+                        f"{too_file}: no valid entries after start/stop/observed cuts"
                     )
+                    continue
+                else:
+                    pass
+                # if the maxAirmass is not specified, add it in
+                if "maxAirmass" not in df:
+                    default_max_airmass = 1.0 / np.cos(
+                        (90 - self.config["telescope"]["min_alt"]) * np.pi / 180.0
+                    )
+                    df["maxAirmass"] = default_max_airmass
 
-                    if len(df) == 0:
-                        self.log(
-                            f"{too_file}: no valid entries after start/stop/observed cuts"
-                        )
-                        continue
-                    else:
-                        pass
-                    # if the maxAirmass is not specified, add it in
-                    if "maxAirmass" not in df:
-                        default_max_airmass = 1.0 / np.cos(
-                            (90 - self.config["telescope"]["min_alt"]) * np.pi / 180.0
-                        )
-                        df["maxAirmass"] = default_max_airmass
+                # calculate the current airmass of all targets
 
-                    # calculate the current airmass of all targets
+                obstime_astropy = astropy.time.Time(obstime_mjd, format="mjd")
 
-                    obstime_astropy = astropy.time.Time(obstime_mjd, format="mjd")
+                frame = astropy.coordinates.AltAz(
+                    obstime=obstime_astropy, location=self.ephem.site
+                )
+                self.log("made the frame ?")
+                self.log(f"df['raDeg'] = {df['raDeg']}")
+                self.log(f"df['decDeg'] = {df['decDeg']}")
+
+                # make a list of the j2000 coords
+                j2000_coords = astropy.coordinates.SkyCoord(
+                    ra=df["raDeg"].values * u.deg,
+                    dec=df["decDeg"].values * u.deg,
+                    frame="icrs",
+                )
+                self.log(f"made the j2000 coords: {j2000_coords}")
 
-                    frame = astropy.coordinates.AltAz(
-                        obstime=obstime_astropy, location=self.ephem.site
-                    )
-                    self.log("made the frame ?")
-                    self.log(f"df['raDeg'] = {df['raDeg']}")
-                    self.log(f"df['decDeg'] = {df['decDeg']}")
-
-                    # make a list of the j2000 coords
-                    j2000_coords = astropy.coordinates.SkyCoord(
-                        ra=df["raDeg"].values * u.deg,
-                        dec=df["decDeg"].values * u.deg,
-                        frame="icrs",
-                    )
-                    self.log(f"made the j2000 coords: {j2000_coords}")
-
-                    local_coords = j2000_coords.transform_to(frame)
-                    local_alt_deg = local_coords.alt.deg
-                    local_az_deg = local_coords.az.deg
-                    airmass = 1 / np.cos((90 - local_alt_deg) * np.pi / 180.0)
-                    df["currentAirmass"] = airmass
-                    df["currentAltDeg"] = local_alt_deg
-                    df["currentAzDeg"] = local_az_deg
-
-                    # make a cut based on airmass
-                    df = df.loc[
-                        (df["currentAirmass"] < df["maxAirmass"])
-                        & (df["currentAirmass"] > 0)
-                    ]
-                    select_cols = df[
-                        [
-                            "raDeg",
-                            "decDeg",
-                            "filter",
-                            "progPI",
-                            "priority",
-                            "obsHistID",
-                            "targName",
-                            "origin_filename",
-                        ]
+                local_coords = j2000_coords.transform_to(frame)
+                local_alt_deg = local_coords.alt.deg
+                local_az_deg = local_coords.az.deg
+                airmass = 1 / np.cos((90 - local_alt_deg) * np.pi / 180.0)
+                df["currentAirmass"] = airmass
+                df["currentAltDeg"] = local_alt_deg
+                df["currentAzDeg"] = local_az_deg
+
+                # make a cut based on airmass
+                df = df.loc[
+                    (df["currentAirmass"] < df["maxAirmass"])
+                    & (df["currentAirmass"] > 0)
+                ]
+                select_cols = df[
+                    [
+                        "raDeg",
+                        "decDeg",
+                        "filter",
+                        "progPI",
+                        "priority",
+                        "obsHistID",
+                        "targName",
+                        "origin_filename",
                     ]
-                    self.log(f"after airmass cuts: df = \n{select_cols}")
+                ]
+                self.log(f"after airmass cuts: df = \n{select_cols}")
 
-                    # do a cut on max altitude also to make sure we don't point too high
-                    df = df.loc[
-                        (df["currentAltDeg"] <= self.config["telescope"]["max_alt"])
-                        & (df["currentAltDeg"] >= self.config["telescope"]["min_alt"])
-                    ]
+                # do a cut on max altitude also to make sure we don't point too high
+                df = df.loc[
+                    (df["currentAltDeg"] <= self.config["telescope"]["max_alt"])
+                    & (df["currentAltDeg"] >= self.config["telescope"]["min_alt"])
+                ]
 
-                    select_cols = df[
-                        [
-                            "raDeg",
-                            "decDeg",
-                            "filter",
-                            "progPI",
-                            "priority",
-                            "obsHistID",
-                            "targName",
-                            "origin_filename",
-                        ]
+                select_cols = df[
+                    [
+                        "raDeg",
+                        "decDeg",
+                        "filter",
+                        "progPI",
+                        "priority",
+                        "obsHistID",
+                        "targName",
+                        "origin_filename",
                     ]
-                    self.log(f"after elevation cuts: df = \n{select_cols}")
+                ]
+                self.log(f"after elevation cuts: df = \n{select_cols}")
 
-                    if len(df) == 0:
-                        self.log(
-                            f"{too_file}: no valid entries after elevation & airmass cuts"
-                        )
-                        continue
-                    else:
-                        pass
+                if len(df) == 0:
+                    self.log(
+                        f"{too_file}: no valid entries after elevation & airmass cuts"
+                    )
+                    continue
+                else:
+                    pass
 
-                    # calculate whether each target will be too close to ephemeris at the current obstime
-                    bodies_inview = np.array([])
-                    bodies = list(self.config["ephem"]["min_target_separation"].keys())
-                    for i in range(len(bodies)):
+                # calculate whether each target will be too close to ephemeris at the current obstime
+                bodies_inview = np.array([])
+                bodies = list(self.config["ephem"]["min_target_separation"].keys())
+                for i in range(len(bodies)):
 
-                        body = bodies[i]
-                        mindist = self.config["ephem"]["min_target_separation"][body]
+                    body = bodies[i]
+                    mindist = self.config["ephem"]["min_target_separation"][body]
 
-                        body_loc = astropy.coordinates.get_body(
-                            body,
-                            time=obstime_astropy,
-                            location=self.ephem.site,
-                        )
-                        body_coords = body_loc.transform_to(frame)
-                        body_alt = body_coords.alt
-                        body_az = body_coords.az
-
-                        dist = np.array(
-                            (
-                                (df["currentAzDeg"] - body_az.deg) ** 2
-                                + (df["currentAltDeg"] - body_alt.deg) ** 2
-                            )
-                            ** 0.5
+                    body_loc = astropy.coordinates.get_body(
+                        body,
+                        time=obstime_astropy,
+                        location=self.ephem.site,
+                    )
+                    body_coords = body_loc.transform_to(frame)
+                    body_alt = body_coords.alt
+                    body_az = body_coords.az
+
+                    dist = np.array(
+                        (
+                            (df["currentAzDeg"] - body_az.deg) ** 2
+                            + (df["currentAltDeg"] - body_alt.deg) ** 2
                         )
+                        ** 0.5
+                    )
 
-                        # make a list of whether the body is in view for each target
-                        body_inview = dist < mindist
+                    # make a list of whether the body is in view for each target
+                    body_inview = dist < mindist
 
-                        # now make a big array of all bodies and all targets
-                        if i == 0:
-                            bodies_inview = body_inview
-                        else:
-                            bodies_inview = np.vstack((bodies_inview, body_inview))
+                    # now make a big array of all bodies and all targets
+                    if i == 0:
+                        bodies_inview = body_inview
+                    else:
+                        bodies_inview = np.vstack((bodies_inview, body_inview))
 
-                        # now collapse the array of bodies and targests so it's just a list of targets and w
-                        # wheather there are ANY bodies in view
-                        ephem_inview = np.any(bodies_inview, axis=0)
+                    # now collapse the array of bodies and targests so it's just a list of targets and w
+                    # wheather there are ANY bodies in view
+                    ephem_inview = np.any(bodies_inview, axis=0)
 
-                    # add the ephem in view to the dataframe
-                    df["ephem_inview"] = ephem_inview
+                # add the ephem in view to the dataframe
+                df["ephem_inview"] = ephem_inview
 
-                    self.log(f'df["ephem_inview"]: \n{df["ephem_inview"]}')
+                self.log(f'df["ephem_inview"]: \n{df["ephem_inview"]}')
 
-                    # make a cut on only targets without ephemeris in the way
-                    df = df.loc[df["ephem_inview"] == False]
+                # make a cut on only targets without ephemeris in the way
+                df = df.loc[df["ephem_inview"] == False]
 
-                    if len(df) == 0:
-                        self.log(
-                            f"{too_file}: no valid entries after making cuts on nearby ephemeris"
-                        )
-                        continue
-                    else:
-                        pass
+                if len(df) == 0:
+                    self.log(
+                        f"{too_file}: no valid entries after making cuts on nearby ephemeris"
+                    )
+                    continue
+                else:
+                    pass
 
-                    # if we got here then the list isn't empty
+                # if we got here then the list isn't empty
 
-                    # now add the schedule to the master TOO list
-                    full_df = pd.concat([full_df, df])
+                # now add the schedule to the master TOO list
+                full_df = pd.concat([full_df, df])
 
-                except wintertoo_validate.RequestValidationError as e:
-                    too_filename = os.path.basename(os.path.normpath(too_file))
-                    # self.log(f'skipping TOO schedule {too_filename}, schema not valid: {e}')
-                    self.log(traceback.format_exc())
-                except Exception as e:
-                    self.log(f"error running load_best_observing_target: {e}")
-                    self.log(traceback.format_exc())
+            except wintertoo_validate.RequestValidationError as e:
+                too_filename = os.path.basename(os.path.normpath(too_file))
+                # self.log(f'skipping TOO schedule {too_filename}, schema not valid: {e}')
+                self.log(traceback.format_exc())
+            except Exception as e:
+                self.log(f"error running load_best_observing_target: {e}")
+                self.log(traceback.format_exc())
+
+        if len(full_df) > 0:
+            # now sort by priority (highest to lowest), then by validStop (earliest to latest)
+            # THIS HAS TO BE IN ONE LINE OTHERWISE IT WILL RE-SORT NOT SORT WITHIN VALS!
+            full_df = full_df.sort_values(
+                by=["priority", "validStop"], ascending=[False, True]
+            )
 
-            if len(full_df) == 0:
-                # there are no valid schedule files. break out to the handling at the bottom
-                pass
+        return full_df
 
+    def get_lookahead_schedule_files(self):
+        """
+        the schedule files the next target is picked from: the ones in the TOO
+        folder and the survey schedule, resolved the same way Schedule.loadSchedule does
+        """
+        files = self.get_ToO_schedule_files()
+        survey_file = self.survey_schedulefile_name
+        if survey_file is not None:
+            if survey_file.lower() == "nightly":
+                try:
+                    survey_file = os.readlink(
+                        os.path.join(
+                            os.getenv("HOME"),
+                            self.config["scheduleFile_nightly_link_directory"],
+                            self.config["scheduleFile_nightly_link_name"],
+                        )
+                    )
+                except OSError:
+                    survey_file = None
             else:
+                if ".db" not in survey_file:
+                    survey_file = survey_file + ".db"
+                survey_file = os.path.join(
+                    self.lookahead_schedule.scheduleFile_directory, survey_file
+                )
+        if survey_file is not None:
+            files.append(survey_file)
+        return sorted(set(files))
 
-                # now do the sorting
+    def get_lookahead_fingerprint(self, current):
+        """
+        everything other than the time that the choice of target depends on: the
+        entries not yet observed in each schedule file (a new, edited or observed
+        entry changes the ranking), and whether it is ok to observe.
+
+        current is the (schedule file, obsHistID) of the observation in progress. it is
+        left out, since it is logged as observed between the ranking and its use.
+        the contents are compared rather than the file mtimes because logging an
+        observation rewrites the file
+        """
+        contents = dict()
+        for file in self.get_lookahead_schedule_files():
+            try:
+                conn = sqlite3.connect(f"file:{file}?mode=ro", uri=True)
+                try:
+                    cursor = conn.execute(
+                        "SELECT * FROM summary WHERE observed = 0 ORDER BY obsHistID"
+                    )
+                    columns = [description[0] for description in cursor.description]
+                    rows = cursor.fetchall()
+                finally:
+                    conn.close()
+            except Exception:
+                contents[file] = None
+                continue
+
+            i_obsHistID = columns.index("obsHistID")
+            digest = hashlib.sha1()
+            for row in rows:
+                if (file, row[i_obsHistID]) == current:
+                    continue
+                digest.update(repr(row).encode("utf-8"))
+            contents[file] = digest.hexdigest()
 
-                # now sort by priority (highest to lowest)
-                # full_df = full_df.sort_values(['priority'],ascending=False)
+        return (self.survey_schedulefile_name, contents, self.ok_to_observe)
 
-                # now sort by validStop (earliest to latest)
-                # full_df = full_df.sort_values(['validStop'],ascending=True)
+    def start_target_lookahead(self, seconds_until_done):
+        """
+        rank the targets to observe after the current observation in a worker thread,
+        so that it happens while the last exposure integrates instead of after it is
+        read out. the result is picked up by commit_lookahead_target
+        """
+        lookahead_config = self.config.get("target_lookahead", dict())
+        if not lookahead_config.get("enabled", False):
+            return
 
-                # THIS HAS TO BE IN ONE LINE OTHERWISE IT WILL RE-SORT NOT SORT WITHIN VALS!
-                full_df = full_df.sort_values(
-                    by=["priority", "validStop"], ascending=[False, True]
-                )
+        if (self.lookahead_thread is not None) and self.lookahead_thread.is_alive():
+            self.log("target lookahead: last lookahead is still running, skipping")
+            return
 
-                # save the dataframe to csv for realtime reference
-                rankedSummary = full_df[
-                    ["obsHistID", "priority", "validStop", "origin_filename"]
-                ]
-                rankedSummary.to_csv(
-                    os.path.join(
-                        os.getenv("HOME"),
-                        "data",
-                        "Valid_ToO_Observations_Ranked.csv",
-                    )
-                )
+        # the targets are ranked for when the next one will be picked
+        seconds_until_done += lookahead_config.get("overhead_s", 0.0)
+        obstime_mjd = self.ephem.state.get("mjd", 0) + seconds_until_done / 86400.0
 
-                # the best target is the first one in this sorted pandas dataframe
-                currentObs = dict(full_df.iloc[0])
-                scheduleFile = currentObs["origin_filepath"]
-                scheduleFile_without_path = scheduleFile.split("/")[-1]
-                self.announce(
-                    f'we should be observing from {scheduleFile_without_path}, obsHistID = {currentObs["obsHistID"]}'
+        current = None
+        if (self.schedule.currentObs is not None) and (
+            self.schedule.currentObs.get("obsHistID") is not None
+        ):
+            current = (
+                self.schedule.currentObs.get("origin_filepath"),
+                int(self.schedule.currentObs.get("obsHistID")),
+            )
+
+        self.lookahead = {
+            "obstime_mjd": obstime_mjd,
+            "current": current,
+            "fingerprint": None,
+            "candidates": None,
+        }
+        self.log(
+            f"target lookahead: ranking targets for {seconds_until_done:0.1f} s from now"
+        )
+        self.lookahead_thread = threading.Thread(
+            target=self.rank_lookahead_targets,
+            args=(self.lookahead, current, lookahead_config.get("n_candidates", 2)),
+            daemon=True,
+        )
+        self.lookahead_thread.start()
+
+    @trace.traced("robo.lookahead")
+    def rank_lookahead_targets(self, lookahead, current, n_candidates):
+        """
+        runs in the lookahead thread: the same ranking as load_best_observing_target
+        (ToOs first, then the survey), but only keeping the best n_candidates as
+        (scheduleFile, obs) pairs, and without touching self.schedule
+        """
+        obstime_mjd = lookahead["obstime_mjd"]
+        candidates = []
+        try:
+            # what the ranking is made from, to check that it's the same when it's used
+            lookahead["fingerprint"] = self.get_lookahead_fingerprint(current)
+
+            ToOscheduleFiles = self.get_ToO_schedule_files()
+            if len(ToOscheduleFiles) > 0:
+                full_df = self.rank_ToO_targets(obstime_mjd, ToOscheduleFiles)
+                for i in range(len(full_df)):
+                    obs = dict(full_df.iloc[i])
+                    candidates.append((obs["origin_filepath"], obs))
+
+            # the survey targets are the fallbacks if the ToOs aren't valid any more
+            if (len(candidates) < n_candidates) and (
+                self.survey_schedulefile_name is not None
+            ):
+                self.lookahead_schedule.loadSchedule(self.survey_schedulefile_name)
+                ranked = self.lookahead_schedule.getRankedObs(
+                    obstime_mjd, printList=False
                 )
-                # point self.schedule to the TOO
-                self.schedule.loadSchedule(scheduleFile)
-                self.schedule.updateCurrentObs(currentObs, obstime_mjd)
-                return
+                if ranked is not None:
+                    for obs in ranked:
+                        candidates.append((self.survey_schedulefile_name, obs))
+
+            # the current observation isn't a candidate for the next one
+            candidates = [
+                (scheduleFile, obs)
+                for (scheduleFile, obs) in candidates
+                if (obs.get("origin_filepath"), obs.get("obsHistID")) != current
+            ]
+            lookahead["candidates"] = candidates[:n_candidates]
 
-        # if we're here, there are no TOO valid observations
-        self.announce(f"there are no valid ToO observations, defaulting to survey")
+        except Exception as e:
+            self.log(f"target lookahead: could not rank targets: {e}")
+            self.log(traceback.format_exc())
 
-        scheduleFile = self.survey_schedulefile_name
-        # point self.schedule to the survey
-        self.announce(f"loading survey schedule: {scheduleFile}")
+    def commit_lookahead_target(self, obstime_mjd):
+        """
+        if targets were ranked during the last observation and nothing the ranking
+        depends on has changed since, load the best of them that is still in its
+        valid window as the current observation. returns False if there is no
+        usable lookahead, in which case the targets have to be ranked from scratch
+        """
+        lookahead = self.lookahead
+        self.lookahead = None
+        if lookahead is None:
+            return False
+
+        if self.lookahead_thread.is_alive():
+            self.log("target lookahead: ranking not finished, discarding it")
+            return False
+
+        if lookahead["candidates"] is None:
+            return False
+
+        max_time_error_s = self.config.get("target_lookahead", dict()).get(
+            "max_time_error_s", 60.0
+        )
+        time_error_s = abs(obstime_mjd - lookahead["obstime_mjd"]) * 86400.0
+        if time_error_s > max_time_error_s:
+            self.log(
+                f"target lookahead: ranked for {time_error_s:0.1f} s from now, discarding it"
+            )
+            return False
+
+        if (
+            self.get_lookahead_fingerprint(lookahead["current"])
+            != lookahead["fingerprint"]
+        ):
+            self.log(
+                "target lookahead: schedules or observing conditions changed, discarding it"
+            )
+            return False
+
+        for scheduleFile, currentObs in lookahead["candidates"]:
+            if currentObs["validStart"] <= obstime_mjd <= currentObs["validStop"]:
+                break
+        else:
+            self.log("target lookahead: no candidate is still valid, discarding it")
+            return False
+
+        scheduleFile_without_path = currentObs["origin_filepath"].split("/")[-1]
+        self.announce(
+            f'we should be observing from {scheduleFile_without_path}, obsHistID = {currentObs["obsHistID"]} (picked during the last exposure)'
+        )
         self.schedule.loadSchedule(scheduleFile)
-        currentObs = self.schedule.getTopRankedObs(obstime_mjd)
-        # self.announce(f'currentObs = {currentObs}')
         self.schedule.updateCurrentObs(currentObs, obstime_mjd)
-        return
+        return True
 
     def get_center_offset_coords(
         self,
@@ -3276,85 +3651,144 @@ class RoboOperator(QtCore.QObject):
         # get the filters to cycle through
         # for now just do WINTER
         camname = "winter"
-        filterIDs = self.config["cal_params"][camname]["flats"]["filterIDs"]
+        flat_config = self.config["cal_params"][camname]["flats"]
 
-        nflats = self.config["cal_params"][camname]["flats"]["n_imgs"]
+        # the exposure times come from the counts in the last flat, not a fixed model
+        flat_controller = flat_exposure.FlatExposureController(
+            flat_config, sun_rising=self.state["sun_rising"], logger=self.logger
+        )
+        filterIDs = flat_controller.order_filters(
+            flat_config["filterIDs"], self.state["sun_alt"]
+        )
+        self.log(f"taking flats in this order: {filterIDs}")
+
+        nflats = flat_config["n_imgs"]
+        adaptive_config = flat_config.get("adaptive", dict())
+        # how long to wait for the sky to come into range (s)
+        wait_s = adaptive_config.get("wait_s", 15.0)
+        # stop trying in a filter after this many frames, good or not
+        max_frames = adaptive_config.get("max_frames_per_filter", 3 * nflats)
+        # how long to keep trying to read the last flat, eg while it is being written (s)
+        image_read_timeout_s = adaptive_config.get("image_read_timeout_s", 10.0)
         ra_total_offset_arcmin = 0
         dec_total_offset_arcmin = 0
 
         self.log(f"sun alt: {self.state['sun_alt']}")
-        self.log(
-            f"min sun alt: {self.config['cal_params'][camname]['flats']['min_sunalt']}"
-        )
-        self.log(
-            f"max sun alt: {self.config['cal_params'][camname]['flats']['max_sunalt']}"
-        )
-        self.log(
-            f"sun alt > min alt: {(self.state['sun_alt'] > self.config['cal_params'][camname]['flats']['min_sunalt'])}"
-        )
-        self.log(
-            f"sun alt < max alt: {(self.state['sun_alt'] < self.config['cal_params'][camname]['flats']['max_sunalt'])}"
-        )
+        self.log(f"min sun alt: {flat_config['min_sunalt']}")
+        self.log(f"max sun alt: {flat_config['max_sunalt']}")
 
-        # start a loop to take flats as long as we're within the allowed limits
-        # while ((self.state['sun_alt'] > self.config['cal_params'][camname]['flats']['min_sunalt']) &
-        # (self.state['sun_alt'] < self.config['cal_params'][camname]['flats']['max_sunalt'])):
-        while True:
+        # step through each filter
+        sun_in_range = True
+        for filterID in filterIDs:
 
-            self.log(f"taking {nflats} flats in each filter:")
-            self.log(f"sun alt: {self.state['sun_alt']}")
-            self.log(
-                f"min sun alt: {self.config['cal_params'][camname]['flats']['min_sunalt']}"
-            )
-            self.log(
-                f"max sun alt: {self.config['cal_params'][camname]['flats']['max_sunalt']}"
-            )
-            below_max = (
-                self.state["sun_alt"]
-                < self.config["cal_params"][camname]["flats"]["max_sunalt"]
-            )
-            above_min = (
-                self.state["sun_alt"]
-                > self.config["cal_params"][camname]["flats"]["min_sunalt"]
-            )
-            sun_in_range = below_max & above_min
-            self.log(f"sun alt > min alt: {above_min}")
-            self.log(f"sun alt < max alt: {below_max}")
-            self.log(f"sun in range: {sun_in_range}")
+            if not sun_in_range:
+                break
 
-            if sun_in_range:
-                pass
-            else:
-                self.log(f"sun not in range! exiting autocal routine")
+            self.log(f"setting up flat for filterID: {filterID}")
+            # go to the specified filter
+            system = "filter wheel"
+            try:
+                # get filter number
+                for position in self.config["filter_wheels"][camname]["positions"]:
+                    if (
+                        self.config["filter_wheels"][camname]["positions"][
+                            position
+                        ].lower()
+                        == filterID.lower()
+                    ):
+                        filter_num = position
+                    else:
+                        pass
+                if filter_num == self.fw.state["filter_pos"]:
+                    self.log(
+                        "requested filter matches current, no further action taken"
+                    )
+                else:
+                    self.log(
+                        f'current filter = {self.fw.state["filter_pos"]}, changing to {filter_num}'
+                    )
+                    # self.do(f'fw_goto {filter_num} --{self.camname}')
+                    self.do(f"fw_goto {filter_num} --{camname}")
+            except Exception as e:
+                msg = f"roboOperator: could not run flat loop instance due to error with {system}: due to {e.__class__.__name__}, {e}"
+                self.log(msg)
+                self.alertHandler.slack_log(f"*ERROR:* {msg}", group=None)
+                err = roboError(context, self.lastcmd, system, msg)
+                self.hardware_error.emit(err)
+                return
 
-            # step through each filter
-            for filterID in filterIDs:
+            # take images until there are enough good ones
+            i = 0
+            while not flat_controller.done(filterID):
 
-                self.log(f"setting up flat for filterID: {filterID}")
-                # go to the specified filter
-                system = "filter wheel"
-                try:
-                    # get filter number
-                    for position in self.config["filter_wheels"][camname]["positions"]:
-                        if (
-                            self.config["filter_wheels"][camname]["positions"][
-                                position
-                            ].lower()
-                            == filterID.lower()
-                        ):
-                            filter_num = position
-                        else:
-                            pass
-                    if filter_num == self.fw.state["filter_pos"]:
-                        self.log(
-                            "requested filter matches current, no further action taken"
-                        )
+                # check if we're still running
+                if not self.running:
+                    # we're not running! return now.
+                    self.log(
+                        "in do_flats method and self.running is False, likely a lockout? Returning."
+                    )
+                    return
+
+                # check for events. do we need this? unclear
+                QtCore.QCoreApplication.processEvents()
+
+                # check if it is ok to observe
+                self.check_ok_to_observe()
+                if self.ok_to_observe:
+                    pass
+                else:
+                    self.log("in do_flats but self.ok_to_observe is False. Returning.")
+                    return
+
+                if i >= max_frames:
+                    self.log(
+                        f"took {i} flats in {filterID} without getting {nflats} good ones, moving on"
+                    )
+                    break
+
+                # check if the sun is in range
+                sun_alt = self.state["sun_alt"]
+                below_max = sun_alt < flat_config["max_sunalt"]
+                above_min = sun_alt > flat_config["min_sunalt"]
+                self.log(
+                    f"sun alt: {sun_alt}, sun alt > min alt: {above_min}, sun alt < max alt: {below_max}"
+                )
+                if not (below_max & above_min):
+                    if self.state["sun_rising"]:
+                        not_there_yet = not above_min
                     else:
-                        self.log(
-                            f'current filter = {self.fw.state["filter_pos"]}, changing to {filter_num}'
-                        )
-                        # self.do(f'fw_goto {filter_num} --{self.camname}')
-                        self.do(f"fw_goto {filter_num} --{camname}")
+                        not_there_yet = not below_max
+                    if not_there_yet:
+                        # the sun is still moving into the flat window
+                        self.log(f"sun not in range yet, waiting {wait_s} s")
+                        self.wait_for_flats(wait_s)
+                        continue
+                    else:
+                        self.log(f"sun not in range! exiting autocal routine")
+                        sun_in_range = False
+                        break
+
+                # get the exposure time
+                action, flat_exptime = flat_controller.plan(
+                    filterID, sun_alt, time.time()
+                )
+                if action == "skip":
+                    self.log(
+                        f"{filterID} would need a {flat_exptime:0.1f} s flat, outside the allowed range, and the sky is moving away from it. moving on"
+                    )
+                    break
+                elif action == "wait":
+                    self.log(
+                        f"{filterID} would need a {flat_exptime:0.1f} s flat, outside the allowed range. waiting {wait_s} s"
+                    )
+                    self.wait_for_flats(wait_s)
+                    continue
+
+                try:
+                    # set the exposure time
+                    self.log(f"setting exptime to {flat_exptime:0.3f} s")
+                    system = "camera"
+                    self.do(f"setExposure {flat_exptime:0.3f} --{self.camname}")
                 except Exception as e:
                     msg = f"roboOperator: could not run flat loop instance due to error with {system}: due to {e.__class__.__name__}, {e}"
                     self.log(msg)
@@ -3362,195 +3796,73 @@ class RoboOperator(QtCore.QObject):
                     err = roboError(context, self.lastcmd, system, msg)
                     self.hardware_error.emit(err)
                     return
-                # take the specified number of images
-                for i in range(nflats):
-
-                    # check if we're still running
-                    if self.running:
-
-                        # check for events. do we need this? unclear
-                        QtCore.QCoreApplication.processEvents()
-
-                        # check if it is ok to observe
-                        self.check_ok_to_observe()
-                        if self.ok_to_observe:
-                            pass
-                        else:
-                            self.log(
-                                "in do_flats but self.ok_to_observe is False. Returning."
-                            )
-                            return
 
-                        # check if the sun is in range
-                        below_max = (
-                            self.state["sun_alt"]
-                            < self.config["cal_params"][camname]["flats"]["max_sunalt"]
-                        )
-                        above_min = (
-                            self.state["sun_alt"]
-                            > self.config["cal_params"][camname]["flats"]["min_sunalt"]
-                        )
-                        sun_in_range = below_max & above_min
-                        self.log(f"taking {nflats} flats in each filter:")
-                        self.log(f"sun alt: {self.state['sun_alt']}")
-                        self.log(
-                            f"min sun alt: {self.config['cal_params'][camname]['flats']['min_sunalt']}"
-                        )
-                        self.log(
-                            f"max sun alt: {self.config['cal_params'][camname]['flats']['max_sunalt']}"
+                # do the exposure!
+                try:
+                    comment = f"Auto Flats {i+1} Alt/Az = ({flat_alt}, {flat_az}), RA +{ra_total_offset_arcmin} am, DEC +{dec_total_offset_arcmin} am"
+                    # now trigger the actual observation. this also starts the mount tracking
+                    self.announce(
+                        f'Executing {filterID}: {comment}, sun alt = {self.state["sun_alt"]:.1f} deg, exptime = {flat_exptime:.1f} s'
+                    )
+                    if i == 0:
+                        self.log("handling the i=0 case")
+                        system = "robo routine"
+                        self.do(
+                            f"robo_observe altaz {flat_alt} {flat_az} -f --calibration"
                         )
-                        self.log(f"sun alt > min alt: {above_min}")
-                        self.log(f"sun alt < max alt: {below_max}")
-                        self.log(f"sun in range: {sun_in_range}")
-
-                        if sun_in_range:
-                            pass
-                        else:
-                            self.log(f"sun not in range! exiting autocal routine")
-
-                        # get the exposure time
-                        if (
-                            self.config["cal_params"][camname]["flats"]["exptime"][
-                                filterID
-                            ]
-                            == "model"
-                        ):
+                    else:
+                        system = "camera"
+                        self.do("robo_do_exposure -f")
+                    # the sun alt at the middle of the exposure
+                    sun_alt_mid = (sun_alt + self.state["sun_alt"]) / 2.0
+                    i += 1
+
+                    # now dither. if i is odd do ra, otherwise dec
+                    dither_arcmin = 5
+                    if i % 2:
+                        axis = "ra"
+                        ra_total_offset_arcmin += dither_arcmin
+                    else:
+                        axis = "dec"
+                        dec_total_offset_arcmin += dither_arcmin
 
-                            try:
-                                a = self.config["cal_params"][camname]["flats"][
-                                    "model"
-                                ][filterID]["a"]
-                                n = self.config["cal_params"][camname]["flats"][
-                                    "model"
-                                ][filterID]["n"]
-                                scale = self.config["cal_params"][camname]["flats"][
-                                    "model"
-                                ][filterID]["scale"]
-                                goal_counts = self.config["cal_params"][camname][
-                                    "flats"
-                                ]["model"]["goal_counts"]
-                                sky_rate = np.exp(a * (-1 * self.state["sun_alt"]) ** n)
-                                dark_rate = self.config["cal_params"][camname]["flats"][
-                                    "model"
-                                ]["dark_rate"]
-                                flat_exptime_requested = scale * (
-                                    goal_counts / (sky_rate + dark_rate)
-                                )
-                                # flat_exptime = scale*(goal_counts/(np.exp(a*(-1*self.state["sun_alt"])**n)))
+                    self.do(f"mount_dither {axis} {dither_arcmin}")
 
-                            except Exception as e:
-                                flat_exptime_requested = 10.0
-                                self.log(
-                                    f"could not set up model flat exposure time for filter {camname}: {filterID} due to: {e}, setting to default {flat_exptime_requested} s"
-                                )
+                except Exception as e:
+                    msg = f"roboOperator: could not run flat loop instance due to error with {system}: due to {e.__class__.__name__}, {e}"
+                    self.log(msg)
+                    self.alertHandler.slack_log(f"*ERROR:* {msg}", group=None)
+                    err = roboError(context, self.lastcmd, system, msg)
+                    self.hardware_error.emit(err)
+                    i += 1
+                    continue
 
+                # measure the flat to set up the next one. the image may not
+                # be written yet, so keep trying for a bit
+                t_start = time.monotonic()
+                while True:
+                    try:
+                        image_directory, image_filename = self.camera.getLastImagePath()
+                        image_filepath = os.path.join(image_directory, image_filename)
+                        if camname == "winter":
+                            image_filepath = image_filepath + "_mef.fits"
                         else:
-                            try:
-                                flat_exptime_requested = self.config["cal_params"][
-                                    camname
-                                ]["flats"]["exptime"][filterID]
-                            except Exception as e:
-                                flat_exptime_requested = 10.0
-                                self.log(
-                                    f"could get exposure time for filter {camname}: {filterID} due to: {e}, setting to default {flat_exptime_requested} s"
-                                )
-
-                        try:
-
-                            # set the exposure time
-                            self.log(
-                                f"requested flat exposure time: {flat_exptime_requested}"
-                            )
-                            allowed_exptimes = np.array(
-                                self.config["cal_params"][camname]["dark"]["exptimes"]
-                            )
-                            self.log(f"allowed exposure times: {allowed_exptimes}")
-                            if type(flat_exptime_requested) is complex:
-                                self.log(
-                                    f"calculation gave complex value of exptime ({flat_exptime_requested}), setting to {min(allowed_exptimes)}s"
-                                )
-                                flat_exptime = min(allowed_exptimes)
-
-                            else:
-                                # get the index of the closest allowed exposure time
-                                index_of_nearest = np.abs(
-                                    allowed_exptimes - flat_exptime_requested
-                                ).argmin()
-                                flat_exptime = allowed_exptimes[index_of_nearest]
-                                self.log(f"setting exptime to {flat_exptime} s")
-                            """
-                            # set the exposure time
-                            minexptime = self.config['cal_params'][camname]['flats']['exptime']['min']
-                            maxexptime = self.config['cal_params'][camname]['flats']['exptime']['max']
-                            
-                            self.log(f'exptime = {flat_exptime} ({type(flat_exptime)})')
-                            self.log(f'min exptime = {minexptime} ({type(minexptime)})')
-                            self.log(f'max exptime = {maxexptime} ({type(maxexptime)})')
-                            
-                            if type(flat_exptime) is complex:
-                                self.log(f'calculation gave complex value of exptime ({flat_exptime}), setting to {minexptime}s')
-                                flat_exptime = minexptime
-                                
-                            elif (flat_exptime < minexptime):
-                                self.log(f'calculated exptime too short ({flat_exptime} < {minexptime}), setting to {minexptime} s')
-                                flat_exptime = minexptime
-                            elif (flat_exptime > maxexptime):
-                                self.log(f'calculated exptime too long ({flat_exptime} > {maxexptime}), setting to {maxexptime} s')
-                                flat_exptime = maxexptime
-                            else:
-                                self.log(f'setting exptime to {flat_exptime} s')
-                            """
-                            system = "camera"
-                            self.do(f"setExposure {flat_exptime:0.3f} --{self.camname}")
-                        except Exception as e:
-                            msg = f"roboOperator: could not run flat loop instance due to error with {system}: due to {e.__class__.__name__}, {e}"
-                            self.log(msg)
-                            self.alertHandler.slack_log(f"*ERROR:* {msg}", group=None)
-                            err = roboError(context, self.lastcmd, system, msg)
-                            self.hardware_error.emit(err)
-                            return
-
-                        # do the exposure!
-                        try:
-                            comment = f"Auto Flats {i+1}/{nflats} Alt/Az = ({flat_alt}, {flat_az}), RA +{ra_total_offset_arcmin} am, DEC +{dec_total_offset_arcmin} am"
-                            # now trigger the actual observation. this also starts the mount tracking
-                            self.announce(
-                                f'Executing {filterID}: {comment}, sun alt = {self.state["sun_alt"]:.1f} deg, exptime = {flat_exptime:.1f} s'
-                            )
-                            if i == 0:
-                                self.log("handling the i=0 case")
-                                system = "robo routine"
-                                self.do(
-                                    f"robo_observe altaz {flat_alt} {flat_az} -f --calibration"
-                                )
-                            else:
-                                system = "camera"
-                                self.do("robo_do_exposure -f")
-
-                            # now dither. if i is odd do ra, otherwise dec
-                            dither_arcmin = 5
-                            if i % 2:
-                                axis = "ra"
-                                ra_total_offset_arcmin += dither_arcmin
-                            else:
-                                axis = "dec"
-                                dec_total_offset_arcmin += dither_arcmin
-
-                            self.do(f"mount_dither {axis} {dither_arcmin}")
-
-                        except Exception as e:
-                            msg = f"roboOperator: could not run flat loop instance due to error with {system}: due to {e.__class__.__name__}, {e}"
-                            self.log(msg)
-                            self.alertHandler.slack_log(f"*ERROR:* {msg}", group=None)
-                            err = roboError(context, self.lastcmd, system, msg)
-                            self.hardware_error.emit(err)
-
-                    else:
-                        # we're not running! return now.
+                            image_filepath = image_filepath + ".fits"
+                        median_counts = flat_exposure.measure_median_counts(image_filepath)
+                        break
+                    except Exception as e:
+                        if (time.monotonic() - t_start) < image_read_timeout_s:
+                            self.wait_for_flats(1.0)
+                            continue
+                        median_counts = None
                         self.log(
-                            "in do_flats method and self.running is False, likely a lockout? Returning."
+                            f"could not measure the counts in the last flat after {image_read_timeout_s} s due to {e.__class__.__name__}, {e}. not counting it"
                         )
-                        return
+                        break
+                if median_counts is not None:
+                    flat_controller.record(
+                        filterID, flat_exptime, median_counts, sun_alt_mid
+                    )
 
         # if we get here, we're done with the light exposure, so turn off dome and mount tracking
         # so that the telescope doesn't drift
@@ -3569,6 +3881,16 @@ class RoboOperator(QtCore.QObject):
             self.hardware_error.emit(err)
             # return
 
+    def wait_for_flats(self, seconds):
+        """
+        wait while the twilight sky comes into range for flats, keeping the
+        event loop running
+        """
+        t_start = time.monotonic()
+        while (time.monotonic() - t_start) < seconds:
+            QtCore.QCoreApplication.processEvents()
+            time.sleep(self.config["cmd_status_dt"])
+
     def do_domeflats(self):
         self.log(f"running dome flat sequence")
         """
@@ -4966,6 +5288,7 @@ class RoboOperator(QtCore.QObject):
         assigned to later images
         """
         self.obsHistID = -1
+        trace.set_obs(None)
         self.ra_deg_scheduled = -1
         self.dec_deg_scheduled = -1
         self.filter_scheduled = ""
@@ -5056,6 +5379,7 @@ class RoboOperator(QtCore.QObject):
         if cam_to_use not in self.camera_manager.get_active_cameras():
             cam_to_use = "winter"
         self.obsHistID = int(currentObs["obsHistID"])
+        trace.set_obs(self.obsHistID)
         self.ra_deg_scheduled = float(currentObs["raDeg"])
         self.dec_deg_scheduled = float(currentObs["decDeg"])
         self.filter_scheduled = str(currentObs["filter"])
@@ -5330,7 +5654,11 @@ class RoboOperator(QtCore.QObject):
                                     f'current filter = {self.fw.state["filter_pos"]}, changing to {filter_num}'
                                 )
                                 # self.do(f'command_filter_wheel {filter_num}')
-                                self.do(f"fw_goto {filter_num} --{self.camname}")
+                                if dithnum_in_this_pointing == 1:
+                                    # the first dither slews, so change the filter during the slew
+                                    self.pending_filter_move = (self.camname, filter_num)
+                                else:
+                                    self.do(f"fw_goto {filter_num} --{self.camname}")
                         else:
                             # for spring fw is not yet implemented
                             self.log(
@@ -5354,6 +5682,17 @@ class RoboOperator(QtCore.QObject):
                         # set up a big descriptive message for slack:
                         msg = f'>> Executing Observation: Pointing Number [{pointing_num}/{num_pointings}]: (dRA, dDec) = ({pointing_offset["coords"]["dRA"]}, {pointing_offset["coords"]["dDec"]})'
 
+                        # rank the next targets while the last exposure of this observation integrates
+                        if (pointing_num == num_pointings) and (
+                            self.remaining_dithers_in_this_pointing == 0
+                        ):
+                            seconds_until_done = self.exptime
+                            if (dithnum_in_this_pointing == 1) and (
+                                self.acquisition_time is not None
+                            ):
+                                seconds_until_done += self.acquisition_time
+                            self.start_target_lookahead(seconds_until_done)
+
                         if dithnum_in_this_pointing == 1:
 
                             msg += f", Dither Number [{dithnum_in_this_pointing}/{self.num_dithers_per_pointing}], Dither (dRA, dDec) = (0, 0) as"
@@ -5505,7 +5844,8 @@ class RoboOperator(QtCore.QObject):
 
                 if logObservation:
                     self.announce("robo: logging observation")
-                    self.schedule.log_observation()
+                    with trace.span("robo.log_observation"):
+                        self.schedule.log_observation()
                     # self.logger.info('robo: logging observation')
 
             else:
@@ -5817,6 +6157,9 @@ class RoboOperator(QtCore.QObject):
         # the observation has not been completed
         self.observation_completed = False
 
+        # a filter change queued up to happen during the slew
+        filter_move, self.pending_filter_move = self.pending_filter_move, None
+
         # tag the context for any error messages
         context = "do_observation"
 
@@ -6272,86 +6615,43 @@ class RoboOperator(QtCore.QObject):
         # if we get here the target is okay
         self.target_ok = True
 
-        ### SLEW THE DOME ###
-        # start with the dome because it can take forever
-
-        system = "dome"
-        try:
-            # turn off dome tracking while slewing
-            self.do("dome_tracking_off")
-
-            self.do(f"dome_goto {self.target_az}")
-
-            # NPL 8-16-23 commented out this sleep! why is it here!!??
-            # time.sleep(5)
-
-            # turn tracking back on
-            # self.do('dome_tracking_on')
-
-        except Exception as e:
-            msg = f"roboOperator: could not set up {system} due to {e.__class__.__name__}, {e}"
-            self.log(msg)
-            err = roboError(context, self.lastcmd, system, msg)
-            self.hardware_error.emit(err)
-            self.target_ok = False
-            return
-
-        ### SLEW THE TELESCOPE ###
-        # start with the dome because it can take forever
+        ### SLEW THE DOME, TELESCOPE, ROTATOR AND FILTER WHEEL ###
+        # all the moves are started together, and we wait for the slowest
+        acquire_kwargs = dict(tracking=tracking)
+        if targtype in ["radec", "object"]:
+            acquire_kwargs.update(
+                ra_hours=self.target_ra_j2000_hours,
+                dec_deg=self.target_dec_j2000_deg,
+            )
+        if not self.mountsim:
+            acquire_kwargs.update(
+                field_angle=self.target_field_angle,
+                mech_angle=self.target_mech_angle,
+            )
+        if filter_move is not None:
+            fwname, filter_num = filter_move
+            acquire_kwargs.update(fwname=fwname, filter_pos=filter_num)
 
-        system = "telescope"
+        self.lastcmd = f"acquire target @ (Alt, Az) = {self.target_alt:0.2f}, {self.target_az:0.2f}"
         try:
-
-            if targtype == "altaz":
-                # slew to the requested alt/az
-                self.do(f"mount_goto_alt_az {self.target_alt} {self.target_az}")
-
-            elif targtype in ["radec", "object"]:
-                # slew to the requested ra/dec
-                self.logger.info(
-                    f"robo: mount_goto_ra_dec_j2000 running in thread {threading.get_ident()}"
-                )
-                self.do(
-                    f"mount_goto_ra_dec_j2000 {self.target_ra_j2000_hours} {self.target_dec_j2000_deg}"
+            self.logger.info(
+                f"robo: acquiring target in thread {threading.get_ident()}"
+            )
+            with trace.span("robo.acquire"):
+                self.acquisition_axis_times = self.motion.acquire(
+                    self.target_alt, self.target_az, **acquire_kwargs
                 )
-
-            # NPL 6-11-23 moved the tracking on call to after the rotator move
-
-            # slew the rotator
-            if not self.mountsim:
-                self.do(f"rotator_goto_field {self.target_field_angle}")
-
-                # TODO: remove when we know how to run the winter rotator
-                # NPL 6-11-23
-                # rotator_home_pos = self.config['telescope']['rotator'][self.camname]['rotator_home_degs']
-                # self.do(f'rotator_goto_mech {rotator_home_pos}')
-                # self.do(f'rotator_goto_mech {self.target_mech_angle}')
-
-                # TODO: NPL 5/23/23 wtf is this 3 second sleep doing here??
-                # time.sleep(3)
+            self.acquisition_time = self.motion.total_time
 
             self.current_mech_angle = self.target_mech_angle
 
-            # turn on tracking
-            if tracking:
-                self.do(f"mount_tracking_on")
-
-        except Exception as e:
-            msg = f"roboOperator: could not set up {system} due to {e.__class__.__name__}, {e}"
-            self.log(msg)
-            err = roboError(context, self.lastcmd, system, msg)
-            self.hardware_error.emit(err)
-            self.target_ok = False
-            return
-
-        ### TURN DOME TRACKING BACK ON ###
-
-        system = "dome"
-        try:
-            # turn tracking back on
-            self.do("dome_tracking_on")
-
         except Exception as e:
+            system = {
+                "dome_tracking_off": "dome",
+                "dome": "dome",
+                "dome_tracking_on": "dome",
+                "filter": "filter wheel",
+            }.get(self.motion.failed_axis, "telescope")
             msg = f"roboOperator: could not set up {system} due to {e.__class__.__name__}, {e}"
             self.log(msg)
             err = roboError(context, self.lastcmd, system, msg)
@@ -6789,3 +7089,8 @@ class RoboOperator(QtCore.QObject):
             self.hardware_error.emit(err)
             self.target_ok = False
             return False, []
+
+
+# publish the robostate fields through RobostateFields, which track changes
+for _field in RoboOperator.ROBOSTATE_FIELDS:
+    setattr(RoboOperator, _field, RobostateField(_field))
@@ -20,6 +20,7 @@ parts of the instrument including
 # system packages
 import os
 
+import Pyro5.core
 import yaml
 from PyQt5 import QtCore
 
@@ -42,6 +43,7 @@ from wsp.housekeeping import housekeeping, labjack_handler_local
 from wsp.power import powerManager
 from wsp.schedule import schedule
 from wsp.telescope import mirror_cover, telescope
+from wsp.utils import trace
 from wsp.utils.paths import WSP_PATH
 from wsp.watchdog import local_watchdog
 
@@ -75,6 +77,9 @@ class control(QtCore.QObject):
 
         print(f"\nsystemControl: running with opts = {opts}")
 
+        # write the wintercmd, robo and camera spans to tonight's trace file
+        trace.start("wsp", self.config, logger=self.logger)
+
         # init the alert handler
         auth_config = yaml.load(
             open(
@@ -143,6 +148,7 @@ class control(QtCore.QObject):
         self.sunsim = False
         self.dometest = False
         self.mountsim = False
+        self.fwsim = False
         self.nochiller = False
         self.interactive_mode = False
         self.disable_watchdog = False
@@ -173,6 +179,10 @@ class control(QtCore.QObject):
             if currentArgument in ["--mountsim"]:
                 self.mountsim = True
 
+            # option to run the winter filter wheel daemon against a simulated stepper
+            if currentArgument in ["--fwsim"]:
+                self.fwsim = True
+
             # option to use the simulated telescope mount
             if currentArgument in ["--nochiller"]:
                 self.nochiller = True
@@ -191,6 +201,7 @@ class control(QtCore.QObject):
         print(f"sysControl: domesim = {self.domesim}")
         print(f"sysControl: dometest = {self.dometest}")
         print(f"sysControl: mountsim = {self.mountsim}")
+        print(f"sysControl: fwsim = {self.fwsim}")
         print(f"sysControl: nochiller = {self.nochiller}")
         print(f"sysControl: disable_watchdog = {self.disable_watchdog}")
 
@@ -301,12 +312,18 @@ class control(QtCore.QObject):
                 self.daemonlist.add_daemon(self.domesimd)
 
             if self.sunsim:
-                # start up the fake sun_simulator
-                self.sunsimd = daemon_utils.PyDaemon(
-                    name="sun_simulator",
-                    filepath=f"{wsp_path}/ephem/sun_simulator_gui.py",
-                )
-                self.daemonlist.add_daemon(self.sunsimd)
+                # start up the fake sun_simulator, unless one is already
+                # running (eg started with its own speed and start time)
+                try:
+                    Pyro5.core.locate_ns(host=self.ns_host).lookup("sunsim")
+                    print("sysControl: using the sun simulator which is already running")
+                except Exception:
+                    self.sunsimd = daemon_utils.PyDaemon(
+                        name="sun_simulator",
+                        filepath=f"{wsp_path}/ephem/sun_simulator_gui.py",
+                        args=["-n", self.ns_host],
+                    )
+                    self.daemonlist.add_daemon(self.sunsimd)
 
             # ephemeris daemon
             # TODO: pass opts? ignore for now. don't need it running in verbose mode
@@ -320,6 +337,8 @@ class control(QtCore.QObject):
 
             # set up filter wheels
             winterfwargs = ["-n", self.ns_host]
+            if self.fwsim:
+                winterfwargs.append("--sim")
             self.winterfwd = daemon_utils.PyDaemon(
                 name="winterfw",
                 filepath=f"{wsp_path}/filterwheel/winterFilterd.py",
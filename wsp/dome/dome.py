@@ -165,6 +165,12 @@ class local_dome(QtCore.QObject):
         self.state.update(
             {"is_connected": bool(self.remote_state.get("is_connected", self.default))}
         )
+        self.state.update(
+            {"poll_latency_ms": self.remote_state.get("poll_latency_ms", self.default)}
+        )
+        self.state.update(
+            {"poll_bytes": self.remote_state.get("poll_bytes", self.default)}
+        )
 
         # timestamp of last reply
         utc = self.remote_state.get(
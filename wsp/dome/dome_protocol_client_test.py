@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+dome_protocol_client_test.py
+
+Runs the dome simulator's command server and checks that
+wsp/utils/protocol_client.py frames its replies correctly: status? replies
+(json) pipelined with line replies, json replies with and without a line
+ending after them, line endings arriving in a later read than the reply,
+unexpected bytes, and reconnecting after the connection is dropped.
+
+The simulator needs PyQt5. Run from anywhere:
+
+    python dome_protocol_client_test.py
+
+Exits with a nonzero status if any check fails.
+"""
+
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+
+import yaml
+from PyQt5 import QtCore
+
+# add the wsp directory and the directory above it to the PATH
+wsp_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, wsp_path)
+sys.path.insert(1, os.path.dirname(wsp_path))
+
+import dome_simulator_commandServer
+from wsp.utils.protocol_client import ProtocolClient, parse_reply, split_json, split_line
+
+STATE = {"Dome_Status": "STOPPED", "Home_Status": "READY", "Dome_Azimuth": 123.4,
+         "Telescope_Azimuth": "n/a", "Shutter_Status": "CLOSED"}
+
+results = []
+
+
+def check(name, condition, detail=""):
+    results.append((name, bool(condition)))
+    print(f"{'PASS' if condition else 'FAIL'}: {name} {detail}")
+
+
+def get_free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("localhost", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def wait_for_server(port, timeout=5.0):
+    t_end = time.monotonic() + timeout
+    while time.monotonic() < t_end:
+        client = ProtocolClient("localhost", port, min_backoff=0.05, max_backoff=0.05)
+        if client.connect(force=True):
+            client.close()
+            return
+        time.sleep(0.05)
+    raise RuntimeError(f"the simulator never started listening on port {port}")
+
+
+def set_state(server, ending):
+    """Have the simulator reply to status? with the state followed by ending"""
+    server.state = json.dumps(STATE) + ending
+    server.updateStateSignal.emit(server.state)
+    # the signal is delivered through the command thread's event loop
+    time.sleep(0.2)
+
+
+def test_framing(server, port):
+    for ending in ["", "\n", "\r\n"]:
+        set_state(server, ending)
+        client = ProtocolClient("localhost", port, max_in_flight=4, name="test")
+        client.connect(force=True)
+
+        reply = parse_reply(client.query("status?", framing="json"))
+        check(f"status? reply, ending {ending!r}", reply == STATE)
+
+        # a line reply pipelined right behind a json one
+        status = client.submit("status?", framing="json")
+        command = client.submit("dome_home", framing="line")
+        check(f"json then line, ending {ending!r}",
+              parse_reply(client.wait(status)) == STATE and client.wait(command) == "0",
+              f"(line reply {command.reply!r})")
+
+        # lots of them, in a mixed order
+        requests = []
+        for i in range(200):
+            if i % 3:
+                requests.append(("0", client.submit(f"dome_goto {i}", framing="line")))
+            else:
+                requests.append((STATE, client.submit("status?", framing="json")))
+        bad = [r.cmd for expected, r in requests
+               if parse_reply(client.wait(r)) != expected and client.wait(r) != expected]
+        check(f"200 pipelined mixed requests, ending {ending!r}", not bad, f"(wrong: {bad[:5]})")
+        check(f"no stray bytes, ending {ending!r}", client.stray_bytes == 0,
+              f"({client.stray_bytes})")
+        client.close()
+
+
+def test_reconnect(server, port):
+    set_state(server, "\n")
+    client = ProtocolClient("localhost", port, name="test")
+    client.connect(force=True)
+    client.query("status?", framing="json")
+    client.close("test")
+    check("reconnect right after a drop", client.connect())
+    check("query after reconnecting", parse_reply(client.query("status?", framing="json")) == STATE)
+    check("connection count", client.n_connects == 2, f"({client.n_connects})")
+    client.close()
+
+    # nothing listening: attempts back off
+    dead = ProtocolClient("localhost", get_free_port(), min_backoff=0.2, max_backoff=0.4, name="dead")
+    attempts = [dead.connect(force=True) for i in range(3)]
+    check("no connection to a closed port", not any(attempts))
+    check("backoff capped at max_backoff", dead.backoff == 0.4, f"({dead.backoff})")
+    check("no attempt during the backoff", dead.connect() is False and dead.n_failures == 3)
+
+
+def test_split_reads():
+    """Replies that arrive in pieces, which the simulator never sends"""
+    client = ProtocolClient("localhost", 0, max_in_flight=4, name="split")
+    server_sock, client.sock = socket.socketpair()
+    client.connected = True
+
+    # the line ending after a json reply arrives with the next reply
+    status = client.submit("status?", framing="json")
+    command = client.submit("dome_home", framing="line")
+    server_sock.sendall(b'{"a": "}"}')
+    check("json reply without its line ending yet", client.wait(status) == '{"a": "}"}')
+    server_sock.sendall(b"\r")
+    time.sleep(0.05)
+    server_sock.sendall(b"\n0\n")
+    check("late line ending not taken for a reply", client.wait(command) == "0",
+          f"({command.reply!r})")
+
+    # a line ending arriving after a json reply when nothing is waiting
+    status = client.submit("status?", framing="json")
+    server_sock.sendall(b"{}")
+    client.wait(status)
+    server_sock.sendall(b"\n")
+    time.sleep(0.05)
+    command = client.submit("dome_home", framing="line")
+    server_sock.sendall(b"1\n")
+    check("late line ending with nothing waiting", client.wait(command) == "1",
+          f"({command.reply!r})")
+    check("late line endings aren't stray", client.stray_bytes == 0, f"({client.stray_bytes})")
+
+    # bytes nobody asked for
+    server_sock.sendall(b"garbage\n")
+    time.sleep(0.05)
+    client._receive(time.monotonic() + 0.5, command)
+    command = client.submit("dome_home", framing="line")
+    server_sock.sendall(b"2\n")
+    check("unexpected bytes dropped", client.wait(command) == "2" and client.stray_bytes == 8,
+          f"({command.reply!r}, {client.stray_bytes} stray)")
+
+    client.close()
+    server_sock.close()
+
+    check("split_line", split_line(b"0\r\n1\n") == (b"0", 3, 0))
+    check("split_json takes the line ending", split_json(b'x {"a": {"b": "{"}}\r\n0\n') == (b'{"a": {"b": "{"}}', 21, 1))
+    check("split_json without a line ending", split_json(b'{"a": 1}0\n') == (b'{"a": 1}', 8, 0))
+    check("split_json incomplete", split_json(b'{"a": {}') is None)
+
+
+def run_tests(app, server, port):
+    try:
+        wait_for_server(port)
+        test_framing(server, port)
+        test_reconnect(server, port)
+        test_split_reads()
+    except Exception:
+        traceback.print_exc()
+        results.append(("exception", False))
+    QtCore.QMetaObject.invokeMethod(app, "quit", QtCore.Qt.QueuedConnection)
+
+
+if __name__ == "__main__":
+    app = QtCore.QCoreApplication(sys.argv)
+    config = yaml.load(open(wsp_path + "/config/config.yaml"), Loader=yaml.FullLoader)
+    port = get_free_port()
+
+    server = dome_simulator_commandServer.server_thread(
+        "localhost", port, logger=None, config=config, state=json.dumps(STATE)
+    )
+    server.start()
+
+    tester = threading.Thread(target=run_tests, args=(app, server, port), daemon=True)
+    tester.start()
+    app.exec_()
+
+    n_failed = len([name for name, passed in results if not passed])
+    print(f"\n{len(results) - n_failed} passed, {n_failed} failed")
+    os._exit(1 if n_failed else 0)
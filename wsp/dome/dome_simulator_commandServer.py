@@ -270,42 +270,18 @@ class command_thread(QtCore.QThread):
         
         
         
-        # receive the data in small chunks and retransmit it
+        # receive the data in small chunks and retransmit it. commands end in
+        # a newline, and a client may send several before reading the replies,
+        # so keep what's left after the last newline for the next read
+        buffer = b''
         while True:
             cmd = self.client_socket.recv(1024)
             
-            cmd_txt = cmd.decode("utf-8").rstrip() #rstrip removes all kinds of trailing whitespace
-            
-            """if not cmd_txt == 'status?':
-                print(f'domesim_cmdServer: received command {cmd_txt}')"""
-            
-            # Generate a new command request object (commandParser.cmd_request) which will be passed out to commandParser
-            new_cmd_request = commandParser.cmd_request(cmd = cmd_txt, 
-                                                        request_addr = self.client_addr, 
-                                                        request_port = self.client_port, 
-                                                        priority = 'low')
-            # signal that the command has been recieved from the client, and pass the command request object to the server thread
-            self.newcmd_from_client.emit(new_cmd_request)
             if cmd:
-                # send a note back to the client that the command was received.
-                try:
-                    #print(f'command thread {threading.get_ident()}: command text = {cmd_txt}')
-                    
-                    if cmd_txt == 'status?':
-                        
-                        reply = f'command thread {threading.get_ident()}: ' + self.state
-                        reply = self.state
-                    else:
-                        #print(f"{cmd_txt} == 'status?': {cmd_txt == 'status?'}")
-                        #reply = f'command [{cmd_txt}] received by server. To stop client session enter "quit"'
-                        reply = '0\n'
-                    self.client_socket.send(bytes(str(reply),"utf-8"))
-                except:
-                    msg = f'could not send reply to client at {self.client_addr} | {self.client.port}'
-                    if not self.logger is None:
-                        self.logger.debug(msg)
-                    else:
-                        print(msg)
+                buffer += cmd
+                while b'\n' in buffer:
+                    line, buffer = buffer.split(b'\n', 1)
+                    self.handle_command(line)
             else:
                 msg = f'Client at {self.client_addr} | {self.client_port} disconnected'
                 print(msg)
@@ -315,6 +291,38 @@ class command_thread(QtCore.QThread):
                     print(msg)
                 self.client_disconnected.emit(self.client)
                 break
+    
+    def handle_command(self, cmd):
+        cmd_txt = cmd.decode("utf-8").rstrip() #rstrip removes all kinds of trailing whitespace
+        
+        """if not cmd_txt == 'status?':
+            print(f'domesim_cmdServer: received command {cmd_txt}')"""
+        
+        # Generate a new command request object (commandParser.cmd_request) which will be passed out to commandParser
+        new_cmd_request = commandParser.cmd_request(cmd = cmd_txt, 
+                                                    request_addr = self.client_addr, 
+                                                    request_port = self.client_port, 
+                                                    priority = 'low')
+        # signal that the command has been recieved from the client, and pass the command request object to the server thread
+        self.newcmd_from_client.emit(new_cmd_request)
+        # send a note back to the client that the command was received.
+        try:
+            #print(f'command thread {threading.get_ident()}: command text = {cmd_txt}')
+            
+            if cmd_txt == 'status?':
+                
+                reply = self.state
+            else:
+                #print(f"{cmd_txt} == 'status?': {cmd_txt == 'status?'}")
+                #reply = f'command [{cmd_txt}] received by server. To stop client session enter "quit"'
+                reply = '0\n'
+            self.client_socket.send(bytes(str(reply),"utf-8"))
+        except:
+            msg = f'could not send reply to client at {self.client_addr} | {self.client_port}'
+            if not self.logger is None:
+                self.logger.debug(msg)
+            else:
+                print(msg)
         
     def __del__(self):
         self.wait()
@@ -29,7 +29,6 @@ import os
 import signal
 
 # import queue
-import socket
 
 # import json
 import subprocess
@@ -39,7 +38,6 @@ import time
 from datetime import datetime
 
 # from astropy.io import fits
-import numpy as np
 import Pyro5.client
 import Pyro5.core
 import Pyro5.server
@@ -58,61 +56,7 @@ print(f"wsp_path = {wsp_path}")
 # from watchdog import watchdog
 from alerts import alert_handler
 from daemon import daemon_utils
-from utils import logging_setup, utils
-
-
-class ReconnectHandler(object):
-    """
-    This is a object to handle reconnections, keep track of how often we should
-    reconnect, track if we are connected, and reconnect if we need to.
-    """
-
-    def __init__(self, connection_timeout=0):
-        self.connection_timeout = connection_timeout
-        # Note that the first one gets skipped
-        # self.reconnect_timeouts = np.array([0, 0.5, 1, 5, 10, 30, 60, 300, 600]) + self.connection_timeout #all the allowed timeouts between reconnection attempts CAN'T BE LESS THAN CONN TIMEOUT
-        self.reconnect_timeouts = (
-            np.array([0, 0.5, 1, 5]) + self.connection_timeout
-        )  # all the allowed timeouts between reconnection attempts CAN'T BE LESS THAN CONN TIMEOUT
-
-        self.reconnect_timeout_level = 0  # the index of the currently active timeout
-        self.reconnect_timeout = self.reconnect_timeouts[self.reconnect_timeout_level]
-
-        self.reset_last_reconnect_timestamp()
-
-    def reset_last_reconnect_timestamp(self):
-        self.last_reconnect_timestamp = datetime.utcnow().timestamp()
-        self.reconnect_remaining_time = 0.0
-        self.time_since_last_connection = 0.0
-
-    def update_timeout(self):
-        """Set the value of the current timeout"""
-        self.reconnect_timeout = self.reconnect_timeouts[self.reconnect_timeout_level]
-        # return current_timeout
-
-    def reset_reconnect_timeout(self):
-        self.reconnect_timeout_level = 0
-        self.update_timeout()
-
-    def increment_reconnect_timeout(self):
-        """Increase the timeout level by one"""
-
-        # if the current timeout level is greater than or equal to the number of levels, do nothing,
-        # otherwise increment by one
-        if self.reconnect_timeout_level >= (len(self.reconnect_timeouts) - 1):
-            pass
-        else:
-            self.reconnect_timeout_level += 1
-
-        # now update the timeout
-        self.update_timeout()
-
-    def get_time_since_last_connection(self):
-        timestamp = datetime.utcnow().timestamp()
-        self.time_since_last_connection = timestamp - self.last_reconnect_timestamp
-        self.reconnect_remaining_time = (
-            self.reconnect_timeout - self.time_since_last_connection
-        )
+from utils import logging_setup, protocol_client, utils
 
 
 class StatusMonitor(QtCore.QObject):
@@ -121,7 +65,16 @@ class StatusMonitor(QtCore.QObject):
     doReconnect = QtCore.pyqtSignal()
     handModeEnabled = QtCore.pyqtSignal()
 
-    def __init__(self, addr, port, logger=None, connection_timeout=0.5, verbose=False):
+    def __init__(
+        self,
+        addr,
+        port,
+        logger=None,
+        connection_timeout=0.5,
+        verbose=False,
+        pipeline=False,
+        max_backoff=60.0,
+    ):
         super(StatusMonitor, self).__init__()
 
         self.state = dict()
@@ -132,13 +85,21 @@ class StatusMonitor(QtCore.QObject):
             connection_timeout  # time to allow each connection attempt to take
         )
         self.verbose = verbose
+        # send each status request as soon as the last one is answered, and pick
+        # up its reply on the next poll, so the poll doesn't wait on the round trip
+        self.pipeline = pipeline
+        self.max_backoff = max_backoff
         self.timestamp = datetime.utcnow().timestamp()
         self.connected = False
 
         # have the doReconnect signal reattempt the connection
         # self.doReconnect.connect(self.connect_socket)
 
-        self.reconnector = ReconnectHandler()
+        # the status request sent on the last poll, when pipelining
+        self.pending_request = None
+        # how long the last poll waited for the status (ms), and how many bytes came back
+        self.poll_latency_ms = None
+        self.poll_bytes = 0
 
         self.setup_connection()
 
@@ -149,51 +110,43 @@ class StatusMonitor(QtCore.QObject):
             self.logger.log(level=level, msg=msg)
 
     def setup_connection(self):
-        self.create_socket()
-
-    def create_socket(self):
-        if self.verbose:
-            self.log("(Thread {threading.get_ident()}) StatusMonitor: socket")
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.settimeout(self.connection_timeout)
+        self.client = protocol_client.ProtocolClient(
+            self.addr,
+            self.port,
+            connect_timeout=self.connection_timeout,
+            reply_timeout=2.0,
+            max_in_flight=1,
+            max_backoff=self.max_backoff,
+            name="StatusMonitor",
+            logger=self.logger,
+            verbose=self.verbose,
+        )
 
     def connect_socket(self):
         if self.verbose:
             self.log(
                 f"(Thread {threading.get_ident()}) StatusMonitor: Attempting to connect socket"
             )
-        # record the time of this connection attempt
-        # self.reset_last_recconnect_timestamp()
-        self.reconnector.reset_last_reconnect_timestamp()
-
-        # increment the reconnection timeout
-        self.reconnector.increment_reconnect_timeout()
-
-        try:
-            if self.verbose:
-                self.log(
-                    f"(Thread {threading.get_ident()}) StatusMonitor: trying to connection to ({self.addr} | {self.port})"
-                )
-
-            # try to reconnect the socket
-            self.sock.connect((self.addr, self.port))
-
-            # print(f'(Thread {threading.get_ident()}) Connection attempt successful!')
-
-            # if this works, then set connected to True
-            self.connected = True
-
-            # since the connection is fine, reset all the timeouts
-            self.reconnector.reset_reconnect_timeout()
-
-        except Exception as e:
-
-            # the connection is broken. set connected to false
-            self.connected = False
-            if self.verbose:
-                self.log(
-                    f"(Thread {threading.get_ident()}) StatusMonitor: connection unsuccessful: {e}, waiting {self.reconnector.reconnect_timeout} until next reconnection"
-                )
+        self.pending_request = None
+        self.connected = self.client.connect()
+
+    def query_status(self):
+        t0 = time.monotonic()
+        if self.pipeline:
+            request = self.pending_request
+            self.pending_request = None
+            if request is None:
+                request = self.client.submit("status?", framing="json")
+            reply = self.client.wait(request)
+            self.pending_request = self.client.submit("status?", framing="json")
+        else:
+            request = self.client.submit("status?", framing="json")
+            reply = self.client.wait(request)
+        # how long the poll was held up: with pipelining the reply has usually
+        # arrived before it's asked for
+        self.poll_latency_ms = (time.monotonic() - t0) * 1e3
+        self.poll_bytes = request.nbytes
+        return protocol_client.parse_reply(reply)
 
     def updateDomeState(self, domeState):
         """
@@ -225,38 +178,35 @@ class StatusMonitor(QtCore.QObject):
         # report back some useful stuff
         self.state.update({"timestamp": self.timestamp})
         self.state.update(
-            {"reconnect_remaining_time": self.reconnector.reconnect_remaining_time}
+            {"reconnect_remaining_time": self.client.time_until_reconnect()}
         )
-        self.state.update({"reconnect_timeout": self.reconnector.reconnect_timeout})
+        self.state.update({"reconnect_timeout": self.client.backoff})
         self.state.update({"is_connected": self.connected})
 
         # if the connection is live, ask for the dome status
         if self.connected:
-            # self.time_since_last_connection = 0.0
-            self.reconnector.time_since_last_connection = 0.0
             # print(f'Connected! Querying Dome Status.')
             try:
-                dome_state = utils.query_socket(
-                    self.sock, "status?", end_char="}", timeout=2
-                )
+                dome_state = self.query_status()
                 # print(f'dome state = {json.dumps(dome_state, indent = 2)}')
                 self.updateDomeState(dome_state)
+                self.state.update({"poll_latency_ms": self.poll_latency_ms})
+                self.state.update({"poll_bytes": self.poll_bytes})
 
-            except:
+            except Exception as e:
                 # print(f'Query attempt failed.')
-                self.connected = False
+                if self.verbose:
+                    self.log(f"StatusMonitor: status query failed: {e}")
+                self.connected = self.client.connected
         else:
             # print(f'Dome Status Not Connected. ')
 
             """
             If we're not connected, then:
-                If we've waited the full reconnection timeout, then try to reconnect
+                If we've waited out the reconnection backoff, then try to reconnect
                 If not, then just note the time and pass''
             """
-            self.reconnector.get_time_since_last_connection()
-
-            # if self.reconnect_remaining_time <= 0.0:
-            if self.reconnector.reconnect_remaining_time <= 0.0:
+            if self.client.time_until_reconnect() <= 0.0:
                 if self.verbose:
                     self.log("StatusMonitor: Do a reconnect")
                 # we have waited the full reconnection timeout
@@ -274,7 +224,15 @@ class CommandHandler(QtCore.QObject):
     newReply = QtCore.pyqtSignal(int)
     newCommand = QtCore.pyqtSignal(str)
 
-    def __init__(self, addr, port, logger=None, connection_timeout=0.5, verbose=False):
+    def __init__(
+        self,
+        addr,
+        port,
+        logger=None,
+        connection_timeout=0.5,
+        verbose=False,
+        max_backoff=60.0,
+    ):
         super(CommandHandler, self).__init__()
 
         self.state = dict()
@@ -285,6 +243,7 @@ class CommandHandler(QtCore.QObject):
             connection_timeout  # time to allow each connection attempt to take
         )
         self.verbose = verbose
+        self.max_backoff = max_backoff
         # this reply is updated in the dome state dictionary when the connection is dead
         self.disconnectedReply = -9
 
@@ -302,20 +261,21 @@ class CommandHandler(QtCore.QObject):
             self.logger.log(level=level, msg=msg)
 
     def setup_connection(self):
-        self.create_socket()
-
-    def create_socket(self):
-        if self.verbose:
-            self.log("(Thread {threading.get_ident()}) CommandHandler: Creating socket")
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        # self.sock.settimeout(self.connection_timeout)
-
         # give it a long timeout so it can wait for slow replies
         # palomar uses 100 s fora shutter open/close
         # a 360 deg homing cycle takes 360deg/(2.5 deg/s) = 144 s
         # so let's use 150 seconds just to be safe
         # TODO: make the timeout update dynamically based on realistic estimates of the return time!
-        self.sock.settimeout(150)
+        self.client = protocol_client.ProtocolClient(
+            self.addr,
+            self.port,
+            connect_timeout=self.connection_timeout,
+            reply_timeout=150.0,
+            max_backoff=self.max_backoff,
+            name="CommandHandler",
+            logger=self.logger,
+            verbose=self.verbose,
+        )
 
     def connect_socket(self):
         if self.verbose:
@@ -326,26 +286,17 @@ class CommandHandler(QtCore.QObject):
         # self.reset_last_recconnect_timestamp()
         # self.reconnector.reset_last_reconnect_timestamp()
 
-        try:
-
-            # try to reconnect the socket
-            self.sock.connect((self.addr, self.port))
+        # the status monitor paces the reconnection attempts, so don't wait out
+        # this connection's own backoff. does nothing if already connected
+        self.connected = self.client.connect(force=True)
 
+        if self.connected:
             if self.verbose:
                 self.log(
                     f"(Thread {threading.get_ident()}) Connection attempt successful!"
                 )
 
-            # if this works, then set connected to True
-            self.connected = True
-
-            # since the connection is fine, reset all the timeouts
-            # self.reconnector.reset_reconnect_timeout()
-
-        except:
-
-            # the connection is broken. set connected to false
-            self.connected = False
+        else:
 
             if self.verbose:
                 self.log(
@@ -368,9 +319,9 @@ class CommandHandler(QtCore.QObject):
             # print(f'Connected! Querying Dome Status.')
 
             try:
-                reply = utils.query_socket(self.sock, cmd, end_char="\n")
-                # timeout = self.connection_timeout)
-                # timeout = 10000)
+                reply = protocol_client.parse_reply(
+                    self.client.query(cmd, framing="line")
+                )
 
                 # log that we sent the command unless it's godome (avoids flooding the log with dome nudges while tracking)
                 if "godome" in cmd:
@@ -386,7 +337,7 @@ class CommandHandler(QtCore.QObject):
                 self.log(
                     f"CommandHandler: Tried to send command {cmd} to dome, but rasied exception: {e}"
                 )
-                self.connected = False
+                self.connected = self.client.connected
         else:
             self.log(
                 f"CommandHandler: Received command: {cmd}, but dome was disconnected. Reply = {self.disconnectedReply}"
@@ -403,13 +354,22 @@ class CommandThread(QtCore.QThread):
     newCommand = QtCore.pyqtSignal(str)
     doReconnect = QtCore.pyqtSignal()
 
-    def __init__(self, addr, port, logger=None, connection_timeout=0.5, verbose=False):
+    def __init__(
+        self,
+        addr,
+        port,
+        logger=None,
+        connection_timeout=0.5,
+        verbose=False,
+        max_backoff=60.0,
+    ):
         super(QtCore.QThread, self).__init__()
         self.addr = addr
         self.port = port
         self.logger = logger
         self.connection_timeout = connection_timeout
         self.verbose = verbose
+        self.max_backoff = max_backoff
 
     def HandleCommand(self, cmd):
         self.newCommand.emit(cmd)
@@ -428,6 +388,7 @@ class CommandThread(QtCore.QThread):
             logger=self.logger,
             connection_timeout=self.connection_timeout,
             verbose=self.verbose,
+            max_backoff=self.max_backoff,
         )
         # if the newReply signal is caught, execute the sendCommand function
         self.newCommand.connect(self.commandHandler.sendCommand)
@@ -447,13 +408,24 @@ class StatusThread(QtCore.QThread):
     doReconnect = QtCore.pyqtSignal()
     enableHandMode = QtCore.pyqtSignal()
 
-    def __init__(self, addr, port, logger=None, connection_timeout=0.5, verbose=False):
+    def __init__(
+        self,
+        addr,
+        port,
+        logger=None,
+        connection_timeout=0.5,
+        verbose=False,
+        pipeline=False,
+        max_backoff=60.0,
+    ):
         super(QtCore.QThread, self).__init__()
         self.addr = addr
         self.port = port
         self.logger = logger
         self.connection_timeout = connection_timeout
         self.verbose = verbose
+        self.pipeline = pipeline
+        self.max_backoff = max_backoff
 
     def run(self):
         def SignalNewStatus(newStatus):
@@ -472,6 +444,8 @@ class StatusThread(QtCore.QThread):
             logger=self.logger,
             connection_timeout=self.connection_timeout,
             verbose=self.verbose,
+            pipeline=self.pipeline,
+            max_backoff=self.max_backoff,
         )
 
         self.statusMonitor.newStatus.connect(SignalNewStatus)
@@ -509,6 +483,8 @@ class Dome(QtCore.QObject):
         connection_timeout=1.5,
         alertHandler=None,
         verbose=False,
+        pipeline=False,
+        max_backoff=60.0,
     ):
         super(Dome, self).__init__()
         # attributes describing the internet address of the dome server
@@ -520,12 +496,16 @@ class Dome(QtCore.QObject):
         self.alertHandler = alertHandler
         self.verbose = verbose
 
+        # status and commands each get their own connection: the server answers
+        # in order, so a status poll would otherwise wait behind a slow command
         self.statusThread = StatusThread(
             self.addr,
             self.port,
             logger=self.logger,
             connection_timeout=self.connection_timeout,
             verbose=self.verbose,
+            pipeline=pipeline,
+            max_backoff=max_backoff,
         )
         self.commandThread = CommandThread(
             self.addr,
@@ -533,6 +513,7 @@ class Dome(QtCore.QObject):
             logger=self.logger,
             connection_timeout=self.connection_timeout,
             verbose=self.verbose,
+            max_backoff=max_backoff,
         )
         # connect the signals and slots
 
@@ -736,6 +717,8 @@ class PyroGUI(QtCore.QObject):
             connection_timeout=self.dome_connection_timeout,
             alertHandler=self.alertHandler,
             verbose=self.verbose,
+            pipeline=self.config[self.servername].get("pipeline", False),
+            max_backoff=self.config[self.servername].get("max_backoff", 60.0),
         )
 
         self.pyro_thread = daemon_utils.PyroDaemon(
@@ -55,10 +55,14 @@ class SunSimulator(QtWidgets.QMainWindow):
     
     newState = QtCore.pyqtSignal(str)
     
-    def __init__(self, ns_host = None, logger = None, *args, **kwargs):
+    def __init__(self, ns_host = None, logger = None, speed = 1, start_time = None, autostart = False, *args, **kwargs):
 
         """
         Initializes the main window
+
+        speed is the number of simulated seconds per second, start_time an
+        aware datetime to start the clock at (default 16:30 local today),
+        and autostart starts the clock without pressing run.
         """
 
         super(SunSimulator, self).__init__(*args, **kwargs)
@@ -115,6 +119,8 @@ class SunSimulator(QtWidgets.QMainWindow):
         # speedbox
         self.speedbox = self.findChild(QtWidgets.QSpinBox, "speedbox")
         self.speedbox.setSingleStep(10)
+        self.speedbox.setMaximum(max(self.speedbox.maximum(), int(speed)))
+        self.speedbox.setValue(int(speed))
         
         # start/stop
         self.stop_button = self.findChild(QtWidgets.QPushButton, "stop_button")
@@ -129,10 +135,12 @@ class SunSimulator(QtWidgets.QMainWindow):
         
         # Set up the state dictionary
         self.state = dict()
-        self.init_time()
+        self.init_time(start_time)
         self.init_state()
         self.update_state()
         
+        if autostart:
+            self.updateLoop.start()
         
         
         
@@ -142,14 +150,17 @@ class SunSimulator(QtWidgets.QMainWindow):
         else:
             self.logger.log(level = level, msg = msg)
     
-    def init_time(self):
-        now_local = datetime.now(self.tz)
-        year = now_local.year
-        month = now_local.month
-        day = now_local.day
-        
-        self.time = datetime(year = year, month = month, day = day, hour = 16, minute = 30, second = 0) 
-        self.time = self.tz.localize(self.time)
+    def init_time(self, start_time = None):
+        if start_time is None:
+            now_local = datetime.now(self.tz)
+            year = now_local.year
+            month = now_local.month
+            day = now_local.day
+            
+            self.time = datetime(year = year, month = month, day = day, hour = 16, minute = 30, second = 0) 
+            self.time = self.tz.localize(self.time)
+        else:
+            self.time = start_time.astimezone(self.tz)
         astropy_time = astropy.time.Time(self.time, format = 'datetime')
         self.mjd = float(astropy_time.mjd)
         self.sun_timestamp = self.time.timestamp()
@@ -300,11 +311,12 @@ class SunSimulator(QtWidgets.QMainWindow):
 class PyroGUI(QtCore.QObject):   
 
                   
-    def __init__(self, ns_host = None, logger = None, parent=None ):            
+    def __init__(self, ns_host = None, logger = None, speed = 1, start_time = None, autostart = False, parent=None ):            
         super(PyroGUI, self).__init__(parent)   
         print(f'main: running in thread {threading.get_ident()}')
         
-        self.sunsim = SunSimulator(ns_host = ns_host, logger = logger)
+        self.sunsim = SunSimulator(ns_host = ns_host, logger = logger, speed = speed,
+                                   start_time = start_time, autostart = autostart)
                 
         self.pyro_thread = daemon_utils.PyroDaemon(obj = self.sunsim, name = 'sunsim', ns_host = ns_host)
         self.pyro_thread.start()
@@ -326,9 +338,12 @@ if __name__ == '__main__':
     doLogging = True
     ns_host = '192.168.1.10'
     sunsim = False
+    speed = 1
+    start_time = None
+    autostart = False
     
     options = "vpn:s"
-    long_options = ["verbose", "print", "ns_host:","sunsim"]
+    long_options = ["verbose", "print", "ns_host:","sunsim", "speed=", "start=", "run"]
     arguments, values = getopt.getopt(args, options, long_options)
     # checking each argument
     print()
@@ -349,8 +364,20 @@ if __name__ == '__main__':
         
         elif currentArgument in ("-s", "--sunsim"):
             sunsim = True
+        
+        elif currentArgument == "--speed":
+            speed = int(currentValue)
+        
+        elif currentArgument == "--start":
+            # ISO format, taken as UTC unless it has an offset, eg 2024-06-01T04:30:00
+            start_time = datetime.fromisoformat(currentValue)
+            if start_time.tzinfo is None:
+                start_time = pytz.utc.localize(start_time)
+        
+        elif currentArgument == "--run":
+            autostart = True
             
-    print(f'ephemd: launching with ns_host = {ns_host}, sunsim = {sunsim}')
+    print(f'ephemd: launching with ns_host = {ns_host}, sunsim = {sunsim}, speed = {speed}, start = {start_time}, run = {autostart}')
     
     config = yaml.load(open(wsp_path + '/config/config.yaml'), Loader = yaml.FullLoader)
     # set up the logger
@@ -362,7 +389,8 @@ if __name__ == '__main__':
         
     
     app = QtWidgets.QApplication(sys.argv)
-    main = PyroGUI(ns_host = ns_host, logger = logger)
+    main = PyroGUI(ns_host = ns_host, logger = logger, speed = speed,
+                   start_time = start_time, autostart = autostart)
     
     
 
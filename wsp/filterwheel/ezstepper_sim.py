@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Simulated EZStepper controller behind a pseudo-terminal.
+
+It answers the part of the EZStepper serial protocol that winterFilterd
+uses -- the microstep (?0), input (?4) and encoder (?8) queries, homing
+(Z...z0) and absolute moves (A<pos>) -- with the same framing as the real
+controller, so the filter wheel daemon can be run and timed offline by
+pointing its serial port at the pty:
+
+    python ezstepper_sim.py         # prints the port to use
+
+or by starting winterFilterd.py with --sim.
+"""
+
+import os
+import re
+import sys
+import tty
+import time
+import select
+import threading
+import yaml
+
+
+class EZStepperSim(object):
+
+    # status bytes: bit 5 is the ready bit, the low nibble the error code
+    STATUS_READY = b'`'
+    STATUS_BUSY = b'@'
+
+    def __init__(self, config, speed = None, reply_delay = 0.005, verbose = False):
+        self.config = config
+        self.addr = str(config['serial']['address'])
+        # microsteps per second
+        self.speed = config['stepper_config']['speed'] if speed is None else speed
+        self.max_encoder_err = config['stepper_config']['max_encoder_err']
+        # how long the controller takes to start answering
+        self.reply_delay = reply_delay
+        self.verbose = verbose
+
+        # the motion is a ramp from move_start to move_goal starting at move_t0
+        self.move_start = 0.0
+        self.move_goal = 0.0
+        self.move_t0 = time.monotonic()
+        self.lock = threading.Lock()
+
+        self.n_commands = 0
+        self.running = False
+
+        self.master, self.slave = os.openpty()
+        # no echo or newline translation on the daemon's side of the pty
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+
+    def log(self, msg):
+        if self.verbose:
+            print(f'EZStepperSim: {msg}')
+
+    def position(self):
+        with self.lock:
+            dt = time.monotonic() - self.move_t0
+            distance = self.move_goal - self.move_start
+            travelled = min(abs(distance), self.speed*dt)
+            return self.move_start + travelled*(1 if distance >= 0 else -1)
+
+    def is_moving(self):
+        return abs(self.position() - self.move_goal) > 0.5
+
+    def move_to(self, goal):
+        pos = self.position()
+        with self.lock:
+            self.move_start = pos
+            self.move_goal = float(goal)
+            self.move_t0 = time.monotonic()
+
+    def set_position(self, pos):
+        with self.lock:
+            self.move_start = float(pos)
+            self.move_goal = float(pos)
+            self.move_t0 = time.monotonic()
+
+    def reply(self, status, contents = ''):
+        frame = b'\xff/0' + status + contents.encode('utf-8') + b'\x03\r\n'
+        time.sleep(self.reply_delay)
+        os.write(self.master, frame)
+
+    def handle(self, command):
+        """Execute one command (without the /<address> prefix)."""
+        self.n_commands += 1
+        status = self.STATUS_BUSY if self.is_moving() else self.STATUS_READY
+        self.log(f'got command {command}')
+
+        if command in ('?0', '?8'):
+            # the encoder ratio is set so that positions are in encoder ticks
+            self.reply(status, str(int(round(self.position()))))
+        elif command == '?4':
+            # opto1 is blocked (0) when the tray is at home
+            opto1 = 0 if abs(self.position()) < self.max_encoder_err else 1
+            self.reply(status, str(opto1 << 2))
+        elif command.startswith('?'):
+            self.reply(status, '0')
+        else:
+            homing = re.search(r'Z(\d+)', command)
+            move = re.search(r'A(-?\d+)', command)
+            if homing:
+                # drive down to the opto, which is position zero
+                self.move_to(0)
+            elif move:
+                self.move_to(int(move.group(1)))
+            self.reply(status)
+
+    def serve(self):
+        buffer = b''
+        while self.running:
+            readable, _, _ = select.select([self.master], [], [], 0.1)
+            if not readable:
+                continue
+            try:
+                buffer += os.read(self.master, 1024)
+            except OSError:
+                break
+            while b'\r' in buffer:
+                line, buffer = buffer.split(b'\r', 1)
+                line = line.decode('utf-8', errors = 'replace').strip()
+                prefix = f'/{self.addr}'
+                # commands for other addresses on the bus get no reply
+                if line.startswith(prefix):
+                    self.handle(line[len(prefix):])
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target = self.serve, daemon = True)
+        self.thread.start()
+        self.log(f'serving on {self.port}')
+        return self.port
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+
+if __name__ == '__main__':
+
+    wsp_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    fwconfig = os.path.join(wsp_path, 'filterwheel', 'winterfw_config.yaml')
+    config = yaml.load(open(fwconfig), Loader = yaml.FullLoader)
+
+    sim = EZStepperSim(config, verbose = '-v' in sys.argv[1:])
+    print(f'EZStepperSim: serial port is {sim.start()}')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        sim.stop()
@@ -84,12 +84,25 @@ class EZStepper(QtCore.QObject):
         self.is_moving = 0
         self.homed = 0
         self.encoder_pos = -1
+        self.encoder_pos_goal = -1
         self.is_homing = 0
 
+        # derived values, cached so that publishing the state is cheap
+        self.filter_pos_measured = -1
+        self._filter_pos_encoder = None
+
         # timers
         self.state_update_dt = config['state_update_dt']
+        # longest we wait for a reply frame to be terminated
         self.reply_timeout = config['reply_timeout']
 
+        # reply latency bookkeeping
+        self.last_command = ''
+        self.last_command_latency = 0.0
+        self.command_latency = dict()
+        self.poll_latency = 0.0
+        self.reply_timeouts = 0
+
 
         ## Startup:
         self.setupSerial()
@@ -112,9 +125,11 @@ class EZStepper(QtCore.QObject):
         # set up the serial port using pyserial "serial" library
         # this can take and pass in any pyserial args
 
+        # replies end with ETX, and send reads until that arrives, so the
+        # read timeout is only a deadline for a reply that never finishes
         self.ser = serial.Serial(port=self.port,
                 baudrate=self.baud_rate,
-                timeout = 1,
+                timeout = self.reply_timeout,
                 parity=serial.PARITY_NONE,
                 stopbits=serial.STOPBITS_ONE,
                 bytesize=serial.EIGHTBITS,
@@ -139,13 +154,26 @@ class EZStepper(QtCore.QObject):
         """
         Get housekeeping status
 
+        One poll cycle: the microstep and encoder queries go out back to
+        back, and the state is published once at the end.
         """
-        self.pos = self.getMicrostepLoc()
-        self.encoder_pos = self.getEncoderLoc()
+        start = time.perf_counter()
+        self.pos = self.getMicrostepLoc(update = False)
+        self.encoder_pos = self.getEncoderLoc(update = False)
+        self.poll_latency = time.perf_counter() - start
         # now update the state dictionary
         self.update_state()
 
 
+    def measuredFilterPosition(self):
+        # the filter position is derived from the encoder reading, so only
+        # work it out again when that has changed
+        if self.encoder_pos != self._filter_pos_encoder:
+            self.filter_pos_measured = self.getFilterPosition()
+            self._filter_pos_encoder = self.encoder_pos
+        return self.filter_pos_measured
+
+
     def update_state(self):
         self.state.update({ 'timestamp' : datetime.utcnow().timestamp(),
                             'is_moving' : self.is_moving,
@@ -153,10 +181,15 @@ class EZStepper(QtCore.QObject):
                             'pos_goal'  : self.pos_goal,
                             'encoder_pos' : self.encoder_pos,
                             'encoder_pos_goal' : self.encoder_pos_goal,
-                            'filter_pos' : self.getFilterPosition(),
+                            'filter_pos' : self.measuredFilterPosition(),
                             'filter_goal' : self.filter_goal,
                             'homed'     : self.homed,
                             'is_homing' : self.is_homing,
+                            'last_command' : self.last_command,
+                            'last_command_latency_ms' : 1000*self.last_command_latency,
+                            'command_latency_ms' : {cmd : 1000*dt for cmd, dt in self.command_latency.items()},
+                            'poll_latency_ms' : 1000*self.poll_latency,
+                            'reply_timeouts' : self.reply_timeouts,
                             })
 
 
@@ -266,25 +299,37 @@ class EZStepper(QtCore.QObject):
     def send(self, serial_command, verbose=False):
         assert self.ser, "No serial setup found"
         self.ser.flushInput()
+        start = time.perf_counter()
         self.ser.write(bytes(f"/{self.addr}{serial_command}\r", 'utf-8'))
-        reply = []
 
-        time.sleep(self.reply_timeout)
+        # the reply frame is /0<status><contents><ETX>: return as soon as
+        # the ETX is in, the serial timeout is the deadline for it
+        raw_reply = self.ser.read_until(b'\x03')
+        latency = time.perf_counter() - start
 
-        for i in range(self.ser.in_waiting):
-            newbyte = self.ser.read(1).hex()
-            reply.append(newbyte)
+        self.last_command = serial_command
+        self.last_command_latency = latency
+        self.command_latency.update({serial_command : latency})
+        if not raw_reply.endswith(b'\x03'):
+            self.reply_timeouts += 1
+            self.log(f'no complete reply to {serial_command} after {latency:.3f} s',
+                     level = logging.WARNING)
+        if verbose: self.log(f'reply to {serial_command} took {1000*latency:.1f} ms')
+
+        reply = [f'{byte:02x}' for byte in raw_reply]
 
         return self.parse_reply(reply, verbose=verbose)
 
 
-    def getEncoderLoc(self, verbose=False) -> int:
+    def getEncoderLoc(self, verbose=False, update=True) -> int:
         '''Get encoder tick reading.
 
         Parameters
         ----------
         verbose : bool, optional
             Print additional info, by default False
+        update : bool, optional
+            Publish the state after the query, by default True
 
         Returns
         -------
@@ -293,17 +338,20 @@ class EZStepper(QtCore.QObject):
         '''
         status, enc_loc = self.send('?8', verbose=verbose)
         self.encoder_pos = int(enc_loc)
-        self.update_state()
+        if update:
+            self.update_state()
         return self.encoder_pos
 
 
-    def getMicrostepLoc(self, verbose=False) -> int:
+    def getMicrostepLoc(self, verbose=False, update=True) -> int:
         '''Get microstep location reading.
 
         Parameters
         ----------
         verbose : bool, optional
             Print additional info, by default False
+        update : bool, optional
+            Publish the state after the query, by default True
 
         Returns
         -------
@@ -312,7 +360,8 @@ class EZStepper(QtCore.QObject):
         '''
         status, ustep_loc = self.send('?0', verbose=verbose)
         self.ustep_loc = int(ustep_loc)
-        self.update_state()
+        if update:
+            self.update_state()
         return self.ustep_loc
 
 
@@ -396,10 +445,8 @@ class EZStepper(QtCore.QObject):
         try:
             while not (arrived or timed_out):
                 time.sleep(self.state_update_dt)
-                self.encoder_pos = self.getEncoderLoc()
+                self.pollStatus()
                 if verbose: self.log(f'while homing: encoder pos is {self.encoder_pos}')
-                time.sleep(self.state_update_dt)
-                self.pos = self.getMicrostepLoc()
                 if verbose: self.log(f'while homing: microstep pos is {self.pos}')
                 arrived = abs(self.encoder_pos) < self.max_encoder_err
                 timed_out = ((time.time() - start_time) >
@@ -469,8 +516,7 @@ class EZStepper(QtCore.QObject):
             start_time = time.time()
             while not (arrived or timed_out):
                 time.sleep(self.state_update_dt)
-                self.encoder_pos = self.getEncoderLoc()
-                self.pos = self.getMicrostepLoc()
+                self.pollStatus()
                 arrived = abs(microstep_loc - self.encoder_pos) < self.max_encoder_err
                 timed_out = ((time.time() - start_time) >
                             self.config['stepper_config']['timeout_secs'])
@@ -816,12 +862,13 @@ if __name__ == '__main__':
 
     verbose = False
     doLogging = True
+    sim = False
     ns_host = '192.168.1.20'
     # Options
-    options = "vpn:a:"
+    options = "vpsn:a:"
 
     # Long options
-    long_options = ["verbose", "print", "ns_host ="]
+    long_options = ["verbose", "print", "sim", "ns_host ="]
 
 
 
@@ -843,6 +890,9 @@ if __name__ == '__main__':
             elif currentArgument in ("-p", "--print"):
                 doLogging = False
 
+            elif currentArgument in ("-s", "--sim"):
+                sim = True
+
 
 
     except getopt.error as err:
@@ -856,6 +906,17 @@ if __name__ == '__main__':
     fwconfig = os.path.join(wsp_path, 'filterwheel', 'winterfw_config.yaml')
     config = yaml.load(open(fwconfig), Loader = yaml.FullLoader)
 
+    if sim:
+        # talk to a simulated stepper on a pty instead of the real one
+        try:
+            from filterwheel.ezstepper_sim import EZStepperSim
+        except ImportError:
+            # run as a script, filterwheel is filterwheel.py next to this
+            from ezstepper_sim import EZStepperSim
+        ezstepper_sim = EZStepperSim(config, verbose = verbose)
+        config['serial']['port'] = ezstepper_sim.start()
+        print(f'winterfw: using simulated stepper on {config["serial"]["port"]}')
+
     app = QtCore.QCoreApplication(sys.argv)
 
     if doLogging:
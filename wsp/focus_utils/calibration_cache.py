@@ -0,0 +1,117 @@
+"""
+Module for caching master calibration frames in memory.
+
+Focus loops calibrate every board of every image against the same handful of
+master darks and flats, so the frames are read from disk once and then served
+from memory. Entries are keyed by path and modification time, so a master that
+is regenerated on disk is picked up on the next request.
+"""
+
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+from astropy.io import fits
+
+
+class CalibrationCache:
+    """
+    Thread-safe in-memory cache of calibration frames keyed by (path, mtime)
+    """
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._frames = dict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path: str | Path) -> np.ndarray:
+        """
+        Get the data of a calibration frame, reading it from disk only if it
+        is not cached or has changed on disk
+
+        Parameters
+        ----------
+        path: path of the calibration frame
+
+        Returns
+        -------
+        Read-only array with the frame data
+        """
+        path = os.path.abspath(path)
+        mtime = os.path.getmtime(path)
+        key = (path, mtime)
+
+        with self._lock:
+            data = self._frames.get(key)
+            if data is not None:
+                self.hits += 1
+                return data
+
+        # read outside of the lock so other frames can be served meanwhile
+        data = np.asarray(fits.getdata(path))
+        data.setflags(write=False)
+
+        with self._lock:
+            self.misses += 1
+            # drop stale versions of the same file
+            for stale_key in [k for k in self._frames if k[0] == path]:
+                del self._frames[stale_key]
+            if len(self._frames) >= self.max_entries:
+                # evict the oldest entry (dicts preserve insertion order)
+                del self._frames[next(iter(self._frames))]
+            self._frames[key] = data
+        return data
+
+    def get_median(self, path: str | Path) -> float:
+        """
+        Get the nan-median of a cached calibration frame
+
+        Parameters
+        ----------
+        path: path of the calibration frame
+
+        Returns
+        -------
+        median of the frame
+        """
+        path = os.path.abspath(path)
+        key = (path, os.path.getmtime(path), "median")
+        with self._lock:
+            median = self._frames.get(key)
+        if median is None:
+            median = float(np.nanmedian(self.get(path)))
+            with self._lock:
+                self._frames[key] = median
+        return median
+
+    def clear(self):
+        """
+        Empty the cache
+        """
+        with self._lock:
+            self._frames.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# module-level cache shared by everything in this process. Each worker of a
+# process pool gets its own copy, which is populated on first use.
+calibration_cache = CalibrationCache()
+
+
+def get_calibration_frame(path: str | Path) -> np.ndarray:
+    """
+    Get a calibration frame from the module-level cache
+
+    Parameters
+    ----------
+    path: path of the calibration frame
+
+    Returns
+    -------
+    Read-only array with the frame data
+    """
+    return calibration_cache.get(path)
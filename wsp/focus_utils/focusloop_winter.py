@@ -7,6 +7,7 @@ import os
 import subprocess
 import sys
 import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from contextlib import redirect_stdout
 from glob import glob
 from pathlib import Path
@@ -27,10 +28,10 @@ sys.path.insert(1, wsp_path)
 print(f"camera: wsp_path = {wsp_path}")
 
 try:
+    from calibration_cache import calibration_cache
     from data_io import get_focus_images_in_directory
     from ldactools import get_table_from_ldac
     from mask import make_mask
-    from matplotlib.gridspec import GridSpec
     from paths import (
         DEFAULT_OUTPUT_DIR,
         MASK_DIR,
@@ -44,6 +45,7 @@ try:
     from quick_calibrate_images import flat_correct, subtract_dark
 except Exception as e:
     print(f"Could not import from focus_utils: {e}")
+    from focus_utils.calibration_cache import calibration_cache
     from focus_utils.data_io import get_focus_images_in_directory
     from focus_utils.ldactools import get_table_from_ldac
     from focus_utils.mask import make_mask
@@ -151,6 +153,64 @@ edge_limits = {
 }
 
 
+def get_clean_catalog(
+    imgname: str,
+    weightimg: str,
+    pixscale: float = 1.00,
+    exclude: bool = False,
+    regions: bool = True,
+) -> Table:
+    """
+    Run sextractor on a single board image (if it has no catalog yet) and
+    return the sources away from the board edges with good FWHM and flags
+
+    Parameters
+    ----------
+    imgname: image name
+    weightimg: weight image
+    pixscale: pixel scale of the image
+    exclude: boolean whether to exclude the edge of the image
+    regions: boolean whether to make regions files
+
+    Returns
+    -------
+    Table of clean sources
+    """
+    if not os.path.exists(imgname + ".cat"):
+        print("Catalog does not exist.")
+        run_sextractor(imgname, pixscale, regions=regions, weightimg=weightimg)
+
+    img_cat = get_table_from_ldac(imgname + ".cat")
+    print("Found %s sources in single image" % (len(img_cat)))
+
+    boardid = fits.getval(imgname, "BOARD_ID")
+    xlolim, xuplim, ylolim, yuplim = edge_limits[str(boardid)]
+    center_mask = (
+        (img_cat["X_IMAGE"] < xuplim)
+        & (img_cat["X_IMAGE"] > xlolim)
+        & (img_cat["Y_IMAGE"] < yuplim)
+        & (img_cat["Y_IMAGE"] > ylolim)
+        & (img_cat["FWHM_IMAGE"] > 0.2)
+        & (img_cat["FLAGS"] == 0)
+    )
+    if exclude:
+        center_mask = np.invert(center_mask)
+    if regions:
+        with open(imgname + ".cat" + ".clean.reg", "w") as f:
+            f.write("image\n")
+            for row in img_cat[center_mask]:
+                f.write(
+                    "CIRCLE(%s,%s,%s) # text={%.2f}\n"
+                    % (
+                        row["X_IMAGE"],
+                        row["Y_IMAGE"],
+                        row["FWHM_IMAGE"] / 2,
+                        row["FWHM_IMAGE"],
+                    )
+                )
+    return img_cat[center_mask]
+
+
 def get_img_fwhm(
     imgnames: str | list[str],
     weightimages: str | list[str],
@@ -186,41 +246,14 @@ def get_img_fwhm(
 
     print("requested", imgnames)
     for ind, imgname in enumerate(imgnames):
-
-        weightimg = weightimages[ind]
-        if not os.path.exists(imgname + ".cat"):
-            print("Catalog does not exist.")
-            run_sextractor(imgname, pixscale, weightimg=weightimg)
-
-        img_cat = get_table_from_ldac(imgname + ".cat")
-        print("Found %s sources in single image" % (len(img_cat)))
-
-        boardid = fits.getval(imgname, "BOARD_ID")
-        xlolim, xuplim, ylolim, yuplim = edge_limits[str(boardid)]
-        center_mask = (
-            (img_cat["X_IMAGE"] < xuplim)
-            & (img_cat["X_IMAGE"] > xlolim)
-            & (img_cat["Y_IMAGE"] < yuplim)
-            & (img_cat["Y_IMAGE"] > ylolim)
-            & (img_cat["FWHM_IMAGE"] > 0.2)
-            & (img_cat["FLAGS"] == 0)
+        img_cat = get_clean_catalog(
+            imgname,
+            weightimages[ind],
+            pixscale=pixscale,
+            exclude=exclude,
+            regions=regions,
         )
-        if exclude:
-            center_mask = np.invert(center_mask)
-        if regions:
-            with open(imgname + ".cat" + ".clean.reg", "w") as f:
-                f.write("image\n")
-                for row in img_cat[center_mask]:
-                    f.write(
-                        "CIRCLE(%s,%s,%s) # text={%.2f}\n"
-                        % (
-                            row["X_IMAGE"],
-                            row["Y_IMAGE"],
-                            row["FWHM_IMAGE"] / 2,
-                            row["FWHM_IMAGE"],
-                        )
-                    )
-        full_img_cat = vstack([full_img_cat, img_cat[center_mask]])
+        full_img_cat = vstack([full_img_cat, img_cat])
 
     print(f"Using {len(full_img_cat)} good sources in total")
 
@@ -308,6 +341,29 @@ def fit_parabola(
     return popt
 
 
+def get_mask_names(imglist: list[str], maskdir: str) -> list[str]:
+    """
+    Function to get the weight masks for a list of board images, making any
+    that do not exist yet
+
+    Parameters
+    ----------
+    imglist: list of board image names
+    maskdir: directory to save masks to
+
+    Returns
+    -------
+    list of mask names, one per image
+    """
+    boardids = [fits.getval(x, "BOARD_ID") for x in imglist]
+    masknames = [f"{maskdir}/mask_boardid_{x}.fits" for x in boardids]
+    for ind, maskname in enumerate(masknames):
+        if not os.path.exists(maskname):
+            print(f"Mask {maskname} does not exist. Making it.")
+            make_mask(imglist[ind], boardid=boardids[ind], maskname=maskname)
+    return masknames
+
+
 def analyse_imgs_focus(
     imglists: list[list[str]],
     pixscale=1.00,
@@ -335,12 +391,7 @@ def analyse_imgs_focus(
     focus_vals = []
 
     for imglist in imglists:
-        boardids = [fits.getval(x, "BOARD_ID") for x in imglist]
-        masknames = [f"{maskdir}/mask_boardid_{x}.fits" for x in boardids]
-        for ind, maskname in enumerate(masknames):
-            if not os.path.exists(maskname):
-                print(f"Mask {maskname} does not exist. Making it.")
-                make_mask(imglist[ind], boardid=boardids[ind], maskname=maskname)
+        masknames = get_mask_names(imglist, maskdir)
 
         print("imglist", imglist)
         img_focus_vals = [fits.getval(x, focus_keyword) for x in imglist]
@@ -422,6 +473,56 @@ def save_split_images(
     return new_paths
 
 
+def calibrate_split_image(
+    split_path: str,
+    masterdarks_dir: str | Path = MASTERDARK_DIR,
+    masterflats_dir: str | Path = MASTERFLAT_DIR,
+    saturate_value: int = 40000,
+) -> str:
+    """
+    Function to dark subtract and flat correct a single board image. The
+    master frames are served from the in-memory calibration cache, so each
+    one is only read from disk once per process.
+
+    Parameters
+    ----------
+    split_path: path of the single-extension board image
+    masterdarks_dir: directory of masterdarks
+    masterflats_dir: directory of masterflats
+    saturate_value: value to set the saturation level to
+
+    Returns
+    -------
+    path of the calibrated image
+    """
+    split_data, split_header = fits.getdata(split_path, header=True)
+    split_header["SATURATE"] = saturate_value
+    master_darkname = os.path.join(
+        masterdarks_dir,
+        f"master_dark_boardid_"
+        f"{split_header['BOARD_ID']}"
+        f"_exptime_{int(np.rint(split_header['EXPTIME']))}"
+        f".fits",
+    )
+    master_flatname = os.path.join(
+        masterflats_dir,
+        f"master_flat_boardid_"
+        f"{split_header['BOARD_ID']}"
+        f"_filter_{split_header['FILTERID']}.fits",
+    )
+    master_dark = calibration_cache.get(master_darkname) * split_header["EXPTIME"]
+    master_flat = calibration_cache.get(master_flatname)
+    split_data = subtract_dark(split_data, master_dark)
+    split_header["SATURATE"] -= (
+        calibration_cache.get_median(master_darkname) * split_header["EXPTIME"]
+    )
+    split_header["SATURATE"] /= calibration_cache.get_median(master_flatname)
+    split_data = flat_correct(split_data, master_flat)
+    cal_split_path = split_path.replace(".fits", "_cal.fits")
+    fits.writeto(cal_split_path, split_data, split_header, overwrite=True)
+    return cal_split_path
+
+
 def split_and_calibrate_images(
     imglist: list[str],
     board_ids: list = [0],
@@ -449,33 +550,15 @@ def split_and_calibrate_images(
     split_path_list = []
     for imgname in imglist:
         split_paths = save_split_images(imgname, board_ids, output_dir=output_dir)
-        split_cal_paths = []
-        for split_path in split_paths:
-            split_data = fits.getdata(split_path)
-            split_header = fits.getheader(split_path)
-            split_header["SATURATE"] = saturate_value
-            master_darkname = os.path.join(
-                masterdarks_dir,
-                f"master_dark_boardid_"
-                f"{split_header['BOARD_ID']}"
-                f"_exptime_{int(np.rint(split_header['EXPTIME']))}"
-                f".fits",
-            )
-            master_flatname = os.path.join(
-                masterflats_dir,
-                f"master_flat_boardid_"
-                f"{split_header['BOARD_ID']}"
-                f"_filter_{split_header['FILTERID']}.fits",
+        split_cal_paths = [
+            calibrate_split_image(
+                split_path,
+                masterdarks_dir=masterdarks_dir,
+                masterflats_dir=masterflats_dir,
+                saturate_value=saturate_value,
             )
-            master_dark = fits.getdata(master_darkname) * split_header["EXPTIME"]
-            master_flat = fits.getdata(master_flatname)
-            split_data = subtract_dark(split_data, master_dark)
-            split_header["SATURATE"] -= np.nanmedian(master_dark)
-            split_header["SATURATE"] /= np.nanmedian(master_flat)
-            split_data = flat_correct(split_data, master_flat)
-            cal_split_path = split_path.replace(".fits", "_cal.fits")
-            fits.writeto(cal_split_path, split_data, split_header, overwrite=True)
-            split_cal_paths.append(cal_split_path)
+            for split_path in split_paths
+        ]
         split_path_list.append(split_cal_paths)
 
     return split_path_list
@@ -519,6 +602,162 @@ def subtract_sky(imagelist: [list[list[str]]]) -> list[list[str]]:
     return sky_subtracted_paths
 
 
+def _calibrate_board_worker(
+    imgname: str,
+    board_id: int,
+    masterdarks_dir: str | Path,
+    masterflats_dir: str | Path,
+    saturate_value: int,
+    output_dir: str | Path,
+) -> list[str]:
+    """
+    Process pool worker: split out and calibrate a single board of a MEF image
+    """
+    split_paths = save_split_images(imgname, board_id, output_dir=output_dir)
+    return [
+        calibrate_split_image(
+            split_path,
+            masterdarks_dir=masterdarks_dir,
+            masterflats_dir=masterflats_dir,
+            saturate_value=saturate_value,
+        )
+        for split_path in split_paths
+    ]
+
+
+def _board_fwhm_worker(
+    imgname: str,
+    weightimg: str,
+    pixscale: float,
+    exclude: bool,
+    focus_keyword: str,
+) -> tuple[float, np.ndarray]:
+    """
+    Process pool worker: extract sources from a single board image and return
+    its focus position and the FWHMs of its clean sources
+    """
+    img_cat = get_clean_catalog(
+        imgname, weightimg, pixscale=pixscale, exclude=exclude, regions=False
+    )
+    focus_val = fits.getval(imgname, focus_keyword)
+    return focus_val, np.asarray(img_cat["FWHM_IMAGE"])
+
+
+def split_and_calibrate_images_parallel(
+    imglist: list[str],
+    executor: ProcessPoolExecutor,
+    board_ids: list = [0],
+    masterdarks_dir: str | Path = MASTERDARK_DIR,
+    masterflats_dir: str | Path = MASTERFLAT_DIR,
+    saturate_value: int = 40000,
+    output_dir: str | Path = DEFAULT_OUTPUT_DIR,
+) -> list[list[str]]:
+    """
+    Same as split_and_calibrate_images, but with every board of every image
+    fanned out across a process pool. Each worker keeps its own calibration cache, so the master
+    frames are read at most once per worker.
+
+    Parameters
+    ----------
+    imglist: list of image names
+    executor: process pool to run on
+    board_ids: list of board ids to use
+    masterdarks_dir: directory of masterdarks
+    masterflats_dir: directory of masterflats
+    saturate_value: value to set the saturation level to
+    output_dir: directory to write the split images to
+
+    Returns
+    -------
+    List of lists of science+calibration images, divided by board id
+    """
+    if not isinstance(board_ids, list):
+        board_ids = [board_ids]
+
+    futures = [
+        [
+            executor.submit(
+                _calibrate_board_worker,
+                str(imgname),
+                int(board_id),
+                masterdarks_dir,
+                masterflats_dir,
+                saturate_value,
+                output_dir,
+            )
+            for board_id in board_ids
+        ]
+        for imgname in imglist
+    ]
+    # keep the input order, subtract_sky relies on it
+    return [
+        [path for future in image_futures for path in future.result()]
+        for image_futures in futures
+    ]
+
+
+def iter_focus_results(
+    imglists: list[list[str]],
+    executor: ProcessPoolExecutor,
+    pixscale: float = 1.00,
+    exclude: bool = False,
+    focus_keyword: str = "FOCPOS",
+    maskdir: str = None,
+):
+    """
+    Generator that analyses a set of images taken at different focus positions
+    on a process pool, with one task per board image. Results are yielded as
+    soon as all the boards of a focus position are done, so the slowest board
+    sets the pace rather than the sum of all of them.
+
+    Parameters
+    ----------
+    imglists: list of lists of board image names, one list per focus position
+    executor: process pool to run on
+    pixscale: pixel scale of the images
+    exclude: boolean whether to exclude the edge of the image
+    focus_keyword: header key for focus position
+    maskdir: directory to save masks to (default None)
+
+    Yields
+    -------
+    (index into imglists, focus position, median FWHM, std FWHM)
+    """
+    pending = dict()
+    future_to_position = dict()
+    for position, imglist in enumerate(imglists):
+        imglist = [str(x) for x in imglist]
+        masknames = get_mask_names(imglist, maskdir)
+        pending[position] = {"remaining": len(imglist), "focus": [], "fwhm": []}
+        for imgname, maskname in zip(imglist, masknames):
+            future = executor.submit(
+                _board_fwhm_worker,
+                imgname,
+                maskname,
+                pixscale,
+                exclude,
+                focus_keyword,
+            )
+            future_to_position[future] = position
+
+    for future in as_completed(future_to_position):
+        position = future_to_position[future]
+        result = pending[position]
+        focus_val, fwhms = future.result()
+        result["focus"].append(focus_val)
+        result["fwhm"].append(fwhms)
+        result["remaining"] -= 1
+        if result["remaining"] > 0:
+            continue
+
+        assert len(np.unique(result["focus"])) == 1
+        all_fwhms = np.concatenate(result["fwhm"])
+        print(f"Using {len(all_fwhms)} good sources in total")
+        mean, med, std = sigma_clipped_stats(all_fwhms, sigma=2)
+        del pending[position]
+        yield position, result["focus"][0], med * pixscale, std * pixscale
+
+
 def calculate_best_focus_from_images(
     image_dir: str | Path,
     masterdarks_dir: str | Path = MASTERDARK_DIR,
@@ -528,6 +767,7 @@ def calculate_best_focus_from_images(
     skip_calibrate: bool = False,
     statsfile: str = "focusloop_stats.txt",
     plot: bool = True,
+    max_workers: int = None,
 ) -> float:
     """
     Function to calculate the best focus from a set of images
@@ -542,33 +782,65 @@ def calculate_best_focus_from_images(
     skip_calibrate: boolean to skip calibration
     statsfile: file to write stats to
     plot: Make plot?
+    max_workers: number of worker processes for calibration and source
+        extraction. None uses one per CPU, 1 runs everything serially.
 
     Returns
     -------
 
     Best focus value
     """
-    if not skip_calibrate:
-        imagelist = get_focus_images_in_directory(image_dir)
-        # Use only focus images
-        # imagelist = [x for x in imagelist if fits.getval(x, 'OBSTYPE') == 'FOCUS']
-        split_paths_list = split_and_calibrate_images(
-            imagelist,
-            masterdarks_dir=masterdarks_dir,
-            masterflats_dir=masterflats_dir,
-            board_ids=board_ids_to_use,
-        )
+    if max_workers == 1:
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+
+    try:
+        if not skip_calibrate:
+            imagelist = get_focus_images_in_directory(image_dir)
+            # Use only focus images
+            # imagelist = [x for x in imagelist if fits.getval(x, 'OBSTYPE') == 'FOCUS']
+            if executor is None:
+                split_paths_list = split_and_calibrate_images(
+                    imagelist,
+                    masterdarks_dir=masterdarks_dir,
+                    masterflats_dir=masterflats_dir,
+                    board_ids=board_ids_to_use,
+                )
+            else:
+                split_paths_list = split_and_calibrate_images_parallel(
+                    imagelist,
+                    executor,
+                    masterdarks_dir=masterdarks_dir,
+                    masterflats_dir=masterflats_dir,
+                    board_ids=board_ids_to_use,
+                )
 
-        split_paths_list = subtract_sky(split_paths_list)
+            split_paths_list = subtract_sky(split_paths_list)
 
-    else:
-        split_paths_list = glob(os.path.join(image_dir, "split", "*.fits"))
-        split_paths_list = [[x] for x in split_paths_list]
+        else:
+            split_paths_list = glob(os.path.join(image_dir, "split", "*.fits"))
+            split_paths_list = [[x] for x in split_paths_list]
 
-    print(f"Found {len(split_paths_list)} images  - {split_paths_list}")
-    med_fwhms, std_fwhms, focus_vals = analyse_imgs_focus(
-        split_paths_list, maskdir=maskdir
-    )
+        print(f"Found {len(split_paths_list)} images  - {split_paths_list}")
+        if executor is None:
+            med_fwhms, std_fwhms, focus_vals = analyse_imgs_focus(
+                split_paths_list, maskdir=maskdir
+            )
+        else:
+            med_fwhms = np.full(len(split_paths_list), np.nan)
+            std_fwhms = np.full(len(split_paths_list), np.nan)
+            focus_vals = np.full(len(split_paths_list), np.nan)
+            for position, focus_val, med, std in iter_focus_results(
+                split_paths_list, executor, maskdir=maskdir
+            ):
+                print(f"focus = {focus_val}: FWHM = {med:.2f} +/- {std:.2f}")
+                med_fwhms[position] = med
+                std_fwhms[position] = std
+                focus_vals[position] = focus_val
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
     nanmask = np.isnan(med_fwhms)
     med_fwhms = med_fwhms[~nanmask]
@@ -670,6 +942,7 @@ def run(cmd_args) -> float:
         maskdir=cmd_args.masks_dir,
         board_ids_to_use=board_ids_to_use,
         statsfile=os.path.join(cmd_args.output_dir, "focusloop_stats.txt"),
+        max_workers=cmd_args.max_workers,
     )
 
     if cmd_args.plot_all:
@@ -684,6 +957,7 @@ def run(cmd_args) -> float:
                     cmd_args.output_dir, f"focusloop_stats_{board_id}" f".txt"
                 ),
                 plot=False,
+                max_workers=cmd_args.max_workers,
             )
 
         plot_all_detectors_focus(cmd_args.output_dir)
@@ -700,6 +974,7 @@ if __name__ == "__main__":
     parser.add_argument("--output_dir", type=str, default=DEFAULT_OUTPUT_DIR)
     parser.add_argument("--board_ids_to_use", type=int, nargs="+", default=None)
     parser.add_argument("--plot_all", action="store_true")
+    parser.add_argument("--max_workers", type=int, default=None)
     parser.add_argument("--silent", action="store_true", default=False)
     args = parser.parse_args()
 
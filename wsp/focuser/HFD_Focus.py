@@ -31,7 +31,6 @@ print(f'focusing: wsp_path = {wsp_path}')
 from alerts import alert_handler
 from focuser import plot_curve
 from focuser import genstats
-from utils import utils
 
 
 
@@ -294,7 +293,7 @@ if __name__ == '__main__':
         datetime_file = datetime.strptime(timestr, '%Y%m%d_%H%M%S')
         if (datetime_file <= datetime_end) & (datetime_file >= datetime_start):
             images.append(file)
-            focuser_pos.append(utils.getFromFITSHeader(file, 'FOCPOS'))
+            focuser_pos.append(genstats.get_header_value(file, 'FOCPOS'))
     
     #%
     # Try something else
@@ -317,31 +316,28 @@ if __name__ == '__main__':
     #last_image = os.readlink(os.path.join(os.getenv("HOME"), 'data','last_image.lnk'))
     #genstats.run_sextractor(last_image,pixscale,weightimg=weightimg)
     
+    all_stats = genstats.get_img_stats_batch(images, pixscale = pixscale,
+                                             weightimg=weightimg,
+                                             exclude = False)
     for i in range(len(images)):#image in images:
         image = images[i]
         focus = focuser_pos[i]
-        try:
-            #mean, median, std, stderr_mean, stderr_med
-            mean, median, std, stderr_mean, stderr_med = genstats.get_img_fluxdiameter(image, pixscale = pixscale, 
-                                                                                       weightimg=weightimg,
-                                                                                       exclude = False)
-            mean_fwhm, med_fwhm, std_fwhm = genstats.get_img_fwhm(image, pixscale = pixscale, 
-                                                                                       weightimg=weightimg,
-                                                                                       exclude = False)
-            focuser_pos_good.append(focus)
-            images_good.append(image)
-            
-            HFD_mean.append(mean*pixscale)
-            HFD_med.append(median*pixscale)
-            HFD_std.append(std*pixscale)
-            HFD_stderr_mean.append(stderr_mean*pixscale)
-            HFD_stderr_med.append(stderr_med*pixscale)
-            
-            FWHM_mean.append(mean_fwhm*pixscale)
-            FWHM_med.append(med_fwhm*pixscale)
-            FWHM_std.append(std_fwhm*pixscale)
-        except Exception as e:
-            print(f'could not analyze image {image}: {e}')
+        stats = all_stats[i]
+        if isinstance(stats, Exception):
+            print(f'could not analyze image {image}: {stats}')
+            continue
+        focuser_pos_good.append(focus)
+        images_good.append(image)
+        
+        HFD_mean.append(stats['hfd']['mean']*pixscale)
+        HFD_med.append(stats['hfd']['med']*pixscale)
+        HFD_std.append(stats['hfd']['std']*pixscale)
+        HFD_stderr_mean.append(stats['hfd']['stderr_mean']*pixscale)
+        HFD_stderr_med.append(stats['hfd']['stderr_med']*pixscale)
+        
+        FWHM_mean.append(stats['fwhm']['mean']*pixscale)
+        FWHM_med.append(stats['fwhm']['med']*pixscale)
+        FWHM_std.append(stats['fwhm']['std']*pixscale)
     
     
     pos = np.array(focuser_pos_good)
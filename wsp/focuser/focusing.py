@@ -228,24 +228,29 @@ class Focus_loop_v3:
     def analyze_best_focus_image(self, best_focus_image):
         
         try:
-            mean, median, std, stderr_mean, stderr_med = genstats.get_img_fluxdiameter(best_focus_image, pixscale = self.pixscale, 
-                                                                                       exclude = False)
-            mean_fwhm, med_fwhm, std_fwhm = genstats.get_img_fwhm(best_focus_image, pixscale = self.pixscale, 
-                                                                                       exclude = False)
-            print(f'type(mean_fwhm) = {type(mean_fwhm)}, mean_fwhm = {mean_fwhm}')
+            stats = genstats.get_img_stats(best_focus_image, pixscale = self.pixscale, 
+                                           exclude = False)
+            hfd = stats['hfd']
+            fwhm = stats['fwhm']
+            ellipticity = stats['ellipticity']
             # now add the info to the focus data dictionary
             self.fitresults.update({'best_focus_image': 
                                         {'hfd' : 
-                                             {'mean'    : mean*self.pixscale,
-                                              'med'     : median*self.pixscale,
-                                              'std'     : std*self.pixscale,
-                                              'stderr_mean'     : stderr_mean*self.pixscale,
-                                              'stderr_med'      : stderr_med*self.pixscale,
+                                             {'mean'    : float(hfd['mean']*self.pixscale),
+                                              'med'     : float(hfd['med']*self.pixscale),
+                                              'std'     : float(hfd['std']*self.pixscale),
+                                              'stderr_mean'     : float(hfd['stderr_mean']*self.pixscale),
+                                              'stderr_med'      : float(hfd['stderr_med']*self.pixscale),
                                               },
                                          'fwhm' : 
-                                             {'mean'    : float(mean_fwhm*self.pixscale),
-                                              'med'     : float(med_fwhm*self.pixscale),
-                                              'std'     : float(std_fwhm*self.pixscale),
+                                             {'mean'    : float(fwhm['mean']*self.pixscale),
+                                              'med'     : float(fwhm['med']*self.pixscale),
+                                              'std'     : float(fwhm['std']*self.pixscale),
+                                              },
+                                         'ellipticity' :
+                                             {'mean'    : float(ellipticity['mean']),
+                                              'med'     : float(ellipticity['med']),
+                                              'std'     : float(ellipticity['std']),
                                               },
                                          'image' : best_focus_image,
                                          },
@@ -266,31 +271,31 @@ class Focus_loop_v3:
         FWHM_mean = []
         FWHM_med = []
         FWHM_std = []
+        # extract all the images at once; each catalog is kept in memory
+        # for the later steps (best focus image, results log)
+        all_stats = genstats.get_img_stats_batch(imglist, pixscale = self.pixscale,
+                                                 exclude = False)
         for i in range(len(imglist)):#image in images:
             image = imglist[i]
             #focus = focuser_pos[i]
             focus = self.filter_range[i]
-            try:
-                #mean, median, std, stderr_mean, stderr_med
-                mean, median, std, stderr_mean, stderr_med = genstats.get_img_fluxdiameter(image, pixscale = self.pixscale, 
-                                                                                           exclude = False)
-                mean_fwhm, med_fwhm, std_fwhm = genstats.get_img_fwhm(image, pixscale = self.pixscale, 
-                                                                                           exclude = False)
-                focuser_pos_good.append(focus)
-                images_good.append(image)
-                
-                HFD_mean.append(mean*self.pixscale)
-                HFD_med.append(median*self.pixscale)
-                HFD_std.append(std*self.pixscale)
-                HFD_stderr_mean.append(stderr_mean*self.pixscale)
-                HFD_stderr_med.append(stderr_med*self.pixscale)
-                
-                FWHM_mean.append(mean_fwhm*self.pixscale)
-                FWHM_med.append(med_fwhm*self.pixscale)
-                FWHM_std.append(std_fwhm*self.pixscale)
-                
-            except Exception as e:
-                print(f'could not analyze image {image}: {e}')
+            stats = all_stats[i]
+            if isinstance(stats, Exception):
+                print(f'could not analyze image {image}: {stats}')
+                continue
+            
+            focuser_pos_good.append(focus)
+            images_good.append(image)
+            
+            HFD_mean.append(stats['hfd']['mean']*self.pixscale)
+            HFD_med.append(stats['hfd']['med']*self.pixscale)
+            HFD_std.append(stats['hfd']['std']*self.pixscale)
+            HFD_stderr_mean.append(stats['hfd']['stderr_mean']*self.pixscale)
+            HFD_stderr_med.append(stats['hfd']['stderr_med']*self.pixscale)
+            
+            FWHM_mean.append(stats['fwhm']['mean']*self.pixscale)
+            FWHM_med.append(stats['fwhm']['med']*self.pixscale)
+            FWHM_std.append(stats['fwhm']['std']*self.pixscale)
                 
         self.pos = np.array(focuser_pos_good)
         self.images = np.array(images_good)
@@ -316,7 +321,7 @@ class Focus_loop_v3:
         
         #TODO: replace this with a more sensible naming system...
         #starttime_string = self.images[0].split('/')[-1].split('.fits')[0].strip('_Camera0')
-        starttime_string = utils.getFromFITSHeader(self.imglist[0], 'UTC').split('.')[0]
+        starttime_string = genstats.get_header_value(self.imglist[0], 'UTC').split('.')[0]
         self.results_filepath = os.path.join(results_log_dir, f'focusResults_{starttime_string}.json')
         
         # create the data directory if it doesn't exist already
@@ -6,6 +6,9 @@ import os
 import subprocess
 import warnings
 import sys
+import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 #from focuser import ldactools as aw
 from matplotlib.gridspec import GridSpec
@@ -28,12 +31,24 @@ astrom_filter = os.path.join(sex_config_path, 'default.conv')
 astrom_swarp = os.path.join(sex_config_path, '/onfig.swarp')
 astrom_nnw = os.path.join(sex_config_path, 'default.nnw')
 photom_sex = os.path.join(sex_config_path, 'photomCat.sex')
+# lean parameter set with only the columns the focus statistics use
+focus_param = os.path.join(sex_config_path, 'focus.param')
 
 
-def run_sextractor(imgname,pixscale=0.47,regions=True,weightimg=os.path.join(wsp_path,'focuser','weight.fits')):
+def run_sextractor(imgname,pixscale=0.47,regions=True,weightimg=os.path.join(wsp_path,'focuser','weight.fits'),profile='full'):
 	#Run sextractor on the proc image file
+	# profile 'full' measures the whole astrometry parameter set and writes
+	# the check-images; 'focus' only measures what the focus statistics use
+	# and writes no check-images (and no regions)
+	if profile == 'focus':
+		param = focus_param
+		checkimages = ' -CHECKIMAGE_TYPE NONE'
+		regions = False
+	else:
+		param = astrom_param
+		checkimages = ' -CHECKIMAGE_TYPE NONE -CHECKIMAGE_NAME '+imgname+'.seg,'+imgname+'.bkg,'+imgname+'.bkg.rms'
 	try:
-		command = 'sex -c ' + astrom_sex + ' ' + imgname + ' ' + '-CATALOG_NAME ' + imgname + '.cat' + ' -CATALOG_TYPE FITS_LDAC ' + '-PARAMETERS_NAME ' + astrom_param + ' ' + '-FILTER_NAME ' + astrom_filter + ' ' + '-STARNNW_NAME ' + astrom_nnw + ' ' + '-WEIGHT_TYPE NONE -CHECKIMAGE_TYPE NONE -PIXEL_SCALE ' + str(pixscale) + ' -DETECT_THRESH 10 -ANALYSIS_THRESH 10 -SATUR_LEVEL 60000 -WEIGHT_TYPE MAP_WEIGHT -WEIGHT_IMAGE ' + weightimg + ' -CHECKIMAGE_NAME '+imgname+'.seg,'+imgname+'.bkg,'+imgname+'.bkg.rms'
+		command = 'sex -c ' + astrom_sex + ' ' + imgname + ' ' + '-CATALOG_NAME ' + imgname + '.cat' + ' -CATALOG_TYPE FITS_LDAC ' + '-PARAMETERS_NAME ' + param + ' ' + '-FILTER_NAME ' + astrom_filter + ' ' + '-STARNNW_NAME ' + astrom_nnw + ' ' + '-WEIGHT_TYPE NONE -PIXEL_SCALE ' + str(pixscale) + ' -DETECT_THRESH 10 -ANALYSIS_THRESH 10 -SATUR_LEVEL 60000 -WEIGHT_TYPE MAP_WEIGHT -WEIGHT_IMAGE ' + weightimg + checkimages
 		print('Executing command : %s'%(command))
 		rval = subprocess.run(command.split(),check=True,capture_output=True)
 		print('Process completed')
@@ -50,37 +65,144 @@ def run_sextractor(imgname,pixscale=0.47,regions=True,weightimg=os.path.join(wsp
 			for row in t:
 				f.write('CIRCLE(%s,%s,%s) # text={%.2f,%.2f}\n'%(row['X_IMAGE'],row['Y_IMAGE'],row['FWHM_IMAGE']/2,row['FWHM_IMAGE'],row['SNR_WIN']))
 
-def get_img_fluxdiameter(imgname,pixscale=0.47,weightimg=os.path.join(wsp_path,'focuser','weight.fits'),xlolim=10,xuplim=2000,ylolim=10,yuplim=2000,exclude=False):
-	if not os.path.exists(imgname+'.cat'):
-		run_sextractor(imgname,pixscale,weightimg=weightimg)
 
-	img_cat = aw.get_table_from_ldac(imgname+'.cat')
-	print('Found %s sources'%(len(img_cat)))
+class FocusCatalog(object):
+	"""
+	The sources extracted from one image, held in memory as numpy columns,
+	and the image header (read once, when first needed).
+	"""
+	columns = ['X_IMAGE', 'Y_IMAGE', 'FLUX_RADIUS', 'FWHM_IMAGE', 'ELONGATION', 'ELLIPTICITY']
 
-	center_mask = (img_cat['X_IMAGE']<xuplim) & (img_cat['X_IMAGE']>xlolim) & (img_cat['Y_IMAGE']<yuplim) & (img_cat['Y_IMAGE']>ylolim)
-	if exclude :
-		center_mask = np.invert(center_mask)
-	n_sources = len(img_cat[center_mask])
-	print('Using %s sources'%(n_sources))
-	mean, median, std = sigma_clipped_stats(2*img_cat[center_mask]['FLUX_RADIUS'])
-	stderr_mean = std/(n_sources)**0.5
-	stderr_med = (np.pi/2)**0.5 * stderr_mean
-	return mean, median, std, stderr_mean, stderr_med
+	def __init__(self, imgname, table):
+		self.imgname = imgname
+		self.data = {}
+		for col in self.columns:
+			if col in table.colnames:
+				self.data[col] = np.asarray(table[col], dtype=float)
+		if 'ELLIPTICITY' not in self.data:
+			# catalogs made before ELLIPTICITY was measured
+			self.data['ELLIPTICITY'] = 1 - 1/self.data['ELONGATION']
+		self._header = None
 
+	def __len__(self):
+		return len(self.data['X_IMAGE'])
 
-def get_img_fwhm(imgname,pixscale=0.47,weightimg=os.path.join(wsp_path,'focuser','weight.fits'),xlolim=10,xuplim=2000,ylolim=10,yuplim=2000,exclude=False):
-	if not os.path.exists(imgname+'.cat'):
-		run_sextractor(imgname,pixscale,weightimg=weightimg)
+	@property
+	def header(self):
+		if self._header is None:
+			self._header = fits.getheader(self.imgname, ignore_missing_end=True)
+		return self._header
+
+	def get_header_value(self, keyword, default=None):
+		return self.header.get(keyword, default)
+
+	def stats(self,xlolim=10,xuplim=2000,ylolim=10,yuplim=2000,exclude=False):
+		"""
+		sigma-clipped HFD (2*FLUX_RADIUS), FWHM and ellipticity statistics of
+		the sources inside (or with exclude, outside) the box, in pixels.
+		the three are clipped independently, in one call.
+		"""
+		x = self.data['X_IMAGE']
+		y = self.data['Y_IMAGE']
+		center_mask = (x<xuplim) & (x>xlolim) & (y<yuplim) & (y>ylolim)
+		if exclude :
+			center_mask = np.invert(center_mask)
+		n_sources = int(np.sum(center_mask))
+		print('Using %s sources'%(n_sources))
+
+		values = np.vstack([2*self.data['FLUX_RADIUS'][center_mask],
+							self.data['FWHM_IMAGE'][center_mask],
+							self.data['ELLIPTICITY'][center_mask]])
+		mean, median, std = sigma_clipped_stats(values, axis=1)
+		stderr_mean = std[0]/(n_sources)**0.5
+		stderr_med = (np.pi/2)**0.5 * stderr_mean
+		return {'n_sources': n_sources,
+				'hfd': {'mean': mean[0], 'med': median[0], 'std': std[0],
+						'stderr_mean': stderr_mean, 'stderr_med': stderr_med},
+				'fwhm': {'mean': mean[1], 'med': median[1], 'std': std[1]},
+				'ellipticity': {'mean': mean[2], 'med': median[2], 'std': std[2]}}
+
+
+# catalogs of the most recent images, by image path
+_catalog_cache = collections.OrderedDict()
+_catalog_cache_size = 64
+_catalog_lock = threading.Lock()
+
+
+def get_catalog(imgname,pixscale=0.47,weightimg=os.path.join(wsp_path,'focuser','weight.fits'),profile='focus'):
+	"""
+	return the FocusCatalog of imgname. sextractor runs only if the image
+	has no catalog on disk yet, and the catalog is parsed only once: later
+	calls for the same (unmodified) image get the one in memory.
+	"""
+	key = os.path.abspath(imgname)
+	mtime = os.path.getmtime(imgname)
+	with _catalog_lock:
+		entry = _catalog_cache.get(key)
+		if entry is not None and entry[0] == mtime:
+			_catalog_cache.move_to_end(key)
+			return entry[1]
+
+	if not os.path.exists(imgname+'.cat') or os.path.getmtime(imgname+'.cat') < mtime:
+		run_sextractor(imgname,pixscale,weightimg=weightimg,profile=profile)
 
-	img_cat = aw.get_table_from_ldac(imgname+'.cat')
-	print('Found %s sources'%(len(img_cat)))
+	catalog = FocusCatalog(imgname, aw.get_table_from_ldac(imgname+'.cat'))
+	print('Found %s sources'%(len(catalog)))
 
-	center_mask = (img_cat['X_IMAGE']<xuplim) & (img_cat['X_IMAGE']>xlolim) & (img_cat['Y_IMAGE']<yuplim) & (img_cat['Y_IMAGE']>ylolim)
-	if exclude :
-		center_mask = np.invert(center_mask)
-	print('Using %s sources'%(len(img_cat[center_mask])))
-	mean, median, std = sigma_clipped_stats(img_cat[center_mask]['FWHM_IMAGE'])
-	return mean,median, std
+	with _catalog_lock:
+		_catalog_cache[key] = (mtime, catalog)
+		_catalog_cache.move_to_end(key)
+		while len(_catalog_cache) > _catalog_cache_size:
+			_catalog_cache.popitem(last=False)
+	return catalog
+
+
+def get_header_value(imgname,keyword,default=None):
+	"""
+	value of keyword in the header of imgname. the header is read once and
+	kept with the image's catalog if the image has been analyzed (and not
+	modified since).
+	"""
+	mtime = os.path.getmtime(imgname)
+	with _catalog_lock:
+		entry = _catalog_cache.get(os.path.abspath(imgname))
+	if entry is not None and entry[0] == mtime:
+		return entry[1].get_header_value(keyword, default)
+	return fits.getheader(imgname, ignore_missing_end=True).get(keyword, default)
+
+
+def get_img_stats(imgname,pixscale=0.47,weightimg=os.path.join(wsp_path,'focuser','weight.fits'),xlolim=10,xuplim=2000,ylolim=10,yuplim=2000,exclude=False):
+	"""
+	HFD, FWHM and ellipticity statistics of an image (in pixels), see
+	FocusCatalog.stats
+	"""
+	catalog = get_catalog(imgname,pixscale,weightimg=weightimg)
+	return catalog.stats(xlolim=xlolim,xuplim=xuplim,ylolim=ylolim,yuplim=yuplim,exclude=exclude)
+
+
+def get_img_stats_batch(imglist,pixscale=0.47,weightimg=os.path.join(wsp_path,'focuser','weight.fits'),max_workers=4,**kwargs):
+	"""
+	get_img_stats for every image in imglist, running sextractor on the
+	images in parallel. returns a list with the stats of each image, or the
+	exception raised while analyzing it.
+	"""
+	def _stats(imgname):
+		try:
+			return get_img_stats(imgname,pixscale,weightimg=weightimg,**kwargs)
+		except Exception as e:
+			return e
+	with ThreadPoolExecutor(max_workers=max_workers) as executor:
+		return list(executor.map(_stats, imglist))
+
+
+def get_img_fluxdiameter(imgname,pixscale=0.47,weightimg=os.path.join(wsp_path,'focuser','weight.fits'),xlolim=10,xuplim=2000,ylolim=10,yuplim=2000,exclude=False):
+	stats = get_img_stats(imgname,pixscale,weightimg=weightimg,xlolim=xlolim,xuplim=xuplim,ylolim=ylolim,yuplim=yuplim,exclude=exclude)['hfd']
+	return stats['mean'], stats['med'], stats['std'], stats['stderr_mean'], stats['stderr_med']
+
+
+def get_img_fwhm(imgname,pixscale=0.47,weightimg=os.path.join(wsp_path,'focuser','weight.fits'),xlolim=10,xuplim=2000,ylolim=10,yuplim=2000,exclude=False):
+	stats = get_img_stats(imgname,pixscale,weightimg=weightimg,xlolim=xlolim,xuplim=xuplim,ylolim=ylolim,yuplim=yuplim,exclude=exclude)['fwhm']
+	return stats['mean'], stats['med'], stats['std']
 
 
 def gen_map(imgname,pixscale=0.466,weightimg=os.path.join(wsp_path,'focuser','weight.fits'),regions=False):
@@ -43,6 +43,8 @@ wsp_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(1, wsp_path)
 print(f'data_handler: wsp_path = {wsp_path}')
 
+# state fields added by hk_loop itself rather than listed in the telemetry config
+LOOP_FIELDS = ['timestamp', 'timestamp_local', 'hk_loop_index', 'hk_loop_period_ms', 'hk_loop_update_ms']
 
 
 class hk_loop(QtCore.QThread):
@@ -51,7 +53,8 @@ class hk_loop(QtCore.QThread):
                  counter, dome, chiller, powerManager, ephem, 
                  #viscam, ccd, summercamera, wintercamera, 
                  camdict, fwdict, imghandlerdict,
-                 robostate, sunsim = False, verbose = False, ns_host = None, logger = None):
+                 robostate, sunsim = False, verbose = False, ns_host = None, logger = None,
+                 shared_state = None):
         QtCore.QThread.__init__(self)
         # loop execution number
         self.index = 0
@@ -87,10 +90,16 @@ class hk_loop(QtCore.QThread):
         self.state = state
         self.curframe = curframe
         
+        # shared memory copy of the state for readers on this machine (or None)
+        self.shared_state = shared_state
+        
         # describe the loop rate
         self.rate = 'hk'
         self.dt = int(np.round(self.config['daq_dt'][self.rate],0))
         
+        # when the last update started, to publish how late each one runs
+        self.t_last_update = None
+        
         # set up the connection to the pyro5 server to get the simulated time if we're in sunsim mode
         if self.sunsim:
             self.setup_sunsim_connection()
@@ -153,6 +162,12 @@ class hk_loop(QtCore.QThread):
             
     def update_status(self, default_value = -999):
         self.index +=1
+        t_update = time.monotonic()
+        if self.t_last_update is None:
+            period_ms = self.dt
+        else:
+            period_ms = (t_update - self.t_last_update) * 1000.0
+        self.t_last_update = t_update
         
         # THIS IS USED TO ADD A TIMESTAMP TO THE STATE DICTIONARY
         """if self.sunsim:
@@ -218,6 +233,19 @@ class hk_loop(QtCore.QThread):
                  if self.verbose:
                      print(f'datahandler: could not update field [{field}] due to {e.__class__}: {e}')
                  pass
+        
+        # how long the timer took to fire (dt when it keeps up) and how long
+        # the update itself took, for tracking how responsive the main loop is
+        self.state.update({'hk_loop_index' : self.index})
+        self.state.update({'hk_loop_period_ms' : period_ms})
+        self.state.update({'hk_loop_update_ms' : (time.monotonic() - t_update) * 1000.0})
+        
+        if self.shared_state is not None:
+            try:
+                self.shared_state.publish(self.state)
+            except Exception as e:
+                if self.verbose:
+                    print(f'datahandler: could not publish shared state due to {e.__class__}: {e}')
      
         
         
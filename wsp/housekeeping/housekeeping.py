@@ -38,7 +38,7 @@ print(f"housekeeping: wsp_path = {wsp_path}")
 # winter modules
 # from housekeeping import easygetdata as egd
 from daemon import daemon_utils
-from housekeeping import data_handler, labjacks
+from housekeeping import data_handler, labjacks, shared_state
 
 # from housekeeping import dirfile_python
 
@@ -132,6 +132,16 @@ class housekeeping:
         # build the dictionaries for current data and fame
         self.build_dicts()
 
+        # publish the state in shared memory too, so processes on this machine
+        # don't need to go through GetStatus. the layout is fixed from here on
+        self.shared_state = shared_state.SharedStateWriter.from_config(
+            self.config,
+            names=list(self.hk_config["fields"])
+            + list(self.hk_config.get("header_fields", {}))
+            + data_handler.LOOP_FIELDS,
+            logger=self.logger,
+        )
+
         # create the dirfile
         # NPL 6-1-21: removing the dirfile handling from wsp
         # self.create_dirfile()
@@ -217,6 +227,7 @@ class housekeeping:
             sunsim=self.sunsim,
             ns_host=self.ns_host,
             logger=self.logger,
+            shared_state=self.shared_state,
         )
 
         # define the dirfile write loop
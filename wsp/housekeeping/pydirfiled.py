@@ -37,7 +37,7 @@ import Pyro5.server
 # from PyQt5 import uic, QtGui, QtWidgets
 from PyQt5 import QtCore
 
-from wsp.housekeeping import dirfile_python
+from wsp.housekeeping import dirfile_python, shared_state
 from wsp.utils import logging_setup, utils
 from wsp.utils.paths import CONFIG_PATH, TELEMETRY_CONFIG_PATH, WSP_PATH
 
@@ -70,7 +70,15 @@ class DirfileWriter(QtCore.QObject):
         which can communicate with the communication threads
     """
 
-    def __init__(self, base_directory, config, logger, ns_host=None, verbose=False):
+    def __init__(
+        self,
+        base_directory,
+        config,
+        logger,
+        ns_host=None,
+        verbose=False,
+        shared_state_config=None,
+    ):
         super(DirfileWriter, self).__init__()
 
         self.base_directory = base_directory
@@ -90,6 +98,12 @@ class DirfileWriter(QtCore.QObject):
         # current state values
         self.state = dict()
 
+        # housekeeping's shared memory snapshot, read instead of GetStatus
+        # when wsp is running on this machine
+        self.shared_state = shared_state.SharedStateReader.from_config(
+            {"hk_shared_state": shared_state_config}, logger=self.logger
+        )
+
         # vectors holding all the samples in the current frame
         self.curframe = dict()
         self.samples_in_curframe = 0
@@ -138,7 +152,12 @@ class DirfileWriter(QtCore.QObject):
         # this should reconnect down the line if we get disconnected
         if self.verbose:
             print(f"dirfiled: updating state")
-        if not self.connected:
+        state = self.shared_state.read()
+        if state is not None:
+            self.state = state
+            self.add_to_frame(self.state)
+
+        elif not self.connected:
             self.init_remote_object()
 
         else:
@@ -343,11 +362,17 @@ class Main(QtCore.QObject):
         opts=None,
         verbose=False,
         parent=None,
+        shared_state_config=None,
     ):
         super(Main, self).__init__(parent)
 
         self.dirfileWriter = DirfileWriter(
-            base_directory, config, logger, ns_host, verbose=verbose
+            base_directory,
+            config,
+            logger,
+            ns_host,
+            verbose=verbose,
+            shared_state_config=shared_state_config,
         )
 
 
@@ -417,6 +442,7 @@ if __name__ == "__main__":
         logger=logger,
         ns_host=ns_host,
         verbose=verbose,
+        shared_state_config=config.get("hk_shared_state"),
     )
 
     signal.signal(signal.SIGINT, sigint_handler)
@@ -0,0 +1,526 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+shared_state.py
+
+This file is part of wsp
+
+# PURPOSE #
+Publishes the housekeeping state in shared memory, so that processes on the
+same machine can read it without a Pyro round trip (GetStatus serializes the
+whole state dictionary for every caller, every time it is asked).
+
+The state is written to a file in /dev/shm which every reader maps into its
+memory. The layout is fixed when housekeeping starts: the names of the
+fields are stored in the file once, and each field gets an 8 byte slot and a
+byte saying what is in it (None, an int, a float, a bool or a string, or
+that the field is missing from the state). A
+string slot holds an index into a table of the strings seen so far, so the
+slots stay fixed size and a string which doesn't change isn't copied again.
+The table only grows, until it is full and is started again.
+
+Updates are guarded by a sequence lock: the writer makes the sequence number
+odd, writes the slots and makes it even again. A reader copies the slots
+between two reads of the sequence number and keeps the copy if the two are
+the same and even, and tries again otherwise. Neither side ever waits for
+the other, and reading is only memory access: no system calls.
+
+    # housekeeping
+    writer = SharedStateWriter(path, names)
+    writer.publish(state)
+
+    # on the same machine
+    reader = SharedStateReader(path)
+    state = reader.read()  # None if there's no recent snapshot: use Pyro
+"""
+
+import atexit
+import json
+import logging
+import mmap
+import numbers
+import os
+import struct
+import time
+
+import numpy as np
+
+DEFAULT_PATH = "/dev/shm/wsp_hk_state"
+
+MAGIC = b"WSPHKST1"
+VERSION = 2
+
+# magic, version, n_slots, max_strings, pool_size, schema_offset,
+# schema_size, kinds_offset, values_offset, entries_offset, pool_offset
+LAYOUT = struct.Struct("<8s10I")
+SEQ = struct.Struct("<Q")
+SEQ_OFFSET = 64
+CLOSED = struct.Struct("<I")
+CLOSED_OFFSET = 72
+# publish time (unix), number of strings in the table, table generation
+PUBLISHED = struct.Struct("<dII")
+PUBLISHED_OFFSET = 80
+SCHEMA_OFFSET = 128
+# where each string is in the pool: offset, length
+ENTRY = struct.Struct("<II")
+
+# what is in a slot. MISSING fields (not in the state, or a value which can't
+# be stored) are left out of the snapshot, as they would be from GetStatus
+NONE, INT, FLOAT, BOOL, STR, MISSING = range(6)
+
+INT64_MIN = -(2**63)
+INT64_MAX = 2**63 - 1
+
+# struct (un)packers kept for the different arrangements of slot kinds
+MAX_PACKERS = 64
+
+# times to retry a read which overlapped a write before giving up on it
+MAX_READ_ATTEMPTS = 100
+
+
+def _align(n, to=8):
+    return (n + to - 1) // to * to
+
+
+class _TableFull(Exception):
+    pass
+
+
+# stands in for a field that isn't in the state
+_ABSENT = object()
+
+
+class SharedStateWriter(object):
+    def __init__(
+        self, path, names, max_strings=4096, pool_size=1 << 18, logger=None
+    ):
+        self.path = path
+        # drop repeats, keeping the order
+        self.names = list(dict.fromkeys(names))
+        self.max_strings = max_strings
+        self.pool_size = pool_size
+        self.logger = logger
+
+        self.n_slots = len(self.names)
+        self.seq = 0
+        self.mm = None
+
+        # the snapshot is put together here, then copied in under the lock
+        self.kinds = bytes(self.n_slots)
+        self.values = bytearray(8 * self.n_slots)
+        self.packers = dict()
+
+        # string table
+        self.string_index = dict()
+        self.pool_used = 0
+        self.generation = 0
+        self.new_strings = []
+
+        # metrics
+        self.n_published = 0
+        self.n_unsupported = 0
+        self.last_publish_us = 0.0
+        # fields which have had values that can't be stored, logged once each
+        self.unsupported_fields = set()
+
+    def log(self, msg, level=logging.INFO):
+        msg = f"shared_state: {msg}"
+        if self.logger is None:
+            print(msg)
+        else:
+            self.logger.log(level=level, msg=msg)
+
+    @classmethod
+    def from_config(cls, config, names, logger=None):
+        """
+        Make a writer from the hk_shared_state section of the config and open
+        it. Returns None if it is turned off or the file can't be made.
+        """
+        shm_config = config.get("hk_shared_state", {}) or {}
+        if not shm_config.get("enabled", True):
+            return None
+        writer = cls(
+            shm_config.get("path", DEFAULT_PATH),
+            names,
+            max_strings=shm_config.get("max_strings", 4096),
+            pool_size=shm_config.get("string_pool_size", 1 << 18),
+            logger=logger,
+        )
+        try:
+            writer.open()
+        except Exception as e:
+            writer.log(
+                f"could not set up shared state at {writer.path}: {e}",
+                level=logging.WARNING,
+            )
+            return None
+        return writer
+
+    def open(self):
+        schema = json.dumps(self.names).encode("utf-8")
+        kinds_offset = _align(SCHEMA_OFFSET + len(schema))
+        values_offset = _align(kinds_offset + self.n_slots)
+        entries_offset = values_offset + 8 * self.n_slots
+        pool_offset = entries_offset + ENTRY.size * self.max_strings
+        size = pool_offset + self.pool_size
+        self.kinds_offset = kinds_offset
+        self.values_offset = values_offset
+        self.entries_offset = entries_offset
+        self.pool_offset = pool_offset
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # build the new file next to the old one and swap it in when it's ready
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self.mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        LAYOUT.pack_into(
+            self.mm,
+            0,
+            MAGIC,
+            VERSION,
+            self.n_slots,
+            self.max_strings,
+            self.pool_size,
+            SCHEMA_OFFSET,
+            len(schema),
+            kinds_offset,
+            values_offset,
+            entries_offset,
+            pool_offset,
+        )
+        self.mm[SCHEMA_OFFSET : SCHEMA_OFFSET + len(schema)] = schema
+
+        # readers of the file from the last run move over to this one
+        mark_closed(self.path)
+        os.replace(tmp_path, self.path)
+        atexit.register(self.close)
+        self.log(f"publishing {self.n_slots} fields to {self.path} ({size} bytes)")
+
+    def close(self):
+        if self.mm is None:
+            return
+        CLOSED.pack_into(self.mm, CLOSED_OFFSET, 1)
+        self.mm.close()
+        self.mm = None
+
+    def _intern(self, s, allow_reset):
+        i = self.string_index.get(s)
+        if i is not None:
+            return i
+        b = s.encode("utf-8")
+        if (len(self.string_index) >= self.max_strings) or (
+            self.pool_used + len(b) > self.pool_size
+        ):
+            if allow_reset:
+                raise _TableFull
+            # doesn't fit even in an empty table
+            return None
+        i = len(self.string_index)
+        self.string_index[s] = i
+        self.new_strings.append((i, self.pool_used, b))
+        self.pool_used += len(b)
+        return i
+
+    def _unsupported(self, name, value):
+        self.n_unsupported += 1
+        if name not in self.unsupported_fields:
+            self.unsupported_fields.add(name)
+            self.log(
+                f"can't store {name} = {value!r:.80} ({type(value).__name__}), "
+                "leaving it out of the snapshot",
+                level=logging.WARNING,
+            )
+        return MISSING, 0
+
+    def _classify(self, name, value, allow_reset):
+        """(kind, slot value) for anything other than a plain float, int or str"""
+        if value is _ABSENT:
+            return MISSING, 0
+        if value is None:
+            return NONE, 0
+        # bools are ints, so check for them first
+        if isinstance(value, (bool, np.bool_)):
+            return BOOL, int(value)
+        if isinstance(value, numbers.Integral):
+            if INT64_MIN <= value <= INT64_MAX:
+                return INT, int(value)
+        elif isinstance(value, numbers.Real):
+            return FLOAT, float(value)
+        elif isinstance(value, str):
+            i = self._intern(value, allow_reset)
+            if i is not None:
+                return STR, i
+        return self._unsupported(name, value)
+
+    def _stage(self, state, allow_reset):
+        kinds = []
+        slots = []
+        self.n_unsupported = 0
+        get = state.get
+        for name in self.names:
+            value = get(name, _ABSENT)
+            # nearly everything is a plain float, int or str
+            t = type(value)
+            if t is float:
+                kinds.append(FLOAT)
+                slots.append(value)
+            elif t is int and INT64_MIN <= value <= INT64_MAX:
+                kinds.append(INT)
+                slots.append(value)
+            elif t is str:
+                i = self._intern(value, allow_reset)
+                if i is None:
+                    kind, slot = self._unsupported(name, value)
+                    kinds.append(kind)
+                    slots.append(slot)
+                else:
+                    kinds.append(STR)
+                    slots.append(i)
+            else:
+                kind, slot = self._classify(name, value, allow_reset)
+                kinds.append(kind)
+                slots.append(slot)
+
+        # floats and ints are packed differently, so there's a packer for
+        # each arrangement of kinds. there are only ever a few
+        self.kinds = bytes(kinds)
+        packer = self.packers.get(self.kinds)
+        if packer is None:
+            if len(self.packers) >= MAX_PACKERS:
+                self.packers.clear()
+            packer = struct.Struct(
+                "<" + "".join("d" if kind == FLOAT else "q" for kind in kinds)
+            )
+            self.packers[self.kinds] = packer
+        packer.pack_into(self.values, 0, *slots)
+
+    def publish(self, state):
+        """Write a snapshot of the state. Fields not in the schema are left out."""
+        if self.mm is None:
+            return
+        t_start = time.monotonic()
+        try:
+            self._stage(state, allow_reset=True)
+        except _TableFull:
+            # start the string table again. the readers see the new
+            # generation and forget the strings they have
+            self.string_index.clear()
+            self.new_strings.clear()
+            self.pool_used = 0
+            self.generation += 1
+            self._stage(state, allow_reset=False)
+
+        mm = self.mm
+        self.seq += 1
+        SEQ.pack_into(mm, SEQ_OFFSET, self.seq)
+        for i, offset, b in self.new_strings:
+            start = self.pool_offset + offset
+            mm[start : start + len(b)] = b
+            ENTRY.pack_into(mm, self.entries_offset + ENTRY.size * i, offset, len(b))
+        mm[self.kinds_offset : self.kinds_offset + self.n_slots] = self.kinds
+        mm[self.values_offset : self.values_offset + 8 * self.n_slots] = self.values
+        PUBLISHED.pack_into(
+            mm, PUBLISHED_OFFSET, time.time(), len(self.string_index), self.generation
+        )
+        self.seq += 1
+        SEQ.pack_into(mm, SEQ_OFFSET, self.seq)
+
+        self.new_strings.clear()
+        self.n_published += 1
+        self.last_publish_us = (time.monotonic() - t_start) * 1e6
+
+
+def mark_closed(path):
+    """Tell the readers of an existing state file that it's been replaced"""
+    try:
+        fd = os.open(path, os.O_RDWR)
+    except OSError:
+        return
+    try:
+        if os.fstat(fd).st_size < SCHEMA_OFFSET:
+            return
+        with mmap.mmap(fd, SCHEMA_OFFSET) as mm:
+            if mm[: len(MAGIC)] == MAGIC:
+                CLOSED.pack_into(mm, CLOSED_OFFSET, 1)
+    finally:
+        os.close(fd)
+
+
+class SharedStateReader(object):
+    def __init__(self, path=DEFAULT_PATH, max_age=5.0, enabled=True, logger=None):
+        self.path = path
+        # snapshots older than this (s) are treated as missing
+        self.max_age = max_age
+        self.enabled = enabled
+        self.logger = logger
+
+        self.mm = None
+        self.names = None
+        self.seq = None
+        self.state = None
+        self.strings = []
+        self.generation = None
+        # an unpacker for each arrangement of slot kinds, like the writer's
+        self.decoders = dict()
+
+        # metrics
+        self.n_reads = 0
+        self.n_retries = 0
+
+    def log(self, msg, level=logging.INFO):
+        msg = f"shared_state: {msg}"
+        if self.logger is None:
+            print(msg)
+        else:
+            self.logger.log(level=level, msg=msg)
+
+    @classmethod
+    def from_config(cls, config, logger=None):
+        shm_config = config.get("hk_shared_state", {}) or {}
+        return cls(
+            shm_config.get("path", DEFAULT_PATH),
+            max_age=shm_config.get("max_age", 5.0),
+            enabled=shm_config.get("enabled", True),
+            logger=logger,
+        )
+
+    def attach(self):
+        """Map the state file. Returns whether it worked."""
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except OSError:
+            return False
+        try:
+            size = os.fstat(fd).st_size
+            if size < SCHEMA_OFFSET:
+                return False
+            mm = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+
+        layout = LAYOUT.unpack_from(mm, 0)
+        if layout[0] != MAGIC or layout[1] != VERSION:
+            mm.close()
+            return False
+        (
+            _,
+            _,
+            self.n_slots,
+            _,
+            _,
+            schema_offset,
+            schema_size,
+            self.kinds_offset,
+            self.values_offset,
+            self.entries_offset,
+            self.pool_offset,
+        ) = layout
+        self.names = json.loads(mm[schema_offset : schema_offset + schema_size])
+        self.mm = mm
+        self.seq = None
+        self.state = None
+        self.strings = []
+        self.generation = None
+        return True
+
+    def detach(self):
+        if self.mm is not None:
+            self.mm.close()
+        self.mm = None
+
+    def read(self):
+        """
+        The latest snapshot of the housekeeping state as a dict, or None if
+        there isn't a recent one.
+        """
+        if not self.enabled:
+            return None
+        if self.mm is None and not self.attach():
+            return None
+        mm = self.mm
+        if CLOSED.unpack_from(mm, CLOSED_OFFSET)[0]:
+            # housekeeping was restarted or stopped: move over to the new file
+            self.detach()
+            if not self.attach():
+                return None
+            mm = self.mm
+            if CLOSED.unpack_from(mm, CLOSED_OFFSET)[0]:
+                self.detach()
+                return None
+
+        for _ in range(MAX_READ_ATTEMPTS):
+            seq = SEQ.unpack_from(mm, SEQ_OFFSET)[0]
+            if seq & 1:
+                self.n_retries += 1
+                continue
+            t_publish, n_strings, generation = PUBLISHED.unpack_from(
+                mm, PUBLISHED_OFFSET
+            )
+            if seq == self.seq:
+                # nothing new since the last read
+                kinds = None
+                break
+            kinds = mm[self.kinds_offset : self.kinds_offset + self.n_slots]
+            values = mm[self.values_offset : self.values_offset + 8 * self.n_slots]
+
+            known = self.strings if generation == self.generation else []
+            new_strings = []
+            for i in range(len(known), n_strings):
+                offset, length = ENTRY.unpack_from(mm, self.entries_offset + ENTRY.size * i)
+                start = self.pool_offset + offset
+                new_strings.append(mm[start : start + length])
+
+            if SEQ.unpack_from(mm, SEQ_OFFSET)[0] == seq:
+                break
+            self.n_retries += 1
+        else:
+            # the writer stopped halfway through a write
+            return None
+
+        if (seq == 0) or (time.time() - t_publish > self.max_age):
+            return None
+
+        if kinds is not None:
+            self.strings = known + [b.decode("utf-8") for b in new_strings]
+            self.generation = generation
+            self.state = self._decode(kinds, values)
+            self.seq = seq
+        self.n_reads += 1
+        return dict(self.state)
+
+    def _decode(self, kinds, values):
+        decoder = self.decoders.get(kinds)
+        if decoder is None:
+            if len(self.decoders) >= MAX_PACKERS:
+                self.decoders.clear()
+            unpacker = struct.Struct(
+                "<" + "".join("d" if kind == FLOAT else "q" for kind in kinds)
+            )
+            special = [
+                (k, kind) for k, kind in enumerate(kinds) if kind in (STR, BOOL, NONE)
+            ]
+            missing = [self.names[k] for k, kind in enumerate(kinds) if kind == MISSING]
+            decoder = (unpacker, special, missing)
+            self.decoders[kinds] = decoder
+        unpacker, special, missing = decoder
+
+        slots = list(unpacker.unpack(values))
+        strings = self.strings
+        for k, kind in special:
+            if kind == STR:
+                slots[k] = strings[slots[k]]
+            elif kind == BOOL:
+                slots[k] = bool(slots[k])
+            else:
+                slots[k] = None
+        state = dict(zip(self.names, slots))
+        for name in missing:
+            del state[name]
+        return state
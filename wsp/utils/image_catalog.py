@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+image_catalog.py
+
+This is part of wsp
+
+# Purpose #
+Incremental index of the images in a directory. Night directories grow to
+thousands of files, and globbing and stat'ing all of them every time we want
+the latest image gets slower through the night. The catalog keeps the files
+it has already seen in memory, sorted by modification time, and on each query
+only rescans the directory if the directory itself has changed (new files are
+written with a rename, which updates the directory mtime). A rescan stats every
+file, but only reads the header of files which are new or have changed size or
+mtime. When the directory hasn't changed, the newest few files, and any file
+whose header couldn't be read yet (eg it was still being written), are stat'ed
+again, since that's where files get rewritten in place.
+
+Queries for the latest image, images since a time and images matching header
+values are answered with a binary search on the sorted index.
+
+"""
+
+import bisect
+import fnmatch
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from astropy.io import fits
+
+# header keywords indexed by default for FITS images
+DEFAULT_HEADER_KEYS = ("OBSTYPE", "FILTERID", "EXPTIME", "BOARD_ID")
+# the newest files are the ones which may still be being written
+RECHECK_NEWEST = 8
+
+
+@dataclass
+class ImageRecord:
+    """One file in the catalog"""
+
+    path: str
+    size: int
+    mtime: float
+    header: Dict[str, Any] = field(default_factory=dict)
+    # False if the header couldn't be read, eg the file was still being written
+    complete: bool = True
+
+
+class ImageCatalog:
+    """
+    In-memory index of the files matching a pattern in one directory.
+
+    The index is a list of records sorted by mtime, plus one sorted list of
+    mtimes per (header keyword, value) pair, so all the queries are a
+    bisection rather than a directory scan.
+    """
+
+    def __init__(
+        self,
+        directory,
+        pattern="*.fits",
+        header_keys=DEFAULT_HEADER_KEYS,
+        recheck_newest=RECHECK_NEWEST,
+    ):
+        self.directory = str(directory)
+        self.pattern = pattern
+        self.header_keys = tuple(header_keys)
+        # how many of the newest files are stat'ed again on every query
+        self.recheck_newest = recheck_newest
+
+        self._lock = threading.RLock()
+        self._dir_mtime_ns = None
+        self._records: Dict[str, ImageRecord] = dict()
+        # parallel lists sorted by (mtime, path)
+        self._sort_keys: List[tuple] = []
+        self._sorted_records: List[ImageRecord] = []
+        # (keyword, value) -> sorted list of (mtime, path)
+        self._header_index: Dict[tuple, List[tuple]] = dict()
+        # paths of the records whose header couldn't be read
+        self._incomplete = set()
+
+        self.scans = 0
+        self.files_stated = 0
+
+    def __len__(self):
+        self.refresh()
+        return len(self._sorted_records)
+
+    def _read_header(self, path):
+        """(the indexed keywords, whether the header could be read)"""
+        if not self.header_keys or not path.endswith((".fits", ".fits.fz")):
+            return dict(), True
+        try:
+            header = fits.getheader(path)
+        except Exception:
+            # partially written or not a FITS file, index it without a header
+            # for now and try again on the next refresh
+            return dict(), False
+        return {key: header[key] for key in self.header_keys if key in header}, True
+
+    def _add(self, path, stat_result):
+        header, complete = self._read_header(path)
+        record = ImageRecord(
+            path=path,
+            size=stat_result.st_size,
+            mtime=stat_result.st_mtime,
+            header=header,
+            complete=complete,
+        )
+        self._records[path] = record
+        if not complete:
+            self._incomplete.add(path)
+        key = (record.mtime, path)
+        ind = bisect.bisect(self._sort_keys, key)
+        self._sort_keys.insert(ind, key)
+        self._sorted_records.insert(ind, record)
+        for item in record.header.items():
+            bisect.insort(self._header_index.setdefault(item, []), key)
+
+    def _remove(self, path):
+        record = self._records.pop(path)
+        self._incomplete.discard(path)
+        key = (record.mtime, path)
+        ind = bisect.bisect_left(self._sort_keys, key)
+        del self._sort_keys[ind]
+        del self._sorted_records[ind]
+        for item in record.header.items():
+            keys = self._header_index[item]
+            del keys[bisect.bisect_left(keys, key)]
+
+    def refresh(self, force=False):
+        """
+        Bring the index up to date. Unless the directory has changed since the
+        last scan, this costs a stat of the directory and of the newest few files.
+        """
+        with self._lock:
+            try:
+                dir_mtime_ns = os.stat(self.directory).st_mtime_ns
+            except FileNotFoundError:
+                dir_mtime_ns = None
+
+            if not force and dir_mtime_ns == self._dir_mtime_ns:
+                recheck = set(self._incomplete)
+                if self.recheck_newest > 0:
+                    recheck.update(
+                        record.path
+                        for record in self._sorted_records[-self.recheck_newest :]
+                    )
+                for path in recheck:
+                    try:
+                        stat_result = os.stat(path)
+                    except FileNotFoundError:
+                        self._remove(path)
+                        continue
+                    self.files_stated += 1
+                    self._update(path, stat_result, force=False)
+                return
+            self._dir_mtime_ns = dir_mtime_ns
+            self.scans += 1
+
+            seen = set()
+            if dir_mtime_ns is not None:
+                with os.scandir(self.directory) as entries:
+                    for entry in entries:
+                        if not fnmatch.fnmatch(entry.name, self.pattern):
+                            continue
+                        path = entry.path
+                        try:
+                            stat_result = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        seen.add(path)
+                        self.files_stated += 1
+                        self._update(path, stat_result, force)
+
+            for path in [path for path in self._records if path not in seen]:
+                self._remove(path)
+
+    def _update(self, path, stat_result, force):
+        """Index a file, or index it again if it changed since it was indexed"""
+        record = self._records.get(path)
+        if (
+            record is not None
+            and not force
+            and record.size == stat_result.st_size
+            and record.mtime == stat_result.st_mtime
+        ):
+            return
+        if record is not None:
+            self._remove(path)
+        self._add(path, stat_result)
+
+    def latest(self, **header_values) -> Optional[ImageRecord]:
+        """
+        Get the most recently modified image, optionally only among the images
+        whose header matches header_values, eg latest(OBSTYPE="FOCUS")
+        """
+        self.refresh()
+        with self._lock:
+            if not header_values:
+                return self._sorted_records[-1] if self._sorted_records else None
+            # walk back from the newest image with the first keyword
+            (first_item, *_) = header_values.items()
+            for _, path in reversed(self._header_index.get(first_item, [])):
+                record = self._records[path]
+                if all(record.header.get(k) == v for k, v in header_values.items()):
+                    return record
+            return None
+
+    def since(self, t, **header_values) -> List[ImageRecord]:
+        """
+        Get the images modified at or after unix time t (all of them if t is
+        None), sorted by mtime, optionally matching header_values
+        """
+        return self.between(t, None, **header_values)
+
+    def between(self, start, end, **header_values) -> List[ImageRecord]:
+        """
+        Get the images modified between unix times start and end (inclusive,
+        either can be None for an open bound), sorted by mtime, optionally
+        only those whose header matches all of header_values
+        """
+        self.refresh()
+        with self._lock:
+            lo_key = (float("-inf"),) if start is None else (start,)
+            hi_key = (float("inf"),) if end is None else (end, chr(0x10FFFF))
+
+            if not header_values:
+                lo = bisect.bisect_left(self._sort_keys, lo_key)
+                hi = bisect.bisect_right(self._sort_keys, hi_key)
+                return self._sorted_records[lo:hi]
+
+            # start from the smallest index among the requested keywords,
+            # then check the rest of the keywords on those records only
+            candidates = None
+            for item in header_values.items():
+                keys = self._header_index.get(item, [])
+                lo = bisect.bisect_left(keys, lo_key)
+                hi = bisect.bisect_right(keys, hi_key)
+                if candidates is None or hi - lo < len(candidates):
+                    candidates = keys[lo:hi]
+            return [
+                record
+                for record in (self._records[path] for _, path in candidates)
+                if all(record.header.get(k) == v for k, v in header_values.items())
+            ]
+
+    def matching(self, **header_values) -> List[ImageRecord]:
+        """Get all the images whose header matches header_values"""
+        return self.between(None, None, **header_values)
+
+    def paths(self) -> List[str]:
+        """Get the paths of all the images, sorted by mtime"""
+        return [record.path for record in self.since(None)]
+
+
+# catalogs are kept per (directory, pattern, header keys) for the life of the
+# process so repeated calls only pay for the incremental update
+_catalogs: Dict[tuple, ImageCatalog] = dict()
+_catalogs_lock = threading.Lock()
+
+
+def get_image_catalog(
+    directory, pattern="*.fits", header_keys=DEFAULT_HEADER_KEYS
+) -> ImageCatalog:
+    """Get the shared catalog for a directory, creating it on first use"""
+    key = (os.path.abspath(directory), pattern, tuple(header_keys))
+    with _catalogs_lock:
+        catalog = _catalogs.get(key)
+        if catalog is None:
+            catalog = ImageCatalog(key[0], pattern=pattern, header_keys=header_keys)
+            _catalogs[key] = catalog
+    return catalog
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+protocol_client.py
+
+A client for the text protocols spoken by the dome command server and
+similar daemons: send a command, get back a reply ending in a newline
+("line" framing) or a JSON/YAML object ("json" framing, eg the reply to
+status?).
+
+Unlike utils.query_socket, received bytes are kept in a buffer between
+replies, so a reply split across reads or arriving together with the start
+of the next one is framed correctly, and nothing after the end of a reply is
+thrown away. The server answers requests in order, so each reply is matched
+to the oldest request still waiting for one. Several requests can be sent
+before their replies are read (up to max_in_flight), eg to send the next
+status poll as soon as the last one is answered. If a reply doesn't come in
+time the connection is dropped, so that a late reply can't be taken for the
+answer to a later request.
+
+Reconnection attempts back off exponentially, from min_backoff to
+max_backoff seconds, and every attempt uses a fresh socket.
+
+The client is not thread safe: use one per thread.
+
+    client = ProtocolClient("localhost", 62000)
+    client.connect()
+    state = parse_reply(client.query("status?", framing="json"))
+"""
+
+import collections
+import logging
+import re
+import select
+import socket
+import time
+
+import yaml
+
+# the characters that matter for finding the end of a json object
+JSON_TOKENS = re.compile(rb'[{}"\\]')
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def split_line(buffer):
+    """
+    Find the first line in the buffer. Returns (frame, end, n_stray) where
+    end is the index after the newline, or None if there is no complete line.
+    """
+    end = buffer.find(b"\n")
+    if end < 0:
+        return None
+    return bytes(buffer[:end]).rstrip(b"\r"), end + 1, 0
+
+
+def split_json(buffer):
+    """
+    Find the first complete {...} object in the buffer, matching braces
+    outside of strings. Anything other than whitespace before it is counted
+    as stray. A line ending right after the object belongs to the reply, so
+    end is after it if it is there. Returns (frame, end, n_stray), or None if
+    there is no complete object yet.
+    """
+    start = buffer.find(b"{")
+    if start < 0:
+        return None
+    n_stray = len(bytes(buffer[:start]).strip())
+
+    depth = 0
+    in_string = False
+    escaped_until = -1
+    for match in JSON_TOKENS.finditer(buffer, start):
+        i = match.start()
+        if i < escaped_until:
+            continue
+        token = match.group()
+        if in_string:
+            if token == b"\\":
+                escaped_until = i + 2
+            elif token == b'"':
+                in_string = False
+        elif token == b'"':
+            in_string = True
+        elif token == b"{":
+            depth += 1
+        elif token == b"}":
+            depth -= 1
+            if depth == 0:
+                return bytes(buffer[start : i + 1]), skip_line_ending(buffer, i + 1), n_stray
+    return None
+
+
+def skip_line_ending(buffer, start=0):
+    """Return the index after the line ending at start, or start if there isn't one"""
+    if buffer[start : start + 2] == b"\r\n":
+        return start + 2
+    if buffer[start : start + 1] in (b"\n", b"\r"):
+        return start + 1
+    return start
+
+
+FRAMINGS = {"line": split_line, "json": split_json}
+
+
+def parse_reply(reply):
+    """Turn a reply into a dict or number if it can be, like query_socket does"""
+    try:
+        # yaml handles keys and values missing their quotes
+        return yaml.load(reply, Loader=yaml.FullLoader)
+    except Exception:
+        return reply
+
+
+class Request(object):
+    __slots__ = ("cmd", "split", "t_sent", "t_reply", "reply", "nbytes")
+
+    def __init__(self, cmd, split):
+        self.cmd = cmd
+        self.split = split
+        self.t_sent = time.monotonic()
+        self.t_reply = None
+        self.reply = None
+        self.nbytes = 0
+
+    @property
+    def done(self):
+        return self.t_reply is not None
+
+
+class ProtocolClient(object):
+    def __init__(
+        self,
+        addr,
+        port,
+        connect_timeout=0.5,
+        reply_timeout=2.0,
+        line_ending="\n",
+        max_in_flight=1,
+        min_backoff=0.5,
+        max_backoff=60.0,
+        max_buffer=1 << 20,
+        name="client",
+        logger=None,
+        verbose=False,
+    ):
+        self.addr = addr
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.reply_timeout = reply_timeout
+        self.line_ending = line_ending
+        self.max_in_flight = max_in_flight
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.max_buffer = max_buffer
+        self.name = name
+        self.logger = logger
+        self.verbose = verbose
+
+        self.sock = None
+        self.connected = False
+        self.buffer = bytearray()
+        self.in_flight = collections.deque()
+        # set when a json reply ended at the end of the buffer, so the line
+        # ending after it (if the server sends one) hasn't been received yet
+        self.line_ending_pending = False
+
+        # reconnection
+        self.n_failures = 0
+        self.backoff = 0.0
+        self.t_next_attempt = 0.0
+
+        # metrics
+        self.n_connects = 0
+        self.n_replies = 0
+        self.bytes_received = 0
+        self.stray_bytes = 0
+        self.last_latency = None
+        self.last_reply_bytes = 0
+
+    def log(self, msg, level=logging.INFO):
+        msg = f"{self.name}: {msg}"
+        if self.logger is None:
+            print(msg)
+        else:
+            self.logger.log(level=level, msg=msg)
+
+    def time_until_reconnect(self):
+        """Seconds until the next connection attempt is allowed"""
+        if self.connected:
+            return 0.0
+        return max(0.0, self.t_next_attempt - time.monotonic())
+
+    def connect(self, force=False):
+        """
+        Connect unless already connected. Unless force is set, nothing is
+        tried until the backoff after the last failed attempt is over.
+        Returns whether the client is connected.
+        """
+        if self.connected:
+            return True
+        if (not force) and (time.monotonic() < self.t_next_attempt):
+            return False
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(self.connect_timeout)
+        try:
+            sock.connect((self.addr, self.port))
+        except OSError as e:
+            sock.close()
+            self.n_failures += 1
+            self.backoff = min(
+                self.max_backoff, self.min_backoff * 2 ** (self.n_failures - 1)
+            )
+            self.t_next_attempt = time.monotonic() + self.backoff
+            if self.verbose:
+                self.log(
+                    f"could not connect to ({self.addr} | {self.port}): {e}, "
+                    f"next attempt in {self.backoff:0.1f} s"
+                )
+            return False
+
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+        self.connected = True
+        self.buffer.clear()
+        self.in_flight.clear()
+        self.line_ending_pending = False
+        self.n_failures = 0
+        self.backoff = 0.0
+        self.n_connects += 1
+        if self.verbose:
+            self.log(f"connected to ({self.addr} | {self.port})")
+        return True
+
+    def close(self, reason=None):
+        """Drop the connection and any requests still waiting for replies"""
+        if reason is not None:
+            self.log(f"closing connection: {reason}", level=logging.WARNING)
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.connected = False
+        self.buffer.clear()
+        self.in_flight.clear()
+        self.line_ending_pending = False
+        # the first reconnection after losing a working connection is right away
+        self.t_next_attempt = time.monotonic() + self.backoff
+
+    def submit(self, cmd, framing="line"):
+        """
+        Send a command without waiting for the reply. The reply is framed
+        with framing ("line" or "json"). If max_in_flight requests are
+        already waiting, waits for the oldest first. Returns the Request.
+        """
+        if not self.connected:
+            raise ConnectionError(f"{self.name} is not connected")
+        while len(self.in_flight) >= self.max_in_flight:
+            self.wait(self.in_flight[0])
+
+        self._drop_pending_line_ending()
+        if not self.in_flight and self.buffer:
+            # nothing was asked for, so nothing should be here
+            self.stray_bytes += len(self.buffer)
+            self.log(
+                f"discarding {len(self.buffer)} unexpected bytes: {bytes(self.buffer[:80])}",
+                level=logging.DEBUG,
+            )
+            self.buffer.clear()
+
+        request = Request(cmd, FRAMINGS[framing])
+        try:
+            self.sock.sendall((cmd + self.line_ending).encode("utf-8"))
+        except OSError as e:
+            self.close(f"could not send {cmd!r}: {e}")
+            raise ConnectionError(f"{self.name}: could not send {cmd!r}: {e}")
+        self.in_flight.append(request)
+        return request
+
+    def wait(self, request, timeout=None):
+        """Wait for the reply to a request and return it (a str)"""
+        if timeout is None:
+            timeout = self.reply_timeout
+        deadline = request.t_sent + timeout
+        while not request.done:
+            if not self.in_flight:
+                raise ConnectionError(f"{self.name}: connection lost before the reply")
+            if not self._take_frame():
+                self._receive(deadline, request)
+        return request.reply
+
+    def query(self, cmd, framing="line", timeout=None):
+        """Send a command and wait for its reply"""
+        return self.wait(self.submit(cmd, framing), timeout)
+
+    def _take_frame(self):
+        """Give the oldest waiting request its reply if it is in the buffer"""
+        request = self.in_flight[0]
+        self._drop_pending_line_ending()
+        frame = request.split(self.buffer)
+        if frame is None:
+            if len(self.buffer) > self.max_buffer:
+                self.close(f"{len(self.buffer)} bytes received without a complete reply")
+                raise ProtocolError(f"{self.name}: reply to {request.cmd!r} too long")
+            return False
+        reply, end, n_stray = frame
+        self.line_ending_pending = request.split is split_json and end == len(self.buffer)
+        del self.buffer[:end]
+        self.in_flight.popleft()
+
+        request.t_reply = time.monotonic()
+        request.reply = reply.decode("utf-8", errors="replace")
+        request.nbytes = end
+        self.n_replies += 1
+        self.stray_bytes += n_stray
+        self.last_latency = request.t_reply - request.t_sent
+        self.last_reply_bytes = end
+        return True
+
+    def _drop_pending_line_ending(self):
+        """
+        Drop the line ending of the last json reply if it arrived after the
+        reply, so it isn't taken for an empty line reply to the next request
+        """
+        if self.line_ending_pending and self.buffer:
+            end = skip_line_ending(self.buffer)
+            # a \r at the end of the buffer may still be followed by a \n
+            self.line_ending_pending = self.buffer[end - 1 : end] == b"\r" and end == len(self.buffer)
+            del self.buffer[:end]
+
+    def _receive(self, deadline, request):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            self.close(f"no reply to {request.cmd!r} after {self.reply_timeout} s")
+            raise TimeoutError(f"{self.name}: no reply to {request.cmd!r}")
+        try:
+            readable, _, _ = select.select([self.sock], [], [], remaining)
+            if not readable:
+                return
+            data = self.sock.recv(65536)
+        except OSError as e:
+            self.close(f"could not receive: {e}")
+            raise ConnectionError(f"{self.name}: could not receive: {e}")
+        if not data:
+            self.close("connection closed by the server")
+            raise ConnectionError(f"{self.name}: connection closed by the server")
+        self.bytes_received += len(data)
+        self.buffer += data
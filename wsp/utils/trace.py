@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+trace.py
+
+Lightweight timing of the steps that make up an observation.
+
+A span is a named interval of time.monotonic_ns(), stamped with the
+observation (obsHistID) being worked on when it was opened:
+
+    from wsp.utils import trace
+
+    with trace.span("robo.select"):
+        ...
+
+    @trace.traced("camera.header")
+    def getFITSheader(self):
+        ...
+
+    trace.record("motion.mount", t_start, t_done)   # times from time.monotonic()
+
+Finished spans go into a ring buffer of the most recent ones (trace.recent())
+and, once trace.start() has been called, a writer thread appends them to
+$HOME/<directory>/trace_<night>_<process>.jsonl. Opening and closing a span
+only reads the clock and appends a tuple to two deques, so a span costs on
+the order of a microsecond; the json encoding and the disk are on the writer
+thread. Each file starts with a line relating the monotonic clock to the wall
+clock, so the files of processes on different hosts can be lined up.
+
+wsp/utils/trace_report.py reads the files back and breaks each observation
+down into its critical path.
+"""
+
+import collections
+import functools
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+# the default ring size, used until start() is called with the config
+RING_SIZE = 10000
+# spans waiting for the writer thread. if the writer falls this far behind,
+# the oldest are dropped (they are still in the ring buffer)
+MAX_PENDING = 100000
+
+
+def night_string():
+    # the same (UTC) night convention as utils.tonight, which names the logs
+    return time.strftime("%Y%m%d", time.gmtime())
+
+
+def trace_filepath(directory, process, night=None):
+    if night is None:
+        night = night_string()
+    return os.path.join(directory, f"trace_{night}_{process}.jsonl")
+
+
+class Span(object):
+    """A context manager timing one span. Made by Tracer.span."""
+
+    __slots__ = ("tracer", "name", "attrs", "t0", "obs")
+
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.obs = self.tracer.obs
+        self.t0 = time.monotonic_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        t1 = time.monotonic_ns()
+        attrs = self.attrs
+        if exc_type is not None:
+            attrs = dict(attrs or {}, error=exc_type.__name__)
+        self.tracer.add((self.name, self.t0, t1, self.obs, attrs))
+        return False
+
+
+class _NoSpan(object):
+    """Stands in for a Span when tracing is turned off"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+class Tracer(object):
+    def __init__(self, ring_size=RING_SIZE):
+        self.enabled = True
+        # the observation new spans are stamped with
+        self.obs = None
+
+        # each span is kept as (name, t0_ns, t1_ns, obs, attrs)
+        self.ring = collections.deque(maxlen=ring_size)
+        self.pending = None
+
+        self.process = None
+        self.directory = None
+        self.flush_interval = 1.0
+        self.logger = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._file = None
+        self._filepath = None
+
+    def log(self, msg, level=logging.INFO):
+        msg = f"trace: {msg}"
+        if self.logger is None:
+            print(msg)
+        else:
+            self.logger.log(level=level, msg=msg)
+
+    def add(self, rec):
+        # deque appends are atomic, so spans can be added from any thread
+        self.ring.append(rec)
+        if self.pending is not None:
+            self.pending.append(rec)
+
+    def span(self, name, **attrs):
+        """A context manager which times the block as a span called name."""
+        if not self.enabled:
+            return NO_SPAN
+        return Span(self, name, attrs or None)
+
+    def record(self, name, t0, t1, obs=None, **attrs):
+        """
+        Add a span timed elsewhere. t0 and t1 are time.monotonic() seconds.
+        obs defaults to the current observation.
+        """
+        if not self.enabled:
+            return
+        if obs is None:
+            obs = self.obs
+        self.add((name, int(t0 * 1e9), int(t1 * 1e9), obs, attrs or None))
+
+    def traced(self, name):
+        """Decorator which times every call of the function as a span."""
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with Span(self, name, None):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def set_obs(self, obs):
+        """Stamp the spans opened from now on with this observation (or None)."""
+        self.obs = obs
+
+    def recent(self, n=None):
+        """The most recent spans as dicts, oldest first."""
+        recs = list(self.ring)
+        if n is not None:
+            recs = recs[-n:]
+        return [self.to_dict(rec) for rec in recs]
+
+    @staticmethod
+    def to_dict(rec):
+        name, t0, t1, obs, attrs = rec
+        d = {"name": name, "t0": t0 / 1e9, "t1": t1 / 1e9, "obs": obs}
+        if attrs:
+            d.update(attrs)
+        return d
+
+    def start(self, process, config=None, logger=None):
+        """
+        Start writing spans to this process's trace file, using the tracing
+        section of the config.
+        """
+        tracing_config = (config or {}).get("tracing", {}) or {}
+        self.logger = logger
+        self.enabled = tracing_config.get("enabled", True)
+        if not self.enabled:
+            self.log("tracing is turned off")
+            return
+
+        ring_size = tracing_config.get("ring_size", RING_SIZE)
+        if ring_size != self.ring.maxlen:
+            self.ring = collections.deque(self.ring, maxlen=ring_size)
+        self.flush_interval = tracing_config.get("flush_interval", 1.0)
+        self.process = process
+        self.directory = os.path.join(
+            os.getenv("HOME"), tracing_config.get("directory", "data/traces")
+        )
+
+        if self._thread is not None:
+            return
+        # spans from before start are in the ring, so they get written too
+        self.pending = collections.deque(self.ring, maxlen=MAX_PENDING)
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="trace_writer", daemon=True
+        )
+        self._thread.start()
+        self.log(f"writing spans to {trace_filepath(self.directory, process)}")
+
+    def stop(self):
+        """Write out the pending spans and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _open(self):
+        filepath = trace_filepath(self.directory, self.process)
+        if filepath == self._filepath:
+            return
+        if self._file is not None:
+            self._file.close()
+        os.makedirs(self.directory, exist_ok=True)
+        self._file = open(filepath, "a")
+        self._filepath = filepath
+        header = {
+            "process": self.process,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "wall": time.time(),
+            "mono": time.monotonic(),
+        }
+        self._file.write(json.dumps(header) + "\n")
+
+    def _write_pending(self):
+        if not self.pending:
+            return
+        try:
+            # a new night starts a new file
+            self._open()
+            lines = []
+            while self.pending:
+                lines.append(json.dumps(self.to_dict(self.pending.popleft())))
+            self._file.write("\n".join(lines) + "\n")
+            self._file.flush()
+        except Exception as e:
+            self.log(f"could not write trace file: {e}", level=logging.WARNING)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self._write_pending()
+        self._write_pending()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._filepath = None
+
+
+# one tracer per process
+tracer = Tracer()
+
+span = tracer.span
+record = tracer.record
+traced = tracer.traced
+set_obs = tracer.set_obs
+recent = tracer.recent
+start = tracer.start
+stop = tracer.stop
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+trace_report.py
+
+Breaks down where the time went during a night, from the trace files that
+wsp and the camera daemons write (see trace.py).
+
+Each observation runs from its first span to the first span of the next
+one, so the time spent picking the next target and waiting on anything else
+between exposures is charged to the observation before it. Within that
+window every moment is charged to one span, the one the observation was
+waiting on: of the spans open at that moment, leave out the ones containing
+another open span (eg the wintercmd command around a camera call), and of the
+rest take the one which ends last. The moves and the camera daemon's steps
+run side by side, so they are never taken to contain each other. Work which doesn't hold up the next step,
+like the FITS write or ranking the next targets, only counts when nothing
+else is open. The spans are grouped into phases (slew, settle, filter,
+rotator, exposure, readout, header, write, log, ...); time with no span open
+is "untraced".
+
+    python -m wsp.utils.trace_report                 # tonight
+    python -m wsp.utils.trace_report 20261019 --path # with each critical path
+    python -m wsp.utils.trace_report 20261019 -o night.json
+"""
+
+import fnmatch
+import getopt
+import glob
+import json
+import os
+import sys
+from datetime import datetime, timezone
+
+import yaml
+
+if __name__ == "__main__":
+    wsp_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    sys.path.insert(1, wsp_path)
+
+from wsp.utils.paths import CONFIG_PATH
+from wsp.utils.trace import night_string
+
+# span names (fnmatch patterns) in each phase, the first match wins
+PHASES = [
+    ("settle", ["motion.*.settle"]),
+    ("tracking", ["motion.*tracking*"]),
+    (
+        "slew",
+        [
+            "motion.mount",
+            "motion.dome",
+            "wintercmd.mount_goto*",
+            "wintercmd.mount_dither*",
+            "wintercmd.mount_offset*",
+            "wintercmd.dome_goto*",
+        ],
+    ),
+    ("rotator", ["motion.rotator*", "wintercmd.rotator_*"]),
+    ("filter", ["motion.filter", "wintercmd.fw_goto*", "wintercmd.command_filter_wheel"]),
+    ("exposure", ["daemon.exposure"]),
+    ("readout", ["daemon.readout"]),
+    # the rest of the doExposure command: waiting to see that the camera is
+    # done, or all of it if the camera daemon doesn't write a trace
+    ("camera", ["wintercmd.doExposure"]),
+    ("header", ["camera.header"]),
+    ("setup", ["camera.*", "wintercmd.setExposure"]),
+    ("write", ["daemon.write"]),
+    ("log", ["robo.log_observation"]),
+    ("select", ["robo.select", "robo.lookahead"]),
+    ("robo", ["robo.*", "wintercmd.robo_*"]),
+    ("command", ["wintercmd.*"]),
+]
+PHASE_NAMES = [phase for phase, _ in PHASES] + ["other", "untraced"]
+
+# spans which run alongside the observation without holding it up
+BACKGROUND = ("daemon.write", "robo.lookahead")
+# spans which never have others nested inside them
+PARALLEL = ("motion.*", "daemon.*")
+
+
+def phase_of(name):
+    for phase, patterns in PHASES:
+        for pattern in patterns:
+            if fnmatch.fnmatchcase(name, pattern):
+                return phase
+    return "other"
+
+
+def load_traces(directory, night):
+    """
+    Read every process's trace file for the night. Returns the spans as
+    dicts with t0 and t1 in unix time, sorted by t0.
+    """
+    spans = []
+    for filepath in sorted(glob.glob(os.path.join(directory, f"trace_{night}_*.jsonl"))):
+        # each (re)start of the process writes a line relating its clocks
+        offset = None
+        process = None
+        with open(filepath) as file:
+            for line in file:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    # a line cut short when the process died
+                    continue
+                if "mono" in rec:
+                    offset = rec["wall"] - rec["mono"]
+                    process = rec["process"]
+                    continue
+                if offset is None:
+                    continue
+                rec["t0"] += offset
+                rec["t1"] += offset
+                rec["process"] = process
+                spans.append(rec)
+    spans.sort(key=lambda rec: rec["t0"])
+    return spans
+
+
+def observation_windows(spans):
+    """
+    Split the night into observations: [(obs, t_start, t_end)]. A new one
+    starts with the first span stamped with a different obsHistID.
+    """
+    windows = []
+    for rec in spans:
+        obs = rec.get("obs")
+        if obs is None or rec["name"] in BACKGROUND:
+            continue
+        if windows and windows[-1][0] == obs:
+            windows[-1][2] = max(windows[-1][2], rec["t1"])
+        else:
+            if windows:
+                windows[-1][2] = rec["t0"]
+            windows.append([obs, rec["t0"], rec["t1"]])
+    return [tuple(window) for window in windows]
+
+
+def critical_path(spans, t_start, t_end):
+    """
+    The critical path through the window: a list of (phase, name, t0, t1)
+    segments in time order.
+    """
+    active_spans = [
+        (i, rec) for i, rec in enumerate(spans) if rec["t1"] > t_start and rec["t0"] < t_end
+    ]
+    edges = {t_start, t_end}
+    for _, rec in active_spans:
+        edges.update(t for t in (rec["t0"], rec["t1"]) if t_start < t < t_end)
+    edges = sorted(edges)
+
+    def contains(outer, inner):
+        (i, a), (j, b) = outer, inner
+        return (
+            not any(fnmatch.fnmatchcase(a["name"], pattern) for pattern in PARALLEL)
+            and a["t0"] <= b["t0"]
+            and b["t1"] <= a["t1"]
+            and (a["t1"] - a["t0"], i) > (b["t1"] - b["t0"], j)
+        )
+
+    path = []
+    for a, b in zip(edges[:-1], edges[1:]):
+        active = [s for s in active_spans if s[1]["t0"] <= a and s[1]["t1"] >= b]
+        leaves = [s for s in active if not any(contains(s, o) for o in active if o is not s)]
+        foreground = [s for s in leaves if s[1]["name"] not in BACKGROUND]
+        leaves = foreground or leaves
+        if leaves:
+            _, rec = max(
+                leaves,
+                key=lambda s: (s[1]["t1"], -PHASE_NAMES.index(phase_of(s[1]["name"]))),
+            )
+            phase, name = phase_of(rec["name"]), rec["name"]
+        else:
+            phase, name = "untraced", ""
+
+        if path and path[-1][0] == phase and path[-1][1] == name:
+            path[-1] = (phase, name, path[-1][2], b)
+        else:
+            path.append((phase, name, a, b))
+    return path
+
+
+def analyze(spans):
+    """Break each observation down by phase. Returns a list of dicts."""
+    observations = []
+    for obs, t_start, t_end in observation_windows(spans):
+        path = critical_path(spans, t_start, t_end)
+        phases = dict()
+        for phase, _, t0, t1 in path:
+            phases[phase] = phases.get(phase, 0.0) + (t1 - t0)
+        observations.append(
+            {
+                "obsHistID": obs,
+                "start": t_start,
+                "cycle": t_end - t_start,
+                "phases": phases,
+                "path": [
+                    {"phase": phase, "span": name, "t0": t0 - t_start, "dt": t1 - t0}
+                    for phase, name, t0, t1 in path
+                ],
+            }
+        )
+    return observations
+
+
+def utc_string(t):
+    return datetime.fromtimestamp(t, timezone.utc).strftime("%H:%M:%S")
+
+
+def render(night, observations, show_path=False):
+    lines = []
+    total = sum(o["cycle"] for o in observations)
+    if not observations:
+        return f"night {night}: no observations traced"
+
+    phase_totals = dict()
+    for o in observations:
+        for phase, dt in o["phases"].items():
+            phase_totals[phase] = phase_totals.get(phase, 0.0) + dt
+    exposing = phase_totals.get("exposure", 0.0)
+    lines.append(
+        f"night {night}: {len(observations)} observations in {total:0.1f} s, "
+        f"{100 * exposing / total:0.1f}% of it exposing"
+    )
+    lines.append(f"  {'phase':<10} {'total (s)':>10} {'per obs (s)':>12} {'share':>7}")
+    for phase in PHASE_NAMES:
+        if phase in phase_totals:
+            dt = phase_totals[phase]
+            lines.append(
+                f"  {phase:<10} {dt:>10.1f} {dt / len(observations):>12.2f} "
+                f"{100 * dt / total:>6.1f}%"
+            )
+
+    lines.append("")
+    for o in observations:
+        breakdown = "  ".join(
+            f"{phase} {o['phases'][phase]:0.1f}"
+            for phase in PHASE_NAMES
+            if o["phases"].get(phase, 0.0) >= 0.05
+        )
+        lines.append(
+            f"obsHistID {o['obsHistID']:>6}  {utc_string(o['start'])}  "
+            f"{o['cycle']:6.1f} s:  {breakdown}"
+        )
+        if show_path:
+            for seg in o["path"]:
+                # leave out the slivers between nested spans
+                if seg["dt"] < 0.005:
+                    continue
+                lines.append(
+                    f"    +{seg['t0']:7.2f} s  {seg['dt']:7.2f} s  "
+                    f"{seg['phase']:<9} {seg['span']}"
+                )
+    return "\n".join(lines)
+
+
+def usage():
+    print(
+        "usage: trace_report.py [night (YYYYMMDD, default tonight)] "
+        "[-d <trace directory>] [--path] [-o <output.json>]"
+    )
+
+
+if __name__ == "__main__":
+    config = yaml.load(open(CONFIG_PATH), Loader=yaml.FullLoader)
+    directory = os.path.join(
+        os.getenv("HOME"), config.get("tracing", {}).get("directory", "data/traces")
+    )
+    show_path = False
+    output = None
+
+    try:
+        arguments, values = getopt.getopt(
+            sys.argv[1:], "hd:o:", ["help", "dir=", "path", "output="]
+        )
+    except getopt.error as err:
+        print(str(err))
+        usage()
+        sys.exit(1)
+
+    for currentArgument, currentValue in arguments:
+        if currentArgument in ("-h", "--help"):
+            usage()
+            sys.exit(0)
+        elif currentArgument in ("-d", "--dir"):
+            directory = currentValue
+        elif currentArgument == "--path":
+            show_path = True
+        elif currentArgument in ("-o", "--output"):
+            output = currentValue
+
+    night = values[0] if values else night_string()
+    spans = load_traces(directory, night)
+    observations = analyze(spans)
+    print(render(night, observations, show_path=show_path))
+
+    if output is not None:
+        with open(output, "w") as file:
+            json.dump({"night": night, "observations": observations}, file, indent=2)
+        print(f"\nwrote {output}")
@@ -18,7 +18,6 @@ are cited where functions are lifted from elsewhere (or are meant to be!).
 
 
 # import unicodecsv
-import glob
 import json
 import logging
 import os
@@ -49,6 +48,12 @@ import matplotlib.pyplot as plt
 from astropy.io import fits
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 
+try:
+    from .image_catalog import get_image_catalog
+except ImportError:
+    # running this file directly
+    from image_catalog import get_image_catalog
+
 
 def offset_coordinates_to_detector_position(
     ra: float,
@@ -691,7 +696,9 @@ def getImages(starttime, endtime, camera="SUMMER", fullpath=True):
     night = tonight_local(datetime_start.timestamp())
     # print(f'night = {night}')
     impath = os.path.join(os.getenv("HOME"), "data", "images", night)
-    filelist = glob.glob(os.path.join(impath, "*.fits"))
+    # the catalog only rescans the directory when it has changed
+    # only the paths are needed, so don't read the headers
+    filelist = get_image_catalog(impath, "*.fits", header_keys=()).paths()
     imglist = []
     for file in filelist:
         if camera.lower() == "summer":
@@ -783,7 +790,7 @@ def getLastModifiedFile(directory, name="*"):
 
     Gets the last modified file in the directory.
 
-    If there are multiple with the same modification date, then get the first from the list
+    If there are multiple with the same modification date, then get the last by path
 
     directory is a complete filepath
 
@@ -793,17 +800,13 @@ def getLastModifiedFile(directory, name="*"):
 
     """
 
-    files = np.array(glob.glob(os.path.join(directory, name)))
-
-    modtimes = np.array([os.stat(file).st_mtime for file in files])
-
-    # get the most recent file(s)
-    latest = files[modtimes == np.max(modtimes)]
+    # the catalog keeps the files sorted by mtime and only stats new ones
+    latest = get_image_catalog(directory, name, header_keys=()).latest()
 
-    # return the first element of the latest array
-    latest_filepath = latest[0]
+    if latest is None:
+        raise FileNotFoundError(f"no files matching {name} in {directory}")
 
-    return latest_filepath
+    return latest.path
 
 
 # BELOW FUNCTIONS LOOK HELPFUL BUT HAVE NOT BEEN TESTED FOR COMPATIBILITY
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+rolling_stats.py
+
+this is a helper for the watchdog monitor which keeps time-windowed
+statistics (mean, least-squares slope, min and max) of a stream of samples.
+
+the samples live in a preallocated circular buffer, and the mean and slope
+come from running sums which are updated as samples enter and leave the
+window, so each update costs the same no matter how long the window is. min
+and max come from monotonic queues, which is O(1) amortized per sample.
+
+@author: nlourie
+"""
+import collections
+import numpy as np
+
+
+class RollingStats(object):
+    """
+    Rolling statistics over the samples from the last dt_window seconds.
+
+    NaN samples are ignored. The buffer starts with room for capacity
+    samples and doubles if the window ever holds more than that.
+    """
+
+    def __init__(self, dt_window, capacity=256):
+        self.dt_window = dt_window
+        self._t = np.zeros(capacity)
+        self._y = np.zeros(capacity)
+        self._start = 0
+        self.n = 0
+
+        # running sums. times are relative to t_ref to keep t**2 well
+        # conditioned (unix timestamps squared lose all precision)
+        self._t_ref = None
+        self._sum_t = 0.0
+        self._sum_y = 0.0
+        self._sum_tt = 0.0
+        self._sum_ty = 0.0
+        # the running sums drift from rounding as samples are added and
+        # removed, so they are recomputed exactly every so often
+        self._updates_since_resum = 0
+
+        # monotonic queues of (t, y) for the window min and max
+        self._minq = collections.deque()
+        self._maxq = collections.deque()
+
+    @property
+    def capacity(self):
+        return len(self._t)
+
+    def _grow(self):
+        order = (self._start + np.arange(self.n)) % self.capacity
+        self._t = np.concatenate([self._t[order], np.zeros(self.capacity)])
+        self._y = np.concatenate([self._y[order], np.zeros(self.capacity)])
+        self._start = 0
+
+    def _resum(self):
+        t, y = self.window()
+        t = t - self._t_ref
+        self._sum_t = float(np.sum(t))
+        self._sum_y = float(np.sum(y))
+        self._sum_tt = float(np.sum(t * t))
+        self._sum_ty = float(np.sum(t * y))
+        self._updates_since_resum = 0
+
+    def _evict(self, t_now):
+        t_min = t_now - self.dt_window
+        while self.n > 0 and self._t[self._start] <= t_min:
+            t = self._t[self._start] - self._t_ref
+            y = self._y[self._start]
+            self._sum_t -= t
+            self._sum_y -= y
+            self._sum_tt -= t * t
+            self._sum_ty -= t * y
+            self._start = (self._start + 1) % self.capacity
+            self.n -= 1
+            self._updates_since_resum += 1
+        while self._minq and self._minq[0][0] <= t_min:
+            self._minq.popleft()
+        while self._maxq and self._maxq[0][0] <= t_min:
+            self._maxq.popleft()
+
+    def add(self, t, y):
+        """
+        add the sample y taken at unix time t, and drop the samples which
+        have fallen out of the window. samples must come in time order.
+        """
+        self._evict(t)
+
+        try:
+            y = float(y)
+        except (TypeError, ValueError):
+            return
+        if np.isnan(y):
+            return
+
+        if self._t_ref is None or self.n == 0:
+            # rebase whenever the window empties
+            self._t_ref = t
+            self._sum_t = self._sum_y = self._sum_tt = self._sum_ty = 0.0
+
+        if self.n == self.capacity:
+            self._grow()
+        end = (self._start + self.n) % self.capacity
+        self._t[end] = t
+        self._y[end] = y
+        self.n += 1
+
+        tr = t - self._t_ref
+        self._sum_t += tr
+        self._sum_y += y
+        self._sum_tt += tr * tr
+        self._sum_ty += tr * y
+
+        while self._minq and self._minq[-1][1] >= y:
+            self._minq.pop()
+        self._minq.append((t, y))
+        while self._maxq and self._maxq[-1][1] <= y:
+            self._maxq.pop()
+        self._maxq.append((t, y))
+
+        self._updates_since_resum += 1
+        if self._updates_since_resum > self.capacity:
+            self._resum()
+
+    def window(self):
+        """
+        return copies of the (timestamps, values) arrays currently in the window
+        """
+        order = (self._start + np.arange(self.n)) % self.capacity
+        return self._t[order], self._y[order]
+
+    @property
+    def mean(self):
+        if self.n == 0:
+            return np.nan
+        return self._sum_y / self.n
+
+    @property
+    def slope(self):
+        """
+        least-squares slope of the values in the window, in units per second
+        """
+        if self.n < 2:
+            return np.nan
+        denom = self.n * self._sum_tt - self._sum_t**2
+        if denom <= 0:
+            return np.nan
+        return (self.n * self._sum_ty - self._sum_t * self._sum_y) / denom
+
+    @property
+    def min(self):
+        if not self._minq:
+            return np.nan
+        return self._minq[0][1]
+
+    @property
+    def max(self):
+        if not self._maxq:
+            return np.nan
+        return self._maxq[0][1]
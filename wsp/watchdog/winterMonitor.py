@@ -17,6 +17,11 @@ import logging
 from PyQt5 import QtCore
 from datetime import datetime
 
+try:
+    from rolling_stats import RollingStats
+except ImportError:
+    from watchdog.rolling_stats import RollingStats
+
 class WINTER_monitor(QtCore.QObject):
     
     """
@@ -43,7 +48,7 @@ class WINTER_monitor(QtCore.QObject):
         self.lockout = False
         self.lockout_enable = True
         self.setup_avg_vals()
-        #self.setup_temp_slope_vals()
+        self.setup_temp_slope_vals()
         
         
     def log(self, msg, level = logging.INFO):
@@ -67,42 +72,34 @@ class WINTER_monitor(QtCore.QObject):
         Using the avg values because these can be very noisy and this will help
         prevent the values from triggering shutdowns just on noise
         """
+        dt_window = self.monitor_config['prestart_conditions']['dt_window']
+        self.avg_stats = dict()
         self.avgdict = dict()
-        self.avgdict.update({'avg_timestamps' : np.array([])})
         for field in self.monitor_config['prestart_conditions']['fields']:
-            self.avgdict.update({f'{field}_arr' : np.array([])})
+            self.avg_stats.update({field : RollingStats(dt_window)})
             self.avgdict.update({f'{field}_avg' : self.default_value})
+            self.avgdict.update({f'{field}_min' : self.default_value})
+            self.avgdict.update({f'{field}_max' : self.default_value})
             
     def update_avg_vals(self, state):
         """
-        take in a state dictionary, then update all the arrays the corresponding
-        average values to use for monitoring whether the camera is in okay
-        shape.
+        take in a state dictionary, then update the rolling statistics and the
+        corresponding average values to use for monitoring whether the camera
+        is in okay shape.
         """
         # read in the state and update all the averages
         self.timestamp = datetime.utcnow().timestamp()
-                
-        timestamps = np.append(self.avgdict['avg_timestamps'], self.timestamp)
-        
-        timestamp_condition = timestamps - timestamps[-1] > (-1.0*(self.monitor_config['prestart_conditions']['dt_window']))
-        timestamps = timestamps[timestamp_condition]
-        self.avgdict['avg_timestamps'] = timestamps
         
-        for field in self.monitor_config['prestart_conditions']['fields']:
-            # append the new data from state, and replace missing vals with nan
-            arr = self.avgdict[f'{field}_arr']
+        for field, stats in self.avg_stats.items():
+            # missing vals come in as nan, which the rolling stats skip
             newval = state.get(field, np.nan)
             if newval == 999:
                 # skip it, it's just startup junk
-                pass
-            else:
-                arr = np.append(arr, newval)
-                # trim so that we only have times within the average window
-                arr = arr[timestamp_condition]
-                # update the dict with the new array
-                self.avgdict.update({f'{field}_arr' : arr})
-                # update the averages
-                self.avgdict.update({f'{field}_avg' : np.average(arr)})
+                continue
+            stats.add(self.timestamp, newval)
+            self.avgdict.update({f'{field}_avg' : stats.mean,
+                                 f'{field}_min' : stats.min,
+                                 f'{field}_max' : stats.max})
         
         #print(f'avgdict = {self.avgdict["Flow_LJ0_3_avg"]}')
     
@@ -111,50 +108,37 @@ class WINTER_monitor(QtCore.QObject):
         dictionary to hold temperature values and temperature change slopes
         to monitor whether the TEC is hitting its commanded temperature in time
         """
+        # the fields list may be empty in the config, which yaml reads as None
+        fields = self.monitor_config['tec_temps'].get('fields') or []
+        dt_window = self.monitor_config['tec_temps']['dt_window']
+        self.last_slope_timestamp = None
+        self.slope_stats = dict()
         self.temp_slope_dict = dict()
-        self.temp_slope_dict.update({'slope_timestamps' : []})
-        for field in self.monitor_config['tec_temps']['fields']:
-            self.temp_slope_dict.update({f'{field}_arr' : []})
+        for field in fields:
+            self.slope_stats.update({field : RollingStats(dt_window)})
             self.temp_slope_dict.update({f'{field}_slope' : self.default_value})
             
     
     def update_temp_slope_vals(self, state):
         """
-        take in a state dictionary, then update all the arrays and the
-        corresponding temperature slope values to use for monitoring whether 
-        camera TEC is hitting its desired temperature.
+        take in a state dictionary, then update the rolling statistics and the
+        corresponding temperature slope values (in degrees per second) to use
+        for monitoring whether camera TEC is hitting its desired temperature.
         """
         # read in the state and update all the averages
         self.timestamp = datetime.utcnow().timestamp()
         
-        # we don't want to do this at arbitrary time precision, these
-        # vectors will get huge. Make sure it's been enough time in between
-        # samples
-        
-        dt_since_last_sample = self.timestamp - self.temp_slop_dict['slope_timestamps'][-1]
-        
-        if dt_since_last_sample > self.monitor_config['tec_temps']['dt_min']:
+        # only sample every dt_min seconds, a faster tick rate doesn't
+        # make the slope any better
+        if self.last_slope_timestamp is not None:
+            dt_since_last_sample = self.timestamp - self.last_slope_timestamp
+            if dt_since_last_sample < self.monitor_config['tec_temps']['dt_min']:
+                return
+        self.last_slope_timestamp = self.timestamp
         
-            self.temp_slope_dict['slope_timestamps'].update(self.timestamp)
-            
-            timestamps = self.temp_slope_dict['slope_timestamps']
-            timestamp_condition = timestamps[timestamps - timestamps[-1] > (-1.0*(self.monitor_config['tec_temps']['dt_window']))]
-            
-            for field in self.monitor_config['tec_temps']['fields']:
-                # append the new data from state, and replace missing vals with nan
-                arr = self.temp_slope_dict[f'{field}_arr']
-                arr.append(state.get(field, np.nan))
-                # trim so that we only have times within the average window
-                arr = arr[timestamp_condition]
-                # update the dict with the new array
-                self.temp_slope_dict.update({f'{field}_arr' : arr})
-                # update the averages
-                try:
-                    self.temp_slope_dict.update({f'{field}_slope' : np.polyfit(self.temp_slope_dict['slope_timestamps'], self.temp_slope_dict[f'{field}_arr'], 1)})
-                except Exception as e:
-                    if self.verbose:
-                        self.log(f'could not update slope calculation for {field}: {e}')
-                    self.temp_slope_dict.update({f'{field}_slope' : None})
+        for field, stats in self.slope_stats.items():
+            stats.add(self.timestamp, state.get(field, np.nan))
+            self.temp_slope_dict.update({f'{field}_slope' : stats.slope})
     
     def get_alarms(self, state):
         """
@@ -166,7 +150,7 @@ class WINTER_monitor(QtCore.QObject):
         alarms = []
         
         self.update_avg_vals(state)
-        #self.update_temp_slope_vals()
+        self.update_temp_slope_vals(state)
         
         # if the camera is powered, we need everything to be within range
         camera_powered = self.get_camera_powered_status(state)
@@ -199,6 +183,13 @@ class WINTER_monitor(QtCore.QObject):
                     self.log(f'could not evaluate state: {e}')
                     return
             
+            # TEC temperatures changing too fast. nan slopes (not enough
+            # samples yet) compare False so they don't alarm
+            max_slope = self.monitor_config['tec_temps']['max_slope']
+            for field in self.slope_stats:
+                if abs(self.temp_slope_dict[f'{field}_slope']) > max_slope:
+                    alarms.append(f'{field} CHANGING TOO FAST')
+            
             # specific alarms:
             
             
@@ -189,6 +189,7 @@ if __name__ == "__main__":
         "domesim",
         "dometest",
         "mountsim",
+        "fwsim",
         "shell",
         "disablewatchdog",
     ]